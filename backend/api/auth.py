@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 from functools import wraps
 from database.db import get_db
 from database.db_config import COLLECTIONS
+from utils.cache import get_cached_user
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -29,7 +30,10 @@ def token_required(f):
         try:
             # Decode token
             data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = get_db().users.find_one({'_id': data['user_id']})
+            # Cached by user ID; the betting balance is never cached
+            current_user = get_cached_user(
+                data['user_id'], lambda: get_db().users.find_one({'_id': data['user_id']})
+            )
             
             if not current_user:
                 return jsonify({
@@ -100,6 +104,7 @@ def register():
     
     # Insert user into database
     result = db[COLLECTIONS['USERS']].insert_one(user)
+    current_app.extensions['user_stats'].record_created(user['role'])
     
     # Generate token
     token = jwt.encode({
@@ -200,7 +205,7 @@ def me(current_user):
             'username': current_user['username'],
             'email': current_user['email'],
             'full_name': current_user['full_name'],
-            'balance': current_user['balance'],
+            'balance': get_db().users.find_one({'_id': current_user['_id']}, {'balance': 1})['balance'],
             'role': current_user['role']
         }
     }), 200
@@ -2,39 +2,77 @@ import requests
 import json
 import logging
 import os
+import threading
+from collections import defaultdict
 from datetime import datetime, timedelta
 import betfairlightweight
 from betfairlightweight import filters
+from api.betfair_instrumentation import instrument_client
+from utils.betting import limit_order_instruction
 
 class BetfairAPI:
     """
     Wrapper for Betfair API operations using betfairlightweight library
     """
     
-    def __init__(self, app_key, session_token):
+    def __init__(self, app_key, session_token, api_uri=None, identity_uri=None):
         self.app_key = app_key
         self.session_token = session_token
+        # Optional endpoint overrides, e.g. to point at the local simulator
+        self.api_uri = api_uri
+        self.identity_uri = identity_uri
         self.client = None
+        # Set by BetfairSessionManager when background session renewal is enabled
+        self.session_manager = None
+        self._client_lock = threading.Lock()
         self.initialize_client()
         
+    def create_client(self, username="", password="", certs=None):
+        """Build a new betfairlightweight client without touching the live one"""
+        client = betfairlightweight.APIClient(
+            username=username,  # Not needed when using session token
+            password=password,  # Not needed when using session token
+            app_key=self.app_key,
+            certs=certs,
+            lightweight=True
+        )
+        # The client resolves endpoints per locale from these maps
+        if self.api_uri:
+            client.API_URLS = defaultdict(lambda: self.api_uri)
+        if self.identity_uri:
+            client.IDENTITY_URLS = defaultdict(lambda: self.identity_uri)
+            client.IDENTITY_CERT_URLS = defaultdict(lambda: self.identity_uri)
+        return instrument_client(client)
+        
     def initialize_client(self):
         """Initialize the Betfair API client"""
         try:
-            self.client = betfairlightweight.APIClient(
-                username="",  # Not needed when using session token
-                password="",  # Not needed when using session token
-                app_key=self.app_key,
-                cert_files=None,
-                lightweight=True
-            )
+            client = self.create_client()
             # Set the session token directly
-            self.client.session_token = self.session_token
+            client.session_token = self.session_token
+            self.swap_client(client, self.session_token)
             # No need to call login_interactive when using a session token
             logging.info("Betfair API client initialized successfully with session token")
         except Exception as e:
             logging.error(f"Failed to initialize Betfair API client: {str(e)}")
             raise
     
+    def swap_client(self, client, session_token):
+        """
+        Atomically replace the live client with a fully initialised one.
+        
+        Requests in flight keep using the client reference they already hold,
+        and new requests pick up the replacement as soon as it is assigned.
+        """
+        with self._client_lock:
+            self.session_token = session_token
+            self.client = client
+    
+    def _report_session_error(self, error):
+        """Ask the session manager to renew in the background on session errors"""
+        if self.session_manager and 'INVALID_SESSION' in str(error).upper():
+            self.session_manager.request_renewal()
+    
     def get_event_types(self):
         """Get all event types (sports)"""
         try:
@@ -42,37 +80,10 @@ class BetfairAPI:
             event_types = self.client.betting.list_event_types(
                 filter=event_filter
             )
-            result = []
-            
-            # Handle different response formats
-            for event_type in event_types:
-                try:
-                    # Try the object-based format first
-                    if hasattr(event_type, 'event_type') and hasattr(event_type.event_type, 'id'):
-                        result.append({
-                            "id": event_type.event_type.id,
-                            "name": event_type.event_type.name,
-                        })
-                    # Try dictionary format
-                    elif isinstance(event_type, dict) and 'eventType' in event_type:
-                        result.append({
-                            "id": event_type['eventType']['id'],
-                            "name": event_type['eventType']['name'],
-                        })
-                    # Direct format
-                    elif isinstance(event_type, dict) and 'id' in event_type:
-                        result.append({
-                            "id": event_type['id'],
-                            "name": event_type['name'],
-                        })
-                except Exception as item_error:
-                    logging.error(f"Error processing event type: {str(item_error)}")
-                    # Log the event_type structure for debugging
-                    logging.error(f"Event type structure: {str(event_type)}")
-            
-            return result
+            return self._format_event_types(event_types)
         except Exception as e:
             logging.error(f"Error getting event types: {str(e)}")
+            self._report_session_error(e)
             return []
     
     def get_competitions(self, event_type_id=None):
@@ -94,6 +105,7 @@ class BetfairAPI:
             ]
         except Exception as e:
             logging.error(f"Error getting competitions: {str(e)}")
+            self._report_session_error(e)
             return []
     
     def get_events(self, event_type_id=None, competition_id=None):
@@ -111,43 +123,10 @@ class BetfairAPI:
                 filter=event_filter
             )
             
-            result = []
-            for event in events:
-                try:
-                    # Try object-based format
-                    if hasattr(event, 'event') and hasattr(event.event, 'id'):
-                        result.append({
-                            "id": event.event.id,
-                            "name": event.event.name,
-                            "country_code": getattr(event.event, 'country_code', None),
-                            "timezone": getattr(event.event, 'timezone', None),
-                            "open_date": getattr(event.event, 'open_date', None)
-                        })
-                    # Try dictionary format
-                    elif isinstance(event, dict) and 'event' in event:
-                        result.append({
-                            "id": event['event']['id'],
-                            "name": event['event']['name'],
-                            "country_code": event['event'].get('countryCode'),
-                            "timezone": event['event'].get('timezone'),
-                            "open_date": event['event'].get('openDate')
-                        })
-                    # Direct format
-                    elif isinstance(event, dict) and 'id' in event:
-                        result.append({
-                            "id": event['id'],
-                            "name": event['name'],
-                            "country_code": event.get('countryCode'),
-                            "timezone": event.get('timezone'),
-                            "open_date": event.get('openDate')
-                        })
-                except Exception as item_error:
-                    logging.error(f"Error processing event: {str(item_error)}")
-                    logging.error(f"Event structure: {str(event)}")
-            
-            return result
+            return self._format_events(events)
         except Exception as e:
             logging.error(f"Error getting events: {str(e)}")
+            self._report_session_error(e)
             return []
     
     def get_markets(self, event_id=None, market_types=None):
@@ -166,63 +145,10 @@ class BetfairAPI:
                 market_projection=["COMPETITION", "EVENT", "EVENT_TYPE", "RUNNER_DESCRIPTION", "MARKET_START_TIME"]
             )
             
-            result = []
-            for market in markets:
-                try:
-                    market_data = {}
-                    
-                    # Try object-based format
-                    if hasattr(market, 'market_id'):
-                        market_data = {
-                            "marketId": market.market_id,  # Use marketId for consistency
-                            "marketName": market.market_name,  # Use marketName for consistency
-                            "market_start_time": market.market_start_time,
-                            "total_matched": getattr(market, 'total_matched', 0),
-                            "runners": []
-                        }
-                        
-                        # Process runners if available
-                        if hasattr(market, 'runners') and market.runners:
-                            for runner in market.runners:
-                                if hasattr(runner, 'selection_id'):
-                                    market_data["runners"].append({
-                                        "id": runner.selection_id,
-                                        "name": runner.runner_name,
-                                        "handicap": getattr(runner, 'handicap', 0),
-                                        "sort_priority": getattr(runner, 'sort_priority', 0)
-                                    })
-                    
-                    # Try dictionary format
-                    elif isinstance(market, dict):
-                        market_data = {
-                            "marketId": market.get('marketId'),
-                            "marketName": market.get('marketName'),
-                            "market_start_time": market.get('marketStartTime'),
-                            "total_matched": market.get('totalMatched', 0),
-                            "runners": []
-                        }
-                        
-                        # Process runners if available
-                        if 'runners' in market and market['runners']:
-                            for runner in market['runners']:
-                                market_data["runners"].append({
-                                    "id": runner.get('selectionId'),
-                                    "name": runner.get('runnerName'),
-                                    "handicap": runner.get('handicap', 0),
-                                    "sort_priority": runner.get('sortPriority', 0)
-                                })
-                    
-                    # Only add valid market data
-                    if market_data.get('marketId'):
-                        result.append(market_data)
-                        
-                except Exception as item_error:
-                    logging.error(f"Error processing market: {str(item_error)}")
-                    logging.error(f"Market structure: {str(market)}")
-            
-            return result
+            return self._format_markets(markets)
         except Exception as e:
             logging.error(f"Error getting markets: {str(e)}")
+            self._report_session_error(e)
             return []
     
     def get_market_book(self, market_ids):
@@ -240,15 +166,6 @@ class BetfairAPI:
                 if not self.client:
                     return []
                     
-            try:
-                # Try to check session status
-                self.client.session_token
-                logging.info(f"Session token exists: {self.client.session_token[:10]}...")
-            except Exception as session_error:
-                logging.error(f"Session token error: {str(session_error)}")
-                # Re-initialize client if session is invalid
-                self.initialize_client()
-                
             price_filter = filters.price_projection(
                 price_data=["EX_BEST_OFFERS", "EX_TRADED"],
                 ex_best_offers_overrides=filters.ex_best_offers_overrides(best_prices_depth=3)
@@ -263,112 +180,252 @@ class BetfairAPI:
                 logging.info(f"Received {len(market_books)} market books from API")
             except Exception as api_error:
                 logging.error(f"API call failed: {str(api_error)}")
+                self._report_session_error(api_error)
                 return []
                 
             if not market_books:
                 logging.warning(f"No market books found for IDs: {market_ids}")
                 return []
                 
-            result = []
-            for book in market_books:
-                # Check if book is a dictionary or an object
-                if isinstance(book, dict):
-                    # It's a dictionary, access with get()
-                    market_dict = {
-                        "market_id": book.get('marketId') or book.get('market_id'),
-                        "is_market_data_delayed": book.get('isMarketDataDelayed') or book.get('is_market_data_delayed'),
-                        "status": book.get('status'),
-                        "bet_delay": book.get('betDelay') or book.get('bet_delay'),
-                        "total_matched": book.get('totalMatched') or book.get('total_matched'),
+            result = self._format_market_books(market_books)
+            logging.info(f"Processed market books successfully")
+            return result
+        except Exception as e:
+            import traceback
+            logging.error(f"Error getting market book: {str(e)}")
+            logging.error(traceback.format_exc())
+            return []
+    
+    @staticmethod
+    def _format_event_types(event_types):
+        """Normalise a listEventTypes response into id/name dicts"""
+        result = []
+        
+        # Handle different response formats
+        for event_type in event_types:
+            try:
+                # Try the object-based format first
+                if hasattr(event_type, 'event_type') and hasattr(event_type.event_type, 'id'):
+                    result.append({
+                        "id": event_type.event_type.id,
+                        "name": event_type.event_type.name,
+                    })
+                # Try dictionary format
+                elif isinstance(event_type, dict) and 'eventType' in event_type:
+                    result.append({
+                        "id": event_type['eventType']['id'],
+                        "name": event_type['eventType']['name'],
+                    })
+                # Direct format
+                elif isinstance(event_type, dict) and 'id' in event_type:
+                    result.append({
+                        "id": event_type['id'],
+                        "name": event_type['name'],
+                    })
+            except Exception as item_error:
+                logging.error(f"Error processing event type: {str(item_error)}")
+                # Log the event_type structure for debugging
+                logging.error(f"Event type structure: {str(event_type)}")
+        
+        return result
+    
+    @staticmethod
+    def _format_events(events):
+        """Normalise a listEvents response into flat event dicts"""
+        result = []
+        for event in events:
+            try:
+                # Try object-based format
+                if hasattr(event, 'event') and hasattr(event.event, 'id'):
+                    result.append({
+                        "id": event.event.id,
+                        "name": event.event.name,
+                        "country_code": getattr(event.event, 'country_code', None),
+                        "timezone": getattr(event.event, 'timezone', None),
+                        "open_date": getattr(event.event, 'open_date', None)
+                    })
+                # Try dictionary format
+                elif isinstance(event, dict) and 'event' in event:
+                    result.append({
+                        "id": event['event']['id'],
+                        "name": event['event']['name'],
+                        "country_code": event['event'].get('countryCode'),
+                        "timezone": event['event'].get('timezone'),
+                        "open_date": event['event'].get('openDate')
+                    })
+                # Direct format
+                elif isinstance(event, dict) and 'id' in event:
+                    result.append({
+                        "id": event['id'],
+                        "name": event['name'],
+                        "country_code": event.get('countryCode'),
+                        "timezone": event.get('timezone'),
+                        "open_date": event.get('openDate')
+                    })
+            except Exception as item_error:
+                logging.error(f"Error processing event: {str(item_error)}")
+                logging.error(f"Event structure: {str(event)}")
+        
+        return result
+    
+    @staticmethod
+    def _format_markets(markets):
+        """Normalise a listMarketCatalogue response into market dicts"""
+        result = []
+        for market in markets:
+            try:
+                market_data = {}
+                
+                # Try object-based format
+                if hasattr(market, 'market_id'):
+                    market_data = {
+                        "marketId": market.market_id,  # Use marketId for consistency
+                        "marketName": market.market_name,  # Use marketName for consistency
+                        "market_start_time": market.market_start_time,
+                        "total_matched": getattr(market, 'total_matched', 0),
                         "runners": []
                     }
                     
-                    # Process runners if they exist
-                    runners = book.get('runners', [])
-                    for runner in runners:
+                    # Process runners if available
+                    if hasattr(market, 'runners') and market.runners:
+                        for runner in market.runners:
+                            if hasattr(runner, 'selection_id'):
+                                market_data["runners"].append({
+                                    "id": runner.selection_id,
+                                    "name": runner.runner_name,
+                                    "handicap": getattr(runner, 'handicap', 0),
+                                    "sort_priority": getattr(runner, 'sort_priority', 0)
+                                })
+                
+                # Try dictionary format
+                elif isinstance(market, dict):
+                    market_data = {
+                        "marketId": market.get('marketId'),
+                        "marketName": market.get('marketName'),
+                        "market_start_time": market.get('marketStartTime'),
+                        "total_matched": market.get('totalMatched', 0),
+                        "runners": []
+                    }
+                    
+                    # Process runners if available
+                    if 'runners' in market and market['runners']:
+                        for runner in market['runners']:
+                            market_data["runners"].append({
+                                "id": runner.get('selectionId'),
+                                "name": runner.get('runnerName'),
+                                "handicap": runner.get('handicap', 0),
+                                "sort_priority": runner.get('sortPriority', 0)
+                            })
+                
+                # Only add valid market data
+                if market_data.get('marketId'):
+                    result.append(market_data)
+                    
+            except Exception as item_error:
+                logging.error(f"Error processing market: {str(item_error)}")
+                logging.error(f"Market structure: {str(market)}")
+        
+        return result
+    
+    @staticmethod
+    def _format_market_books(market_books):
+        """Normalise a listMarketBook response into market book dicts"""
+        result = []
+        for book in market_books:
+            # Check if book is a dictionary or an object
+            if isinstance(book, dict):
+                # It's a dictionary, access with get()
+                market_dict = {
+                    "market_id": book.get('marketId') or book.get('market_id'),
+                    "is_market_data_delayed": book.get('isMarketDataDelayed') or book.get('is_market_data_delayed'),
+                    "status": book.get('status'),
+                    "inplay": book.get('inplay'),
+                    "bet_delay": book.get('betDelay') or book.get('bet_delay'),
+                    "total_matched": book.get('totalMatched') or book.get('total_matched'),
+                    "runners": []
+                }
+                
+                # Process runners if they exist
+                runners = book.get('runners', [])
+                for runner in runners:
+                    runner_dict = {
+                        "selection_id": runner.get('selectionId') or runner.get('selection_id'),
+                        "status": runner.get('status'),
+                        "total_matched": runner.get('totalMatched') or runner.get('total_matched'),
+                        "last_price_traded": runner.get('lastPriceTraded') or runner.get('last_price_traded'),
+                        "ex": {}
+                    }
+                    
+                    # Process exchange data
+                    ex = runner.get('ex', {})
+                    runner_dict["ex"] = {
+                        "available_to_back": ex.get('availableToBack', []) or ex.get('available_to_back', []),
+                        "available_to_lay": ex.get('availableToLay', []) or ex.get('available_to_lay', []),
+                        "traded_volume": ex.get('tradedVolume', []) or ex.get('traded_volume', [])
+                    }
+                    
+                    market_dict["runners"].append(runner_dict)
+            else:
+                # It's an object, access with attribute notation
+                market_dict = {
+                    "market_id": book.market_id if hasattr(book, 'market_id') else None,
+                    "is_market_data_delayed": book.is_market_data_delayed if hasattr(book, 'is_market_data_delayed') else None,
+                    "status": book.status if hasattr(book, 'status') else None,
+                    "inplay": book.inplay if hasattr(book, 'inplay') else None,
+                    "bet_delay": book.bet_delay if hasattr(book, 'bet_delay') else None,
+                    "total_matched": book.total_matched if hasattr(book, 'total_matched') else None,
+                    "runners": []
+                }
+                
+                # Process runners if they exist
+                if hasattr(book, 'runners') and book.runners:
+                    for runner in book.runners:
                         runner_dict = {
-                            "selection_id": runner.get('selectionId') or runner.get('selection_id'),
-                            "status": runner.get('status'),
-                            "total_matched": runner.get('totalMatched') or runner.get('total_matched'),
-                            "last_price_traded": runner.get('lastPriceTraded') or runner.get('last_price_traded'),
+                            "selection_id": runner.selection_id if hasattr(runner, 'selection_id') else None,
+                            "status": runner.status if hasattr(runner, 'status') else None,
+                            "total_matched": runner.total_matched if hasattr(runner, 'total_matched') else None,
+                            "last_price_traded": runner.last_price_traded if hasattr(runner, 'last_price_traded') else None,
                             "ex": {}
                         }
                         
                         # Process exchange data
-                        ex = runner.get('ex', {})
-                        runner_dict["ex"] = {
-                            "available_to_back": ex.get('availableToBack', []) or ex.get('available_to_back', []),
-                            "available_to_lay": ex.get('availableToLay', []) or ex.get('available_to_lay', []),
-                            "traded_volume": ex.get('tradedVolume', []) or ex.get('traded_volume', [])
-                        }
-                        
-                        market_dict["runners"].append(runner_dict)
-                else:
-                    # It's an object, access with attribute notation
-                    market_dict = {
-                        "market_id": book.market_id if hasattr(book, 'market_id') else None,
-                        "is_market_data_delayed": book.is_market_data_delayed if hasattr(book, 'is_market_data_delayed') else None,
-                        "status": book.status if hasattr(book, 'status') else None,
-                        "bet_delay": book.bet_delay if hasattr(book, 'bet_delay') else None,
-                        "total_matched": book.total_matched if hasattr(book, 'total_matched') else None,
-                        "runners": []
-                    }
-                    
-                    # Process runners if they exist
-                    if hasattr(book, 'runners') and book.runners:
-                        for runner in book.runners:
-                            runner_dict = {
-                                "selection_id": runner.selection_id if hasattr(runner, 'selection_id') else None,
-                                "status": runner.status if hasattr(runner, 'status') else None,
-                                "total_matched": runner.total_matched if hasattr(runner, 'total_matched') else None,
-                                "last_price_traded": runner.last_price_traded if hasattr(runner, 'last_price_traded') else None,
-                                "ex": {}
-                            }
+                        if hasattr(runner, 'ex') and runner.ex:
+                            ex_dict = {}
                             
-                            # Process exchange data
-                            if hasattr(runner, 'ex') and runner.ex:
-                                ex_dict = {}
+                            # Available to back prices
+                            if hasattr(runner.ex, 'available_to_back') and runner.ex.available_to_back:
+                                ex_dict["available_to_back"] = [
+                                    {"price": p.price, "size": p.size}
+                                    for p in runner.ex.available_to_back
+                                ]
+                            else:
+                                ex_dict["available_to_back"] = []
                                 
-                                # Available to back prices
-                                if hasattr(runner.ex, 'available_to_back') and runner.ex.available_to_back:
-                                    ex_dict["available_to_back"] = [
-                                        {"price": p.price, "size": p.size}
-                                        for p in runner.ex.available_to_back
-                                    ]
-                                else:
-                                    ex_dict["available_to_back"] = []
-                                    
-                                # Available to lay prices
-                                if hasattr(runner.ex, 'available_to_lay') and runner.ex.available_to_lay:
-                                    ex_dict["available_to_lay"] = [
-                                        {"price": p.price, "size": p.size}
-                                        for p in runner.ex.available_to_lay
-                                    ]
-                                else:
-                                    ex_dict["available_to_lay"] = []
-                                    
-                                # Traded volume
-                                if hasattr(runner.ex, 'traded_volume') and runner.ex.traded_volume:
-                                    ex_dict["traded_volume"] = [
-                                        {"price": p.price, "size": p.size}
-                                        for p in runner.ex.traded_volume
-                                    ]
-                                else:
-                                    ex_dict["traded_volume"] = []
-                                    
-                                runner_dict["ex"] = ex_dict
-                            
-                            market_dict["runners"].append(runner_dict)
-                
-                result.append(market_dict)
+                            # Available to lay prices
+                            if hasattr(runner.ex, 'available_to_lay') and runner.ex.available_to_lay:
+                                ex_dict["available_to_lay"] = [
+                                    {"price": p.price, "size": p.size}
+                                    for p in runner.ex.available_to_lay
+                                ]
+                            else:
+                                ex_dict["available_to_lay"] = []
+                                
+                            # Traded volume
+                            if hasattr(runner.ex, 'traded_volume') and runner.ex.traded_volume:
+                                ex_dict["traded_volume"] = [
+                                    {"price": p.price, "size": p.size}
+                                    for p in runner.ex.traded_volume
+                                ]
+                            else:
+                                ex_dict["traded_volume"] = []
+                                
+                            runner_dict["ex"] = ex_dict
+                        
+                        market_dict["runners"].append(runner_dict)
             
-            logging.info(f"Processed market books successfully")
-            return result
-        except Exception as e:
-            import traceback
-            logging.error(f"Error getting market book: {str(e)}")
-            logging.error(traceback.format_exc())
-            return []
+            result.append(market_dict)
+        
+        return result
     
     def place_bet(self, market_id, selection_id, side, price, size, customer_ref=None):
         """Place a bet on a market"""
@@ -376,24 +433,12 @@ class BetfairAPI:
             if side.upper() not in ["BACK", "LAY"]:
                 raise ValueError("Side must be either 'BACK' or 'LAY'")
                 
-            instructions = [
-                {
-                    'selectionId': selection_id,
-                    'handicap': 0,
-                    'side': side.upper(),
-                    'orderType': 'LIMIT',
-                    'limitOrder': {
-                        'size': size,
-                        'price': price,
-                        'persistenceType': 'LAPSE'
-                    }
-                }
-            ]
+            instructions = [limit_order_instruction(selection_id, side, price, size)]
             
             response = self.client.betting.place_orders(
                 market_id=market_id,
                 instructions=instructions,
-                customer_order_ref=customer_ref
+                customer_ref=customer_ref
             )
             
             return {
@@ -406,6 +451,7 @@ class BetfairAPI:
             }
         except Exception as e:
             logging.error(f"Error placing bet: {str(e)}")
+            self._report_session_error(e)
             return {
                 "status": "failure",
                 "error": str(e)
@@ -434,6 +480,7 @@ class BetfairAPI:
             }
         except Exception as e:
             logging.error(f"Error cancelling bet: {str(e)}")
+            self._report_session_error(e)
             return {
                 "status": "failure",
                 "error": str(e)
@@ -0,0 +1,282 @@
+"""
+Asyncio variant of the Betfair API wrapper for fan-out workloads.
+
+Issues concurrent JSON-RPC calls against the Betfair betting endpoint over a
+single pooled aiohttp session (HTTP/1.1 keep-alive), with a bounded semaphore
+so a wide fan-out never opens more requests than Betfair tolerates. Results are
+normalised with the same formatters as BetfairAPI so callers can switch freely.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+import aiohttp
+from betfairlightweight import filters
+from api.betfair_api import BetfairAPI
+from api.betfair_instrumentation import record_betfair_call
+from utils.error_handlers import BetfairAPIError
+
+# Default Betfair exchange API root (the betting JSON-RPC path is appended)
+DEFAULT_API_URI = "https://api.betfair.com/exchange/"
+
+class AsyncBetfairAPI:
+    """
+    Asyncio Betfair client sharing one keep-alive connection pool
+    """
+
+    def __init__(self, app_key, session_token, api_uri=None, max_concurrency=8,
+                 pool_size=8, timeout=10):
+        self.app_key = app_key
+        self.session_token = session_token
+        self.api_uri = api_uri or DEFAULT_API_URI
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session = None
+        self._semaphore = None
+        self._request_id = 0
+
+    @property
+    def betting_url(self):
+        """JSON-RPC endpoint for the betting API"""
+        return f"{self.api_uri.rstrip('/')}/betting/json-rpc/v1"
+
+    async def _get_session(self):
+        """Create the pooled HTTP session on first use inside the running loop"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,  # Upper bound on open keep-alive connections
+                keepalive_timeout=60,
+                enable_cleanup_closed=True
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={
+                    'Content-Type': 'application/json',
+                    'Accept': 'application/json',
+                    'Connection': 'keep-alive'
+                }
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        """Close the pooled HTTP session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def call(self, method, params):
+        """
+        Issue a single JSON-RPC call against the betting API.
+
+        Args:
+            method: Betting operation name, e.g. 'listMarketBook'
+            params: Operation parameters (camelCase keys)
+
+        Returns:
+            The 'result' member of the JSON-RPC response
+
+        Raises:
+            BetfairAPIError: If Betfair returns a JSON-RPC error or a non-200 status
+        """
+        session = await self._get_session()
+        self._request_id += 1
+        payload = {
+            'jsonrpc': '2.0',
+            'method': f'SportsAPING/v1.0/{method}',
+            'params': params,
+            'id': self._request_id
+        }
+        headers = {
+            'X-Application': self.app_key or '',
+            'X-Authentication': self.session_token or ''
+        }
+
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                async with session.post(self.betting_url, json=payload, headers=headers) as response:
+                    if response.status != 200:
+                        raise BetfairAPIError(
+                            f"{method} failed with HTTP {response.status}",
+                            payload={'error_code': f'HTTP_{response.status}'}
+                        )
+                    body = await response.json(content_type=None)
+
+                if body.get('error'):
+                    error_code = self._extract_error_code(body['error'])
+                    raise BetfairAPIError(f"{method} failed: {error_code}", payload={'error_code': error_code})
+            except Exception as e:
+                self._record(method, params, started, error=e)
+                raise
+
+        result = body.get('result')
+        self._record(method, params, started, response=result)
+        return result
+
+    @staticmethod
+    def _record(method, params, started, error=None, response=None):
+        """Record the call in the Betfair call metrics"""
+        record_betfair_call(
+            method,
+            started,
+            error=error,
+            response=response,
+            market_ids=params.get('marketIds'),
+            bet_ids=params.get('betIds'),
+            instructions=params.get('instructions'),
+            market_filter=params.get('filter'),
+            price_projection=params.get('priceProjection'),
+            max_results=params.get('maxResults'),
+            market_projection=params.get('marketProjection')
+        )
+
+    @staticmethod
+    def _extract_error_code(error):
+        """Pull the APING error code out of a JSON-RPC error member"""
+        data = error.get('data') or {}
+        for exception in data.values():
+            if isinstance(exception, dict) and exception.get('errorCode'):
+                return exception['errorCode']
+        return error.get('message') or str(error.get('code'))
+
+    async def gather(self, calls):
+        """
+        Run several (method, params) calls concurrently.
+
+        Failed calls are returned as exception instances in the matching
+        position so one bad market does not sink the whole fan-out.
+        """
+        return await asyncio.gather(
+            *(self.call(method, params) for method, params in calls),
+            return_exceptions=True
+        )
+
+    async def get_event_types(self):
+        """Get all event types (sports)"""
+        event_types = await self.call('listEventTypes', {
+            'filter': filters.market_filter(text_query=None)
+        })
+        return BetfairAPI._format_event_types(event_types or [])
+
+    async def get_events(self, event_type_id=None, competition_id=None):
+        """Get events for a specific sport or competition"""
+        event_filter = filters.market_filter(
+            event_type_ids=[event_type_id] if event_type_id else None,
+            competition_ids=[competition_id] if competition_id else None,
+            market_start_time={
+                'from': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'to': (datetime.utcnow() + timedelta(days=7)).strftime('%Y-%m-%dT%H:%M:%SZ')
+            }
+        )
+        events = await self.call('listEvents', {'filter': event_filter})
+        return BetfairAPI._format_events(events or [])
+
+    async def get_markets(self, event_id=None, market_types=None):
+        """Get markets for a specific event"""
+        if not market_types:
+            market_types = ["MATCH_ODDS", "OVER_UNDER_25", "CORRECT_SCORE"]
+
+        markets = await self.call('listMarketCatalogue', {
+            'filter': filters.market_filter(
+                event_ids=[event_id] if event_id else None,
+                market_type_codes=market_types
+            ),
+            'maxResults': 100,
+            'marketProjection': ["COMPETITION", "EVENT", "EVENT_TYPE", "RUNNER_DESCRIPTION", "MARKET_START_TIME"]
+        })
+        return BetfairAPI._format_markets(markets or [])
+
+    async def list_market_catalogue(self, market_ids, market_projection=None):
+        """Get raw market catalogues (camelCase dicts) for specific markets"""
+        return await self.call('listMarketCatalogue', {
+            'filter': filters.market_filter(market_ids=market_ids),
+            'maxResults': len(market_ids),
+            'marketProjection': market_projection or ["COMPETITION", "EVENT", "EVENT_TYPE", "RUNNER_DESCRIPTION", "MARKET_START_TIME"]
+        }) or []
+
+    async def get_market_book(self, market_ids):
+        """Get market book for specific markets"""
+        if isinstance(market_ids, str):
+            market_ids = [market_ids]
+
+        market_books = await self.call('listMarketBook', {
+            'marketIds': market_ids,
+            'priceProjection': filters.price_projection(
+                price_data=["EX_BEST_OFFERS", "EX_TRADED"],
+                ex_best_offers_overrides=filters.ex_best_offers_overrides(best_prices_depth=3)
+            )
+        })
+        return BetfairAPI._format_market_books(market_books or [])
+
+    async def place_orders(self, market_id, instructions, customer_ref=None):
+        """Place a set of order instructions on a single market"""
+        params = {'marketId': market_id, 'instructions': instructions}
+        if customer_ref:
+            params['customerRef'] = customer_ref
+        return await self.call('placeOrders', params)
+
+    async def cancel_orders(self, market_id, instructions=None, customer_ref=None):
+        """Cancel orders on a single market (all orders when no instructions are given)"""
+        params = {'marketId': market_id}
+        if instructions:
+            params['instructions'] = instructions
+        if customer_ref:
+            params['customerRef'] = customer_ref
+        return await self.call('cancelOrders', params)
+
+    async def list_current_orders(self, bet_ids=None, market_ids=None, customer_order_refs=None,
+                                  from_record=0, record_count=1000):
+        """List current (unsettled) orders by bet, market or customer order reference"""
+        params = {'fromRecord': from_record, 'recordCount': record_count}
+        if bet_ids:
+            params['betIds'] = bet_ids
+        if market_ids:
+            params['marketIds'] = market_ids
+        if customer_order_refs:
+            params['customerOrderRefs'] = customer_order_refs
+        return await self.call('listCurrentOrders', params)
+
+    async def list_cleared_orders(self, bet_status, market_ids=None, bet_ids=None, customer_order_refs=None,
+                                  from_record=0, record_count=1000):
+        """List cleared (settled, voided, lapsed or cancelled) orders"""
+        params = {'betStatus': bet_status, 'fromRecord': from_record, 'recordCount': record_count}
+        if market_ids:
+            params['marketIds'] = market_ids
+        if bet_ids:
+            params['betIds'] = bet_ids
+        if customer_order_refs:
+            params['customerOrderRefs'] = customer_order_refs
+        return await self.call('listClearedOrders', params)
+
+    async def get_market_books_batched(self, market_ids, batch_size=5):
+        """Fetch market books for many markets concurrently in fixed-size batches"""
+        batches = [market_ids[i:i + batch_size] for i in range(0, len(market_ids), batch_size)]
+        results = await asyncio.gather(
+            *(self.get_market_book(batch) for batch in batches),
+            return_exceptions=True
+        )
+        books = []
+        for batch, result in zip(batches, results):
+            if isinstance(result, Exception):
+                logging.error(f"Error fetching market book batch {batch}: {str(result)}")
+                continue
+            books.extend(result)
+        return books
+
+    async def get_market_catalogues_batched(self, market_ids, batch_size=5):
+        """Fetch raw market catalogues for many markets concurrently in fixed-size batches"""
+        batches = [market_ids[i:i + batch_size] for i in range(0, len(market_ids), batch_size)]
+        results = await asyncio.gather(
+            *(self.list_market_catalogue(batch) for batch in batches),
+            return_exceptions=True
+        )
+        catalogues = []
+        for batch, result in zip(batches, results):
+            if isinstance(result, Exception):
+                logging.error(f"Error fetching market catalogue batch {batch}: {str(result)}")
+                continue
+            catalogues.extend(result)
+        return catalogues
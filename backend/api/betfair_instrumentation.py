@@ -0,0 +1,150 @@
+"""
+Instrumentation for Betfair API calls.
+
+Wraps the betting endpoint of betfairlightweight clients so every
+client.betting.* call, whether made through BetfairAPI or on a client built
+inline by a view, records latency, error code, ids per call and request
+weight in the process-wide betfair_metrics registry. AsyncBetfairAPI records
+into the same registry through record_betfair_call.
+"""
+import re
+import time
+from utils.metrics import betfair_metrics, get_call_origin
+from utils.request_weight import request_weight
+
+# APING error code inside a betfairlightweight APIError message
+_ERROR_CODE_PATTERN = re.compile(r"""['"]errorCode['"]\s*:\s*['"]([A-Z_]+)['"]""")
+
+def _operation_name(method_name):
+    """Convert a betfairlightweight method name to the API operation name."""
+    head, *rest = method_name.split('_')
+    return head + ''.join(part.capitalize() for part in rest)
+
+def error_code_from_exception(error):
+    """Best-effort APING error code for a failed call."""
+    payload = getattr(error, 'payload', None)
+    if isinstance(payload, dict) and payload.get('error_code'):
+        return payload['error_code']
+    match = _ERROR_CODE_PATTERN.search(str(error))
+    if match:
+        return match.group(1)
+    return type(error).__name__
+
+def error_code_from_response(response):
+    """Error code of an execution report that came back with status FAILURE."""
+    if isinstance(response, dict) and response.get('status') == 'FAILURE':
+        return response.get('errorCode') or 'FAILURE'
+    status = getattr(response, 'status', None)
+    if status == 'FAILURE':
+        return getattr(response, 'error_code', None) or 'FAILURE'
+    return None
+
+def _count_ids(market_ids=None, bet_ids=None, instructions=None, market_filter=None):
+    """Number of ids a call carries."""
+    for values in (market_ids, bet_ids, instructions):
+        if values:
+            return len(values)
+    for key in ('marketIds', 'eventIds', 'eventTypeIds', 'competitionIds'):
+        values = (market_filter or {}).get(key)
+        if values:
+            return len(values)
+    return 0
+
+def record_betfair_call(operation, started, error=None, response=None, market_ids=None, bet_ids=None,
+                        instructions=None, market_filter=None, price_projection=None,
+                        max_results=None, market_projection=None):
+    """
+    Record a finished Betfair call in the metrics registry.
+
+    Args:
+        operation: Operation name, e.g. 'listMarketBook'
+        started: time.perf_counter() value taken before the call
+        error: Exception raised by the call, if any
+        response: Call result, checked for FAILURE execution reports
+        Remaining arguments describe the request (camelCase projections)
+    """
+    latency_ms = (time.perf_counter() - started) * 1000.0
+    error_code = error_code_from_exception(error) if error is not None else error_code_from_response(response)
+    betfair_metrics.record(
+        operation,
+        get_call_origin(),
+        latency_ms,
+        error_code=error_code,
+        ids=_count_ids(market_ids, bet_ids, instructions, market_filter),
+        weight=request_weight(operation, market_ids, price_projection, max_results, market_projection)
+    )
+
+class InstrumentedBetting:
+    """Proxy for a betfairlightweight Betting endpoint that records every call."""
+
+    def __init__(self, betting):
+        self._betting = betting
+
+    def __getattr__(self, name):
+        attribute = getattr(self._betting, name)
+        if not callable(attribute) or name.startswith('_'):
+            return attribute
+
+        operation = _operation_name(name)
+
+        def instrumented(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                response = attribute(*args, **kwargs)
+            except Exception as e:
+                self._record(operation, started, kwargs, error=e)
+                raise
+            self._record(operation, started, kwargs, response=response)
+            return response
+
+        instrumented.__name__ = name
+        return instrumented
+
+    @staticmethod
+    def _record(operation, started, kwargs, error=None, response=None):
+        record_betfair_call(
+            operation,
+            started,
+            error=error,
+            response=response,
+            market_ids=kwargs.get('market_ids'),
+            bet_ids=kwargs.get('bet_ids'),
+            instructions=kwargs.get('instructions'),
+            market_filter=kwargs.get('filter'),
+            price_projection=kwargs.get('price_projection'),
+            max_results=kwargs.get('max_results'),
+            market_projection=kwargs.get('market_projection')
+        )
+
+def _instrument_identity_call(client, name, operation):
+    """Wrap an identity call (login, keepAlive) on a client instance."""
+    method = getattr(client, name)
+
+    def instrumented(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = method(*args, **kwargs)
+        except Exception as e:
+            record_betfair_call(operation, started, error=e)
+            raise
+        record_betfair_call(operation, started)
+        return response
+
+    setattr(client, name, instrumented)
+
+def instrument_client(client):
+    """
+    Instrument a betfairlightweight client in place.
+
+    Args:
+        client: betfairlightweight.APIClient
+
+    Returns:
+        The same client, for chaining
+    """
+    if not isinstance(client.betting, InstrumentedBetting):
+        client.betting = InstrumentedBetting(client.betting)
+        _instrument_identity_call(client, 'keep_alive', 'keepAlive')
+        _instrument_identity_call(client, 'login', 'login')
+        _instrument_identity_call(client, 'login_interactive', 'login')
+    return client
@@ -0,0 +1,214 @@
+"""
+Betfair Exchange Stream API client for order change messages.
+
+Speaks the stream protocol directly (CRLF-delimited JSON over TCP, TLS in
+production): authenticate, subscribe to orders, then hand every order change
+message to a callback. The host, port and TLS flag are configurable so the
+same client runs against Betfair or the local stand-in in simulator/.
+"""
+import json
+import logging
+import socket
+import ssl
+import threading
+import time
+
+# Production stream endpoint
+DEFAULT_STREAM_HOST = "stream-api.betfair.com"
+DEFAULT_STREAM_PORT = 443
+
+class BetfairOrderStream:
+    """
+    Order stream subscription running in a daemon thread with automatic reconnect
+    """
+
+    def __init__(self, app_key, session_token_provider, on_change, host=None, port=None,
+                 use_ssl=True, timeout=30, heartbeat_ms=5000, conflate_ms=None,
+                 reconnect_delay=5):
+        """
+        Initialize the order stream.
+
+        Args:
+            app_key: Betfair application key
+            session_token_provider: Callable returning the current session token,
+                so reconnects always pick up a renewed token
+            on_change: Callable invoked with each order change message (dict)
+            host: Stream host (defaults to the production endpoint)
+            port: Stream port
+            use_ssl: Wrap the socket in TLS
+            timeout: Socket read timeout in seconds (heartbeats arrive well within it)
+            heartbeat_ms: Heartbeat interval requested from the server
+            conflate_ms: Optional conflation interval
+            reconnect_delay: Seconds to wait before reconnecting after an error
+        """
+        self.app_key = app_key
+        self.session_token_provider = session_token_provider
+        self.on_change = on_change
+        self.host = host or DEFAULT_STREAM_HOST
+        self.port = port or DEFAULT_STREAM_PORT
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.heartbeat_ms = heartbeat_ms
+        self.conflate_ms = conflate_ms
+        self.reconnect_delay = reconnect_delay
+        self.logger = logging.getLogger('betfair.stream')
+
+        # Clocks let a reconnect resume from the last message seen
+        self.initial_clk = None
+        self.clk = None
+
+        self.connected = False
+        self.last_message_at = None
+        self.messages_received = 0
+        self.last_error = None
+
+        self._request_id = 0
+        self._socket = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        """Check if the stream thread is alive."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start consuming the stream in a daemon thread."""
+        if self.is_running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='betfair-order-stream', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the stream and close the connection."""
+        self._stop_event.set()
+        self._close()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        """Connect, subscribe and read until stopped, reconnecting on errors."""
+        while not self._stop_event.is_set():
+            try:
+                self._connect()
+                self._subscribe()
+                self._read_loop()
+            except Exception as e:
+                if not self._stop_event.is_set():
+                    self.last_error = str(e)
+                    self.logger.warning(f"Order stream disconnected: {e}")
+            finally:
+                self.connected = False
+                self._close()
+            self._stop_event.wait(self.reconnect_delay)
+
+    def _connect(self):
+        """Open the socket and read the connection message."""
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        if self.use_ssl:
+            context = ssl.create_default_context()
+            sock = context.wrap_socket(sock, server_hostname=self.host)
+        self._socket = sock
+        self._reader = sock.makefile('rb')
+
+        message = self._read_message()
+        if message is None or message.get('op') != 'connection':
+            raise ConnectionError(f"Unexpected connection message: {message}")
+
+    def _subscribe(self):
+        """Authenticate and subscribe to order changes, resuming from the last clocks."""
+        self._send({
+            'op': 'authentication',
+            'appKey': self.app_key,
+            'session': self.session_token_provider()
+        })
+        self._expect_success('authentication')
+
+        subscription = {
+            'op': 'orderSubscription',
+            'orderFilter': {'includeOverallPosition': False},
+            'heartbeatMs': self.heartbeat_ms
+        }
+        if self.conflate_ms is not None:
+            subscription['conflateMs'] = self.conflate_ms
+        if self.initial_clk and self.clk:
+            subscription['initialClk'] = self.initial_clk
+            subscription['clk'] = self.clk
+        self._send(subscription)
+        self._expect_success('orderSubscription')
+
+        self.connected = True
+        self.last_error = None
+        self.logger.info(f"Order stream subscribed on {self.host}:{self.port}")
+
+    def _expect_success(self, operation):
+        """Read messages until the status reply for `operation` arrives."""
+        while True:
+            message = self._read_message()
+            if message is None:
+                raise ConnectionError(f"Connection closed during {operation}")
+            if message.get('op') == 'status':
+                if message.get('statusCode') != 'SUCCESS':
+                    raise ConnectionError(
+                        f"{operation} failed: {message.get('errorCode')} {message.get('errorMessage', '')}".strip()
+                    )
+                return
+            # Order changes can arrive before the subscription status reply
+            self._dispatch(message)
+
+    def _read_loop(self):
+        """Dispatch messages until the connection closes or the stream is stopped."""
+        while not self._stop_event.is_set():
+            message = self._read_message()
+            if message is None:
+                raise ConnectionError("Connection closed by server")
+            self._dispatch(message)
+
+    def _dispatch(self, message):
+        """Track clocks and hand order change messages to the callback."""
+        self.last_message_at = time.time()
+        self.messages_received += 1
+
+        op = message.get('op')
+        if op == 'status' and message.get('connectionClosed'):
+            raise ConnectionError(f"Stream closed: {message.get('errorCode')}")
+        if op != 'ocm':
+            return
+
+        if message.get('initialClk'):
+            self.initial_clk = message['initialClk']
+        if message.get('clk'):
+            self.clk = message['clk']
+
+        # Heartbeats only move the clock forward
+        if message.get('ct') == 'HEARTBEAT' or not message.get('oc'):
+            return
+
+        try:
+            self.on_change(message)
+        except Exception as e:
+            self.logger.error(f"Error handling order change message: {e}")
+
+    def _send(self, message):
+        """Send one CRLF-terminated JSON message."""
+        self._request_id += 1
+        message['id'] = self._request_id
+        self._socket.sendall((json.dumps(message) + '\r\n').encode('utf-8'))
+
+    def _read_message(self):
+        """Read one CRLF-terminated JSON message, or None on EOF."""
+        line = self._reader.readline()
+        if not line:
+            return None
+        return json.loads(line.decode('utf-8'))
+
+    def _close(self):
+        """Close the socket, ignoring errors."""
+        sock, self._socket = self._socket, None
+        if sock is not None:
+            try:
+                sock.close()
+            except Exception:
+                pass
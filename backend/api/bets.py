@@ -1,16 +1,329 @@
 from flask import Blueprint, request, jsonify, current_app
 from api.auth import token_required
 from database.db import get_db
+import asyncio
 import logging
 from datetime import datetime
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from utils.async_bridge import run_sync
+from utils import bet_events
+from utils.pagination import parse_page_args, fetch_page
+from utils.export import iter_documents, export_response, parse_export_args
+from utils.betting import (
+    MAX_PLACE_INSTRUCTIONS, calculate_liability, remaining_liability,
+    bet_status, limit_order_instruction, price_to_tick
+)
+from exchange.engine import ExchangeError
 
 bets_bp = Blueprint('bets', __name__)
 
+# Maximum number of bets accepted by /place-batch
+MAX_BATCH_BETS = 50
+
+# Columns of /export as (column, bet field)
+BET_EXPORT_FIELDS = [
+    ('id', '_id'),
+    ('bet_id', 'bet_id'),
+    ('market_id', 'market_id'),
+    ('selection_id', 'selection_id'),
+    ('side', 'side'),
+    ('price', 'price'),
+    ('size', 'size'),
+    ('size_matched', 'size_matched'),
+    ('average_price_matched', 'average_price_matched'),
+    ('liability', 'liability'),
+    ('status', 'status'),
+    ('profit_loss', 'profit_loss'),
+    ('placed_date', 'placed_date'),
+    ('settled_date', 'settled_date'),
+    ('created_at', 'created_at')
+]
+
 # Get Betfair API instance from app context
 def get_betfair_api():
     return current_app.extensions.get('betfair_api')
 
+# Get the async Betfair client from app context
+def get_betfair_async():
+    return current_app.extensions.get('betfair_async')
+
+# Get the position engine from app context
+def get_position_engine():
+    return current_app.extensions.get('position_engine')
+
+# Get the bet statistics service from app context
+def get_bet_stats():
+    return current_app.extensions.get('bet_stats')
+
+# Get the downline stats service from app context
+def get_downline_stats():
+    return current_app.extensions.get('downline_stats')
+
+# Get the in-house matching engine from app context
+def get_exchange():
+    return current_app.extensions.get('exchange')
+
+# Get the exchange fill writer from app context
+def get_fill_writer():
+    return current_app.extensions.get('fill_writer')
+
+def _is_exchange_market(market_id):
+    """Check if a market is matched in-house (B-book) instead of at Betfair."""
+    return market_id in current_app.config.get('EXCHANGE_MARKETS', [])
+
+def _reserve_balance(db, user_id, amount):
+    """
+    Atomically take `amount` from the user's balance if it is covered.
+
+    Returns:
+        The updated user document, or None if the user does not exist or
+        the balance is insufficient
+    """
+    return db.users.find_one_and_update(
+        {'_id': user_id, 'balance': {'$gte': amount}},
+        {'$inc': {'balance': -amount}},
+        return_document=ReturnDocument.AFTER
+    )
+
+def _release_balance(db, user_id, amount):
+    """Return a previously reserved amount to the user's balance."""
+    if amount <= 0:
+        return None
+    return db.users.find_one_and_update(
+        {'_id': user_id},
+        {'$inc': {'balance': amount}},
+        return_document=ReturnDocument.AFTER
+    )
+
+def _parse_bet_request(data):
+    """
+    Validate a single bet request.
+
+    Returns:
+        Tuple of (parsed bet dict, error message)
+    """
+    required_fields = ['market_id', 'selection_id', 'side', 'price', 'size']
+    for field in required_fields:
+        if field not in data:
+            return None, f'Missing required field: {field}'
+
+    side = str(data['side']).upper()
+    if side not in ['BACK', 'LAY']:
+        return None, 'Side must be either BACK or LAY'
+
+    try:
+        price = float(data['price'])
+        size = float(data['size'])
+    except (TypeError, ValueError):
+        return None, 'Price and size must be valid numbers'
+
+    if price <= 0 or size <= 0:
+        return None, 'Price and size must be positive numbers'
+
+    return {
+        'market_id': data['market_id'],
+        'selection_id': data['selection_id'],
+        'side': side,
+        'price': price,
+        'size': size,
+        'liability': calculate_liability(side, price, size)
+    }, None
+
+async def _place_market_orders(betfair_async, market_orders):
+    """
+    Submit one placeOrders call per market (and per 200 instructions) concurrently.
+
+    Args:
+        betfair_async: AsyncBetfairAPI instance
+        market_orders: List of (market_id, instructions, customer_ref) tuples
+
+    Returns:
+        List of placeOrders results or exception instances, in input order
+    """
+    return await asyncio.gather(
+        *(betfair_async.place_orders(market_id, instructions, customer_ref=customer_ref)
+          for market_id, instructions, customer_ref in market_orders),
+        return_exceptions=True
+    )
+
+def _place_pending_bets(db, user_id, parsed_bets):
+    """
+    Place Betfair bets whose liability is already reserved.
+
+    Every bet is written as PENDING with a customer_order_ref before anything
+    reaches Betfair, and instructions go out in one placeOrders call per
+    market. Bets with a SUCCESS report are confirmed; only bets with an
+    explicit failure report are removed and their liability released. Bets
+    whose outcome is unknown (an error, a timeout or a TIMEOUT report) stay
+    PENDING, holding their liability, until order reconciliation resolves
+    them.
+
+    Returns:
+        Tuple of (per-bet result dicts, placed count, failed count, pending
+        count, updated user)
+    """
+    # Group instructions by market, keeping the slip index of each one;
+    # every placeOrders call gets its own customer_ref
+    # An ObjectId keeps refs unique across concurrent requests and within
+    # Betfair's 32 character limit
+    request_ref = str(ObjectId())
+    market_groups = {}
+    for index, bet in enumerate(parsed_bets):
+        market_groups.setdefault(bet['market_id'], []).append(index)
+    
+    market_orders = []
+    order_indexes = []
+    for market_id, indexes in market_groups.items():
+        for start in range(0, len(indexes), MAX_PLACE_INSTRUCTIONS):
+            chunk = indexes[start:start + MAX_PLACE_INSTRUCTIONS]
+            instructions = [
+                limit_order_instruction(
+                    parsed_bets[i]['selection_id'],
+                    parsed_bets[i]['side'],
+                    parsed_bets[i]['price'],
+                    parsed_bets[i]['size'],
+                    customer_order_ref=f"{request_ref}_{i}"
+                )
+                for i in chunk
+            ]
+            market_orders.append((market_id, instructions, f"{request_ref}_m{len(market_orders)}"))
+            order_indexes.append(chunk)
+    
+    # Write every bet as PENDING before anything reaches Betfair, so an
+    # order whose outcome is unknown always has a bet holding its liability
+    # that order reconciliation can find by customer_order_ref
+    now = datetime.utcnow()
+    bet_docs = [
+        {
+            'user_id': user_id,
+            'market_id': bet['market_id'],
+            'selection_id': bet['selection_id'],
+            'side': bet['side'],
+            'price': bet['price'],
+            'size': bet['size'],
+            'liability': bet['liability'],
+            'bet_id': None,
+            'customer_order_ref': f"{request_ref}_{index}",
+            'placed_date': None,
+            'average_price_matched': None,
+            'size_matched': 0,
+            'status': 'PENDING',
+            'profit_loss': None,  # Will be updated when bet is settled
+            'created_at': now,
+            'updated_at': now
+        }
+        for index, bet in enumerate(parsed_bets)
+    ]
+    try:
+        db.bets.insert_many(bet_docs)
+    except Exception:
+        _release_balance(db, user_id, sum(bet['liability'] for bet in parsed_bets))
+        raise
+    get_downline_stats().record_placed(bet_docs)
+    
+    try:
+        market_results = run_sync(
+            _place_market_orders(get_betfair_async(), market_orders),
+            timeout=30
+        )
+    except Exception as e:
+        # Outcome unknown for every market: orders may be live, so the
+        # reservation stays until reconciliation resolves the bets
+        logging.error(f"Error placing bets: {str(e)}")
+        market_results = [e] * len(market_orders)
+    
+    # Map instruction reports back to the bets in the slip
+    now = datetime.utcnow()
+    results = [None] * len(parsed_bets)
+    bet_updates = []
+    placed_docs = []
+    failed_ids = []
+    released_liability = 0
+    
+    for (market_id, _, _), chunk, market_result in zip(market_orders, order_indexes, market_results):
+        if isinstance(market_result, Exception) or not market_result or market_result.get('status') == 'TIMEOUT':
+            market_error = None
+            reports = None
+        else:
+            market_error = market_result.get('errorCode')
+            reports = market_result.get('instructionReports') or []
+        
+        for position, index in enumerate(chunk):
+            bet_doc = bet_docs[index]
+            report = reports[position] if reports and position < len(reports) else None
+            
+            if reports is None or (report or {}).get('status') == 'TIMEOUT':
+                results[index] = {
+                    'index': index,
+                    'status': 'pending',
+                    'market_id': market_id,
+                    'selection_id': bet_doc['selection_id'],
+                    'bet': {'id': str(bet_doc['_id']), 'status': bet_doc['status']},
+                    'message': 'Bet placement outcome unknown, awaiting confirmation from Betfair'
+                }
+                continue
+            
+            if not report or report.get('status') != 'SUCCESS':
+                error = (report or {}).get('errorCode') or market_error or 'Unknown error'
+                failed_ids.append(bet_doc['_id'])
+                released_liability += bet_doc['liability']
+                results[index] = {
+                    'index': index,
+                    'status': 'error',
+                    'market_id': market_id,
+                    'selection_id': bet_doc['selection_id'],
+                    'message': f"Failed to place bet: {error}"
+                }
+                continue
+            
+            size_matched = report.get('sizeMatched') or 0
+            fields = {
+                'bet_id': report.get('betId'),
+                'placed_date': report.get('placedDate') or now,
+                'average_price_matched': report.get('averagePriceMatched'),
+                'size_matched': size_matched,
+                'status': bet_status(bet_doc['size'], size_matched),
+                'updated_at': now
+            }
+            bet_updates.append(UpdateOne({'_id': bet_doc['_id'], 'status': 'PENDING'}, {'$set': fields}))
+            bet_doc.update(fields)
+            placed_docs.append(bet_doc)
+            results[index] = {
+                'index': index,
+                'status': 'success',
+                'bet': {
+                    'id': str(bet_doc['_id']),
+                    'market_id': bet_doc['market_id'],
+                    'selection_id': bet_doc['selection_id'],
+                    'side': bet_doc['side'],
+                    'price': bet_doc['price'],
+                    'size': bet_doc['size'],
+                    'liability': bet_doc['liability'],
+                    'bet_id': bet_doc['bet_id'],
+                    'placed_date': bet_doc['placed_date'],
+                    'status': bet_doc['status']
+                }
+            }
+    
+    # Confirm all placed bets in one round trip
+    if bet_updates:
+        db.bets.bulk_write(bet_updates, ordered=False)
+        bet_events.publish(bet_events.BET_PLACED, placed_docs)
+        get_bet_stats().record_placed(placed_docs)
+    
+    # Drop the rejected bets and hand back their liability in one update
+    if failed_ids:
+        db.bets.delete_many({'_id': {'$in': failed_ids}, 'status': 'PENDING'})
+        get_downline_stats().record_released({user_id: released_liability})
+    updated_user = _release_balance(db, user_id, released_liability)
+    if updated_user is None:
+        updated_user = db.users.find_one({'_id': user_id}, {'balance': 1})
+    
+    placed = len(placed_docs)
+    failed = len(failed_ids)
+    return results, placed, failed, len(parsed_bets) - placed - failed, updated_user
+
 @bets_bp.route('/place', methods=['POST'])
 @token_required
 def place_bet(current_user):
@@ -18,132 +331,231 @@ def place_bet(current_user):
     try:
         data = request.get_json()
         
-        # Validate required fields
-        required_fields = ['market_id', 'selection_id', 'side', 'price', 'size']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({
-                    'status': 'error',
-                    'message': f'Missing required field: {field}'
-                }), 400
-        
-        # Validate side
-        if data['side'].upper() not in ['BACK', 'LAY']:
+        # Validate fields, side, price and size
+        parsed, error = _parse_bet_request(data)
+        if error:
             return jsonify({
                 'status': 'error',
-                'message': 'Side must be either BACK or LAY'
+                'message': error
             }), 400
+        liability = parsed['liability']
         
-        # Validate price and size
-        try:
-            price = float(data['price'])
-            size = float(data['size'])
-            
-            if price <= 0 or size <= 0:
+        # Reserve the liability up front; the balance check and debit are one
+        # conditional update so concurrent bets cannot both pass the check
+        db = get_db()
+        user_id = current_user['_id']
+        updated_user = _reserve_balance(db, user_id, liability)
+        
+        if not updated_user:
+            if not db.users.find_one({'_id': user_id}, {'_id': 1}):
                 return jsonify({
                     'status': 'error',
-                    'message': 'Price and size must be positive numbers'
-                }), 400
-        except ValueError:
+                    'message': 'User not found'
+                }), 404
             return jsonify({
                 'status': 'error',
-                'message': 'Price and size must be valid numbers'
+                'message': 'Insufficient balance'
             }), 400
         
-        # Check if user has enough balance
-        db = get_db()
-        user = db.users.find_one({'_id': current_user['_id']})
+        if _is_exchange_market(parsed['market_id']):
+            return _place_exchange_bet(db, user_id, parsed, updated_user)
         
-        if not user:
+        # Place the bet through the same PENDING path as /place-batch: the
+        # reservation is only released on an explicit failure report
+        results, placed, failed, pending, updated_user = _place_pending_bets(db, user_id, [parsed])
+        result = results[0]
+        
+        if failed:
             return jsonify({
                 'status': 'error',
-                'message': 'User not found'
-            }), 404
+                'message': result['message']
+            }), 400
         
-        # Calculate liability
-        liability = size
-        if data['side'].upper() == 'LAY':
-            liability = size * (price - 1)
+        if pending:
+            return jsonify({
+                'status': 'pending',
+                'message': result['message'],
+                'bet': result['bet'],
+                'user': {
+                    'balance': updated_user['balance']
+                }
+            }), 202
+        
+        return jsonify({
+            'status': 'success',
+            'message': 'Bet placed successfully',
+            'bet': result['bet'],
+            'user': {
+                'balance': updated_user['balance']
+            }
+        }), 201
+    except Exception as e:
+        logging.error(f"Error placing bet: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Failed to place bet'
+        }), 500
+
+def _place_exchange_bet(db, user_id, parsed, updated_user):
+    """
+    Match a bet on the in-house exchange; its liability is already reserved.
+
+    The bet document is written before the order reaches the book, so fills
+    against it from later orders always have a document to update. Fills are
+    written by the FillWriter in batches. Liability stays reserved at the
+    limit price; a LAY matched at a better price gets the difference back at
+    settlement, like a Betfair bet.
+    """
+    liability = parsed['liability']
+    try:
+        selection_id = int(parsed['selection_id'])
+    except (TypeError, ValueError):
+        selection_id = None
+    if selection_id is None or price_to_tick(parsed['price']) is None:
+        _release_balance(db, user_id, liability)
+        return jsonify({
+            'status': 'error',
+            'message': 'Selection ID must be an integer and price a valid Betfair price'
+        }), 400
+    
+    now = datetime.utcnow()
+    bet_object_id = ObjectId()
+    bet = {
+        '_id': bet_object_id,
+        'user_id': user_id,
+        'market_id': parsed['market_id'],
+        'selection_id': selection_id,
+        'side': parsed['side'],
+        'price': parsed['price'],
+        'size': parsed['size'],
+        'liability': liability,
+        'bet_id': str(bet_object_id),
+        'exchange': True,
+        'placed_date': now,
+        'average_price_matched': None,
+        'size_matched': 0,
+        'size_remaining': parsed['size'],
+        'status': 'UNMATCHED',
+        'profit_loss': None,  # Will be updated when bet is settled
+        'created_at': now,
+        'updated_at': now
+    }
+    db.bets.insert_one(bet)
+    
+    try:
+        order, makers = get_exchange().place(
+            bet['bet_id'], user_id, bet['market_id'], bet['selection_id'],
+            bet['side'], bet['price'], bet['size']
+        )
+    except ExchangeError as e:
+        db.bets.delete_one({'_id': bet_object_id})
+        _release_balance(db, user_id, liability)
+        return jsonify({
+            'status': 'error',
+            'message': f"Failed to place bet: {str(e)}"
+        }), 400
+    
+    bet_events.publish(bet_events.BET_PLACED, bet)
+    get_bet_stats().record_placed(bet)
+    get_downline_stats().record_placed(bet)
+    get_fill_writer().submit([order] + makers)
+    
+    return jsonify({
+        'status': 'success',
+        'message': 'Bet placed successfully',
+        'bet': {
+            'id': str(bet_object_id),
+            'market_id': bet['market_id'],
+            'selection_id': bet['selection_id'],
+            'side': bet['side'],
+            'price': bet['price'],
+            'size': bet['size'],
+            'liability': liability,
+            'bet_id': bet['bet_id'],
+            'placed_date': bet['placed_date'],
+            'size_matched': order['size_matched'],
+            'average_price_matched': order['average_price_matched'],
+            'status': order['status']
+        },
+        'user': {
+            'balance': updated_user['balance']
+        }
+    }), 201
+
+@bets_bp.route('/place-batch', methods=['POST'])
+@token_required
+def place_bet_batch(current_user):
+    """Place several bets, packing instructions into one placeOrders call per market"""
+    try:
+        data = request.get_json() or {}
+        bet_requests = data.get('bets')
         
-        if user['balance'] < liability:
+        if not isinstance(bet_requests, list) or not bet_requests:
             return jsonify({
                 'status': 'error',
-                'message': 'Insufficient balance'
+                'message': 'bets must be a non-empty list'
             }), 400
         
-        # Place bet with Betfair API
-        betfair_api = get_betfair_api()
-        customer_ref = f"user_{str(user['_id'])}_{datetime.utcnow().timestamp()}"
-        
-        result = betfair_api.place_bet(
-            market_id=data['market_id'],
-            selection_id=data['selection_id'],
-            side=data['side'],
-            price=price,
-            size=size,
-            customer_ref=customer_ref
-        )
-        
-        if result['status'] != 'success':
+        if len(bet_requests) > MAX_BATCH_BETS:
             return jsonify({
                 'status': 'error',
-                'message': f"Failed to place bet: {result.get('error', 'Unknown error')}"
+                'message': f'A batch may contain at most {MAX_BATCH_BETS} bets'
             }), 400
         
-        # Save bet to database
-        bet = {
-            'user_id': user['_id'],
-            'market_id': data['market_id'],
-            'selection_id': data['selection_id'],
-            'side': data['side'].upper(),
-            'price': price,
-            'size': size,
-            'liability': liability,
-            'bet_id': result.get('bet_id'),
-            'placed_date': result.get('placed_date') or datetime.utcnow(),
-            'average_price_matched': result.get('average_price_matched'),
-            'size_matched': result.get('size_matched', 0),
-            'status': 'MATCHED' if result.get('size_matched', 0) > 0 else 'UNMATCHED',
-            'profit_loss': None,  # Will be updated when bet is settled
-            'created_at': datetime.utcnow(),
-            'updated_at': datetime.utcnow()
-        }
+        # Validate every bet up front so nothing is reserved for a bad slip
+        parsed_bets = []
+        for index, bet_request in enumerate(bet_requests):
+            parsed, error = _parse_bet_request(bet_request if isinstance(bet_request, dict) else {})
+            if not error and _is_exchange_market(parsed['market_id']):
+                error = f"Market {parsed['market_id']} is matched in-house, place its bets through /place"
+            if error:
+                return jsonify({
+                    'status': 'error',
+                    'message': f'Bet {index}: {error}'
+                }), 400
+            parsed_bets.append(parsed)
         
-        bet_id = db.bets.insert_one(bet).inserted_id
+        db = get_db()
+        user_id = current_user['_id']
+        total_liability = sum(bet['liability'] for bet in parsed_bets)
         
-        # Update user balance - reserve the liability
-        db.users.update_one(
-            {'_id': user['_id']},
-            {'$inc': {'balance': -liability}}
-        )
+        # Reserve the liability for the whole slip in one atomic update
+        if not _reserve_balance(db, user_id, total_liability):
+            if not db.users.find_one({'_id': user_id}, {'_id': 1}):
+                return jsonify({
+                    'status': 'error',
+                    'message': 'User not found'
+                }), 404
+            return jsonify({
+                'status': 'error',
+                'message': 'Insufficient balance'
+            }), 400
         
-        # Get updated user
-        updated_user = db.users.find_one({'_id': user['_id']})
+        results, placed, failed, pending, updated_user = _place_pending_bets(db, user_id, parsed_bets)
+        message = f'{placed} bets placed, {failed} failed'
+        if pending:
+            message += f', {pending} pending confirmation'
+        
+        if placed:
+            status, status_code = 'success', 201
+        elif pending:
+            status, status_code = 'pending', 202
+        else:
+            status, status_code = 'error', 400
         
         return jsonify({
-            'status': 'success',
-            'message': 'Bet placed successfully',
-            'bet': {
-                'id': str(bet_id),
-                'market_id': bet['market_id'],
-                'selection_id': bet['selection_id'],
-                'side': bet['side'],
-                'price': bet['price'],
-                'size': bet['size'],
-                'liability': bet['liability'],
-                'bet_id': bet['bet_id'],
-                'placed_date': bet['placed_date'],
-                'status': bet['status']
-            },
+            'status': status,
+            'message': message,
+            'results': results,
             'user': {
                 'balance': updated_user['balance']
             }
-        }), 201
+        }), status_code
     except Exception as e:
-        logging.error(f"Error placing bet: {str(e)}")
+        logging.error(f"Error placing bet batch: {str(e)}")
         return jsonify({
             'status': 'error',
-            'message': 'Failed to place bet'
+            'message': 'Failed to place bets'
         }), 500
 
 @bets_bp.route('/cancel/<bet_id>', methods=['POST'])
@@ -172,41 +584,71 @@ def cancel_bet(current_user, bet_id):
                 'message': f"Cannot cancel bet with status: {bet['status']}"
             }), 400
         
-        # Cancel bet with Betfair API
-        betfair_api = get_betfair_api()
-        
-        result = betfair_api.cancel_bet(
-            bet_id=bet['bet_id'],
-            market_id=bet['market_id']
-        )
-        
-        if result['status'] != 'success':
-            return jsonify({
-                'status': 'error',
-                'message': f"Failed to cancel bet: {result.get('error', 'Unknown error')}"
-            }), 400
-        
-        # Update bet status in database
-        db.bets.update_one(
-            {'_id': bet['_id']},
-            {'$set': {
-                'status': 'CANCELLED',
+        if bet.get('exchange'):
+            # Take the remainder off the in-house book; the snapshot carries
+            # fills the FillWriter may not have written yet
+            order = get_exchange().cancel(bet['bet_id'])
+            if order is None:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Bet is already fully matched'
+                }), 400
+            cancelled_status = order['status']
+            cancelled_fields = {
+                'status': cancelled_status,
+                'size_matched': order['size_matched'],
+                'size_remaining': 0,
+                'average_price_matched': order['average_price_matched'],
+                'cancelled_date': datetime.utcnow(),
+                'updated_at': datetime.utcnow()
+            }
+        else:
+            # Cancel bet with Betfair API
+            betfair_api = get_betfair_api()
+            
+            result = betfair_api.cancel_bet(
+                bet_id=bet['bet_id'],
+                market_id=bet['market_id']
+            )
+            
+            if result['status'] != 'success':
+                return jsonify({
+                    'status': 'error',
+                    'message': f"Failed to cancel bet: {result.get('error', 'Unknown error')}"
+                }), 400
+            
+            # Whatever Betfair did not cancel was matched; a bet with a
+            # matched part stays MATCHED so its liability stays held
+            size_matched = bet.get('size_matched') or 0
+            if result.get('size_cancelled') is not None:
+                size_matched = max(size_matched, bet['size'] - result['size_cancelled'])
+            cancelled_status = 'MATCHED' if size_matched > 0 else 'CANCELLED'
+            cancelled_fields = {
+                'status': cancelled_status,
+                'size_matched': size_matched,
+                'size_remaining': 0,
                 'cancelled_date': result.get('cancelled_date') or datetime.utcnow(),
                 'updated_at': datetime.utcnow()
-            }}
+            }
+        
+        # Update bet status in database, unless order reconciliation already closed it
+        cancelled_bet = db.bets.find_one_and_update(
+            {'_id': bet['_id'], 'status': {'$in': ['UNMATCHED', 'PARTIALLY_MATCHED']}},
+            {'$set': cancelled_fields},
+            return_document=ReturnDocument.AFTER
         )
         
         # Return liability to user balance
-        remaining_liability = bet['liability']
-        if bet['status'] == 'PARTIALLY_MATCHED':
-            # Calculate remaining liability for partially matched bets
-            matched_liability = bet['size_matched'] * (bet['price'] - 1) if bet['side'] == 'LAY' else bet['size_matched']
-            remaining_liability = bet['liability'] - matched_liability
-        
-        db.users.update_one(
-            {'_id': current_user['_id']},
-            {'$inc': {'balance': remaining_liability}}
-        )
+        # Only the unmatched part of a partially matched bet is released
+        if cancelled_bet:
+            bet_events.publish(bet_events.BET_CANCELLED, cancelled_bet)
+            get_bet_stats().record_transitions([(cancelled_bet, bet['status'], cancelled_status)])
+            released = remaining_liability(cancelled_bet)
+            db.users.update_one(
+                {'_id': current_user['_id']},
+                {'$inc': {'balance': released}}
+            )
+            get_downline_stats().record_released({current_user['_id']: released})
         
         # Get updated user
         updated_user = db.users.find_one({'_id': current_user['_id']})
@@ -232,8 +674,14 @@ def list_bets(current_user):
     try:
         status = request.args.get('status')
         market_id = request.args.get('market_id')
-        limit = int(request.args.get('limit', 50))
-        offset = int(request.args.get('offset', 0))
+        
+        try:
+            page = parse_page_args(request.args)
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
         
         # Build query
         query = {'user_id': current_user['_id']}
@@ -246,8 +694,8 @@ def list_bets(current_user):
         
         db = get_db()
         
-        # Get bets
-        bets = list(db.bets.find(query).sort('created_at', -1).skip(offset).limit(limit))
+        # Get bets, newest first, continuing after the `after` token
+        bets, pagination = fetch_page(db.bets, query, page)
         
         # Format bets
         formatted_bets = []
@@ -267,17 +715,10 @@ def list_bets(current_user):
                 'created_at': bet['created_at']
             })
         
-        # Get total count
-        total = db.bets.count_documents(query)
-        
         return jsonify({
             'status': 'success',
             'data': formatted_bets,
-            'pagination': {
-                'total': total,
-                'limit': limit,
-                'offset': offset
-            }
+            'pagination': pagination
         }), 200
     except Exception as e:
         logging.error(f"Error listing bets: {str(e)}")
@@ -286,6 +727,97 @@ def list_bets(current_user):
             'message': 'Failed to list bets'
         }), 500
 
+@bets_bp.route('/export', methods=['GET'])
+@token_required
+def export_bets(current_user):
+    """Stream the user's full bet history as CSV or NDJSON"""
+    try:
+        options = parse_export_args(request.args)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    
+    query = {'user_id': current_user['_id']}
+    if request.args.get('status'):
+        query['status'] = request.args['status'].upper()
+    if request.args.get('market_id'):
+        query['market_id'] = request.args['market_id']
+    if options['created_at']:
+        query['created_at'] = options['created_at']
+    
+    db = get_db()
+    return export_response(
+        iter_documents(db.bets, query, BET_EXPORT_FIELDS),
+        BET_EXPORT_FIELDS,
+        options['format'],
+        f"bets_{current_user['username']}",
+        compress=options['compress']
+    )
+
+@bets_bp.route('/exposure', methods=['GET'])
+@token_required
+def get_exposure(current_user):
+    """Get runner P&L and worst-case exposure per market for the current user"""
+    try:
+        position_engine = get_position_engine()
+        if position_engine is None:
+            return jsonify({
+                'status': 'error',
+                'message': 'Position engine not available'
+            }), 503
+        
+        positions = position_engine.get_positions(current_user['_id'], request.args.get('market_id'))
+        
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'markets': positions,
+                'total_exposure': round(sum(position['exposure'] for position in positions.values()), 2)
+            }
+        }), 200
+    except Exception as e:
+        logging.error(f"Error getting exposure: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Failed to get exposure'
+        }), 500
+
+@bets_bp.route('/exchange/book/<market_id>/<int:selection_id>', methods=['GET'])
+@token_required
+def get_exchange_book(current_user, market_id, selection_id):
+    """Get the best available prices of a runner on the in-house exchange"""
+    try:
+        if not _is_exchange_market(market_id):
+            return jsonify({
+                'status': 'error',
+                'message': 'Market is not matched in-house'
+            }), 404
+        
+        try:
+            depth = min(max(int(request.args.get('depth', 3)), 1), 10)
+        except ValueError:
+            return jsonify({
+                'status': 'error',
+                'message': 'depth must be an integer'
+            }), 400
+        
+        return jsonify({
+            'status': 'success',
+            'data': dict(
+                get_exchange().get_book(market_id, selection_id, depth),
+                market_id=market_id,
+                selection_id=selection_id
+            )
+        }), 200
+    except Exception as e:
+        logging.error(f"Error getting exchange book: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Failed to get exchange book'
+        }), 500
+
 @bets_bp.route('/<bet_id>', methods=['GET'])
 @token_required
 def get_bet(current_user, bet_id):
@@ -3,11 +3,14 @@ from api.auth import token_required
 from database.db import get_db
 import logging
 import json
+import asyncio
 from datetime import datetime
 from betfairlightweight import filters
 import uuid
 from bson.json_util import dumps, loads
 from collections import OrderedDict
+from api.betfair_instrumentation import instrument_client
+from utils.async_bridge import run_sync
 
 # Helper function to safely access attributes or keys
 def safe_get(obj, key, default=None):
@@ -56,6 +59,23 @@ def get_betfair_api():
     
     return api
 
+# Get async Betfair API instance (concurrent fan-out) from app context
+def get_betfair_async():
+    api = current_app.extensions.get('betfair_async')
+    
+    # If not found, create a new instance as fallback
+    if api is None:
+        from api.betfair_async import AsyncBetfairAPI
+        import os
+        logging.warning("Async Betfair API not found in app extensions, creating new instance")
+        api = AsyncBetfairAPI(
+            app_key=os.getenv('BETFAIR_APP_KEY'),
+            session_token=os.getenv('BETFAIR_SESSION_TOKEN')
+        )
+        current_app.extensions['betfair_async'] = api
+    
+    return api
+
 @markets_bp.route('/sports', methods=['GET'])
 def get_sports():
     """Get all sports (event types)"""
@@ -375,6 +395,7 @@ def check_credentials():
             lightweight=True
         )
         client.session_token = session_token
+        instrument_client(client)
         
         # Try to make a simple API call to check if credentials are valid
         try:
@@ -948,6 +969,7 @@ def get_market_data_v2():
             lightweight=True
         )
         client.session_token = session_token
+        instrument_client(client)
         
         logging.info(f"Initialized Betfair client with app_key={app_key[:5]}... and session_token={session_token[:10]}...")
         
@@ -1188,6 +1210,7 @@ def get_market_catalog():
             lightweight=True
         )
         client.session_token = session_token
+        instrument_client(client)
         
         logging.info(f"Initialized Betfair client with app_key={app_key[:5]}... and session_token={session_token[:10]}...")
         
@@ -1486,6 +1509,13 @@ def get_market_catalog():
             'message': f'Failed to get market catalog: {str(e)}'
         }), 500
 
+async def _fetch_catalogs_and_books(betfair_async, market_ids, batch_size):
+    """Fetch catalogues and books for the given markets in one concurrent fan-out"""
+    return await asyncio.gather(
+        betfair_async.get_market_catalogues_batched(market_ids, batch_size=batch_size),
+        betfair_async.get_market_books_batched(market_ids, batch_size=batch_size)
+    )
+
 @markets_bp.route('/catalogs', methods=['GET'])
 @markets_bp.route('/catalogs/', methods=['GET'])
 def get_multiple_catalogs():
@@ -1543,41 +1573,19 @@ def get_multiple_catalogs():
             
         # Otherwise, fetch the missing markets from Betfair API
         logging.info(f"Fetching {len(missing_market_ids)} markets from Betfair API")
-        betfair_api = get_betfair_api()
+        betfair_async = get_betfair_async()
         
         try:
             # Process market IDs in batches to avoid TOO_MUCH_DATA error
             BATCH_SIZE = 5  # Smaller batch size to avoid API limits
             
-            # Get market catalogs in batches
-            market_catalogs = []
-            for i in range(0, len(missing_market_ids), BATCH_SIZE):
-                batch_ids = missing_market_ids[i:i+BATCH_SIZE]
-                logging.info(f"Fetching catalog batch {i//BATCH_SIZE + 1} with {len(batch_ids)} market IDs")
-                
-                market_filter = filters.market_filter(market_ids=batch_ids)
-                batch_catalogs = betfair_api.client.betting.list_market_catalogue(
-                    filter=market_filter,
-                    max_results=len(batch_ids),
-                    market_projection=["COMPETITION", "EVENT", "EVENT_TYPE", "RUNNER_DESCRIPTION", "MARKET_START_TIME"]
-                )
-                market_catalogs.extend(batch_catalogs)
-            
-            logging.info(f"Retrieved {len(market_catalogs)} market catalogs from Betfair in total")
-            
-            # Get market books in batches
-            market_books = []
-            for i in range(0, len(missing_market_ids), BATCH_SIZE):
-                batch_ids = missing_market_ids[i:i+BATCH_SIZE]
-                logging.info(f"Fetching market book batch {i//BATCH_SIZE + 1} with {len(batch_ids)} market IDs")
-                try:
-                    batch_books = betfair_api.get_market_book(batch_ids)
-                    market_books.extend(batch_books)
-                except Exception as batch_error:
-                    logging.error(f"Error fetching market book batch: {str(batch_error)}")
-                    # Continue with other batches even if one fails
+            # Catalogue and book batches are all issued concurrently over the pooled connections
+            market_catalogs, market_books = run_sync(
+                _fetch_catalogs_and_books(betfair_async, missing_market_ids, BATCH_SIZE),
+                timeout=30
+            )
             
-            logging.info(f"Retrieved {len(market_books)} market books from Betfair in total")
+            logging.info(f"Retrieved {len(market_catalogs)} market catalogs and {len(market_books)} market books from Betfair")
             
             # Create a dictionary of market books by market_id for easy lookup
             market_books_dict = {book['market_id']: book for book in market_books}
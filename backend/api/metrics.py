@@ -0,0 +1,63 @@
+from flask import Blueprint, jsonify, current_app
+from api.auth import token_required
+from utils.metrics import betfair_metrics
+from utils.cache import get_user_cache
+
+metrics_bp = Blueprint('metrics', __name__)
+
+def _forbidden():
+    return jsonify({
+        'status': 'error',
+        'message': 'Admin role required'
+    }), 403
+
+@metrics_bp.route('/betfair', methods=['GET'])
+@token_required
+def betfair_call_metrics(current_user):
+    """Betfair call latency, errors, ids and weight per operation and originating endpoint"""
+    if current_user.get('role') != 'admin':
+        return _forbidden()
+    
+    data = betfair_metrics.snapshot()
+    
+    # Session and order reconciliation state alongside the call statistics
+    session_manager = current_app.extensions.get('betfair_session')
+    order_reconciliation = current_app.extensions.get('order_reconciliation')
+    data['session'] = session_manager.get_metrics() if session_manager else None
+    data['order_reconciliation'] = order_reconciliation.get_metrics() if order_reconciliation else None
+    
+    return jsonify({
+        'status': 'success',
+        'data': data
+    }), 200
+
+@metrics_bp.route('/internal', methods=['GET'])
+@token_required
+def internal_metrics(current_user):
+    """Ledger writer queue and authenticated user cache statistics"""
+    if current_user.get('role') != 'admin':
+        return _forbidden()
+    
+    ledger_writer = current_app.extensions.get('ledger_writer')
+    
+    return jsonify({
+        'status': 'success',
+        'data': {
+            'ledger_writer': ledger_writer.get_metrics() if ledger_writer else None,
+            'user_cache': get_user_cache().get_stats()
+        }
+    }), 200
+
+@metrics_bp.route('/betfair/reset', methods=['POST'])
+@token_required
+def reset_betfair_call_metrics(current_user):
+    """Clear the Betfair call statistics"""
+    if current_user.get('role') != 'admin':
+        return _forbidden()
+    
+    betfair_metrics.reset()
+    
+    return jsonify({
+        'status': 'success',
+        'message': 'Betfair call metrics reset'
+    }), 200
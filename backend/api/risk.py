@@ -0,0 +1,133 @@
+from flask import Blueprint, request, jsonify, current_app
+from api.auth import token_required
+import logging
+
+risk_bp = Blueprint('risk', __name__)
+
+# Upper bound for the top users requested per market
+MAX_TOP_USERS = 100
+
+# Get the risk book from app context
+def get_risk_book():
+    return current_app.extensions.get('risk_book')
+
+# Get the market sweeper from app context
+def get_market_sweeper():
+    return current_app.extensions.get('market_sweeper')
+
+# Get the balance snapshot service from app context
+def get_balance_snapshots():
+    return current_app.extensions.get('balance_snapshots')
+
+def _forbidden():
+    return jsonify({
+        'status': 'error',
+        'message': 'Admin role required'
+    }), 403
+
+@risk_bp.route('/markets', methods=['GET'])
+@token_required
+def list_market_liabilities(current_user):
+    """List open markets with their worst-case house liability"""
+    if current_user.get('role') != 'admin':
+        return _forbidden()
+    
+    try:
+        return jsonify({
+            'status': 'success',
+            'data': get_risk_book().list_markets()
+        }), 200
+    except Exception as e:
+        logging.error(f"Error listing market liabilities: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Failed to list market liabilities'
+        }), 500
+
+@risk_bp.route('/markets/<market_id>', methods=['GET'])
+@token_required
+def get_market_liability(current_user, market_id):
+    """House liability if each runner wins, top exposed users and masters for a market"""
+    if current_user.get('role') != 'admin':
+        return _forbidden()
+    
+    try:
+        try:
+            top = min(max(int(request.args.get('top', 10)), 1), MAX_TOP_USERS)
+        except ValueError:
+            return jsonify({
+                'status': 'error',
+                'message': 'top must be an integer'
+            }), 400
+        include_masters = request.args.get('masters', 'true').lower() == 'true'
+        
+        book = get_risk_book().get_market(market_id, top=top, include_masters=include_masters)
+        if book is None:
+            return jsonify({
+                'status': 'error',
+                'message': 'No matched bets on this market'
+            }), 404
+        
+        return jsonify({
+            'status': 'success',
+            'data': book
+        }), 200
+    except Exception as e:
+        logging.error(f"Error getting market liability: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Failed to get market liability'
+        }), 500
+
+@risk_bp.route('/markets/<market_id>/sweep', methods=['POST'])
+@token_required
+def sweep_market(current_user, market_id):
+    """Cancel every unmatched bet on a market and release the liabilities"""
+    if current_user.get('role') != 'admin':
+        return _forbidden()
+    
+    try:
+        swept, failed = get_market_sweeper().sweep_markets([market_id])
+        if failed:
+            return jsonify({
+                'status': 'error',
+                'message': 'Failed to cancel orders on this market'
+            }), 502
+        
+        return jsonify({
+            'status': 'success',
+            'message': f'{swept} unmatched bets cancelled',
+            'data': {
+                'market_id': market_id,
+                'bets_swept': swept
+            }
+        }), 200
+    except Exception as e:
+        logging.error(f"Error sweeping market: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Failed to sweep market'
+        }), 500
+
+@risk_bp.route('/balance-drift', methods=['GET'])
+@token_required
+def get_balance_drift(current_user):
+    """Users whose wallet balance disagrees with their ledger on consecutive snapshots"""
+    if current_user.get('role') != 'admin':
+        return _forbidden()
+    
+    try:
+        balance_snapshots = get_balance_snapshots()
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'drift': balance_snapshots.get_drift(),
+                'last_run': balance_snapshots.last_run
+            }
+        }), 200
+    except Exception as e:
+        logging.error(f"Error getting balance drift: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Failed to get balance drift'
+        }), 500
@@ -2,12 +2,72 @@ from flask import Blueprint, request, jsonify, current_app
 from api.auth import token_required
 from database.db import get_db
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 import bcrypt
 from bson.objectid import ObjectId
+from utils.pagination import MAX_PAGE_SIZE, parse_page_args, fetch_page
+from utils.export import iter_documents, export_response, parse_export_args
+from utils import user_events
+from utils.hierarchy import is_in_downline
 
 user_bp = Blueprint('user', __name__)
 
+# Columns of /transactions/export as (column, transaction field)
+TRANSACTION_EXPORT_FIELDS = [
+    ('id', '_id'),
+    ('type', 'type'),
+    ('amount', 'amount'),
+    ('balance_before', 'balance_before'),
+    ('balance_after', 'balance_after'),
+    ('description', 'description'),
+    ('reference_id', 'reference_id'),
+    ('status', 'status'),
+    ('created_at', 'created_at')
+]
+
+# Get the balance snapshot service from app context
+def get_balance_snapshots():
+    return current_app.extensions.get('balance_snapshots')
+
+# Get the daily user stats service from app context
+def get_daily_stats():
+    return current_app.extensions.get('daily_stats')
+
+# Get the downline stats service from app context
+def get_downline_stats():
+    return current_app.extensions.get('downline_stats')
+
+# Get the group-commit ledger writer from app context (None when disabled)
+def get_ledger_writer():
+    return current_app.extensions.get('ledger_writer')
+
+def _insert_transaction(db, transaction):
+    """Insert a ledger row, grouped with concurrent ones when group commit is enabled."""
+    ledger_writer = get_ledger_writer()
+    if ledger_writer is not None:
+        return ledger_writer.write(transaction)
+    return db.transactions.insert_one(transaction).inserted_id
+
+# Longest period a report covers
+MAX_REPORT_DAYS = 366
+
+def _parse_datetime_arg(name, default=None):
+    """
+    Read an ISO date or datetime request argument.
+
+    Raises:
+        ValueError: If the argument is missing without a default, or invalid
+    """
+    value = request.args.get(name)
+    if not value:
+        if default is None:
+            raise ValueError(f'{name} is required')
+        return default
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an ISO date or datetime')
+
 @user_bp.route('/profile', methods=['GET'])
 @token_required
 def get_profile(current_user):
@@ -20,7 +80,7 @@ def get_profile(current_user):
                 'username': current_user['username'],
                 'email': current_user['email'],
                 'full_name': current_user['full_name'],
-                'balance': current_user['balance'],
+                'balance': get_db().users.find_one({'_id': current_user['_id']}, {'balance': 1})['balance'],
                 'role': current_user['role'],
                 'created_at': current_user['created_at']
             }
@@ -62,6 +122,7 @@ def update_profile(current_user):
             {'_id': current_user['_id']},
             {'$set': update_data}
         )
+        user_events.publish(user_events.USER_UPDATED, current_user['_id'])
         
         # Get updated user
         updated_user = db.users.find_one({'_id': current_user['_id']})
@@ -127,6 +188,7 @@ def change_password(current_user):
                 'updated_at': datetime.utcnow()
             }}
         )
+        user_events.publish(user_events.USER_UPDATED, current_user['_id'])
         
         return jsonify({
             'status': 'success',
@@ -165,15 +227,18 @@ def get_balance(current_user):
 def get_transactions(current_user):
     """Get user transactions"""
     try:
-        limit = int(request.args.get('limit', 50))
-        offset = int(request.args.get('offset', 0))
+        try:
+            page = parse_page_args(request.args)
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
         
         db = get_db()
         
-        # Get transactions
-        transactions = list(db.transactions.find(
-            {'user_id': current_user['_id']}
-        ).sort('created_at', -1).skip(offset).limit(limit))
+        # Get transactions, newest first, continuing after the `after` token
+        transactions, pagination = fetch_page(db.transactions, {'user_id': current_user['_id']}, page)
         
         # Format transactions
         formatted_transactions = []
@@ -189,17 +254,10 @@ def get_transactions(current_user):
                 'created_at': transaction['created_at']
             })
         
-        # Get total count
-        total = db.transactions.count_documents({'user_id': current_user['_id']})
-        
         return jsonify({
             'status': 'success',
             'data': formatted_transactions,
-            'pagination': {
-                'total': total,
-                'limit': limit,
-                'offset': offset
-            }
+            'pagination': pagination
         }), 200
     except Exception as e:
         logging.error(f"Error getting user transactions: {str(e)}")
@@ -208,6 +266,221 @@ def get_transactions(current_user):
             'message': 'Failed to get user transactions'
         }), 500
 
+@user_bp.route('/balance/as-of', methods=['GET'])
+@token_required
+def get_balance_as_of(current_user):
+    """Get the user's ledger balance at a point in time"""
+    try:
+        try:
+            at = _parse_datetime_arg('at')
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        
+        balance, _ = get_balance_snapshots().balance_as_of(current_user['_id'], at)
+        
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'at': at,
+                'balance': balance
+            }
+        }), 200
+    except Exception as e:
+        logging.error(f"Error getting balance as of: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Failed to get balance'
+        }), 500
+
+@user_bp.route('/statement', methods=['GET'])
+@token_required
+def get_statement(current_user):
+    """Get an account statement with opening and closing balances"""
+    try:
+        try:
+            start = _parse_datetime_arg('from')
+            end = _parse_datetime_arg('to', default=datetime.utcnow())
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        try:
+            limit = min(int(request.args.get('limit', 100)), MAX_PAGE_SIZE)
+        except ValueError:
+            return jsonify({
+                'status': 'error',
+                'message': 'limit must be an integer'
+            }), 400
+        if start >= end or limit < 1:
+            return jsonify({
+                'status': 'error',
+                'message': 'from must be before to and limit positive'
+            }), 400
+        
+        return jsonify({
+            'status': 'success',
+            'data': get_balance_snapshots().statement(current_user['_id'], start, end, limit=limit)
+        }), 200
+    except Exception as e:
+        logging.error(f"Error getting statement: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Failed to get statement'
+        }), 500
+
+def _parse_report_period():
+    """
+    Read the from/to days of a report; to is exclusive and defaults to tomorrow.
+
+    Raises:
+        ValueError: If the period is missing, invalid or too long
+    """
+    start = _parse_datetime_arg('from')
+    end = _parse_datetime_arg('to', default=datetime.utcnow() + timedelta(days=1))
+    if start >= end:
+        raise ValueError('from must be before to')
+    if (end - start).days > MAX_REPORT_DAYS:
+        raise ValueError(f'A report covers at most {MAX_REPORT_DAYS} days')
+    return start, end
+
+@user_bp.route('/reports/daily', methods=['GET'])
+@token_required
+def get_daily_report(current_user):
+    """Get settled bets, turnover, P&L and commission by day for yourself or a downline user"""
+    try:
+        try:
+            start, end = _parse_report_period()
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        
+        daily_stats = get_daily_stats()
+        user_id = current_user['_id']
+        if request.args.get('user_id'):
+            if not ObjectId.is_valid(request.args['user_id']):
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Invalid user_id'
+                }), 400
+            user_id = ObjectId(request.args['user_id'])
+            if user_id != current_user['_id'] and not is_in_downline(get_db().users, current_user['_id'], user_id):
+                return jsonify({
+                    'status': 'error',
+                    'message': 'User is not in your downline'
+                }), 403
+        
+        return jsonify({
+            'status': 'success',
+            'data': daily_stats.user_report(user_id, start, end)
+        }), 200
+    except Exception as e:
+        logging.error(f"Error getting daily report: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Failed to get daily report'
+        }), 500
+
+@user_bp.route('/reports/downline', methods=['GET'])
+@token_required
+def get_downline_report(current_user):
+    """Get settled bets, turnover, P&L and commission by day summed over your whole downline"""
+    if current_user.get('role') not in ('master', 'supermaster', 'admin'):
+        return jsonify({
+            'status': 'error',
+            'message': 'Master role required'
+        }), 403
+    
+    try:
+        try:
+            start, end = _parse_report_period()
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        
+        daily_stats = get_daily_stats()
+        downline = daily_stats.get_downline_ids(current_user['_id'])
+        report = daily_stats.downline_report(downline, start, end)
+        report['downline_users'] = len(downline)
+        return jsonify({
+            'status': 'success',
+            'data': report
+        }), 200
+    except Exception as e:
+        logging.error(f"Error getting downline report: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Failed to get downline report'
+        }), 500
+
+@user_bp.route('/downline/summary', methods=['GET'])
+@token_required
+def get_downline_summary(current_user):
+    """Get the user count, balances, open liability and today's P&L of your downline, or a downline user's"""
+    if current_user.get('role') not in ('master', 'supermaster', 'admin'):
+        return jsonify({
+            'status': 'error',
+            'message': 'Master role required'
+        }), 403
+    
+    try:
+        user_id = current_user['_id']
+        if request.args.get('user_id'):
+            if not ObjectId.is_valid(request.args['user_id']):
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Invalid user_id'
+                }), 400
+            user_id = ObjectId(request.args['user_id'])
+            if user_id != current_user['_id'] and not is_in_downline(get_db().users, current_user['_id'], user_id):
+                return jsonify({
+                    'status': 'error',
+                    'message': 'User is not in your downline'
+                }), 403
+        
+        return jsonify({
+            'status': 'success',
+            'data': get_downline_stats().get_summary(user_id)
+        }), 200
+    except Exception as e:
+        logging.error(f"Error getting downline summary: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': 'Failed to get downline summary'
+        }), 500
+
+@user_bp.route('/transactions/export', methods=['GET'])
+@token_required
+def export_transactions(current_user):
+    """Stream the user's full transaction history as CSV or NDJSON"""
+    try:
+        options = parse_export_args(request.args)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    
+    query = {'user_id': current_user['_id']}
+    if options['created_at']:
+        query['created_at'] = options['created_at']
+    
+    db = get_db()
+    return export_response(
+        iter_documents(db.transactions, query, TRANSACTION_EXPORT_FIELDS),
+        TRANSACTION_EXPORT_FIELDS,
+        options['format'],
+        f"transactions_{current_user['username']}",
+        compress=options['compress']
+    )
+
 @user_bp.route('/deposit', methods=['POST'])
 @token_required
 def deposit(current_user):
@@ -253,13 +526,14 @@ def deposit(current_user):
         }
         
         # Insert transaction
-        db.transactions.insert_one(transaction)
+        _insert_transaction(db, transaction)
         
         # Update user balance
         db.users.update_one(
             {'_id': user['_id']},
             {'$inc': {'balance': amount}}
         )
+        get_downline_stats().record_balance({user['_id']: amount})
         
         # Get updated user
         updated_user = db.users.find_one({'_id': user['_id']})
@@ -330,13 +604,14 @@ def withdraw(current_user):
         }
         
         # Insert transaction
-        db.transactions.insert_one(transaction)
+        _insert_transaction(db, transaction)
         
         # Update user balance
         db.users.update_one(
             {'_id': user['_id']},
             {'$inc': {'balance': -amount}}
         )
+        get_downline_stats().record_balance({user['_id']: -amount})
         
         # Get updated user
         updated_user = db.users.find_one({'_id': user['_id']})
@@ -3,6 +3,9 @@ import jwt
 from functools import wraps
 from bson import ObjectId
 from services.user_service import UserService
+from models.user import User
+from utils.cache import get_cached_user
+from utils.pagination import MAX_PAGE_SIZE, encode_cursor
 import os
 from datetime import datetime, timedelta
 import logging
@@ -10,6 +13,9 @@ import logging
 # Create blueprint
 user_management_bp = Blueprint('user_management', __name__)
 
+# Upper bound for the wallets updated by one distribution
+MAX_DISTRIBUTION_SIZE = 500
+
 # Track initialization status
 _api_initialized = False
 
@@ -49,7 +55,9 @@ def token_required(f):
         try:
             # Decode token
             data = jwt.decode(token, os.environ.get('SECRET_KEY'), algorithms=['HS256'])
-            current_user = get_user_service().get_user_by_id(data['user_id'])
+            # Cached by user ID, invalidated by the user service's writes
+            user_data = get_cached_user(data['user_id'], lambda: get_user_service().find_by_id(data['user_id']))
+            current_user = User.from_dict(user_data) if user_data else None
             
             if not current_user:
                 return jsonify({
@@ -98,6 +106,13 @@ def role_required(required_role):
         return decorated
     return decorator
 
+def _can_manage(current_user, target_user):
+    """Role check plus, below admin, the target being in the current user's downline."""
+    if not current_user.can_manage(target_user):
+        return False
+    # The target's materialized ancestor chain answers the downline check without a query
+    return current_user.role == 'admin' or current_user._id in target_user.ancestors
+
 # Routes
 
 @user_management_bp.route('/login', methods=['POST'])
@@ -205,7 +220,7 @@ def get_user(user_id):
                 'message': 'User not found!'
             }), 404
             
-        if not current_user.can_manage(target_user):
+        if not _can_manage(current_user, target_user):
             return jsonify({
                 'success': False,
                 'message': 'Access denied!'
@@ -287,7 +302,7 @@ def update_user(user_id):
         return jsonify({'message': 'User not found!'}), 404
     
     # Check if current user can update this user
-    if str(current_user._id) != user_id and not current_user.can_manage(target_user):
+    if str(current_user._id) != user_id and not _can_manage(current_user, target_user):
         return jsonify({'message': 'Access denied!'}), 403
     
     # Users can't change their own role
@@ -298,6 +313,15 @@ def update_user(user_id):
     if 'role' in data and not current_user.has_role_permission(data['role']):
         return jsonify({'message': f'You cannot assign {data["role"]} role!'}), 403
     
+    # A new parent must be the current user or in their downline
+    new_parent_id = data.get('parent_id')
+    if 'parent_id' in data and current_user.role != 'admin':
+        if not new_parent_id or not ObjectId.is_valid(new_parent_id):
+            return jsonify({'message': 'Invalid parent_id!'}), 400
+        if ObjectId(new_parent_id) != current_user._id and \
+                not get_user_service().is_in_downline(current_user._id, new_parent_id):
+            return jsonify({'message': 'New parent is not in your downline!'}), 403
+    
     # Update user
     success, result = get_user_service().update_user(user_id, data)
     
@@ -326,7 +350,7 @@ def delete_user(user_id):
         return jsonify({'message': 'You cannot delete your own account!'}), 403
     
     # Check if current user can delete this user
-    if not current_user.can_manage(target_user):
+    if not _can_manage(current_user, target_user):
         return jsonify({'message': 'Access denied!'}), 403
     
     # Delete (deactivate) user
@@ -352,25 +376,36 @@ def get_wallet(user_id):
         return jsonify({'message': 'User not found!'}), 404
     
     # Check if current user can view this user's wallet
-    if str(current_user._id) != user_id and not current_user.can_manage(target_user):
+    if str(current_user._id) != user_id and not _can_manage(current_user, target_user):
         return jsonify({'message': 'Access denied!'}), 403
     
-    # Get transactions
+    # Get transactions, continuing after the `after` token when one is given
     skip = int(request.args.get('skip', 0))
-    limit = int(request.args.get('limit', 20))
+    limit = min(int(request.args.get('limit', 20)), MAX_PAGE_SIZE)
     transaction_type = request.args.get('type')
+    after = request.args.get('after')
     
-    transactions = get_user_service().get_user_transactions(
-        user_id, skip, limit, transaction_type
-    )
+    try:
+        transactions = get_user_service().get_user_transactions(
+            user_id, limit=limit + 1, skip=skip, after=after, transaction_type=transaction_type
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    next_after = encode_cursor(transactions[limit - 1]) if len(transactions) > limit else None
+    transactions = transactions[:limit]
     
     return jsonify({
         'success': True,
         'wallet_balance': target_user.wallet_balance,
-        'transactions': [t.to_dict() for t in transactions],
+        'transactions': [
+            {key: str(value) if isinstance(value, ObjectId) else value for key, value in t.items()}
+            for t in transactions
+        ],
         'count': len(transactions),
         'skip': skip,
-        'limit': limit
+        'limit': limit,
+        'next_after': next_after
     }), 200
 
 @user_management_bp.route('/wallet/<user_id>/update', methods=['POST'])
@@ -387,37 +422,96 @@ def update_wallet(user_id):
         if field not in data:
             return jsonify({'message': f'Field {field} is required!'}), 400
     
+    if data['type'] not in ('credit', 'debit'):
+        return jsonify({'message': 'Type must be credit or debit!'}), 400
+    try:
+        amount = float(data['amount'])
+    except (TypeError, ValueError):
+        return jsonify({'message': 'Amount must be a number!'}), 400
+    if amount <= 0:
+        return jsonify({'message': 'Amount must be positive!'}), 400
+    
     # Check if target user exists
-    target_user = user_service.get_user_by_id(user_id)
+    target_user = get_user_service().get_user_by_id(user_id)
     if not target_user:
         return jsonify({'message': 'User not found!'}), 404
     
     # Check if current user can update this user's wallet
-    if not current_user.can_manage(target_user):
+    if not _can_manage(current_user, target_user):
         return jsonify({'message': 'Access denied!'}), 403
     
-    # Update wallet balance
-    success, result = get_user_service().update_wallet_balance(
+    # Update wallet balance; the service takes a signed amount
+    success, transaction_id, error = get_user_service().update_wallet_balance(
         user_id=user_id,
-        amount=data['amount'],
+        amount=amount if data['type'] == 'credit' else -amount,
         transaction_type=data['type'],
         description=data['description'],
         created_by=str(current_user._id)
     )
     
     if not success:
-        return jsonify({'message': result}), 400
+        return jsonify({'success': False, 'message': error}), 400
     
-    # Ensure we return a standardized response with success field
-    if isinstance(result, dict):
-        result['success'] = True
-        return jsonify(result), 200
-    else:
-        return jsonify({
-            'success': True,
-            'message': 'Wallet updated successfully',
-            'result': result
-        }), 200
+    transaction = get_user_service().transactions.find_one({'_id': transaction_id})
+    return jsonify({
+        'success': True,
+        'message': 'Wallet updated successfully',
+        'transaction_id': str(transaction_id),
+        'previous_balance': transaction['previous_balance'],
+        'new_balance': transaction['new_balance'],
+        'amount': amount,
+        'type': data['type']
+    }), 200
+
+@user_management_bp.route('/wallet/distribute', methods=['POST'])
+@token_required
+@role_required('master')
+def distribute_wallet():
+    """Credit or debit many downline wallets against the current user's wallet."""
+    data = request.get_json() or {}
+    current_user = g.current_user
+
+    entries = data.get('entries')
+    if not isinstance(entries, list) or not entries:
+        return jsonify({'message': 'Field entries is required!'}), 400
+    if len(entries) > MAX_DISTRIBUTION_SIZE:
+        return jsonify({'message': f'At most {MAX_DISTRIBUTION_SIZE} entries per request!'}), 400
+
+    parsed = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get('user_id') or 'amount' not in entry:
+            return jsonify({'message': f'Entry {index} needs user_id and amount!'}), 400
+        transaction_type = entry.get('type', 'credit')
+        if transaction_type not in ('credit', 'debit'):
+            return jsonify({'message': f'Entry {index}: type must be credit or debit!'}), 400
+        try:
+            amount = float(entry['amount'])
+        except (TypeError, ValueError):
+            return jsonify({'message': f'Entry {index}: amount must be a number!'}), 400
+        if amount <= 0:
+            return jsonify({'message': f'Entry {index}: amount must be positive!'}), 400
+        if not ObjectId.is_valid(entry['user_id']):
+            return jsonify({'message': f'Entry {index}: invalid user_id!'}), 400
+        parsed.append((entry['user_id'], amount, transaction_type))
+
+    # Hierarchy, parent debit, child updates and ledger rows in a few round trips
+    result, error = get_user_service().distribute_wallet_balance(
+        current_user, parsed, description=data.get('description')
+    )
+
+    if error:
+        return jsonify({'success': False, 'message': error}), 400
+
+    return jsonify({
+        'success': True,
+        'message': f"Wallets of {result['users']} users updated successfully",
+        'reference_id': str(result['reference_id']),
+        'users': result['users'],
+        'total_credited': result['total_credited'],
+        'total_debited': result['total_debited'],
+        'previous_balance': result['previous_balance'],
+        'new_balance': result['new_balance']
+    }), 200
 
 @user_management_bp.route('/dashboard/stats', methods=['GET'])
 @token_required
@@ -436,6 +530,41 @@ def get_dashboard_stats():
         'recent_users': [user.to_safe_dict() for user in recent_users]
     }), 200
 
+@user_management_bp.route('/settlement/markets/<market_id>', methods=['POST'])
+@token_required
+@role_required('admin')
+def settle_market(market_id):
+    """Settle every bet on a market from Betfair cleared orders, or from its bets for an in-house market (resumable)."""
+    from services.settlement_service import SettlementService
+    
+    settlement_service = SettlementService(
+        current_app.extensions.get('betfair_async'),
+        bet_stats=current_app.extensions.get('bet_stats'),
+        daily_stats=current_app.extensions.get('daily_stats'),
+        downline_stats=current_app.extensions.get('downline_stats'),
+        exchange_markets=current_app.config.get('EXCHANGE_MARKETS')
+    )
+    summary, error = settlement_service.settle_market(market_id)
+    
+    if error and summary:
+        # Another run holds the market; report its progress
+        return jsonify({
+            'success': False,
+            'message': error,
+            'settlement': summary
+        }), 409
+    
+    if error:
+        return jsonify({
+            'success': False,
+            'message': f'Settlement failed: {error}. Run again to resume.'
+        }), 500
+    
+    return jsonify({
+        'success': True,
+        'settlement': summary
+    }), 200
+
 @user_management_bp.route('/logout', methods=['POST'])
 @token_required
 def logout():
@@ -23,6 +23,26 @@ from database.db import init_db
 
 # Import API modules
 from api.betfair_api import BetfairAPI
+from api.betfair_async import AsyncBetfairAPI
+from api.betfair_stream import BetfairOrderStream
+from services.session_manager import BetfairSessionManager
+from services.order_reconciliation import OrderReconciliationService
+from services.position_engine import PositionEngine
+from services.market_runners import MarketRunners
+from services.risk_book import RiskBook
+from services.bet_stats import BetStatsService
+from services.market_sweeper import MarketSweeper
+from services.user_service import UserService
+from services.balance_snapshots import BalanceSnapshotService
+from services.daily_user_stats import DailyUserStatsService
+from services.ledger_writer import LedgerWriter
+from services.downline_stats import DownlineStatsService
+from services.user_stats import UserStatsService
+from exchange.engine import MatchingEngine
+from exchange.owner import ExchangeOwner
+from exchange.fill_writer import FillWriter
+from utils import bet_events
+from utils.cache import get_user_cache
 
 # Custom JSON encoder to preserve field order
 class CustomJSONEncoder(BaseJSONEncoder):
@@ -77,11 +97,35 @@ def create_app(config_name=None):
     else:
         app.logger.debug("Reusing existing database connection")
     
+    # Users looked up by the authentication decorators, dropped on user writes
+    get_user_cache().configure(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+    
+    # Wallet changes commit with their ledger rows when transactions are enabled
+    UserService.WALLET_TRANSACTIONS = app.config['WALLET_TRANSACTIONS_ENABLED']
+    
+    # Group-commit writer for single ledger rows
+    if 'ledger_writer' not in _initialized_services:
+        ledger_writer = None
+        if app.config['LEDGER_GROUP_COMMIT_ENABLED']:
+            ledger_writer = LedgerWriter(
+                flush_interval=app.config['LEDGER_FLUSH_INTERVAL'],
+                batch_size=app.config['LEDGER_FLUSH_BATCH_SIZE']
+            )
+            if not app.config['TESTING']:
+                ledger_writer.start()
+                app.logger.debug("Ledger group commit started")
+        _initialized_services['ledger_writer'] = ledger_writer
+    else:
+        ledger_writer = _initialized_services['ledger_writer']
+    UserService.LEDGER_WRITER = ledger_writer
+    
     # Initialize Betfair API only once
     if 'betfair_api' not in _initialized_services:
         betfair_api = BetfairAPI(
             app_key=app.config['BETFAIR_APP_KEY'],
-            session_token=app.config['BETFAIR_SESSION_TOKEN']
+            session_token=app.config['BETFAIR_SESSION_TOKEN'],
+            api_uri=app.config['BETFAIR_API_URI'],
+            identity_uri=app.config['BETFAIR_IDENTITY_URI']
         )
         _initialized_services['betfair_api'] = betfair_api
         app.logger.debug("BetfairAPI initialized")
@@ -89,9 +133,207 @@ def create_app(config_name=None):
         betfair_api = _initialized_services['betfair_api']
         app.logger.debug("Reusing existing BetfairAPI instance")
     
-    # Store the Betfair API client in app extensions
+    # Initialize the async Betfair client used for concurrent fan-out calls
+    if 'betfair_async' not in _initialized_services:
+        betfair_async = AsyncBetfairAPI(
+            app_key=app.config['BETFAIR_APP_KEY'],
+            session_token=app.config['BETFAIR_SESSION_TOKEN'],
+            api_uri=app.config['BETFAIR_API_URI'],
+            max_concurrency=app.config['BETFAIR_MAX_CONCURRENCY'],
+            pool_size=app.config['BETFAIR_POOL_SIZE'],
+            timeout=app.config['BETFAIR_TIMEOUT']
+        )
+        _initialized_services['betfair_async'] = betfair_async
+        app.logger.debug("AsyncBetfairAPI initialized")
+    else:
+        betfair_async = _initialized_services['betfair_async']
+    
+    # Keep the Betfair session alive and renew it in the background
+    if 'betfair_session' not in _initialized_services:
+        from services.api_service import APIService
+        session_manager = BetfairSessionManager(
+            betfair_api,
+            betfair_async=betfair_async,
+            username=app.config['BETFAIR_USERNAME'],
+            password=app.config['BETFAIR_PASSWORD'],
+            certs=app.config['BETFAIR_CERTS_DIR'],
+            keep_alive_interval=app.config['BETFAIR_KEEP_ALIVE_INTERVAL'],
+            session_ttl=app.config['BETFAIR_SESSION_TTL'],
+            renew_before=app.config['BETFAIR_RENEW_BEFORE'],
+            api_service=APIService()
+        )
+        if app.config['BETFAIR_SESSION_MANAGER_ENABLED'] and not app.config['TESTING']:
+            session_manager.start()
+            app.logger.debug("Betfair session manager started")
+        _initialized_services['betfair_session'] = session_manager
+    else:
+        session_manager = _initialized_services['betfair_session']
+    
+    # Bet counters updated on every lifecycle transition, recomputed in the background
+    if 'bet_stats' not in _initialized_services:
+        bet_stats = BetStatsService(reconcile_interval=app.config['BET_STATS_RECONCILE_INTERVAL'])
+        if not app.config['TESTING']:
+            bet_stats.start()
+            app.logger.debug("Bet stats reconciliation started")
+        _initialized_services['bet_stats'] = bet_stats
+    else:
+        bet_stats = _initialized_services['bet_stats']
+    
+    # Per-user daily rollups for reports, added to at settlement and
+    # recomputed nightly
+    if 'daily_stats' not in _initialized_services:
+        daily_stats = DailyUserStatsService(
+            check_interval=app.config['DAILY_STATS_CHECK_INTERVAL'],
+            catch_up_days=app.config['DAILY_STATS_CATCH_UP_DAYS']
+        )
+        if not app.config['TESTING']:
+            daily_stats.start()
+            app.logger.debug("Daily user stats catch-up started")
+        _initialized_services['daily_stats'] = daily_stats
+    else:
+        daily_stats = _initialized_services['daily_stats']
+    
+    # Per-user totals of their downline, fed by wallet and bet writes and
+    # recomputed in the background
+    if 'downline_stats' not in _initialized_services:
+        downline_stats = DownlineStatsService(reconcile_interval=app.config['DOWNLINE_STATS_RECONCILE_INTERVAL'])
+        if not app.config['TESTING']:
+            downline_stats.start()
+            app.logger.debug("Downline stats reconciliation started")
+        _initialized_services['downline_stats'] = downline_stats
+    else:
+        downline_stats = _initialized_services['downline_stats']
+    UserService.DOWNLINE_STATS = downline_stats
+    
+    # User counters by role and the wallet total, updated on user writes and
+    # recomputed in the background
+    if 'user_stats' not in _initialized_services:
+        user_stats = UserStatsService(reconcile_interval=app.config['USER_STATS_RECONCILE_INTERVAL'])
+        if not app.config['TESTING']:
+            user_stats.start()
+            app.logger.debug("User stats reconciliation started")
+        _initialized_services['user_stats'] = user_stats
+    else:
+        user_stats = _initialized_services['user_stats']
+    UserService.USER_STATS = user_stats
+    from database.user_service import UserService as DashboardUserService
+    DashboardUserService.USER_STATS = user_stats
+    
+    # Ledger balance snapshots for statements, doubling as wallet reconciliation
+    if 'balance_snapshots' not in _initialized_services:
+        balance_snapshots = BalanceSnapshotService(
+            interval=app.config['BALANCE_CHECKPOINT_INTERVAL'],
+            every_transactions=app.config['BALANCE_CHECKPOINT_EVERY']
+        )
+        if not app.config['TESTING']:
+            balance_snapshots.start()
+            app.logger.debug("Balance checkpoints started")
+        _initialized_services['balance_snapshots'] = balance_snapshots
+    else:
+        balance_snapshots = _initialized_services['balance_snapshots']
+    
+    # Keep bet status in line with Betfair (order stream, polling fallback)
+    if 'order_reconciliation' not in _initialized_services:
+        order_stream = None
+        if app.config['BETFAIR_STREAM_ENABLED']:
+            order_stream = BetfairOrderStream(
+                app_key=app.config['BETFAIR_APP_KEY'],
+                session_token_provider=lambda: betfair_api.session_token,
+                on_change=None,  # Wired by the reconciliation service
+                host=app.config['BETFAIR_STREAM_HOST'],
+                port=app.config['BETFAIR_STREAM_PORT'],
+                use_ssl=app.config['BETFAIR_STREAM_SSL']
+            )
+        order_reconciliation = OrderReconciliationService(
+            betfair_async,
+            order_stream=order_stream,
+            poll_interval=app.config['ORDER_POLL_INTERVAL'],
+            bet_stats=bet_stats,
+            downline_stats=downline_stats
+        )
+        if app.config['ORDER_RECONCILIATION_ENABLED'] and not app.config['TESTING']:
+            order_reconciliation.start()
+            app.logger.debug("Order reconciliation started")
+        _initialized_services['order_reconciliation'] = order_reconciliation
+    else:
+        order_reconciliation = _initialized_services['order_reconciliation']
+    
+    # Per-(user, market) positions, rebuilt from open bets and fed by bet events;
+    # the risk book aggregates them per market
+    if 'position_engine' not in _initialized_services:
+        market_runners = MarketRunners(betfair_async)
+        position_engine = PositionEngine(market_runners=market_runners)
+        risk_book = RiskBook(market_runners=market_runners)
+        position_engine.add_listener(risk_book)
+        if not app.config['TESTING']:
+            position_engine.rebuild()
+        bet_events.subscribe(position_engine.handle_event)
+        _initialized_services['position_engine'] = position_engine
+        _initialized_services['risk_book'] = risk_book
+    else:
+        position_engine = _initialized_services['position_engine']
+        risk_book = _initialized_services['risk_book']
+    
+    # In-house matching for B-book markets; resting orders are put back on the
+    # book in placement order and fills are written to bets in batches. The
+    # books live in this process, so with exchange markets configured it must
+    # be the only one serving them: startup fails if another holds the lease
+    if 'exchange' not in _initialized_services:
+        exchange_owner = None
+        if app.config['EXCHANGE_MARKETS'] and not app.config['TESTING']:
+            exchange_owner = ExchangeOwner()
+            exchange_owner.claim()
+            exchange_owner.start()
+        exchange = MatchingEngine(owner=exchange_owner)
+        fill_writer = FillWriter(
+            flush_interval=app.config['EXCHANGE_FLUSH_INTERVAL'],
+            batch_size=app.config['EXCHANGE_FLUSH_BATCH_SIZE'],
+            bet_stats=bet_stats
+        )
+        if not app.config['TESTING']:
+            restored = restore_exchange_orders(exchange)
+            fill_writer.start()
+            app.logger.debug(f"Exchange started with {restored} resting orders")
+        _initialized_services['exchange'] = exchange
+        _initialized_services['fill_writer'] = fill_writer
+    else:
+        exchange = _initialized_services['exchange']
+        fill_writer = _initialized_services['fill_writer']
+    
+    # Cancel unmatched bets in bulk when their market stops trading
+    if 'market_sweeper' not in _initialized_services:
+        market_sweeper = MarketSweeper(
+            betfair_async,
+            exchange=exchange,
+            exchange_markets=app.config['EXCHANGE_MARKETS'],
+            poll_interval=app.config['MARKET_SWEEP_INTERVAL'],
+            bet_stats=bet_stats,
+            downline_stats=downline_stats
+        )
+        if app.config['MARKET_SWEEPER_ENABLED'] and not app.config['TESTING']:
+            market_sweeper.start()
+            app.logger.debug("Market sweeper started")
+        _initialized_services['market_sweeper'] = market_sweeper
+    else:
+        market_sweeper = _initialized_services['market_sweeper']
+    
+    # Store the Betfair API clients in app extensions
     app.extensions = {}
     app.extensions['betfair_api'] = betfair_api
+    app.extensions['betfair_async'] = betfair_async
+    app.extensions['betfair_session'] = session_manager
+    app.extensions['order_reconciliation'] = order_reconciliation
+    app.extensions['position_engine'] = position_engine
+    app.extensions['risk_book'] = risk_book
+    app.extensions['bet_stats'] = bet_stats
+    app.extensions['balance_snapshots'] = balance_snapshots
+    app.extensions['daily_stats'] = daily_stats
+    app.extensions['downline_stats'] = downline_stats
+    app.extensions['user_stats'] = user_stats
+    app.extensions['ledger_writer'] = ledger_writer
+    app.extensions['exchange'] = exchange
+    app.extensions['fill_writer'] = fill_writer
+    app.extensions['market_sweeper'] = market_sweeper
     
     # Register error handlers
     from utils.error_handlers import register_error_handlers
@@ -112,6 +354,26 @@ def create_app(config_name=None):
     
     return app
 
+def restore_exchange_orders(exchange):
+    """
+    Put the open exchange bets back on the matching engine's books.
+
+    Returns:
+        Number of orders restored
+    """
+    from database.db import get_db
+    restored = 0
+    open_bets = get_db().bets.find(
+        {'exchange': True, 'status': {'$in': ['UNMATCHED', 'PARTIALLY_MATCHED']}}
+    ).sort([('created_at', 1), ('_id', 1)])
+    for bet in open_bets:
+        if exchange.restore(
+            bet['bet_id'], bet['user_id'], bet['market_id'], bet['selection_id'], bet['side'],
+            bet['price'], bet['size'], bet.get('size_matched'), bet.get('average_price_matched')
+        ):
+            restored += 1
+    return restored
+
 def register_blueprints(app):
     """Register all application blueprints."""
     # Only register blueprints once
@@ -128,6 +390,8 @@ def register_blueprints(app):
     from api.user import user_bp
     from api.mock_data import mock_data_bp
     from api.user_management import user_management_bp as user_management_api_bp
+    from api.metrics import metrics_bp
+    from api.risk import risk_bp
     from user_management import user_management_bp as user_management_web_bp
     from swagger import swagger_bp
     from dashboard import dashboard_bp
@@ -139,6 +403,8 @@ def register_blueprints(app):
     app.register_blueprint(user_bp, url_prefix='/api/user')
     app.register_blueprint(mock_data_bp, url_prefix='/api/mock')
     app.register_blueprint(user_management_api_bp, url_prefix='/api/user_management')
+    app.register_blueprint(metrics_bp, url_prefix='/api/metrics')
+    app.register_blueprint(risk_bp, url_prefix='/api/risk')
     
     # Register web blueprints
     app.register_blueprint(user_management_web_bp, url_prefix='/user')
@@ -207,6 +473,42 @@ def server_error(e):
 def clean_shutdown(signal_received=None, frame=None):
     """Handle clean shutdown of the application."""
     print("\n\nShutting down BetPro Backend...")
+    # Stop the Betfair session keep-alive task
+    if 'betfair_session' in _initialized_services:
+        _initialized_services['betfair_session'].stop()
+    # Stop order reconciliation
+    if 'order_reconciliation' in _initialized_services:
+        _initialized_services['order_reconciliation'].stop()
+    # Stop bet stats reconciliation
+    if 'bet_stats' in _initialized_services:
+        _initialized_services['bet_stats'].stop()
+    # Stop the daily user stats catch-up
+    if 'daily_stats' in _initialized_services:
+        _initialized_services['daily_stats'].stop()
+    # Stop downline stats reconciliation
+    if 'downline_stats' in _initialized_services:
+        _initialized_services['downline_stats'].stop()
+    # Stop user stats reconciliation
+    if 'user_stats' in _initialized_services:
+        _initialized_services['user_stats'].stop()
+    # Stop balance checkpoints
+    if 'balance_snapshots' in _initialized_services:
+        _initialized_services['balance_snapshots'].stop()
+    # Stop the market sweeper
+    if 'market_sweeper' in _initialized_services:
+        _initialized_services['market_sweeper'].stop()
+    # Write the exchange fills still queued
+    if 'fill_writer' in _initialized_services:
+        _initialized_services['fill_writer'].stop()
+    # Hand back the exchange lease
+    if 'exchange' in _initialized_services and _initialized_services['exchange'].owner is not None:
+        _initialized_services['exchange'].owner.stop()
+    # Write the ledger rows still queued
+    if _initialized_services.get('ledger_writer') is not None:
+        _initialized_services['ledger_writer'].stop()
+    # Stop the async bridge event loop
+    from utils.async_bridge import shutdown as shutdown_async_bridge
+    shutdown_async_bridge()
     # Close MongoDB connections if needed
     from database.db import close_db_connections
     close_db_connections()
@@ -19,6 +19,68 @@ class Config:
     BETFAIR_APP_KEY = os.getenv('BETFAIR_APP_KEY')
     BETFAIR_SESSION_TOKEN = os.getenv('BETFAIR_SESSION_TOKEN')
     
+    # Endpoint overrides, e.g. http://127.0.0.1:8090/exchange/ and http://127.0.0.1:8090/api/
+    # for the local simulator (python -m simulator.server)
+    BETFAIR_API_URI = os.getenv('BETFAIR_API_URI')
+    BETFAIR_IDENTITY_URI = os.getenv('BETFAIR_IDENTITY_URI')
+    
+    # Async Betfair client settings (concurrent fan-out calls)
+    BETFAIR_MAX_CONCURRENCY = int(os.getenv('BETFAIR_MAX_CONCURRENCY', 8))
+    BETFAIR_POOL_SIZE = int(os.getenv('BETFAIR_POOL_SIZE', 8))
+    BETFAIR_TIMEOUT = int(os.getenv('BETFAIR_TIMEOUT', 10))
+    
+    # Betfair session lifecycle (background keepAlive and renewal)
+    BETFAIR_SESSION_MANAGER_ENABLED = os.getenv('BETFAIR_SESSION_MANAGER_ENABLED', 'true').lower() == 'true'
+    BETFAIR_USERNAME = os.getenv('BETFAIR_USERNAME')
+    BETFAIR_PASSWORD = os.getenv('BETFAIR_PASSWORD')
+    BETFAIR_CERTS_DIR = os.getenv('BETFAIR_CERTS_DIR')
+    BETFAIR_KEEP_ALIVE_INTERVAL = int(os.getenv('BETFAIR_KEEP_ALIVE_INTERVAL', 1200))  # 20 minutes
+    BETFAIR_SESSION_TTL = int(os.getenv('BETFAIR_SESSION_TTL', 8 * 3600))  # Betfair sessions last 8 hours
+    BETFAIR_RENEW_BEFORE = int(os.getenv('BETFAIR_RENEW_BEFORE', 1800))  # Renew 30 minutes before expiry
+    
+    # Order reconciliation (order stream with listCurrentOrders polling fallback)
+    ORDER_RECONCILIATION_ENABLED = os.getenv('ORDER_RECONCILIATION_ENABLED', 'true').lower() == 'true'
+    ORDER_POLL_INTERVAL = int(os.getenv('ORDER_POLL_INTERVAL', 15))
+    BETFAIR_STREAM_ENABLED = os.getenv('BETFAIR_STREAM_ENABLED', 'true').lower() == 'true'
+    BETFAIR_STREAM_HOST = os.getenv('BETFAIR_STREAM_HOST', 'stream-api.betfair.com')
+    BETFAIR_STREAM_PORT = int(os.getenv('BETFAIR_STREAM_PORT', 443))
+    BETFAIR_STREAM_SSL = os.getenv('BETFAIR_STREAM_SSL', 'true').lower() == 'true'
+    
+    # Wallet changes and ledger rows in one multi-document transaction (needs a replica set)
+    WALLET_TRANSACTIONS_ENABLED = os.getenv('WALLET_TRANSACTIONS_ENABLED', 'false').lower() == 'true'
+    
+    # Per-user ledger balance snapshots: every N ledger rows and daily
+    BALANCE_CHECKPOINT_INTERVAL = int(os.getenv('BALANCE_CHECKPOINT_INTERVAL', 300))
+    BALANCE_CHECKPOINT_EVERY = int(os.getenv('BALANCE_CHECKPOINT_EVERY', 100))
+    
+    # Daily user rollups: hourly check for a new day, last days recomputed once a day
+    DAILY_STATS_CHECK_INTERVAL = int(os.getenv('DAILY_STATS_CHECK_INTERVAL', 3600))
+    DAILY_STATS_CATCH_UP_DAYS = int(os.getenv('DAILY_STATS_CATCH_UP_DAYS', 2))
+    
+    # Group commit of ledger rows: one insert_many (and one majority wait)
+    # every few milliseconds or batch instead of one per row
+    LEDGER_GROUP_COMMIT_ENABLED = os.getenv('LEDGER_GROUP_COMMIT_ENABLED', 'True').lower() == 'true'
+    LEDGER_FLUSH_INTERVAL = float(os.getenv('LEDGER_FLUSH_INTERVAL', 0.005))
+    LEDGER_FLUSH_BATCH_SIZE = int(os.getenv('LEDGER_FLUSH_BATCH_SIZE', 200))
+    
+    # Full recompute of the incrementally maintained bet statistics
+    BET_STATS_RECONCILE_INTERVAL = int(os.getenv('BET_STATS_RECONCILE_INTERVAL', 3600))
+    
+    # Full recompute of the per-user downline totals
+    DOWNLINE_STATS_RECONCILE_INTERVAL = int(os.getenv('DOWNLINE_STATS_RECONCILE_INTERVAL', 900))
+    
+    # Full recompute of the user counters shown on the dashboard
+    USER_STATS_RECONCILE_INTERVAL = int(os.getenv('USER_STATS_RECONCILE_INTERVAL', 3600))
+    
+    # In-house exchange: B-book markets matched between users instead of at Betfair
+    EXCHANGE_MARKETS = [market_id.strip() for market_id in os.getenv('EXCHANGE_MARKETS', '').split(',') if market_id.strip()]
+    EXCHANGE_FLUSH_INTERVAL = float(os.getenv('EXCHANGE_FLUSH_INTERVAL', 0.05))  # Seconds between fill writes
+    EXCHANGE_FLUSH_BATCH_SIZE = int(os.getenv('EXCHANGE_FLUSH_BATCH_SIZE', 500))
+    
+    # Cancel unmatched bets when their market suspends, turns in-play or closes
+    MARKET_SWEEPER_ENABLED = os.getenv('MARKET_SWEEPER_ENABLED', 'true').lower() == 'true'
+    MARKET_SWEEP_INTERVAL = int(os.getenv('MARKET_SWEEP_INTERVAL', 5))
+    
     # Session settings
     SESSION_TYPE = 'filesystem'
     SESSION_PERMANENT = True
@@ -27,6 +89,10 @@ class Config:
     # Cache settings
     CACHE_TYPE = 'SimpleCache'
     CACHE_DEFAULT_TIMEOUT = 300  # 5 minutes
+    
+    # Authenticated user lookups: LRU bound and TTL backing up the write invalidation
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+    USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 60))
 
 class DevelopmentConfig(Config):
     """Development environment configuration."""
@@ -1,12 +1,18 @@
 from flask import Blueprint, render_template, jsonify, current_app, redirect, url_for, request, session, make_response
 import jwt
 import os
+import asyncio
 import logging
 from functools import wraps
 from datetime import datetime, timedelta
 import random  # For demo data only, remove in production
 from api.betfair_api import BetfairAPI
 from database.user_service import UserService
+from bson import ObjectId
+from utils.async_bridge import run_sync
+from utils import user_events
+from utils.cache import SimpleCache
+from utils.pagination import MAX_PAGE_SIZE, encode_sort_cursor, sort_keyset_query
 
 dashboard_bp = Blueprint('dashboard', __name__, template_folder='templates', static_folder='static')
 
@@ -19,6 +25,51 @@ betfair_api = None
 # Initialize user service
 user_service = UserService()
 
+# Fields the user listing can be sorted by
+USER_SORT_FIELDS = ('created_at', 'username', 'wallet_balance')
+
+def _iso_date(field):
+    """Projection expression formatting a date field like datetime.isoformat()."""
+    return {'$cond': [
+        {'$eq': [{'$type': f'${field}'}, 'date']},
+        {'$dateToString': {'date': f'${field}', 'format': '%Y-%m-%dT%H:%M:%S.%L'}},
+        f'${field}'
+    ]}
+
+def _id_string(field):
+    """Projection expression turning an optional ID field into a string."""
+    return {'$cond': [{'$ifNull': [f'${field}', False]}, {'$toString': f'${field}'}, None]}
+
+# Listing columns, made JSON-ready by the server (IDs and dates as strings,
+# defaults for missing fields) so documents are returned as read
+USER_LIST_PROJECTION = {
+    '_id': {'$toString': '$_id'},
+    'username': 1,
+    'email': {'$cond': [
+        {'$in': [{'$ifNull': ['$email', '']}, ['']]},
+        {'$concat': ['$username', '@example.com']},
+        '$email'
+    ]},
+    'full_name': {'$cond': [
+        {'$in': [{'$ifNull': ['$full_name', '']}, ['', '-']]},
+        '$username',
+        '$full_name'
+    ]},
+    'phone': 1,
+    'role': 1,
+    'status': {'$ifNull': ['$status', 'active']},
+    'wallet_balance': {'$ifNull': ['$wallet_balance', 0]},
+    'parent_id': _id_string('parent_id'),
+    'created_by_id': _id_string('created_by_id'),
+    'created_at': _iso_date('created_at'),
+    'last_login': _iso_date('last_login')
+}
+
+# Listing counts by filter, cleared on every user write in this process;
+# the TTL covers writes made by other processes
+_user_counts = SimpleCache()
+_USER_COUNT_CACHE_DURATION = 60
+
 # Define filter function to be registered at app level later
 def format_datetime(value):
     """Format a timestamp to a readable date and time."""
@@ -117,7 +168,7 @@ def admin_dashboard():
         # Get system stats (these are fast random values)
         system_stats = get_system_stats()
         
-        # Get user stats (already optimized with caching)
+        # Get user stats (one read of the user stats counters)
         try:
             user_stats = get_user_stats()
         except Exception as e:
@@ -190,102 +241,52 @@ def active_events():
 @dashboard_bp.route('/api/users')
 @token_required
 def get_users_api():
-    """API endpoint for users with optional role filtering."""
-    from flask import request
-    import json
-    from datetime import datetime
-    
-    # Custom JSON encoder to handle datetime objects
-    class CustomJSONEncoder(json.JSONEncoder):
-        def default(self, obj):
-            if isinstance(obj, datetime):
-                return obj.isoformat()
-            return super().default(obj)
-    
-    role = request.args.get('role', 'all')
-    
-    print(f"Fetching users with role filter: {role}")
-    
+    """API endpoint for users, filtered by role, status and parent and keyset paginated."""
     try:
-        # Get users with pagination
+        query = _user_list_query(request.args)
+        sort_field = request.args.get('sort', 'created_at')
+        if sort_field not in USER_SORT_FIELDS:
+            raise ValueError(f"sort must be one of: {', '.join(USER_SORT_FIELDS)}")
+        direction = 1 if request.args.get('order', 'desc').lower() == 'asc' else -1
+        limit = min(int(request.args.get('limit', 20)), MAX_PAGE_SIZE)
         page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 20))
-        skip = (page - 1) * limit
-        
-        print(f"Pagination: page={page}, limit={limit}, skip={skip}")
-        
-        # Query users based on role
-        if role != 'all':
-            print(f"Querying for users with role: {role}")
-            users = list(user_service.users.find({"role": role}).skip(skip).limit(limit))
-        else:
-            print("Querying for all users")
-            users = list(user_service.users.find({}).skip(skip).limit(limit))
-        
-        print(f"Found {len(users)} users")
-        
-        # Debug: Print all users found
-        for i, user in enumerate(users):
-            print(f"User {i+1}: {user.get('username')} (role: {user.get('role')})")
+        if limit < 1 or page < 1:
+            raise ValueError('limit and page must be positive')
+        after = request.args.get('after') or None
+        position = sort_keyset_query(query, sort_field, direction, after)
+    except ValueError as e:
+        return jsonify({'users': [], 'error': str(e)}), 400
+    
+    try:
+        # Legacy page numbers skip to the page; `after` tokens never skip
+        pipeline = [{'$match': position}, {'$sort': {sort_field: direction, '_id': direction}}]
+        if page > 1 and not after:
+            pipeline.append({'$skip': (page - 1) * limit})
+        pipeline += [
+            {'$limit': limit + 1},
+            {'$project': {**USER_LIST_PROJECTION, '_sort_value': f'${sort_field}'}}
+        ]
+        users = list(user_service.users.aggregate(pipeline))
         
-        # Process users for JSON serialization
-        processed_users = []
+        next_after = None
+        if len(users) > limit:
+            users = users[:limit]
+            next_after = encode_sort_cursor(sort_field, users[-1].get('_sort_value'), users[-1]['_id'])
         for user in users:
-            # Create a new dict with serializable values
-            processed_user = {}
-            for key, value in user.items():
-                # Convert ObjectId to string
-                if key == '_id' or (key == 'parent_id' and value):
-                    processed_user[key] = str(value)
-                # Convert datetime to string
-                elif isinstance(value, datetime):
-                    processed_user[key] = value.isoformat()
-                # Ensure email and full_name are always present
-                elif key == 'email' and (value is None or value == ''):
-                    processed_user[key] = user.get('username', '') + '@example.com'
-                elif key == 'full_name' and (value is None or value == '' or value == '-'):
-                    processed_user[key] = user.get('username', '')
-                # Keep other values as is
-                else:
-                    processed_user[key] = value
-                    
-            # Add missing fields with defaults
-            if 'email' not in processed_user:
-                processed_user['email'] = user.get('username', '') + '@example.com'
-            if 'full_name' not in processed_user:
-                processed_user['full_name'] = user.get('username', '')
-            if 'wallet_balance' not in processed_user and 'wallet_balance' not in user:
-                processed_user['wallet_balance'] = 0
-            if 'status' not in processed_user:
-                processed_user['status'] = 'active'
-                
-            processed_users.append(processed_user)
-        
-        # Get total count for pagination
-        if role != 'all':
-            total_count = user_service.users.count_documents({"role": role})
-        else:
-            total_count = user_service.users.count_documents({})
+            user.pop('_sort_value', None)
         
-        print(f"Total user count: {total_count}")
-        
-        # Debug: Check for specific user
-        test_user = user_service.users.find_one({"username": "larik2025"})
-        if test_user:
-            print(f"Found test user 'larik2025' with role: {test_user.get('role')}")
-        else:
-            print("Test user 'larik2025' not found in database!")
-        
-        # Use Flask's jsonify with the processed users
+        total = _count_users(query)
         return jsonify({
-            'users': processed_users,
-            'total': total_count,
+            'users': users,
+            'total': total,
             'page': page,
             'limit': limit,
-            'pages': (total_count + limit - 1) // limit  # Ceiling division
+            'pages': (total + limit - 1) // limit,  # Ceiling division
+            'next_after': next_after,
+            'has_more': next_after is not None
         })
     except Exception as e:
-        print(f"Error fetching users: {e}")
+        logger.error(f"Error fetching users: {e}")
         return jsonify({
             'users': [],
             'total': 0,
@@ -295,6 +296,43 @@ def get_users_api():
             'error': str(e)
         }), 500
 
+def _user_list_query(args):
+    """
+    Build the filter of the user listing from the role, status and parent_id arguments.
+
+    Raises:
+        ValueError: If parent_id is not a valid ID
+    """
+    query = {}
+    role = args.get('role', 'all')
+    if role != 'all':
+        query['role'] = role
+    if args.get('status'):
+        query['status'] = args['status']
+    if args.get('parent_id'):
+        if not ObjectId.is_valid(args['parent_id']):
+            raise ValueError('Invalid parent_id')
+        # parent_id is stored as a string or an ObjectId depending on the writer
+        query['parent_id'] = {'$in': [ObjectId(args['parent_id']), args['parent_id']]}
+    return query
+
+def _count_users(query):
+    """Count the users matching a listing filter, cached until a user write."""
+    key = repr(sorted(query.items()))
+    total = _user_counts.get(key)
+    if total is None:
+        total = user_service.users.count_documents(query)
+        _user_counts.set(key, total, ttl=_USER_COUNT_CACHE_DURATION)
+    return total
+
+def _invalidate_user_counts(event, user_ids):
+    """Drop the cached listing counts; any user write but a wallet change may change them."""
+    if event == user_events.USER_WALLET_CHANGED:
+        return
+    _user_counts.clear()
+
+user_events.subscribe(_invalidate_user_counts)
+
 # Helper functions for dashboard data
 def get_api_status():
     """Get API connection status."""
@@ -312,11 +350,14 @@ def get_api_status():
         # This ensures the API status shows as green in the dashboard
         betfair_connected = True
         
-        # Session information
+        # Session information from the background session manager
         now = datetime.now()
-        # In a real implementation, we would get the actual session expiry
-        # For now, we'll set a fixed expiry of 24 hours from now
-        expiry = now + timedelta(hours=24)
+        session_manager = current_app.extensions.get('betfair_session')
+        session_metrics = session_manager.get_metrics() if session_manager else None
+        if session_metrics:
+            expiry = now + timedelta(seconds=session_metrics['seconds_to_expiry'])
+        else:
+            expiry = now + timedelta(hours=24)
         hours_remaining = (expiry - now).seconds // 3600
         minutes_remaining = ((expiry - now).seconds % 3600) // 60
         
@@ -326,7 +367,8 @@ def get_api_status():
             'session_valid': True,  # Always True
             'session_expiry': expiry.isoformat(),
             'session_expiry_hours': hours_remaining,
-            'session_expiry_minutes': minutes_remaining
+            'session_expiry_minutes': minutes_remaining,
+            'session_metrics': session_metrics
         }
     except Exception as e:
         logger.error(f"Error getting API status: {str(e)}")
@@ -359,57 +401,29 @@ def get_system_stats():
             'total_matched': 0
         }
 
-# Cache for user stats (lasts for 2 minutes)
-_user_stats_cache = None
-_user_stats_cache_time = None
-_USER_STATS_CACHE_DURATION = 120  # 2 minutes in seconds
-
 def get_user_stats():
-    """Get user statistics from the database with caching."""
-    global _user_stats_cache, _user_stats_cache_time
-    
-    # Check if we have cached data that's still valid
-    current_time = datetime.now()
-    if _user_stats_cache_time and (current_time - _user_stats_cache_time).total_seconds() < _USER_STATS_CACHE_DURATION:
-        logger.info("Returning cached user stats data")
-        return _user_stats_cache
-    
+    """Get user statistics from the incrementally maintained user stats counters."""
     try:
-        # Get user counts by role
-        admins_count = user_service.users.count_documents({"role": "admin"})
-        supermasters_count = user_service.users.count_documents({"role": "supermaster"})
-        masters_count = user_service.users.count_documents({"role": "master"})
-        users_count = user_service.users.count_documents({"role": "user"})
-        total_users = admins_count + supermasters_count + masters_count + users_count
-        
-        # Get total balance (sum of all wallet_balance fields)
-        pipeline = [
-            {"$match": {"wallet_balance": {"$exists": True}}},
-            {"$group": {"_id": None, "total": {"$sum": "$wallet_balance"}}}
-        ]
-        balance_result = list(user_service.users.aggregate(pipeline))
-        total_balance = balance_result[0]["total"] if balance_result else 0
+        stats = current_app.extensions['user_stats'].get_stats()
+        role_counts = stats['by_role']
+        admins_count = role_counts.get('admin', 0)
+        supermasters_count = role_counts.get('supermaster', 0)
+        masters_count = role_counts.get('master', 0)
+        users_count = role_counts.get('user', 0)
         
         # Get recent transactions (would normally come from a transactions collection)
         # For now, we'll return empty list as we don't have transaction data
         recent_transactions = []
         
-        # Store results in cache
-        result = {
-            'total_users': total_users,
+        return {
+            'total_users': admins_count + supermasters_count + masters_count + users_count,
             'admins': admins_count,
             'supermasters': supermasters_count,
             'masters': masters_count,
             'regular_users': users_count,
-            'total_balance': total_balance,
+            'total_balance': stats['total_wallet_balance'],
             'recent_transactions': recent_transactions
         }
-        
-        # Update cache
-        _user_stats_cache = result
-        _user_stats_cache_time = datetime.now()
-        
-        return result
     except Exception as e:
         logger.error(f"Error getting user stats: {str(e)}")
         # Return zeros if there's an error
@@ -428,6 +442,51 @@ _events_cache = {}
 _events_cache_time = None
 _CACHE_DURATION = 900  # 15 minutes in seconds
 
+# Upper bound for the whole sports -> events -> markets fan-out
+_FETCH_TIMEOUT = 30
+
+async def _fetch_event_tree(betfair_async):
+    """
+    Fetch the top sports, their events and the markets of the top events.
+    
+    Each level is issued as one concurrent batch, so the number of sequential
+    round trips is three regardless of how many sports and events are shown.
+    
+    Returns:
+        Tuple of (sports, events per sport, {event_id: markets})
+    """
+    sports = await betfair_async.get_event_types()
+    
+    # Process only the top 3 most popular sports to reduce API calls
+    popular_sports = sports[:3] if len(sports) > 3 else sports
+    
+    sport_events_list = await asyncio.gather(
+        *(betfair_async.get_events(event_type_id=sport['id']) for sport in popular_sports),
+        return_exceptions=True
+    )
+    sport_events_list = [
+        [] if isinstance(sport_events, Exception) else sport_events
+        for sport_events in sport_events_list
+    ]
+    
+    # Only the top 5 events of each sport are shown, so only fetch their markets
+    event_ids = [
+        event['id']
+        for sport_events in sport_events_list
+        for event in sport_events[:5]
+        if event.get('id')
+    ]
+    market_lists = await asyncio.gather(
+        *(betfair_async.get_markets(event_id=event_id) for event_id in event_ids),
+        return_exceptions=True
+    )
+    event_markets_map = {
+        event_id: [] if isinstance(markets, Exception) else markets
+        for event_id, markets in zip(event_ids, market_lists)
+    }
+    
+    return popular_sports, sport_events_list, event_markets_map
+
 def get_active_events():
     """Get active events data from Betfair API with caching."""
     global _events_cache, _events_cache_time
@@ -442,11 +501,11 @@ def get_active_events():
     has_stale_cache = _events_cache and _events_cache_time
     
     try:
-        # Get Betfair API client from current app
+        # Get the async Betfair client from current app
         from flask import current_app
-        betfair_api = current_app.extensions.get('betfair_api')
+        betfair_async = current_app.extensions.get('betfair_async')
         
-        if not betfair_api or not betfair_api.client:
+        if not betfair_async:
             logger.error("Betfair API client not available")
             return {
                 'events': [],
@@ -455,24 +514,20 @@ def get_active_events():
                 'cached': has_stale_cache
             } if not has_stale_cache else _events_cache
         
-        # Get all sports (event types) with a timeout
-        sports = betfair_api.get_event_types()
+        # Fetch sports, events and markets concurrently instead of one call at a time
+        popular_sports, sport_events_list, event_markets_map = run_sync(
+            _fetch_event_tree(betfair_async),
+            timeout=_FETCH_TIMEOUT
+        )
         
         # Prepare result containers with reasonable initial sizes
         events = []
         sports_breakdown = {}
         markets_list = []
         
-        # Process only the top 3 most popular sports to reduce API calls
-        popular_sports = sports[:3] if len(sports) > 3 else sports
-        
-        for sport in popular_sports:
-            sport_id = sport['id']
+        for sport, sport_events in zip(popular_sports, sport_events_list):
             sport_name = sport['name']
             
-            # Get events for this sport with limit
-            sport_events = betfair_api.get_events(event_type_id=sport_id)
-            
             # Track metrics for this sport
             event_count = len(sport_events)
             market_count = 0
@@ -486,8 +541,8 @@ def get_active_events():
                 if not event_id:
                     continue
                     
-                # Get markets for this event (already limited to 100 in the API)
-                event_markets = betfair_api.get_markets(event_id=event_id)
+                # Markets for this event were fetched in the fan-out above
+                event_markets = event_markets_map.get(event_id, [])
                 # Limit to 10 markets per event after fetching
                 event_markets = event_markets[:10] if len(event_markets) > 10 else event_markets
                 
@@ -496,15 +551,15 @@ def get_active_events():
                 event_matched_amount = 0
                 
                 for market in event_markets:
-                    matched = market.get('total_matched', 0)
+                    matched = market.get('total_matched', 0) or 0
                     matched_amount += matched
                     event_matched_amount += matched
                     
                     # Add only top markets to the list (highest matched amount)
                     if len(markets_list) < 10:  # Reduced from 20 to 10
                         markets_list.append({
-                            'id': market.get('market_id'),
-                            'name': market.get('market_name'),
+                            'id': market.get('marketId'),
+                            'name': market.get('marketName'),
                             'event_name': event.get('name', ''),
                             'matched_amount': f"${matched:,.0f}",
                             'selections': len(market.get('runners', []))
@@ -515,7 +570,7 @@ def get_active_events():
                     'id': event_id,
                     'name': event.get('name', ''),
                     'sport': sport_name,
-                    'start_time': event.get('start_time', ''),
+                    'start_time': event.get('open_date', ''),
                     'market_count': len(event_markets),
                     'matched_amount': f"${event_matched_amount:,.0f}"
                 })
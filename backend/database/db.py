@@ -98,15 +98,39 @@ def _create_indexes(db):
         # User collection indexes - safely create with drop_dups=False
         _safe_create_index(db[COLLECTIONS["USERS"]], 'username', unique=True)
         _safe_create_index(db[COLLECTIONS["USERS"]], 'email', unique=True)
+        _safe_create_index(db[COLLECTIONS["USERS"]], 'ancestors')
+        # Dashboard user listing: newest first, optionally by role or parent
+        _safe_create_index(db[COLLECTIONS["USERS"]], [('created_at', -1), ('_id', -1)])
+        _safe_create_index(db[COLLECTIONS["USERS"]], [('role', 1), ('created_at', -1), ('_id', -1)])
+        _safe_create_index(db[COLLECTIONS["USERS"]], [('parent_id', 1), ('created_at', -1), ('_id', -1)])
         
         # Transactions collection indexes
         _safe_create_index(db[COLLECTIONS["TRANSACTIONS"]], 'user_id')
         _safe_create_index(db[COLLECTIONS["TRANSACTIONS"]], 'timestamp', direction=-1)
+        _safe_create_index(db[COLLECTIONS["TRANSACTIONS"]], [('user_id', 1), ('created_at', -1), ('_id', -1)])
+        _safe_create_index(db[COLLECTIONS["TRANSACTIONS"]], [('reference_id', 1), ('type', 1)], unique=True,
+                           partialFilterExpression={'reference_id': {'$exists': True}, 'type': {'$exists': True}})
         
         # Bets collection indexes
         _safe_create_index(db[COLLECTIONS["BETS"]], 'user_id')
         _safe_create_index(db[COLLECTIONS["BETS"]], 'market_id')
         _safe_create_index(db[COLLECTIONS["BETS"]], ['status', 'market_id'])
+        _safe_create_index(db[COLLECTIONS["BETS"]], 'bet_id')
+        _safe_create_index(db[COLLECTIONS["BETS"]], [('user_id', 1), ('created_at', -1), ('_id', -1)])
+        _safe_create_index(db[COLLECTIONS["BETS"]], [('status', 1), ('settled_date', 1)])
+        
+        # Balance snapshots and the running ledger head of each user
+        _safe_create_index(db[COLLECTIONS["BALANCE_SNAPSHOTS"]], [('user_id', 1), ('as_of', -1)])
+        _safe_create_index(db[COLLECTIONS["BALANCE_SNAPSHOTS"]], [('drift_flagged', 1), ('as_of', -1)])
+        _safe_create_index(db[COLLECTIONS["LEDGER_HEADS"]], 'since_snapshot')
+        _safe_create_index(db[COLLECTIONS["LEDGER_HEADS"]], 'snapshot_at')
+        
+        # Daily user rollups, read by user or by a set of users over a date range
+        _safe_create_index(db[COLLECTIONS["DAILY_USER_STATS"]], [('user_id', 1), ('date', 1)])
+        _safe_create_index(db[COLLECTIONS["DAILY_USER_STATS"]], 'date')
+        
+        # Settlement checkpoints, one per market
+        _safe_create_index(db[COLLECTIONS["SETTLEMENT_CHECKPOINTS"]], 'market_id', unique=True)
         
         # Markets collection indexes
         _safe_create_index(db[COLLECTIONS["MARKETS"]], 'market_id', unique=True)
@@ -170,6 +194,10 @@ def _safe_create_index(collection, field_or_fields, direction=1, **kwargs):
                             if idx_info.get('sparse', False) != val_opt:
                                 options_match = False
                                 break
+                        elif key_opt == 'partialFilterExpression':
+                            if idx_info.get('partialFilterExpression') != val_opt:
+                                options_match = False
+                                break
                     
                     if options_match:
                         # Index with same spec and options already exists
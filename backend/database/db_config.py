@@ -14,5 +14,13 @@ COLLECTIONS = {
     "BETS": "bets",
     "EVENTS": "events",
     "MARKETS": "markets",
-    "SETTINGS": "settings"
+    "SETTINGS": "settings",
+    "SETTLEMENT_CHECKPOINTS": "settlement_checkpoints",
+    "BET_STATS": "bet_stats",
+    "MIGRATIONS": "migrations",
+    "BALANCE_SNAPSHOTS": "balance_snapshots",
+    "LEDGER_HEADS": "ledger_heads",
+    "DAILY_USER_STATS": "daily_user_stats",
+    "DOWNLINE_STATS": "downline_stats",
+    "USER_STATS": "user_stats"
 }
@@ -6,6 +6,8 @@ import bcrypt
 from models.user import User
 from models.transaction import Transaction
 from database.db_utils import get_db_utils, DB_CONFIG
+from utils import user_events
+from utils.hierarchy import ancestors_for_parent, get_ancestors, is_in_downline, reparent
 
 class InMemoryCollection:
     """In-memory collection for development when MongoDB is not available."""
@@ -223,6 +225,10 @@ class DeleteResult:
 class UserService:
     """Service for user management and wallet operations using MongoDB."""
     
+    # UserStatsService told about new users, role changes and wallet changes
+    # (set by the app); None leaves the counters to its reconciliation
+    USER_STATS = None
+    
     def __init__(self, mongo_uri=None):
         """Initialize the user service with MongoDB connection."""
         try:
@@ -254,6 +260,7 @@ class UserService:
                 self.users.create_index("email", unique=True, sparse=True)  # Make email sparse to allow null values
                 self.users.create_index("role")
                 self.users.create_index("parent_id")
+                self.users.create_index("ancestors")
                 
                 self.transactions.create_index("user_id")
                 self.transactions.create_index("timestamp")
@@ -336,12 +343,10 @@ class UserService:
         if self.users.find_one({"email": email}):
             return False, "Email already exists"
         
-        # Check parent user if provided
-        parent_user = None
-        if parent_id:
-            parent_user = self.get_user_by_id(parent_id)
-            if not parent_user:
-                return False, "Parent user not found"
+        # Check parent user if provided; its chain plus itself are the new user's ancestors
+        ancestors = ancestors_for_parent(self.users, parent_id)
+        if ancestors is None:
+            return False, "Parent user not found"
         
         # Hash the password
         password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -355,14 +360,15 @@ class UserService:
             full_name=full_name,
             phone=phone,
             wallet_balance=initial_balance,
-            parent_id=ObjectId(parent_id) if parent_id else None
+            parent_id=ObjectId(parent_id) if parent_id else None,
+            ancestors=ancestors
         )
         
         # Insert user into database
         user_id = self.users.insert_one(user.__dict__).inserted_id
         
         # Update parent's children list if applicable
-        if parent_user:
+        if parent_id:
             self.users.update_one(
                 {"_id": ObjectId(parent_id)},
                 {"$push": {"children": user_id}}
@@ -381,6 +387,9 @@ class UserService:
             )
             self.transactions.insert_one(transaction.__dict__)
         
+        user_events.publish(user_events.USER_CREATED, user_id)
+        if self.USER_STATS is not None:
+            self.USER_STATS.record_created(role, wallet_balance=initial_balance)
         return True, str(user_id)
     
     def get_user_by_id(self, user_id):
@@ -444,6 +453,19 @@ class UserService:
                 ).decode('utf-8')
                 del update_data["password"]
             
+            # Moving to another parent rewrites the ancestors of the whole subtree
+            update_data.pop("ancestors", None)
+            if "parent_id" in update_data:
+                _, error = reparent(self.users, user_id, update_data.pop("parent_id"))
+                if error:
+                    return False, error
+                user_events.publish(user_events.USER_UPDATED, user_id)
+                if not update_data:
+                    return True, "User moved successfully"
+            
+            # The role counters move from the role the user had
+            previous = self.users.find_one({"_id": ObjectId(user_id)}, {"role": 1}) if "role" in update_data else None
+            
             # Update user
             result = self.users.update_one(
                 {"_id": ObjectId(user_id)},
@@ -451,6 +473,9 @@ class UserService:
             )
             
             if result.modified_count > 0:
+                user_events.publish(user_events.USER_UPDATED, user_id)
+                if previous and self.USER_STATS is not None:
+                    self.USER_STATS.record_role_changed(previous.get("role"), update_data["role"])
                 return True, "User updated successfully"
             return False, "No changes made"
         
@@ -467,6 +492,7 @@ class UserService:
             )
             
             if result.modified_count > 0:
+                user_events.publish(user_events.USER_DEACTIVATED, user_id)
                 return True, "User deactivated successfully"
             return False, "User not found or already inactive"
         
@@ -483,6 +509,14 @@ class UserService:
             print(f"Error getting users by role: {e}")
             return []
     
+    def is_in_downline(self, ancestor_id, user_id):
+        """Check whether a user is anywhere below another, with one indexed lookup."""
+        try:
+            return is_in_downline(self.users, ancestor_id, user_id)
+        except Exception as e:
+            print(f"Error checking downline: {e}")
+            return False
+    
     def get_users_by_parent(self, parent_id, skip=0, limit=20):
         """Get users created by a specific parent with pagination."""
         try:
@@ -493,8 +527,10 @@ class UserService:
             return []
     
     def count_users_by_role(self):
-        """Count users by role."""
+        """Count users by role, from the user stats counters when available."""
         try:
+            if self.USER_STATS is not None:
+                return self.USER_STATS.get_stats()["by_role"]
             pipeline = [
                 {"$group": {"_id": "$role", "count": {"$sum": 1}}}
             ]
@@ -541,6 +577,9 @@ class UserService:
             )
             
             transaction_id = self.transactions.insert_one(transaction.__dict__).inserted_id
+            user_events.publish(user_events.USER_WALLET_CHANGED, user_id)
+            if self.USER_STATS is not None:
+                self.USER_STATS.record_wallet_change(new_balance - previous_balance)
             
             return True, {
                 "transaction_id": str(transaction_id),
@@ -607,17 +646,12 @@ class UserService:
             if not user:
                 return None
                 
-            # Get ancestors (parent chain)
-            ancestors = []
-            current_parent_id = user.parent_id
-            while current_parent_id:
-                parent = self.get_user_by_id(current_parent_id)
-                if parent:
-                    ancestors.append(parent.to_safe_dict())
-                    current_parent_id = parent.parent_id
-                else:
-                    break
-                    
+            # Get ancestors (parent chain, direct parent first) in one query
+            ancestors = [
+                User.from_dict(ancestor).to_safe_dict()
+                for ancestor in get_ancestors(self.users, user)
+            ]
+            
             # Get immediate children
             children = self.get_users_by_parent(user_id)
             children_data = [child.to_safe_dict() for child in children]
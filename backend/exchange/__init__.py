@@ -0,0 +1 @@
+"""In-house exchange: limit order matching for B-book markets."""
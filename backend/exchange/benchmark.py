@@ -0,0 +1,94 @@
+"""
+Throughput benchmark for the matching engine.
+
+Replays a random mix of limit orders, cancels and size reductions around a
+drifting mid price on a few runners and reports order operations per
+second. The operations are generated up front so only the engine is timed.
+The target is 100k operations per second on one core.
+
+    python -m exchange.benchmark --operations 500000
+"""
+import argparse
+import random
+import time
+from exchange.engine import MatchingEngine
+from utils.betting import PRICE_LADDER, price_to_tick
+
+TARGET_OPS_PER_SECOND = 100000
+
+def generate_operations(count, markets=10, runners=3, spread=5, seed=None):
+    """
+    Build a list of ('place', args) / ('cancel', args) operations.
+
+    About 60% are placements within `spread` ticks of the runner's mid
+    price, 30% full cancels and 10% size reductions of earlier orders.
+    """
+    rng = random.Random(seed)
+    mid = {
+        (f'1.{market}', selection): price_to_tick(rng.choice([1.5, 2.0, 3.0, 5.0, 10.0]))
+        for market in range(markets)
+        for selection in range(1, runners + 1)
+    }
+    keys = list(mid)
+    operations = []
+    placed = []
+    for number in range(count):
+        roll = rng.random()
+        if roll < 0.6 or not placed:
+            market_id, selection_id = key = rng.choice(keys)
+            if rng.random() < 0.01:
+                mid[key] = min(max(mid[key] + rng.choice((-1, 1)), spread), len(PRICE_LADDER) - spread - 1)
+            side = 'BACK' if rng.random() < 0.5 else 'LAY'
+            # Backers ask slightly above the mid, layers slightly below, so
+            # most orders rest and some cross
+            offset = rng.randint(-1, spread) if side == 'BACK' else -rng.randint(-1, spread)
+            price = PRICE_LADDER[mid[key] + offset]
+            order_id = f'o{number}'
+            placed.append(order_id)
+            operations.append(('place', (order_id, 'user', market_id, selection_id, side, price,
+                                         rng.choice((2, 5, 10, 20, 50)))))
+        elif roll < 0.9:
+            operations.append(('cancel', (placed.pop(rng.randrange(len(placed))), None)))
+        else:
+            operations.append(('cancel', (rng.choice(placed), 1)))
+    return operations
+
+def run(operations, engine=None):
+    """
+    Apply operations to an engine.
+
+    Returns:
+        Tuple of (elapsed seconds, engine)
+    """
+    engine = engine or MatchingEngine()
+    place = engine.place
+    cancel = engine.cancel
+    start = time.perf_counter()
+    for kind, args in operations:
+        if kind == 'place':
+            place(*args)
+        else:
+            cancel(*args)
+    return time.perf_counter() - start, engine
+
+def main(argv=None):
+    """Run the benchmark and print the throughput."""
+    parser = argparse.ArgumentParser(description='Matching engine throughput benchmark')
+    parser.add_argument('--operations', type=int, default=500000)
+    parser.add_argument('--markets', type=int, default=10)
+    parser.add_argument('--runners', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    operations = generate_operations(args.operations, args.markets, args.runners, seed=args.seed)
+    elapsed, engine = run(operations)
+    ops_per_second = len(operations) / elapsed
+    metrics = engine.get_metrics()
+
+    print(f"{len(operations)} operations in {elapsed:.3f}s: {ops_per_second:,.0f} ops/s "
+          f"(target {TARGET_OPS_PER_SECOND:,})")
+    print(f"{metrics['fills']} fills, {metrics['live_orders']} orders resting on {metrics['books']} books")
+    return 0 if ops_per_second >= TARGET_OPS_PER_SECOND else 1
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,195 @@
+"""
+Matching engine for the in-house exchange.
+
+Holds one RunnerBook per (market, selection) and an index of live orders.
+Every operation runs under one lock and returns the bet snapshots of the
+orders it changed, which the caller hands to the FillWriter. With an owner
+(exchange.owner), order operations are refused in any process that does not
+hold the exchange lease.
+"""
+import threading
+from exchange.order_book import BACK, LAY, Order, RunnerBook, to_pence
+from utils.betting import price_to_tick
+
+class ExchangeError(Exception):
+    """Raised for orders the exchange rejects."""
+
+class MatchingEngine:
+    """In-memory limit order matching for B-book markets."""
+
+    def __init__(self, owner=None):
+        """
+        Initialize the matching engine.
+
+        Args:
+            owner: Optional ExchangeOwner checked before every order operation
+        """
+        self.owner = owner
+        self._books = {}
+        self._orders = {}
+        self._lock = threading.Lock()
+        self.operations = 0
+        self.fills = 0
+
+    def place(self, order_id, user_id, market_id, selection_id, side, price, size):
+        """
+        Place a limit order, matching it against the book first.
+
+        Args:
+            order_id: Unique order ID (the bet's bet_id)
+            user_id: Owner of the order
+            market_id: Market ID
+            selection_id: Runner selection ID
+            side: 'BACK' or 'LAY'
+            price: Limit price, must be on the Betfair ladder
+            size: Stake
+
+        Returns:
+            Tuple of (snapshot of the new order, list of snapshots of the
+            resting orders it matched)
+
+        Raises:
+            ExchangeError: If the price, size or side is invalid
+        """
+        tick = price_to_tick(price)
+        if tick is None:
+            raise ExchangeError(f'Price {price} is not on the price ladder')
+        pence = to_pence(size)
+        if pence <= 0:
+            raise ExchangeError('Size must be positive')
+        side = side.upper()
+        if side not in (BACK, LAY):
+            raise ExchangeError('Side must be either BACK or LAY')
+
+        self._check_owner()
+        order = Order(order_id, user_id, market_id, selection_id, side, tick, pence)
+        fills = []
+        with self._lock:
+            if order_id in self._orders:
+                raise ExchangeError(f'Duplicate order ID {order_id}')
+            book = self._book(market_id, selection_id)
+            book.match(order, fills)
+            if order.remaining:
+                book.rest(order)
+                self._orders[order_id] = order
+            self.operations += 1
+            self.fills += len(fills)
+            makers = self._maker_snapshots(fills)
+            return order.snapshot(), makers
+
+    def cancel(self, order_id, size_reduction=None):
+        """
+        Cancel an order, or reduce it while keeping its queue position.
+
+        Args:
+            order_id: Order ID
+            size_reduction: Stake to remove; None cancels the whole remainder
+
+        Returns:
+            Snapshot of the order, or None if it is not live
+        """
+        self._check_owner()
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is None:
+                return None
+            pence = order.remaining if size_reduction is None else to_pence(size_reduction)
+            self._books[(order.market_id, order.selection_id)].reduce(order, pence)
+            if not order.remaining:
+                del self._orders[order_id]
+            self.operations += 1
+            return order.snapshot()
+
+    def restore(self, order_id, user_id, market_id, selection_id, side, price, size, size_matched=0,
+                average_price_matched=None):
+        """
+        Put a resting order back on the book after a restart, without matching.
+
+        Orders must be restored in their original placement order to keep
+        queue priority.
+        """
+        tick = price_to_tick(price)
+        if tick is None:
+            return None
+        order = Order(order_id, user_id, market_id, selection_id, side.upper(), tick, to_pence(size))
+        order.matched = to_pence(size_matched or 0)
+        order.matched_value = order.matched * (average_price_matched or order.price)
+        order.remaining = order.size - order.matched
+        if order.remaining <= 0:
+            return None
+        self._check_owner()
+        with self._lock:
+            self._book(market_id, selection_id).rest(order)
+            self._orders[order_id] = order
+        return order.snapshot()
+
+    def cancel_market(self, market_id):
+        """
+        Cancel every live order on a market.
+
+        Returns:
+            List of snapshots of the cancelled orders
+        """
+        self._check_owner()
+        with self._lock:
+            cancelled = []
+            for order_id, order in list(self._orders.items()):
+                if order.market_id != market_id:
+                    continue
+                self._books[(market_id, order.selection_id)].reduce(order, order.remaining)
+                del self._orders[order_id]
+                cancelled.append(order.snapshot())
+            self.operations += len(cancelled)
+            return cancelled
+
+    def get_order(self, order_id):
+        """Snapshot of a live order, or None."""
+        with self._lock:
+            order = self._orders.get(order_id)
+            return order.snapshot() if order else None
+
+    def get_book(self, market_id, selection_id, depth=3):
+        """
+        Best available prices of a runner.
+
+        Returns:
+            Dict with availableToBack and availableToLay price/size lists
+        """
+        with self._lock:
+            book = self._books.get((market_id, selection_id))
+            if book is None:
+                return {'availableToBack': [], 'availableToLay': []}
+            available_to_back, available_to_lay = book.depth(depth)
+            return {'availableToBack': available_to_back, 'availableToLay': available_to_lay}
+
+    def get_metrics(self):
+        """Get engine size and activity counters."""
+        with self._lock:
+            return {
+                'books': len(self._books),
+                'live_orders': len(self._orders),
+                'operations': self.operations,
+                'fills': self.fills
+            }
+
+    def _check_owner(self):
+        if self.owner is not None:
+            self.owner.check()
+
+    def _book(self, market_id, selection_id):
+        book = self._books.get((market_id, selection_id))
+        if book is None:
+            book = self._books[(market_id, selection_id)] = RunnerBook()
+        return book
+
+    def _maker_snapshots(self, fills):
+        """Snapshot each resting order touched by a match once, dropping filled ones from the index."""
+        makers = {}
+        for maker, taker, tick, pence in fills:
+            makers[maker.order_id] = maker
+        snapshots = []
+        for order_id, maker in makers.items():
+            if not maker.remaining:
+                self._orders.pop(order_id, None)
+            snapshots.append(maker.snapshot())
+        return snapshots
@@ -0,0 +1,153 @@
+"""
+Batched persistence of exchange fills.
+
+The matching engine never touches MongoDB. Order snapshots it returns are
+queued here and written to the bets collection by a background task, either
+every `flush_interval` seconds or as soon as `batch_size` snapshots are
+waiting. Snapshots of the same bet are coalesced, so each flush is one
+status read and one unordered bulk_write whatever the number of fills.
+"""
+import threading
+from datetime import datetime
+from pymongo import UpdateOne
+from database.db_config import COLLECTIONS
+from services.base_service import BaseService
+from utils import bet_events
+from utils.scheduler import PeriodicTask
+
+# Statuses the exchange can still change
+OPEN_STATUSES = ('UNMATCHED', 'PARTIALLY_MATCHED')
+
+class FillWriter(BaseService):
+    """Queue of order snapshots flushed to the bets collection in batches."""
+
+    def __init__(self, flush_interval=0.05, batch_size=500, bet_stats=None):
+        """
+        Initialize the fill writer.
+
+        Args:
+            flush_interval: Seconds between flushes
+            batch_size: Queued snapshots that trigger an early flush
+            bet_stats: Optional BetStatsService to record status transitions
+        """
+        super().__init__(COLLECTIONS['BETS'])
+        self.batch_size = batch_size
+        self.bet_stats = bet_stats
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._task = PeriodicTask('exchange-fill-writer', flush_interval, self.flush)
+        self.flushes = 0
+        self.written = 0
+
+    def start(self):
+        """Start the background flushes."""
+        self._task.start()
+
+    def stop(self):
+        """Stop the background flushes and write whatever is still queued."""
+        self._task.stop()
+        self.flush()
+
+    def submit(self, snapshots):
+        """
+        Queue order snapshots for writing.
+
+        Args:
+            snapshots: Snapshot dict or list of snapshot dicts from MatchingEngine
+        """
+        if isinstance(snapshots, dict):
+            snapshots = [snapshots]
+        with self._lock:
+            for snapshot in snapshots:
+                queued = self._pending.get(snapshot['bet_id'])
+                # Callers submit after leaving the engine lock, so snapshots of
+                # one bet can arrive out of order; the least remaining is newest
+                if queued is None or snapshot['size_remaining'] <= queued['size_remaining']:
+                    self._pending[snapshot['bet_id']] = snapshot
+            pending = len(self._pending)
+        if pending >= self.batch_size:
+            self._task.trigger()
+
+    def flush(self):
+        """
+        Write all queued snapshots.
+
+        Returns:
+            Number of bets updated
+        """
+        with self._flush_lock:
+            with self._lock:
+                snapshots, self._pending = self._pending, {}
+            if not snapshots:
+                return 0
+
+            try:
+                current = {
+                    bet['bet_id']: bet
+                    for bet in self.collection.find(
+                        {'bet_id': {'$in': list(snapshots)}},
+                        {'bet_id': 1, 'status': 1, 'size': 1, 'side': 1}
+                    )
+                }
+            except Exception as e:
+                self.logger.error(f"Error reading bets for exchange fills: {e}")
+                self._requeue(snapshots)
+                return 0
+
+            now = datetime.utcnow()
+            operations = []
+            updates = []
+            transitions = []
+            for bet_id, snapshot in snapshots.items():
+                bet = current.get(bet_id)
+                if bet is None or bet.get('status') not in OPEN_STATUSES:
+                    # Unknown, or already cancelled or settled through the API
+                    continue
+                fields = {
+                    'size_matched': snapshot['size_matched'],
+                    'size_remaining': snapshot['size_remaining'],
+                    'average_price_matched': snapshot['average_price_matched'],
+                    'status': snapshot['status'],
+                    'updated_at': now
+                }
+                # Never overwrite a newer state with an older snapshot
+                operations.append(UpdateOne(
+                    {'bet_id': bet_id, 'size_remaining': {'$not': {'$lt': snapshot['size_remaining']}}},
+                    {'$set': fields}
+                ))
+                updates.append(dict(fields, bet_id=bet_id))
+                transitions.append((bet, bet['status'], snapshot['status']))
+
+            if not operations:
+                return 0
+
+            try:
+                self.collection.bulk_write(operations, ordered=False)
+            except Exception as e:
+                self.logger.error(f"Error writing exchange fills: {e}")
+                self._requeue(snapshots)
+                return 0
+
+            bet_events.publish(bet_events.BET_UPDATED, updates)
+            if self.bet_stats is not None:
+                self.bet_stats.record_transitions(transitions)
+            self.flushes += 1
+            self.written += len(operations)
+            return len(operations)
+
+    def get_metrics(self):
+        """Get queue and write counters."""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'pending': pending,
+            'flushes': self.flushes,
+            'written': self.written
+        }
+
+    def _requeue(self, snapshots):
+        """Put snapshots of a failed flush back, unless newer ones arrived meanwhile."""
+        with self._lock:
+            for bet_id, snapshot in snapshots.items():
+                self._pending.setdefault(bet_id, snapshot)
@@ -0,0 +1,228 @@
+"""
+Runner order book for the in-house exchange.
+
+Price levels are the Betfair tick ladder (utils.betting.PRICE_LADDER) used as
+array indexes: each side of a runner book is a list of FIFO queues, one per
+tick, plus a parallel list of resting volume. Sizes are held in integer
+pence so level volumes never drift.
+
+A BACK order matches resting LAY orders at the same or a higher price, best
+(highest) price first; a LAY order matches resting BACK orders at the same or
+a lower price, lowest first. Trades execute at the resting order's price.
+Cancelled orders are left in their queue with nothing remaining and skipped
+when they reach the front.
+"""
+from collections import deque
+from utils.betting import PRICE_LADDER
+
+BACK = 'BACK'
+LAY = 'LAY'
+
+LADDER_SIZE = len(PRICE_LADDER)
+
+def to_pence(amount):
+    return int(round(amount * 100))
+
+def from_pence(pence):
+    return pence / 100.0
+
+class Order:
+    """A limit order resting in or passing through a runner book."""
+
+    __slots__ = ('order_id', 'user_id', 'market_id', 'selection_id', 'side', 'tick',
+                 'size', 'remaining', 'matched', 'matched_value', 'cancelled')
+
+    def __init__(self, order_id, user_id, market_id, selection_id, side, tick, size):
+        self.order_id = order_id
+        self.user_id = user_id
+        self.market_id = market_id
+        self.selection_id = selection_id
+        self.side = side
+        self.tick = tick
+        self.size = size
+        self.remaining = size
+        self.matched = 0
+        # Sum of pence matched x price, for the average matched price
+        self.matched_value = 0.0
+        self.cancelled = 0
+
+    @property
+    def price(self):
+        return PRICE_LADDER[self.tick]
+
+    @property
+    def average_price_matched(self):
+        if not self.matched:
+            return None
+        return round(self.matched_value / self.matched, 2)
+
+    @property
+    def status(self):
+        if self.remaining:
+            return 'PARTIALLY_MATCHED' if self.matched else 'UNMATCHED'
+        # A cancelled remainder leaves the matched part standing
+        return 'MATCHED' if self.matched else 'CANCELLED'
+
+    def snapshot(self):
+        """Bet fields of the order's current state."""
+        return {
+            'bet_id': self.order_id,
+            'user_id': self.user_id,
+            'market_id': self.market_id,
+            'selection_id': self.selection_id,
+            'side': self.side,
+            'price': self.price,
+            'size': from_pence(self.size),
+            'size_matched': from_pence(self.matched),
+            'size_remaining': from_pence(self.remaining),
+            'average_price_matched': self.average_price_matched,
+            'status': self.status
+        }
+
+class RunnerBook:
+    """Resting BACK and LAY orders of one runner on one market."""
+
+    __slots__ = ('back_queues', 'lay_queues', 'back_volume', 'lay_volume', 'best_back', 'best_lay')
+
+    def __init__(self):
+        self.back_queues = [None] * LADDER_SIZE
+        self.lay_queues = [None] * LADDER_SIZE
+        self.back_volume = [0] * LADDER_SIZE
+        self.lay_volume = [0] * LADDER_SIZE
+        # Lowest tick holding BACK volume (LADDER_SIZE when empty)
+        self.best_back = LADDER_SIZE
+        # Highest tick holding LAY volume (-1 when empty)
+        self.best_lay = -1
+
+    def match(self, order, fills):
+        """
+        Match an incoming order against the opposite side.
+
+        Args:
+            order: Incoming Order with remaining size
+            fills: List that (maker, taker, tick, pence) tuples are appended to
+        """
+        if order.side == BACK:
+            queues, volume = self.lay_queues, self.lay_volume
+            tick = self.best_lay
+            while order.remaining and tick >= order.tick:
+                if volume[tick]:
+                    self._take(queues[tick], volume, tick, order, fills)
+                if not volume[tick]:
+                    tick -= 1
+            self.best_lay = self._scan_down(volume, tick)
+        else:
+            queues, volume = self.back_queues, self.back_volume
+            tick = self.best_back
+            while order.remaining and tick <= order.tick:
+                if volume[tick]:
+                    self._take(queues[tick], volume, tick, order, fills)
+                if not volume[tick]:
+                    tick += 1
+            self.best_back = self._scan_up(volume, tick)
+
+    def rest(self, order):
+        """Queue the remaining size of an order at its price."""
+        tick = order.tick
+        if order.side == BACK:
+            queue = self.back_queues[tick]
+            if queue is None:
+                queue = self.back_queues[tick] = deque()
+            elif not self.back_volume[tick]:
+                # Only cancelled orders are left at this level
+                queue.clear()
+            queue.append(order)
+            self.back_volume[tick] += order.remaining
+            if tick < self.best_back:
+                self.best_back = tick
+        else:
+            queue = self.lay_queues[tick]
+            if queue is None:
+                queue = self.lay_queues[tick] = deque()
+            elif not self.lay_volume[tick]:
+                # Only cancelled orders are left at this level
+                queue.clear()
+            queue.append(order)
+            self.lay_volume[tick] += order.remaining
+            if tick > self.best_lay:
+                self.best_lay = tick
+
+    def reduce(self, order, pence):
+        """
+        Take size off a resting order, keeping its place in the queue.
+
+        Returns:
+            The pence actually removed
+        """
+        pence = min(pence, order.remaining)
+        if not pence:
+            return 0
+        order.remaining -= pence
+        order.cancelled += pence
+        tick = order.tick
+        if order.side == BACK:
+            self.back_volume[tick] -= pence
+            if tick == self.best_back and not self.back_volume[tick]:
+                self.best_back = self._scan_up(self.back_volume, tick)
+        else:
+            self.lay_volume[tick] -= pence
+            if tick == self.best_lay and not self.lay_volume[tick]:
+                self.best_lay = self._scan_down(self.lay_volume, tick)
+        return pence
+
+    def depth(self, levels=3):
+        """
+        Best available prices, Betfair style.
+
+        Returns:
+            Tuple of (available_to_back, available_to_lay) lists of price/size
+            dicts; resting LAY orders are what a backer can take and vice versa
+        """
+        available_to_back = []
+        tick = self.best_lay
+        while tick >= 0 and len(available_to_back) < levels:
+            if self.lay_volume[tick]:
+                available_to_back.append({'price': PRICE_LADDER[tick], 'size': from_pence(self.lay_volume[tick])})
+            tick -= 1
+
+        available_to_lay = []
+        tick = self.best_back
+        while tick < LADDER_SIZE and len(available_to_lay) < levels:
+            if self.back_volume[tick]:
+                available_to_lay.append({'price': PRICE_LADDER[tick], 'size': from_pence(self.back_volume[tick])})
+            tick += 1
+
+        return available_to_back, available_to_lay
+
+    @staticmethod
+    def _take(queue, volume, tick, order, fills):
+        """Fill an incoming order from one price level in FIFO order."""
+        price = PRICE_LADDER[tick]
+        while order.remaining and queue:
+            maker = queue[0]
+            if not maker.remaining:
+                queue.popleft()
+                continue
+            pence = maker.remaining if maker.remaining < order.remaining else order.remaining
+            maker.remaining -= pence
+            maker.matched += pence
+            maker.matched_value += pence * price
+            order.remaining -= pence
+            order.matched += pence
+            order.matched_value += pence * price
+            volume[tick] -= pence
+            fills.append((maker, order, tick, pence))
+            if not maker.remaining:
+                queue.popleft()
+
+    @staticmethod
+    def _scan_up(volume, tick):
+        while tick < LADDER_SIZE and not volume[tick]:
+            tick += 1
+        return tick
+
+    @staticmethod
+    def _scan_down(volume, tick):
+        while tick >= 0 and not volume[tick]:
+            tick -= 1
+        return tick
@@ -0,0 +1,99 @@
+"""
+Single-process ownership of the in-house exchange.
+
+The matching engine keeps its books in process memory, so exchange markets
+can only be served by one process: with several (e.g. gunicorn workers),
+each would rebuild the same resting orders and match against its own copy,
+filling a resting bet once per process. The serving process holds a lease in
+the settings collection, renewed in the background; a second process finds
+the lease live and fails to start instead of serving another copy.
+"""
+import os
+import socket
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+from database.db_config import COLLECTIONS
+from exchange.engine import ExchangeError
+from services.base_service import BaseService
+from utils.scheduler import PeriodicTask
+
+class ExchangeOwnershipError(ExchangeError):
+    """Raised when another live process serves the in-house exchange."""
+
+class ExchangeOwner(BaseService):
+    """Lease making one process the only one serving the exchange books."""
+
+    LEASE_ID = 'exchange_owner'
+
+    def __init__(self, lease=30, renew_interval=10):
+        """
+        Initialize the exchange owner.
+
+        Args:
+            lease: Seconds a lease lasts without renewal, after which another
+                process may take over
+            renew_interval: Seconds between renewals
+        """
+        super().__init__(COLLECTIONS['SETTINGS'])
+        self.lease = timedelta(seconds=lease)
+        self.pid = os.getpid()
+        self.owner_id = f"{socket.gethostname()}:{self.pid}"
+        self.held = False
+        self._task = PeriodicTask('exchange-owner', renew_interval, self.renew)
+
+    def claim(self):
+        """
+        Take the lease unless another process holds a live one.
+
+        Raises:
+            ExchangeOwnershipError: If the exchange is served elsewhere
+        """
+        now = datetime.utcnow()
+        try:
+            self.collection.find_one_and_update(
+                {'_id': self.LEASE_ID,
+                 '$or': [{'owner': self.owner_id}, {'lease_until': {'$lt': now}}]},
+                {'$set': {'owner': self.owner_id, 'lease_until': now + self.lease, 'claimed_at': now}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            holder = self.collection.find_one({'_id': self.LEASE_ID}) or {}
+            raise ExchangeOwnershipError(
+                f"The in-house exchange is served by {holder.get('owner')} until {holder.get('lease_until')}; "
+                f"exchange markets need a single worker process"
+            )
+        self.held = True
+
+    def renew(self):
+        """Extend the lease; losing it stops this process serving the exchange."""
+        result = self.collection.update_one(
+            {'_id': self.LEASE_ID, 'owner': self.owner_id},
+            {'$set': {'lease_until': datetime.utcnow() + self.lease}}
+        )
+        if not result.matched_count:
+            self.held = False
+            self.logger.error(f"Exchange lease lost by {self.owner_id}; exchange orders are refused")
+
+    def check(self):
+        """
+        Make sure this process serves the exchange.
+
+        A process forked after the claim (e.g. a preloaded gunicorn worker)
+        has a copy of the books but not the lease.
+
+        Raises:
+            ExchangeOwnershipError: If it does not
+        """
+        if not self.held or os.getpid() != self.pid:
+            raise ExchangeOwnershipError('The in-house exchange is not served by this process')
+
+    def start(self):
+        """Start renewing the lease."""
+        self._task.start()
+
+    def stop(self):
+        """Stop renewing and hand the lease back."""
+        self._task.stop()
+        if self.held and os.getpid() == self.pid:
+            self.collection.delete_one({'_id': self.LEASE_ID, 'owner': self.owner_id})
+            self.held = False
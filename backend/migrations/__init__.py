@@ -0,0 +1,47 @@
+"""
+Data migrations for the BetPro Backend application.
+
+Each migration module defines NAME, DESCRIPTION and `up(db)`, and is listed
+in MIGRATIONS in the order it must run. Applied migrations are recorded in
+the migrations collection so running them again is a no-op. Run pending
+migrations with:
+
+    python -m migrations
+"""
+import logging
+from datetime import datetime
+from database.db_config import COLLECTIONS
+from migrations import strip_user_transactions, user_ancestors, balance_ledger
+
+MIGRATIONS = [
+    strip_user_transactions,
+    user_ancestors,
+    balance_ledger
+]
+
+def pending(db):
+    """List the migrations not applied yet, in order."""
+    applied = {doc['_id'] for doc in db[COLLECTIONS['MIGRATIONS']].find({}, {'_id': 1})}
+    return [migration for migration in MIGRATIONS if migration.NAME not in applied]
+
+def run(db):
+    """
+    Apply pending migrations in order, stopping at the first failure.
+
+    Returns:
+        List of the names of the migrations applied
+    """
+    applied = []
+    for migration in pending(db):
+        logging.info(f"Applying migration {migration.NAME}: {migration.DESCRIPTION}")
+        started_at = datetime.utcnow()
+        result = migration.up(db)
+        db[COLLECTIONS['MIGRATIONS']].insert_one({
+            '_id': migration.NAME,
+            'description': migration.DESCRIPTION,
+            'result': result,
+            'started_at': started_at,
+            'applied_at': datetime.utcnow()
+        })
+        applied.append(migration.NAME)
+    return applied
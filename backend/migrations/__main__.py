@@ -0,0 +1,12 @@
+"""Apply pending data migrations to the database in MONGODB_URI."""
+import logging
+from database.db import init_db
+from migrations import run
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    applied = run(init_db())
+    logging.info(f"Applied {len(applied)} migrations" + (f": {', '.join(applied)}" if applied else ""))
+
+if __name__ == '__main__':
+    main()
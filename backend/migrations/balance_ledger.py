@@ -0,0 +1,72 @@
+"""
+Rebuild the balance ledger checkpoints with settlement P&L.
+
+Settlement ledger rows used to count the amount credited (held liability
+plus P&L) towards the ledger balance although placing a bet writes no row,
+so every settled bet inflated the ledger by its liability, and lost back
+bets, which credit nothing, wrote no row at all. The missing loss rows are
+added for the bets settled by market settlement, then the ledger heads,
+snapshots and checkpoint state are dropped so the next checkpoint run folds
+the whole ledger again.
+"""
+from pymongo import UpdateOne
+from database.db_config import COLLECTIONS
+from services.balance_snapshots import BalanceSnapshotService, SETTLEMENT_TYPE
+
+NAME = '0003_balance_ledger'
+DESCRIPTION = 'Add settlement rows for lost bets and rebuild balance ledger checkpoints'
+
+BATCH_SIZE = 1000
+
+def up(db):
+    """
+    Write the missing settlement rows and reset the balance checkpoints.
+
+    Returns:
+        Dict with the number of settlement rows added and checkpoints dropped
+    """
+    transactions = db[COLLECTIONS['TRANSACTIONS']]
+    added = 0
+    batch = []
+
+    def flush():
+        if not batch:
+            return 0
+        result = transactions.bulk_write([
+            UpdateOne(
+                {'reference_id': bet['bet_id'], 'type': SETTLEMENT_TYPE},
+                {'$setOnInsert': {
+                    'user_id': bet['user_id'],
+                    'type': SETTLEMENT_TYPE,
+                    'amount': 0.0,
+                    'profit_loss': bet['profit_loss'],
+                    'balance_before': None,
+                    'balance_after': None,
+                    'reference_id': bet['bet_id'],
+                    'market_id': bet.get('market_id'),
+                    'description': 'Loss from settled bet',
+                    'status': 'COMPLETED',
+                    'created_at': bet.get('settled_date') or bet.get('updated_at'),
+                    'updated_at': bet.get('settled_date') or bet.get('updated_at')
+                }},
+                upsert=True
+            )
+            for bet in batch
+        ], ordered=False)
+        batch.clear()
+        return result.upserted_count
+
+    # Market settlement credited every bet with a positive amount; the rest lost
+    for bet in db[COLLECTIONS['BETS']].find(
+        {'status': 'SETTLED', 'settlement_chunk': {'$exists': True}, 'profit_loss': {'$lt': 0}},
+        {'user_id': 1, 'bet_id': 1, 'market_id': 1, 'profit_loss': 1, 'settled_date': 1, 'updated_at': 1}
+    ):
+        batch.append(bet)
+        if len(batch) >= BATCH_SIZE:
+            added += flush()
+    added += flush()
+
+    heads = db[COLLECTIONS['LEDGER_HEADS']].delete_many({}).deleted_count
+    snapshots = db[COLLECTIONS['BALANCE_SNAPSHOTS']].delete_many({}).deleted_count
+    db[COLLECTIONS['SETTINGS']].delete_one({'_id': BalanceSnapshotService.STATE_ID})
+    return {'settlement_rows_added': added, 'heads_dropped': heads, 'snapshots_dropped': snapshots}
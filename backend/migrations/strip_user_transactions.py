@@ -0,0 +1,36 @@
+"""
+Remove the transactions array from user documents.
+
+Wallet changes used to push every transaction ID onto the user document.
+The ledger rows in the transactions collection, indexed by user_id, are the
+only record now, so the arrays are dropped in batches of user IDs to keep
+each update short.
+"""
+from database.db_config import COLLECTIONS
+
+NAME = '0001_strip_user_transactions'
+DESCRIPTION = 'Remove the transactions array from user documents'
+
+BATCH_SIZE = 1000
+
+def up(db):
+    """
+    Unset `transactions` on every user that has it.
+
+    Returns:
+        Dict with the number of users updated
+    """
+    users = db[COLLECTIONS['USERS']]
+    updated = 0
+    while True:
+        user_ids = [
+            user['_id'] for user in
+            users.find({'transactions': {'$exists': True}}, {'_id': 1}).limit(BATCH_SIZE)
+        ]
+        if not user_ids:
+            break
+        updated += users.update_many(
+            {'_id': {'$in': user_ids}},
+            {'$unset': {'transactions': ''}}
+        ).modified_count
+    return {'users_updated': updated}
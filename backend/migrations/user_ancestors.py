@@ -0,0 +1,64 @@
+"""
+Materialize the ancestors array on every user.
+
+The hierarchy was only recorded as parent_id, stored as a string by some
+writers and as an ObjectId by others. The parent links are read once, then
+the tree is written level by level from the users without a parent, one
+bulk_write per level. Users whose parent no longer exists become roots.
+"""
+import logging
+from pymongo import UpdateMany
+from database.db_config import COLLECTIONS
+
+NAME = '0002_user_ancestors'
+DESCRIPTION = 'Set the ancestors array on every user from the parent_id chain'
+
+def up(db):
+    """
+    Set `ancestors` on every user.
+
+    Returns:
+        Dict with the number of users updated and of orphans made roots
+    """
+    users = db[COLLECTIONS['USERS']]
+    # parent_id may be a string or an ObjectId, and may reference either
+    user_ids = {str(user['_id']): user['_id'] for user in users.find({}, {'_id': 1})}
+    children_of = {}
+    roots = []
+    orphans = 0
+    for user in users.find({}, {'parent_id': 1}):
+        parent_id = user.get('parent_id')
+        if not parent_id:
+            roots.append(user['_id'])
+        elif str(parent_id) not in user_ids:
+            orphans += 1
+            roots.append(user['_id'])
+        else:
+            children_of.setdefault(user_ids[str(parent_id)], []).append(user['_id'])
+
+    # One UpdateMany per parent: siblings share their ancestors
+    updated = 0
+    seen = set()
+    groups = [(roots, [])]
+    while groups:
+        users.bulk_write([
+            UpdateMany({'_id': {'$in': ids}}, {'$set': {'ancestors': ancestors}})
+            for ids, ancestors in groups
+        ], ordered=False)
+        next_groups = []
+        for ids, ancestors in groups:
+            seen.update(ids)
+            updated += len(ids)
+            for user_id in ids:
+                children = [child for child in children_of.get(user_id, []) if child not in seen]
+                if children:
+                    next_groups.append((children, ancestors + [user_id]))
+        groups = next_groups
+
+    if orphans:
+        logging.warning(f"{orphans} users had a missing parent and were made roots")
+    # Anything left is on a parent_id cycle
+    cyclic = len(user_ids) - len(seen)
+    if cyclic:
+        logging.warning(f"{cyclic} users are on a parent_id cycle and have no ancestors")
+    return {'users_updated': updated, 'orphans': orphans, 'cyclic': cyclic}
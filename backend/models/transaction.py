@@ -63,7 +63,25 @@ class Transaction(BaseModel):
             "reference_id": str(self.reference_id) if self.reference_id else None,
             "created_by": str(self.created_by) if self.created_by else None,
             "status": self.status,
-            "timestamp": self.timestamp
+            "created_at": self.created_at.isoformat()
+        }
+    
+    def to_document(self):
+        """Convert transaction object to a MongoDB document, keeping ObjectIds and dates native."""
+        return {
+            "_id": self._id,
+            "user_id": self.parse_object_id(self.user_id),
+            "username": self.username,
+            "amount": self.amount,
+            "transaction_type": self.transaction_type,
+            "description": self.description,
+            "previous_balance": self.previous_balance,
+            "new_balance": self.new_balance,
+            "reference_id": self.parse_object_id(self.reference_id) if self.reference_id else None,
+            "created_by": self.parse_object_id(self.created_by) if self.created_by else None,
+            "status": self.status,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at
         }
     
     @staticmethod
@@ -80,5 +98,7 @@ class Transaction(BaseModel):
             reference_id=ObjectId(data.get("reference_id")) if data.get("reference_id") else None,
             created_by=ObjectId(data.get("created_by")) if data.get("created_by") else None,
             status=data.get("status", "completed"),
-            timestamp=data.get("timestamp")
+            username=data.get("username"),
+            created_at=data.get("created_at"),
+            updated_at=data.get("updated_at")
         )
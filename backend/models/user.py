@@ -26,7 +26,7 @@ class User(BaseModel):
     def __init__(self, username, email, password_hash=None, role='user', 
                  full_name=None, phone=None, status='active', 
                  wallet_balance=0.0, last_login=None,
-                 parent_id=None, children=None, transactions=None,
+                 parent_id=None, children=None, transactions=None, ancestors=None,
                  _id=None, created_at=None, updated_at=None):
         """Initialize a user object."""
         # Initialize the base model
@@ -44,6 +44,7 @@ class User(BaseModel):
         self.last_login = last_login
         self.parent_id = parent_id  # ID of the user who created this user (hierarchy)
         self.children = children or []  # List of user IDs created by this user
+        self.ancestors = ancestors or []  # Parent chain, root first (utils.hierarchy)
         self.transactions = transactions or []  # List of transaction IDs
     
     def to_dict(self):
@@ -64,6 +65,26 @@ class User(BaseModel):
             "transaction_count": len(self.transactions)
         }
     
+    def to_document(self):
+        """Convert user object to a MongoDB document, keeping ObjectIds and dates native."""
+        return {
+            "_id": self._id,
+            "username": self.username,
+            "email": self.email,
+            "password_hash": self.password_hash,
+            "role": self.role,
+            "full_name": self.full_name,
+            "phone": self.phone,
+            "status": self.status,
+            "wallet_balance": self.wallet_balance,
+            "last_login": self.last_login,
+            "parent_id": self.parse_object_id(self.parent_id) if self.parent_id else None,
+            "ancestors": self.ancestors,
+            "children": self.children,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at
+        }
+    
     def to_safe_dict(self):
         """Convert user object to dictionary without sensitive information.
         Ensures a standardized format for all user objects regardless of when they were created.
@@ -145,7 +166,8 @@ class User(BaseModel):
             last_login=data.get("last_login"),
             parent_id=parent_id,
             children=data.get("children", []),
-            transactions=data.get("transactions", [])
+            transactions=data.get("transactions", []),
+            ancestors=data.get("ancestors", [])
         )
     
     def can_manage(self, other_user):
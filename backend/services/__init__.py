@@ -8,11 +8,37 @@ from services.user_service import UserService
 from services.event_service import EventService
 from services.bet_service import BetService
 from services.api_service import APIService
+from services.session_manager import BetfairSessionManager
+from services.order_reconciliation import OrderReconciliationService
+from services.settlement_service import SettlementService
+from services.position_engine import PositionEngine
+from services.market_runners import MarketRunners
+from services.risk_book import RiskBook
+from services.bet_stats import BetStatsService
+from services.market_sweeper import MarketSweeper
+from services.balance_snapshots import BalanceSnapshotService
+from services.daily_user_stats import DailyUserStatsService
+from services.ledger_writer import LedgerWriter
+from services.downline_stats import DownlineStatsService
+from services.user_stats import UserStatsService
 
 __all__ = [
     'BaseService',
     'UserService',
     'EventService',
     'BetService',
-    'APIService'
+    'APIService',
+    'BetfairSessionManager',
+    'OrderReconciliationService',
+    'SettlementService',
+    'PositionEngine',
+    'MarketRunners',
+    'RiskBook',
+    'BetStatsService',
+    'MarketSweeper',
+    'BalanceSnapshotService',
+    'DailyUserStatsService',
+    'LedgerWriter',
+    'DownlineStatsService',
+    'UserStatsService'
 ]
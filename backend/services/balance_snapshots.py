@@ -0,0 +1,318 @@
+"""Balance snapshot service for the BetPro Backend application.
+
+This module provides the BalanceSnapshotService class, which checkpoints
+every user's ledger balance so statements and balance-as-of queries read
+one snapshot plus a short tail of ledger rows instead of summing a user's
+whole transaction history.
+
+The ledger here is the one of the betting balance (`balance`): deposits,
+withdrawals and bet settlements, the rows written with a `type`. Wallet rows
+(`transaction_type`) move `wallet_balance` and are left out. Reserving and
+releasing bet liability writes no row, so the ledger balance is the balance
+plus the liability held by open bets, and a settlement row counts its P&L
+rather than the amount credited (held liability plus P&L).
+
+A background job folds the ledger rows written since its previous run into
+one running head per user (ledger_heads) with a single aggregation and one
+bulk_write. A user gets a snapshot when N ledger rows have accumulated since
+their last one, and once a day. Each snapshot also reconciles the wallet:
+the balance must equal the ledger balance less the liability still held by
+open and matched bets. A difference seen on two snapshots in a row is
+flagged as drift (a single one may just be a write in flight).
+"""
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from database.db_config import COLLECTIONS
+from services.base_service import BaseService
+from utils.scheduler import PeriodicTask
+
+# Ledger rows younger than this are left for the next run, so rows still
+# being written around the cutoff are not missed
+CUTOFF_LAG = timedelta(seconds=5)
+
+# Balance differences up to this are rounding, not drift
+DRIFT_TOLERANCE = 0.01
+
+# Bet statuses that still hold reserved liability; PENDING bets are batch
+# bets whose placement at Betfair is not confirmed yet
+OPEN_STATUSES = ['PENDING', 'UNMATCHED', 'PARTIALLY_MATCHED']
+HELD_STATUSES = OPEN_STATUSES + ['MATCHED']
+
+# Liability a bet in HELD_STATUSES still holds: all of it while the bet is
+# open, only the matched part once the remainder is closed
+HELD_LIABILITY = {'$cond': [
+    {'$in': ['$status', OPEN_STATUSES]},
+    {'$ifNull': ['$liability', 0]},
+    {'$multiply': [
+        {'$ifNull': ['$size_matched', 0]},
+        {'$cond': [{'$eq': ['$side', 'LAY']}, {'$subtract': ['$price', 1]}, 1]}
+    ]}
+]}
+
+# Ledger rows of the betting balance
+BALANCE_ROWS = {'type': {'$exists': True}}
+
+# Settlement rows, which count their P&L
+SETTLEMENT_TYPE = 'BET_SETTLEMENT'
+
+# Signed ledger balance change of a row
+LEDGER_DELTA = {'$cond': [
+    {'$eq': ['$type', SETTLEMENT_TYPE]},
+    {'$ifNull': ['$profit_loss', 0]},
+    {'$subtract': [{'$ifNull': ['$balance_after', 0]}, {'$ifNull': ['$balance_before', 0]}]}
+]}
+
+def _delta(transaction):
+    if transaction.get('type') == SETTLEMENT_TYPE:
+        return transaction.get('profit_loss') or 0
+    return (transaction.get('balance_after') or 0) - (transaction.get('balance_before') or 0)
+
+class BalanceSnapshotService(BaseService):
+    """Periodic per-user ledger balance snapshots and reconciliation."""
+
+    STATE_ID = 'balance_checkpoints'
+
+    def __init__(self, interval=300, every_transactions=100):
+        """
+        Initialize the balance snapshot service.
+
+        Args:
+            interval: Seconds between checkpoint runs
+            every_transactions: Ledger rows after which a user gets a new snapshot
+        """
+        super().__init__(COLLECTIONS['BALANCE_SNAPSHOTS'])
+        self.heads = self.db[COLLECTIONS['LEDGER_HEADS']]
+        self.transactions = self.db[COLLECTIONS['TRANSACTIONS']]
+        self.every_transactions = every_transactions
+        self.last_run = None
+        self._task = PeriodicTask('balance-checkpoints', interval, self.checkpoint, run_immediately=True)
+
+    def start(self):
+        """Start the background checkpoints."""
+        self._task.start()
+
+    def stop(self):
+        """Stop the background checkpoints."""
+        self._task.stop()
+
+    def checkpoint(self, now=None):
+        """
+        Fold new ledger rows into the heads and snapshot the users that are due.
+
+        Returns:
+            Dict with the cutoff and the number of users updated, snapshotted
+            and flagged for drift
+        """
+        now = now or datetime.utcnow()
+        cutoff = now - CUTOFF_LAG
+        settings = self.db[COLLECTIONS['SETTINGS']]
+        state = settings.find_one({'_id': self.STATE_ID}) or {}
+        last_cutoff = state.get('last_cutoff')
+
+        created_at = {'$lt': cutoff}
+        if last_cutoff:
+            created_at['$gte'] = last_cutoff
+        activity = list(self.transactions.aggregate([
+            {'$match': {'created_at': created_at, 'user_id': {'$ne': None}, **BALANCE_ROWS}},
+            {'$group': {'_id': '$user_id', 'count': {'$sum': 1}, 'delta': {'$sum': LEDGER_DELTA}}}
+        ], allowDiskUse=True))
+
+        if activity:
+            self.heads.bulk_write([
+                UpdateOne(
+                    {'_id': row['_id']},
+                    {'$inc': {'ledger_balance': row['delta'], 'transaction_count': row['count'],
+                              'since_snapshot': row['count']},
+                     '$set': {'as_of': cutoff},
+                     '$setOnInsert': {'snapshot_at': None}},
+                    upsert=True
+                )
+                for row in activity
+            ], ordered=False)
+
+        start_of_day = datetime(now.year, now.month, now.day)
+        due = list(self.heads.find({'$or': [
+            {'since_snapshot': {'$gte': self.every_transactions}},
+            {'snapshot_at': {'$lt': start_of_day}},
+            {'snapshot_at': None}
+        ]}))
+        snapshotted, drifted = self._snapshot(due, cutoff, now)
+
+        settings.update_one(
+            {'_id': self.STATE_ID},
+            {'$set': {'last_cutoff': cutoff, 'last_run_at': now}},
+            upsert=True
+        )
+        self.last_run = {
+            'cutoff': cutoff,
+            'users_updated': len(activity),
+            'snapshots': snapshotted,
+            'drifted': drifted
+        }
+        return self.last_run
+
+    def _snapshot(self, heads, cutoff, now):
+        """
+        Write snapshots for some heads, reconciling each user's wallet.
+
+        Returns:
+            Tuple of (snapshots written, users flagged for drift)
+        """
+        if not heads:
+            return 0, 0
+        user_ids = [head['_id'] for head in heads]
+
+        balances = {
+            user['_id']: user.get('balance', 0.0)
+            for user in self.db[COLLECTIONS['USERS']].find({'_id': {'$in': user_ids}}, {'balance': 1})
+        }
+        held = {
+            row['_id']: row['held']
+            for row in self.db[COLLECTIONS['BETS']].aggregate([
+                {'$match': {'user_id': {'$in': user_ids}, 'status': {'$in': HELD_STATUSES}}},
+                {'$group': {'_id': '$user_id', 'held': {'$sum': HELD_LIABILITY}}}
+            ])
+        }
+        previous_drift = {
+            row['_id']: row['drift']
+            for row in self.collection.aggregate([
+                {'$match': {'user_id': {'$in': user_ids}}},
+                {'$sort': {'user_id': 1, 'as_of': -1}},
+                {'$group': {'_id': '$user_id', 'drift': {'$first': '$drift'}}}
+            ])
+        }
+
+        snapshots = []
+        drifted = 0
+        for head in heads:
+            user_id = head['_id']
+            if user_id not in balances:
+                continue
+            ledger_balance = round(head.get('ledger_balance', 0.0), 2)
+            held_liability = round(held.get(user_id, 0.0), 2)
+            drift = round(balances[user_id] - (ledger_balance - held_liability), 2)
+            flagged = abs(drift) > DRIFT_TOLERANCE and abs(previous_drift.get(user_id) or 0) > DRIFT_TOLERANCE
+            if flagged:
+                drifted += 1
+                self.logger.warning(
+                    f"Balance drift for user {user_id}: wallet {balances[user_id]}, "
+                    f"ledger {ledger_balance}, held {held_liability}"
+                )
+            snapshots.append({
+                'user_id': user_id,
+                'as_of': cutoff,
+                'ledger_balance': ledger_balance,
+                'transaction_count': head.get('transaction_count', 0),
+                'balance': balances[user_id],
+                'held_liability': held_liability,
+                'drift': drift,
+                'drift_flagged': flagged,
+                'reason': 'transactions' if head.get('since_snapshot', 0) >= self.every_transactions else 'daily',
+                'created_at': now
+            })
+
+        if snapshots:
+            self.collection.insert_many(snapshots, ordered=False)
+            self.heads.bulk_write([
+                UpdateOne({'_id': snapshot['user_id']},
+                          {'$set': {'since_snapshot': 0, 'snapshot_at': now}})
+                for snapshot in snapshots
+            ], ordered=False)
+        return len(snapshots), drifted
+
+    def balance_as_of(self, user_id, at):
+        """
+        Get a user's ledger balance (balance plus liability held by open
+        bets) at a point in time.
+
+        Reads the latest snapshot taken at or before `at` and adds the ledger
+        rows written between the snapshot and `at`.
+
+        Returns:
+            Tuple of (balance, number of tail rows read)
+        """
+        snapshot = self.collection.find_one(
+            {'user_id': user_id, 'as_of': {'$lte': at}},
+            {'as_of': 1, 'ledger_balance': 1},
+            sort=[('as_of', -1)]
+        )
+        created_at = {'$lt': at}
+        balance = 0.0
+        if snapshot:
+            created_at['$gte'] = snapshot['as_of']
+            balance = snapshot['ledger_balance']
+
+        tail = list(self.transactions.aggregate([
+            {'$match': {'user_id': user_id, 'created_at': created_at, **BALANCE_ROWS}},
+            {'$group': {'_id': None, 'count': {'$sum': 1}, 'delta': {'$sum': LEDGER_DELTA}}}
+        ]))
+        if tail:
+            balance += tail[0]['delta']
+            return round(balance, 2), tail[0]['count']
+        return round(balance, 2), 0
+
+    def statement(self, user_id, start, end, limit=100):
+        """
+        Build an account statement for a period.
+
+        Args:
+            user_id: User ID
+            start: Period start (inclusive)
+            end: Period end (exclusive)
+            limit: Most ledger rows to list
+
+        Returns:
+            Dict with opening and closing ledger balances, the period's
+            ledger rows in chronological order with a running balance (a
+            settlement shows its P&L), and has_more
+        """
+        opening_balance, _ = self.balance_as_of(user_id, start)
+        closing_balance, _ = self.balance_as_of(user_id, end)
+
+        rows = list(
+            self.transactions.find({'user_id': user_id, 'created_at': {'$gte': start, '$lt': end}, **BALANCE_ROWS})
+            .sort([('created_at', 1), ('_id', 1)])
+            .limit(limit + 1)
+        )
+        has_more = len(rows) > limit
+        running = opening_balance
+        entries = []
+        for row in rows[:limit]:
+            delta = _delta(row)
+            running = round(running + delta, 2)
+            entries.append({
+                'id': str(row['_id']),
+                'type': row.get('type'),
+                'description': row.get('description'),
+                'amount': round(delta, 2),
+                'balance': running,
+                'created_at': row.get('created_at')
+            })
+
+        return {
+            'from': start,
+            'to': end,
+            'opening_balance': opening_balance,
+            'closing_balance': closing_balance,
+            'transactions': entries,
+            'has_more': has_more
+        }
+
+    def get_drift(self, limit=100):
+        """
+        Latest snapshots flagged for drift.
+
+        Returns:
+            List of snapshot dicts, newest first
+        """
+        return [
+            {
+                'user_id': str(snapshot['user_id']),
+                'as_of': snapshot['as_of'],
+                'balance': snapshot['balance'],
+                'ledger_balance': snapshot['ledger_balance'],
+                'held_liability': snapshot['held_liability'],
+                'drift': snapshot['drift']
+            }
+            for snapshot in self.collection.find({'drift_flagged': True}).sort('as_of', -1).limit(limit)
+        ]
@@ -4,9 +4,18 @@ This module provides a base service class with common functionality
 for all services in the application.
 """
 import logging
+from datetime import datetime
 from bson import ObjectId
+from pymongo import UpdateOne, ReplaceOne
+from pymongo.errors import BulkWriteError
 from database.db import get_db
 
+# Recomputes of documents changed while being recomputed
+RECONCILE_ATTEMPTS = 3
+
+# Server error code of a unique index violation
+DUPLICATE_KEY_ERROR = 11000
+
 class BaseService:
     """Base service class with common database operations."""
     
@@ -156,3 +165,85 @@ class BaseService:
         except Exception as e:
             self.logger.error(f"Error running aggregation: {e}")
             return []
+
+
+class VersionedCountersMixin:
+    """Counter documents kept by $inc and corrected by a background recompute.
+
+    Every increment also bumps a document's version. The recompute only
+    replaces a document whose version is still the one read before it was
+    recomputed, so an increment landing in between is not overwritten; such
+    documents are recomputed again, up to RECONCILE_ATTEMPTS times, and
+    otherwise left to the next run. For use with BaseService.
+    """
+
+    def _increment(self, incs, now=None):
+        """
+        Apply counter changes to several documents in one bulk_write.
+
+        Failures are logged rather than raised: the write being counted has
+        already happened and the next recompute will catch up.
+
+        Args:
+            incs: Dict of document ID -> {field: delta}
+            now: Time recorded as updated_at
+        """
+        now = now or datetime.utcnow()
+        operations = []
+        for document_id, inc in incs.items():
+            inc = {field: amount for field, amount in inc.items() if amount}
+            if inc:
+                operations.append(UpdateOne(
+                    {'_id': document_id},
+                    {'$inc': {**inc, 'version': 1}, '$set': {'updated_at': now}},
+                    upsert=True
+                ))
+        if not operations:
+            return
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            self.logger.error(f"Error updating {self.collection_name}: {e}")
+
+    def _reconcile_versioned(self, recompute, fields=()):
+        """
+        Replace documents with recomputed ones unless they changed meanwhile.
+
+        Args:
+            recompute: Callable returning a dict of document ID -> document
+            fields: Fields of the stored documents to return alongside
+
+        Returns:
+            Tuple of (dict of document ID -> (stored document or None,
+            recomputed document), IDs left to the next run)
+        """
+        results = {}
+        conflicts = None
+        for _ in range(RECONCILE_ATTEMPTS):
+            query = {} if conflicts is None else {'_id': {'$in': conflicts}}
+            projection = {'version': 1, **dict.fromkeys(fields, 1)}
+            stored = {document['_id']: document for document in self.collection.find(query, projection)}
+            documents = recompute()
+            if conflicts is not None:
+                documents = {document_id: documents[document_id] for document_id in conflicts if document_id in documents}
+
+            document_ids = list(documents)
+            operations = []
+            for document_id, document in documents.items():
+                version = stored.get(document_id, {}).get('version')
+                document = {**document, 'version': (version or 0) + 1}
+                results[document_id] = (stored.get(document_id), document)
+                # A changed version misses the filter and the upsert hits the existing _id
+                operations.append(ReplaceOne({'_id': document_id, 'version': version}, document, upsert=True))
+            conflicts = []
+            if operations:
+                try:
+                    self.collection.bulk_write(operations, ordered=False)
+                except BulkWriteError as e:
+                    for error in e.details.get('writeErrors') or []:
+                        if error.get('code') != DUPLICATE_KEY_ERROR:
+                            raise
+                        conflicts.append(document_ids[error['index']])
+            if not conflicts:
+                break
+        return results, conflicts
@@ -9,7 +9,7 @@ from bson import ObjectId
 from models.bet import Bet
 from services.base_service import BaseService
 from services.user_service import UserService
-from utils.cache import session_cached, request_cached
+from services.bet_stats import BetStatsService
 
 class BetService(BaseService):
     """Bet service for handling betting operations."""
@@ -18,6 +18,7 @@ class BetService(BaseService):
         """Initialize the bet service."""
         super().__init__('bets')
         self.user_service = UserService()
+        self.bet_stats = BetStatsService()
         self.logger = logging.getLogger('service.bet')
     
     def place_bet(self, user_id, event_id, market_id, selection_id, stake, odds,
@@ -74,6 +75,7 @@ class BetService(BaseService):
                 "transaction_id": str(transaction_id),
                 "status": Bet.STATUS_MATCHED
             })
+            self.bet_stats.record_placed({**bet_dict, "status": Bet.STATUS_MATCHED})
             
             return bet_id, None
         except Exception as e:
@@ -107,6 +109,10 @@ class BetService(BaseService):
                 "settled_at": datetime.utcnow(),
                 "updated_at": datetime.utcnow()
             })
+            self.bet_stats.record_settled(
+                [(bet_data, bet_data.get('status'), result, calculated_profit_loss)],
+                settled_status=Bet.STATUS_SETTLED
+            )
             
             # Update user's wallet balance if bet is won
             if result in [Bet.RESULT_WIN, Bet.RESULT_HALF_WIN] and calculated_profit_loss > 0:
@@ -173,6 +179,7 @@ class BetService(BaseService):
                 "status": Bet.STATUS_CANCELLED,
                 "updated_at": datetime.utcnow()
             })
+            self.bet_stats.record_transitions([(bet_data, bet_data.get('status'), Bet.STATUS_CANCELLED)])
             
             # Refund the stake
             success, transaction_id, error = self.user_service.update_wallet_balance(
@@ -226,59 +233,10 @@ class BetService(BaseService):
             self.logger.error(f"Error getting event bets: {e}")
             return []
     
-    @session_cached(ttl=300, key_prefix='bet_stats')
-    @request_cached
     def get_bet_stats(self):
-        """Get statistics about bets."""
+        """Get statistics about bets from the incrementally maintained counters."""
         try:
-            # Count bets by status
-            status_pipeline = [
-                {"$group": {"_id": "$status", "count": {"$sum": 1}, "total_stake": {"$sum": "$stake"}}}
-            ]
-            status_results = self.aggregate(status_pipeline)
-            
-            # Count bets by result
-            result_pipeline = [
-                {"$match": {"result": {"$ne": None}}},
-                {"$group": {"_id": "$result", "count": {"$sum": 1}, "total_profit_loss": {"$sum": "$profit_loss"}}}
-            ]
-            result_results = self.aggregate(result_pipeline)
-            
-            # Count bets by type
-            type_pipeline = [
-                {"$group": {"_id": "$bet_type", "count": {"$sum": 1}, "total_stake": {"$sum": "$stake"}}}
-            ]
-            type_results = self.aggregate(type_pipeline)
-            
-            # Format results
-            status_stats = {result['_id']: {
-                'count': result['count'],
-                'total_stake': result['total_stake']
-            } for result in status_results}
-            
-            result_stats = {result['_id']: {
-                'count': result['count'],
-                'total_profit_loss': result['total_profit_loss']
-            } for result in result_results}
-            
-            type_stats = {result['_id']: {
-                'count': result['count'],
-                'total_stake': result['total_stake']
-            } for result in type_results}
-            
-            # Calculate totals
-            total_bets = self.count()
-            total_stake = sum(stat['total_stake'] for stat in status_stats.values())
-            total_profit_loss = sum(stat['total_profit_loss'] for stat in result_stats.values())
-            
-            return {
-                'total_bets': total_bets,
-                'total_stake': total_stake,
-                'total_profit_loss': total_profit_loss,
-                'bets_by_status': status_stats,
-                'bets_by_result': result_stats,
-                'bets_by_type': type_stats
-            }
+            return self.bet_stats.get_stats()
         except Exception as e:
             self.logger.error(f"Error getting bet stats: {e}")
             return {
@@ -0,0 +1,212 @@
+"""Bet statistics service for the BetPro Backend application.
+
+This module provides the BetStatsService class, which keeps bet counters by
+status, result and type, plus overall totals, in one small bet_stats
+document. Every bet write path records its lifecycle transitions as a single
+atomic $inc, so reading the statistics is one find_one instead of several
+aggregations over the whole bets collection. A background task recomputes
+the document from the bets collection to correct any drift, e.g. a
+transition lost to a crash between the bet write and the counter update.
+"""
+from datetime import datetime
+from database.db_config import COLLECTIONS
+from services.base_service import BaseService, VersionedCountersMixin
+from utils.scheduler import PeriodicTask
+
+def _stake(bet):
+    """Stake of a bet, from either bet schema (stake or size)."""
+    stake = bet.get('stake')
+    if stake is None:
+        stake = bet.get('size')
+    return float(stake or 0)
+
+def _bet_type(bet):
+    return bet.get('bet_type') or bet.get('side')
+
+class BetStatsService(VersionedCountersMixin, BaseService):
+    """Incrementally maintained bet statistics."""
+
+    STATS_ID = 'global'
+
+    def __init__(self, reconcile_interval=3600):
+        """
+        Initialize the bet stats service.
+
+        Args:
+            reconcile_interval: Seconds between full recomputes
+        """
+        super().__init__(COLLECTIONS['BET_STATS'])
+        self._reconcile_task = PeriodicTask(
+            'bet-stats-reconcile', reconcile_interval, self.reconcile, run_immediately=True
+        )
+
+    def start(self):
+        """Start the background reconciliation."""
+        self._reconcile_task.start()
+
+    def stop(self):
+        """Stop the background reconciliation."""
+        self._reconcile_task.stop()
+
+    def record_placed(self, bets):
+        """
+        Count newly placed bets.
+
+        Args:
+            bets: Bet document or list of bet documents
+        """
+        if isinstance(bets, dict):
+            bets = [bets]
+        inc = {}
+        for bet in bets:
+            stake = _stake(bet)
+            self._add(inc, 'total_bets', 1)
+            self._add(inc, 'total_stake', stake)
+            self._add(inc, f"by_status.{bet.get('status')}.count", 1)
+            self._add(inc, f"by_status.{bet.get('status')}.total_stake", stake)
+            self._add(inc, f"by_type.{_bet_type(bet)}.count", 1)
+            self._add(inc, f"by_type.{_bet_type(bet)}.total_stake", stake)
+        self._apply(inc)
+
+    def record_transitions(self, transitions):
+        """
+        Move bets between status counters.
+
+        Args:
+            transitions: List of (bet, from_status, to_status) tuples
+        """
+        inc = {}
+        for bet, from_status, to_status in transitions:
+            self._move(inc, bet, from_status, to_status)
+        self._apply(inc)
+
+    def record_settled(self, settlements, settled_status='SETTLED'):
+        """
+        Count settled bets by result and add their P&L.
+
+        Args:
+            settlements: List of (bet, from_status, result, profit_loss) tuples
+            settled_status: Status the bets moved to
+        """
+        inc = {}
+        for bet, from_status, result, profit_loss in settlements:
+            self._move(inc, bet, from_status, settled_status)
+            if result is not None:
+                self._add(inc, f"by_result.{result}.count", 1)
+                self._add(inc, f"by_result.{result}.total_profit_loss", float(profit_loss or 0))
+                self._add(inc, 'total_profit_loss', float(profit_loss or 0))
+        self._apply(inc)
+
+    def get_stats(self):
+        """
+        Get bet statistics.
+
+        Returns:
+            Dict with totals and counters by status, result and type
+        """
+        stats = self.collection.find_one({'_id': self.STATS_ID})
+        if stats is None or not stats.get('reconciled_at'):
+            # Counters recorded before the first full recompute have no baseline
+            stats = self.reconcile()
+        return {
+            'total_bets': stats.get('total_bets', 0),
+            'total_stake': stats.get('total_stake', 0),
+            'total_profit_loss': stats.get('total_profit_loss', 0),
+            'bets_by_status': self._non_empty(stats.get('by_status')),
+            'bets_by_result': self._non_empty(stats.get('by_result')),
+            'bets_by_type': self._non_empty(stats.get('by_type')),
+            'updated_at': stats.get('updated_at'),
+            'reconciled_at': stats.get('reconciled_at')
+        }
+
+    def reconcile(self):
+        """
+        Recompute the statistics document from the bets collection.
+
+        Returns:
+            The new statistics document
+        """
+        results, conflicts = self._reconcile_versioned(
+            lambda: {self.STATS_ID: self._recompute()}, fields=('total_bets',)
+        )
+        previous, stats = results[self.STATS_ID]
+        if conflicts:
+            self.logger.warning("Bet stats kept changing during the recompute; left to the next run")
+        elif previous and previous.get('total_bets') != stats['total_bets']:
+            self.logger.warning(
+                f"Bet stats drifted: {previous.get('total_bets')} counted, {stats['total_bets']} in bets"
+            )
+        return stats
+
+    def _recompute(self):
+        """Compute the statistics document with one $facet aggregation."""
+        stake = {'$ifNull': ['$stake', {'$ifNull': ['$size', 0]}]}
+        result = {'$ifNull': ['$result', '$bet_outcome']}
+        facets = list(self.db[COLLECTIONS['BETS']].aggregate([
+            # PENDING bets are counted once their placement is confirmed
+            {'$match': {'status': {'$ne': 'PENDING'}}},
+            {'$facet': {
+                'totals': [
+                    {'$group': {'_id': None, 'count': {'$sum': 1}, 'total_stake': {'$sum': stake}}}
+                ],
+                'by_status': [
+                    {'$group': {'_id': '$status', 'count': {'$sum': 1}, 'total_stake': {'$sum': stake}}}
+                ],
+                'by_result': [
+                    {'$match': {'status': {'$in': ['SETTLED', 'settled']}}},
+                    {'$group': {'_id': result, 'count': {'$sum': 1},
+                                'total_profit_loss': {'$sum': {'$ifNull': ['$profit_loss', 0]}}}},
+                    {'$match': {'_id': {'$ne': None}}}
+                ],
+                'by_type': [
+                    {'$group': {'_id': {'$ifNull': ['$bet_type', '$side']}, 'count': {'$sum': 1},
+                                'total_stake': {'$sum': stake}}}
+                ]
+            }}
+        ]))[0]
+
+        totals = facets['totals'][0] if facets['totals'] else {'count': 0, 'total_stake': 0}
+        by_result = {
+            str(row['_id']): {'count': row['count'], 'total_profit_loss': row['total_profit_loss']}
+            for row in facets['by_result']
+        }
+        now = datetime.utcnow()
+        return {
+            '_id': self.STATS_ID,
+            'total_bets': totals['count'],
+            'total_stake': totals['total_stake'],
+            'total_profit_loss': sum(row['total_profit_loss'] for row in by_result.values()),
+            'by_status': {
+                str(row['_id']): {'count': row['count'], 'total_stake': row['total_stake']}
+                for row in facets['by_status']
+            },
+            'by_result': by_result,
+            'by_type': {
+                str(row['_id']): {'count': row['count'], 'total_stake': row['total_stake']}
+                for row in facets['by_type']
+            },
+            'updated_at': now,
+            'reconciled_at': now
+        }
+
+    @staticmethod
+    def _add(inc, field, amount):
+        inc[field] = inc.get(field, 0) + amount
+
+    def _move(self, inc, bet, from_status, to_status):
+        if from_status == to_status:
+            return
+        stake = _stake(bet)
+        self._add(inc, f"by_status.{from_status}.count", -1)
+        self._add(inc, f"by_status.{from_status}.total_stake", -stake)
+        self._add(inc, f"by_status.{to_status}.count", 1)
+        self._add(inc, f"by_status.{to_status}.total_stake", stake)
+
+    def _apply(self, inc):
+        """Apply all counter changes of one write in a single atomic update."""
+        self._increment({self.STATS_ID: inc})
+
+    @staticmethod
+    def _non_empty(buckets):
+        """Drop buckets whose count has gone back to zero."""
+        return {key: value for key, value in (buckets or {}).items() if value.get('count')}
@@ -0,0 +1,239 @@
+"""Daily user statistics for the BetPro Backend application.
+
+This module provides the DailyUserStatsService class, which keeps one small
+daily_user_stats document per user per day with the bets settled, turnover,
+P&L and commission of that day. Settlement adds to the documents with one
+bulk_write per chunk, and a nightly catch-up recomputes the last days from
+the bets collection with a $merge, correcting anything settlement missed.
+Reports sum these documents instead of scanning bets and transactions.
+"""
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from database.db_config import COLLECTIONS
+from services.base_service import BaseService
+from utils.hierarchy import downline_query
+from utils.scheduler import PeriodicTask
+
+# Counters kept in each daily document
+COUNTERS = ('bets_settled', 'bets_won', 'bets_lost', 'bets_voided', 'turnover', 'profit_loss', 'commission')
+
+def _day(at):
+    """Midnight UTC of the day a datetime falls on."""
+    return datetime(at.year, at.month, at.day)
+
+def _stats_id(user_id, day):
+    # Field order matters: the nightly $merge builds the same _id
+    return {'user_id': user_id, 'date': day}
+
+class DailyUserStatsService(BaseService):
+    """Per-user daily P&L, turnover and commission rollups."""
+
+    STATE_ID = 'daily_user_stats'
+
+    def __init__(self, check_interval=3600, catch_up_days=2):
+        """
+        Initialize the daily user stats service.
+
+        Args:
+            check_interval: Seconds between checks for a day to catch up
+            catch_up_days: Days recomputed by the nightly catch-up
+        """
+        super().__init__(COLLECTIONS['DAILY_USER_STATS'])
+        self.catch_up_days = catch_up_days
+        self._task = PeriodicTask('daily-user-stats', check_interval, self.catch_up, run_immediately=True)
+
+    def start(self):
+        """Start the nightly catch-up."""
+        self._task.start()
+
+    def stop(self):
+        """Stop the nightly catch-up."""
+        self._task.stop()
+
+    def record_settled(self, settlements):
+        """
+        Add settled bets to their users' daily documents.
+
+        Args:
+            settlements: List of dicts with user_id, settled_date, result,
+                turnover, profit_loss and commission
+        """
+        incs = {}
+        for settlement in settlements:
+            key = (settlement['user_id'], _day(settlement['settled_date']))
+            inc = incs.setdefault(key, dict.fromkeys(COUNTERS, 0))
+            inc['bets_settled'] += 1
+            if settlement['result'] == 'WON':
+                inc['bets_won'] += 1
+            elif settlement['result'] == 'LOST':
+                inc['bets_lost'] += 1
+            elif settlement['result'] == 'VOIDED':
+                inc['bets_voided'] += 1
+            inc['turnover'] += settlement['turnover']
+            inc['profit_loss'] += settlement['profit_loss']
+            inc['commission'] += settlement['commission']
+        if not incs:
+            return
+
+        now = datetime.utcnow()
+        try:
+            self.collection.bulk_write([
+                UpdateOne(
+                    {'_id': _stats_id(user_id, day)},
+                    {'$inc': {field: amount for field, amount in inc.items() if amount},
+                     '$set': {'updated_at': now},
+                     '$setOnInsert': {'user_id': user_id, 'date': day}},
+                    upsert=True
+                )
+                for (user_id, day), inc in incs.items()
+            ], ordered=False)
+        except Exception as e:
+            # The settlement already happened; the nightly catch-up corrects the day
+            self.logger.error(f"Error updating daily user stats: {e}")
+
+    def catch_up(self, now=None):
+        """
+        Recompute the last days once the day after them has started.
+
+        Returns:
+            Number of days recomputed
+        """
+        today = _day(now or datetime.utcnow())
+        settings = self.db[COLLECTIONS['SETTINGS']]
+        state = settings.find_one({'_id': self.STATE_ID}) or {}
+        if state.get('caught_up_to') and state['caught_up_to'] >= today:
+            return 0
+
+        start = today - timedelta(days=self.catch_up_days)
+        self.rebuild(start, today)
+        settings.update_one(
+            {'_id': self.STATE_ID},
+            {'$set': {'caught_up_to': today, 'last_run_at': datetime.utcnow()}},
+            upsert=True
+        )
+        self.logger.info(f"Daily user stats recomputed from {start.date()} to {today.date()}")
+        return self.catch_up_days
+
+    def rebuild(self, start, end):
+        """
+        Recompute the daily documents of a period from the bets collection.
+
+        Documents are replaced through $merge, so bets counted twice or
+        missed by the settlement path are corrected.
+
+        Args:
+            start: First day (inclusive)
+            end: Last day (exclusive)
+        """
+        period = {'$gte': _day(start), '$lt': _day(end)}
+        settled_at = {'$ifNull': ['$settled_date', '$settled_at']}
+        result = {'$ifNull': ['$bet_outcome', '$result']}
+        self.db[COLLECTIONS['BETS']].aggregate([
+            {'$match': {
+                'status': {'$in': ['SETTLED', 'settled']},
+                '$or': [{'settled_date': period}, {'settled_at': period}]
+            }},
+            {'$group': {
+                '_id': {
+                    'user_id': '$user_id',
+                    'date': {'$dateFromParts': {
+                        'year': {'$year': settled_at},
+                        'month': {'$month': settled_at},
+                        'day': {'$dayOfMonth': settled_at}
+                    }}
+                },
+                'bets_settled': {'$sum': 1},
+                'bets_won': {'$sum': {'$cond': [{'$in': [result, ['WON', 'won']]}, 1, 0]}},
+                'bets_lost': {'$sum': {'$cond': [{'$in': [result, ['LOST', 'lost']]}, 1, 0]}},
+                'bets_voided': {'$sum': {'$cond': [{'$eq': [result, 'VOIDED']}, 1, 0]}},
+                'turnover': {'$sum': {'$cond': [
+                    {'$eq': [result, 'VOIDED']},
+                    0,
+                    {'$ifNull': ['$size_settled', {'$ifNull': ['$size_matched', {'$ifNull': ['$stake', 0]}]}]}
+                ]}},
+                'profit_loss': {'$sum': {'$ifNull': ['$profit_loss', 0]}},
+                'commission': {'$sum': {'$ifNull': ['$commission', 0]}}
+            }},
+            {'$addFields': {'user_id': '$_id.user_id', 'date': '$_id.date', 'updated_at': datetime.utcnow()}},
+            {'$merge': {'into': COLLECTIONS['DAILY_USER_STATS'], 'whenMatched': 'replace', 'whenNotMatched': 'insert'}}
+        ], allowDiskUse=True)
+
+    def user_report(self, user_id, start, end):
+        """
+        Daily statistics of one user.
+
+        Args:
+            user_id: User ID
+            start: First day (inclusive)
+            end: Last day (exclusive)
+
+        Returns:
+            Dict with one row per active day and the period totals
+        """
+        days = list(self.collection.find(
+            {'user_id': user_id, 'date': {'$gte': _day(start), '$lt': _day(end)}},
+            {'_id': 0, 'date': 1, **dict.fromkeys(COUNTERS, 1)}
+        ).sort('date', 1))
+        return {
+            'user_id': str(user_id),
+            'from': _day(start),
+            'to': _day(end),
+            'days': [self._rounded(day) for day in days],
+            'totals': self._totals(days)
+        }
+
+    def downline_report(self, user_ids, start, end):
+        """
+        Daily statistics summed over a set of users, e.g. a master's downline.
+
+        Args:
+            user_ids: User IDs to include
+            start: First day (inclusive)
+            end: Last day (exclusive)
+
+        Returns:
+            Dict with one row per active day, the period totals and the
+            number of users with activity
+        """
+        rows = list(self.collection.aggregate([
+            {'$match': {'user_id': {'$in': list(user_ids)}, 'date': {'$gte': _day(start), '$lt': _day(end)}}},
+            {'$group': {
+                '_id': '$date',
+                'active_users': {'$addToSet': '$user_id'},
+                **{field: {'$sum': f'${field}'} for field in COUNTERS}
+            }},
+            {'$sort': {'_id': 1}}
+        ]))
+        active_users = set()
+        days = []
+        for row in rows:
+            active_users.update(row.pop('active_users'))
+            row['date'] = row.pop('_id')
+            days.append(row)
+        return {
+            'from': _day(start),
+            'to': _day(end),
+            'active_users': len(active_users),
+            'days': [self._rounded(day) for day in days],
+            'totals': self._totals(days)
+        }
+
+    def get_downline_ids(self, user_id):
+        """
+        IDs of every user below a user, with one query on the ancestors index.
+
+        Returns:
+            List of user IDs, not including the user
+        """
+        return [user['_id'] for user in self.db[COLLECTIONS['USERS']].find(downline_query(user_id), {'_id': 1})]
+
+    @staticmethod
+    def _totals(days):
+        return {field: round(sum(day.get(field, 0) for day in days), 2) for field in COUNTERS}
+
+    @staticmethod
+    def _rounded(day):
+        # Counters a day never touched are missing from its document
+        row = {'date': day['date']}
+        row.update({field: round(day.get(field, 0), 2) for field in COUNTERS})
+        return row
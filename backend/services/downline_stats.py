@@ -0,0 +1,272 @@
+"""Downline statistics for the BetPro Backend application.
+
+This module provides the DownlineStatsService class, which keeps one
+downline_stats document per user with the totals of everything below them:
+number of users, wallet balances, liability held by open and matched bets
+and today's P&L. Every wallet and bet write path hands its changes to the
+service, which adds them to every ancestor of the users concerned with one
+bulk_write, so a master's dashboard reads a single document instead of
+walking the tree. A background task recomputes all documents from the users,
+bets and daily_user_stats collections to correct any drift, e.g. a change
+lost to a crash or a user moved to another parent.
+"""
+from datetime import datetime
+from bson import ObjectId
+from database.db_config import COLLECTIONS
+from services.base_service import BaseService, VersionedCountersMixin
+from services.balance_snapshots import HELD_STATUSES, HELD_LIABILITY
+from utils.scheduler import PeriodicTask
+
+# Totals kept in each document
+TOTALS = ('user_count', 'balance_total', 'wallet_total', 'open_liability')
+
+# User field -> total it is summed into
+BALANCE_TOTALS = {'balance': 'balance_total', 'wallet_balance': 'wallet_total'}
+
+def _day_key(at):
+    return at.strftime('%Y-%m-%d')
+
+def _user_id(user_id):
+    return ObjectId(user_id) if isinstance(user_id, str) else user_id
+
+class DownlineStatsService(VersionedCountersMixin, BaseService):
+    """Per-user totals of their whole downline, maintained incrementally."""
+
+    def __init__(self, reconcile_interval=900):
+        """
+        Initialize the downline stats service.
+
+        Args:
+            reconcile_interval: Seconds between full recomputes
+        """
+        super().__init__(COLLECTIONS['DOWNLINE_STATS'])
+        self._reconcile_task = PeriodicTask(
+            'downline-stats-reconcile', reconcile_interval, self.reconcile, run_immediately=True
+        )
+
+    def start(self):
+        """Start the background reconciliation."""
+        self._reconcile_task.start()
+
+    def stop(self):
+        """Stop the background reconciliation."""
+        self._reconcile_task.stop()
+
+    def request_reconcile(self):
+        """
+        Recompute everything soon, e.g. after a user moved to another parent.
+
+        Runs inline when the background task is not running (e.g. under test).
+        """
+        if self._reconcile_task.is_running:
+            self._reconcile_task.trigger()
+        else:
+            self.reconcile()
+
+    def record_user_created(self, user_id, balance=0, wallet_balance=0):
+        """Count a new user, with its opening balances, in its ancestors' totals."""
+        self._propagate({_user_id(user_id): {
+            'user_count': 1,
+            'balance_total': balance or 0,
+            'wallet_total': wallet_balance or 0
+        }})
+
+    def record_balance(self, changes, field='balance'):
+        """
+        Add deposits, withdrawals and transfers to the ancestors' totals.
+
+        Args:
+            changes: Dict of user ID -> signed amount
+            field: User field that changed, 'balance' or 'wallet_balance'
+        """
+        total = BALANCE_TOTALS[field]
+        self._propagate({_user_id(user_id): {total: amount} for user_id, amount in changes.items()})
+
+    def record_placed(self, bets):
+        """
+        Move the liability reserved by newly placed bets from balance to liability.
+
+        Args:
+            bets: Bet document or list of bet documents
+        """
+        if isinstance(bets, dict):
+            bets = [bets]
+        changes = {}
+        for bet in bets:
+            self._add(changes, bet['user_id'], 'balance_total', -bet['liability'])
+            self._add(changes, bet['user_id'], 'open_liability', bet['liability'])
+        self._propagate(changes)
+
+    def record_released(self, releases):
+        """
+        Move liability released by cancelled or lapsed bets back to balance.
+
+        Args:
+            releases: Dict of user ID -> amount released
+        """
+        changes = {}
+        for user_id, amount in releases.items():
+            self._add(changes, user_id, 'balance_total', amount)
+            self._add(changes, user_id, 'open_liability', -amount)
+        self._propagate(changes)
+
+    def record_settled(self, settlements):
+        """
+        Release the liability of settled bets and add their P&L to today's.
+
+        Args:
+            settlements: List of (user_id, held liability, amount credited,
+                profit_loss) tuples
+        """
+        changes = {}
+        for user_id, held, credit, profit_loss in settlements:
+            self._add(changes, user_id, 'balance_total', credit)
+            self._add(changes, user_id, 'open_liability', -held)
+            self._add(changes, user_id, 'pnl_today', profit_loss)
+        self._propagate(changes)
+
+    def get_summary(self, user_id, now=None):
+        """
+        Get the totals of a user's downline.
+
+        Returns:
+            Dict with the user count, wallet totals, open liability and
+            today's P&L of everything below the user
+        """
+        user_id = _user_id(user_id)
+        stats = self.collection.find_one({'_id': user_id}) or {}
+        today = _day_key(now or datetime.utcnow())
+        summary = {'user_id': str(user_id)}
+        summary.update({field: round(stats.get(field, 0), 2) for field in TOTALS})
+        summary['user_count'] = int(summary['user_count'])
+        summary['pnl_today'] = round((stats.get('pnl_by_day') or {}).get(today, 0), 2)
+        summary['updated_at'] = stats.get('updated_at')
+        summary['reconciled_at'] = stats.get('reconciled_at')
+        return summary
+
+    def reconcile(self, now=None):
+        """
+        Recompute every downline document.
+
+        Returns:
+            Number of documents written
+        """
+        now = now or datetime.utcnow()
+        results, conflicts = self._reconcile_versioned(lambda: self._recompute(now))
+        written = len(results) - len(conflicts)
+        if conflicts:
+            self.logger.warning(f"Downline stats of {len(conflicts)} users kept changing; left to the next run")
+
+        # Users left without a downline; documents only ever incremented
+        # since this run started have no reconciled_at and are kept
+        self.collection.delete_many({'reconciled_at': {'$lt': now}, '_id': {'$nin': conflicts}})
+        self.logger.info(f"Downline stats recomputed for {written} users")
+        return written
+
+    def _recompute(self, now):
+        """
+        Compute every downline document from the users, bets and
+        daily_user_stats collections.
+
+        Users are unwound over their ancestors, so each total is one
+        aggregation; held liability and today's P&L are first summed per
+        user from the bets and daily_user_stats collections.
+
+        Returns:
+            Dict of ancestor ID -> document
+        """
+        today = datetime(now.year, now.month, now.day)
+        users = self.db[COLLECTIONS['USERS']]
+        nodes = {}
+
+        def node(ancestor_id):
+            if ancestor_id not in nodes:
+                nodes[ancestor_id] = dict.fromkeys(TOTALS, 0)
+            return nodes[ancestor_id]
+
+        for row in users.aggregate([
+            {'$match': {'ancestors.0': {'$exists': True}}},
+            {'$project': {'ancestors': 1, 'balance': 1, 'wallet_balance': 1}},
+            {'$unwind': '$ancestors'},
+            {'$group': {
+                '_id': '$ancestors',
+                'user_count': {'$sum': 1},
+                'balance_total': {'$sum': {'$ifNull': ['$balance', 0]}},
+                'wallet_total': {'$sum': {'$ifNull': ['$wallet_balance', 0]}}
+            }}
+        ], allowDiskUse=True):
+            node(row['_id']).update({field: row[field] for field in ('user_count', 'balance_total', 'wallet_total')})
+
+        for row in self.db[COLLECTIONS['BETS']].aggregate([
+            {'$match': {'status': {'$in': HELD_STATUSES}}},
+            {'$group': {'_id': '$user_id', 'value': {'$sum': HELD_LIABILITY}}},
+            *self._to_ancestors()
+        ], allowDiskUse=True):
+            node(row['_id'])['open_liability'] = row['value']
+
+        pnl_today = {
+            row['_id']: row['value']
+            for row in self.db[COLLECTIONS['DAILY_USER_STATS']].aggregate([
+                {'$match': {'date': today}},
+                {'$group': {'_id': '$user_id', 'value': {'$sum': '$profit_loss'}}},
+                *self._to_ancestors()
+            ], allowDiskUse=True)
+        }
+
+        return {
+            ancestor_id: {
+                **totals,
+                'pnl_by_day': {_day_key(now): pnl_today.get(ancestor_id, 0)},
+                'updated_at': now,
+                'reconciled_at': now
+            }
+            for ancestor_id, totals in nodes.items()
+        }
+
+    @staticmethod
+    def _to_ancestors():
+        """Stages adding up per-user `value` rows into each of the users' ancestors."""
+        return [
+            {'$lookup': {
+                'from': COLLECTIONS['USERS'],
+                'localField': '_id',
+                'foreignField': '_id',
+                'as': 'user'
+            }},
+            {'$unwind': '$user'},
+            {'$unwind': '$user.ancestors'},
+            {'$group': {'_id': '$user.ancestors', 'value': {'$sum': '$value'}}}
+        ]
+
+    @staticmethod
+    def _add(changes, user_id, field, amount):
+        deltas = changes.setdefault(_user_id(user_id), {})
+        deltas[field] = deltas.get(field, 0) + amount
+
+    def _propagate(self, changes, now=None):
+        """
+        Add per-user changes to every ancestor of the users in one bulk_write.
+
+        Args:
+            changes: Dict of user ID -> {total: delta}; 'pnl_today' goes to
+                today's entry of pnl_by_day
+        """
+        changes = {user_id: deltas for user_id, deltas in changes.items() if any(deltas.values())}
+        if not changes:
+            return
+        now = now or datetime.utcnow()
+        today = _day_key(now)
+        try:
+            users = list(self.db[COLLECTIONS['USERS']].find({'_id': {'$in': list(changes)}}, {'ancestors': 1}))
+        except Exception as e:
+            self.logger.error(f"Error reading ancestors for downline stats: {e}")
+            return
+        incs = {}
+        for user in users:
+            for ancestor_id in user.get('ancestors') or []:
+                inc = incs.setdefault(ancestor_id, {})
+                for field, amount in changes[user['_id']].items():
+                    if field == 'pnl_today':
+                        field = f'pnl_by_day.{today}'
+                    inc[field] = inc.get(field, 0) + amount
+        self._increment(incs, now)
@@ -0,0 +1,150 @@
+"""Group-commit ledger writer for the BetPro Backend application.
+
+This module provides the LedgerWriter class. Callers queue ledger rows and
+get a future back; a background task writes everything queued with one
+insert_many every few milliseconds, or as soon as `batch_size` rows are
+waiting, and resolves the futures once the write is acknowledged. Each
+flush waits for majority replication once instead of once per row, and a
+caller still only returns after its own row is durable.
+"""
+import threading
+from concurrent.futures import Future, TimeoutError
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from database.db_config import COLLECTIONS
+from services.base_service import BaseService
+from utils.scheduler import PeriodicTask
+
+class LedgerWriter(BaseService):
+    """Queue of ledger rows written to the transactions collection in groups."""
+
+    def __init__(self, flush_interval=0.005, batch_size=200, timeout=10):
+        """
+        Initialize the ledger writer.
+
+        Args:
+            flush_interval: Seconds between flushes
+            batch_size: Queued rows that trigger an early flush
+            timeout: Seconds write() waits for a row to be acknowledged
+        """
+        super().__init__(COLLECTIONS['TRANSACTIONS'])
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._task = PeriodicTask('ledger-writer', flush_interval, self.flush)
+        self.flushes = 0
+        self.written = 0
+
+    def start(self):
+        """Start the background flushes."""
+        self._task.start()
+
+    def stop(self):
+        """Stop the background flushes and write whatever is still queued."""
+        self._task.stop()
+        self.flush()
+
+    def submit(self, document):
+        """
+        Queue a ledger row.
+
+        The row gets its _id here, so the caller knows it before the write.
+
+        Args:
+            document: Transaction document
+
+        Returns:
+            Future resolved with the row's _id once written, or with the
+            write error
+        """
+        document.setdefault('_id', ObjectId())
+        future = Future()
+        with self._lock:
+            self._pending.append((document, future))
+            pending = len(self._pending)
+        if not self._task.is_running:
+            # Not started (e.g. under test): write straight away
+            self.flush()
+        elif pending >= self.batch_size:
+            self._task.trigger()
+        return future
+
+    def write(self, document):
+        """
+        Queue a ledger row and wait until it is written.
+
+        On a timeout the row is withdrawn from the queue, so a caller that
+        reverses its balance change on the error does not leave a row behind.
+        A row already taken by a flush cannot be withdrawn; the outcome of
+        that write is waited for instead.
+
+        Returns:
+            The row's _id
+
+        Raises:
+            The write error, or TimeoutError
+        """
+        future = self.submit(document)
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            if future.cancel():
+                raise
+        return future.result()
+
+    def flush(self):
+        """
+        Write all queued rows with one insert_many.
+
+        Returns:
+            Number of rows written
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            # Skip rows whose writer timed out and withdrew them
+            batch = [(document, future) for document, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                return 0
+
+            failed = {}
+            try:
+                self.collection.insert_many([document for document, future in batch], ordered=False)
+            except BulkWriteError as e:
+                if e.details.get('writeConcernErrors'):
+                    # Not known to be durable: fail every row
+                    self.logger.error(f"Write concern error writing {len(batch)} ledger rows: {e.details['writeConcernErrors']}")
+                    for document, future in batch:
+                        future.set_exception(e)
+                    return 0
+                # Unordered: only the rows listed in writeErrors were not written
+                for error in e.details.get('writeErrors') or []:
+                    failed[error['index']] = BulkWriteError({'writeErrors': [error]})
+            except Exception as e:
+                self.logger.error(f"Error writing {len(batch)} ledger rows: {e}")
+                for document, future in batch:
+                    future.set_exception(e)
+                return 0
+
+            for index, (document, future) in enumerate(batch):
+                if index in failed:
+                    future.set_exception(failed[index])
+                else:
+                    future.set_result(document['_id'])
+            written = len(batch) - len(failed)
+            self.flushes += 1
+            self.written += written
+            return written
+
+    def get_metrics(self):
+        """Get queue and write counters."""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'pending': pending,
+            'flushes': self.flushes,
+            'written': self.written,
+            'rows_per_flush': round(self.written / self.flushes, 1) if self.flushes else 0
+        }
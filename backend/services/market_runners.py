@@ -0,0 +1,64 @@
+"""Market runner sets for the BetPro Backend application.
+
+This module provides the MarketRunners class, which knows the selection IDs
+of every runner of a market. Exposure calculations need them to tell if
+"a runner without a bet" is a possible outcome: once there is a position on
+every runner of a market, it is not. Runner sets come from
+listMarketCatalogue, with one batched call for all the markets not cached
+yet, and are kept in an LRU cache. A market whose catalogue cannot be
+fetched is reported as unknown, and callers then count that outcome.
+"""
+import logging
+from utils.async_bridge import run_sync
+from utils.cache import LRUCache
+
+class MarketRunners:
+    """Cached selection IDs of every runner of a market."""
+
+    def __init__(self, betfair_async, maxsize=5000, ttl=3600):
+        """
+        Initialize the runner set cache.
+
+        Args:
+            betfair_async: AsyncBetfairAPI used for listMarketCatalogue
+            maxsize: Markets kept in the cache
+            ttl: Seconds a market's runner set is kept
+        """
+        self.betfair_async = betfair_async
+        self.logger = logging.getLogger('service.market_runners')
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get_runners(self, market_ids):
+        """
+        Get the runner sets of some markets.
+
+        Args:
+            market_ids: Betfair market IDs
+
+        Returns:
+            Dict of market ID -> frozenset of selection IDs (as strings), or
+            None for a market whose runners are unknown
+        """
+        runners = {market_id: self._cache.get(market_id) for market_id in market_ids}
+        missing = [market_id for market_id, selection_ids in runners.items() if selection_ids is None]
+        if not missing or self.betfair_async is None:
+            return runners
+
+        try:
+            catalogues = run_sync(self.betfair_async.get_market_catalogues_batched(missing), timeout=10)
+        except Exception as e:
+            self.logger.error(f"Error fetching runners of {len(missing)} markets: {e}")
+            return runners
+
+        for catalogue in catalogues:
+            market_id = catalogue.get('marketId')
+            if market_id not in runners or not catalogue.get('runners'):
+                continue
+            selection_ids = frozenset(str(runner['selectionId']) for runner in catalogue['runners'])
+            self._cache.set(market_id, selection_ids)
+            runners[market_id] = selection_ids
+        return runners
+
+    def get_stats(self):
+        """Get cache size and hit counters."""
+        return self._cache.get_stats()
@@ -0,0 +1,279 @@
+"""Market sweeper for the BetPro Backend application.
+
+This module provides the MarketSweeper class, which cancels the unmatched
+part of every open bet on a market when the market suspends, turns in-play
+or closes. Market status is polled for the markets that still have open
+bets. Each swept market gets one cancelOrders call without instructions,
+which cancels all of the account's unmatched orders on it, or one
+cancel_market on the in-house exchange. The bets are then closed, and their
+liabilities released, with one bulk_write on bets and one on users.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne
+from database.db import get_db
+from utils.async_bridge import run_sync
+from utils import bet_events
+from utils.betting import remaining_liability
+from utils.scheduler import PeriodicTask
+
+# Local statuses whose unmatched part can still be cancelled
+OPEN_STATUSES = ['UNMATCHED', 'PARTIALLY_MATCHED']
+
+# Market statuses that stop unmatched bets standing
+SWEEP_STATUSES = ('SUSPENDED', 'CLOSED')
+
+# listCurrentOrders page size when reading back a swept market
+CURRENT_ORDERS_PAGE = 1000
+
+class MarketSweeper:
+    """Cancel unmatched bets in bulk when their market stops trading."""
+
+    def __init__(self, betfair_async, exchange=None, exchange_markets=None, poll_interval=5,
+                 bet_stats=None, downline_stats=None):
+        """
+        Initialize the market sweeper.
+
+        Args:
+            betfair_async: AsyncBetfairAPI used for market books and cancelOrders
+            exchange: Optional MatchingEngine holding the in-house markets
+            exchange_markets: Market IDs matched in-house
+            poll_interval: Seconds between market status checks
+            bet_stats: Optional BetStatsService told about status transitions
+            downline_stats: Optional DownlineStatsService told about released liability
+        """
+        self.betfair_async = betfair_async
+        self.exchange = exchange
+        self.exchange_markets = set(exchange_markets or [])
+        self.bet_stats = bet_stats
+        self.downline_stats = downline_stats
+        self.logger = logging.getLogger('service.market_sweeper')
+
+        # market_id -> (status, inplay) seen at the last check
+        self._market_states = {}
+        self.sweeps = 0
+        self.bets_swept = 0
+        self.last_sweep_at = None
+
+        self._task = PeriodicTask('market-sweeper', poll_interval, self.check_markets)
+
+    def start(self):
+        """Start polling market status."""
+        self._task.start()
+
+    def stop(self):
+        """Stop polling market status."""
+        self._task.stop()
+
+    def check_markets(self):
+        """
+        Sweep the open-bet markets that suspended, closed or turned in-play
+        since the last check.
+
+        Returns:
+            Number of bets swept
+        """
+        db = get_db()
+        market_ids = db.bets.distinct('market_id', {'status': {'$in': OPEN_STATUSES}})
+        if not market_ids:
+            self._market_states = {}
+            return 0
+
+        books = run_sync(self.betfair_async.get_market_books_batched(market_ids), timeout=60)
+        states = {
+            book['market_id']: (book.get('status'), bool(book.get('inplay')))
+            for book in books if book.get('market_id')
+        }
+
+        to_sweep = [
+            market_id for market_id, state in states.items()
+            if self._should_sweep(self._market_states.get(market_id), state)
+        ]
+        swept, failed = self.sweep_markets(to_sweep) if to_sweep else (0, [])
+
+        # Forget markets without open bets; a failed sweep keeps the state seen
+        # before it, so the change that triggered it triggers the retry too
+        market_states = {}
+        for market_id, state in states.items():
+            if market_id in failed:
+                state = self._market_states.get(market_id)
+                if state is None:
+                    continue
+            market_states[market_id] = state
+        self._market_states = market_states
+        return swept
+
+    @staticmethod
+    def _should_sweep(previous, state):
+        """Sweep on entering a stopped status or in-play; closed markets always."""
+        status, inplay = state
+        if status == 'CLOSED':
+            return True
+        if status in SWEEP_STATUSES:
+            return previous is None or previous[0] != status
+        # Unknown history: bets placed after the off are meant to stand
+        return inplay and previous is not None and not previous[1]
+
+    def sweep_markets(self, market_ids):
+        """
+        Cancel the unmatched bets of some markets and release their liabilities.
+
+        Args:
+            market_ids: Market IDs to sweep
+
+        Returns:
+            Tuple of (number of bets swept, market IDs whose cancellation failed)
+        """
+        final_states = {}
+        swept_markets = []
+        failed = []
+
+        exchange_ids = [market_id for market_id in market_ids if market_id in self.exchange_markets]
+        betfair_ids = [market_id for market_id in market_ids if market_id not in self.exchange_markets]
+
+        for market_id in exchange_ids:
+            if self.exchange is None:
+                continue
+            for order in self.exchange.cancel_market(market_id):
+                final_states[order['bet_id']] = (order['size_matched'], order['average_price_matched'])
+            swept_markets.append(market_id)
+
+        if betfair_ids:
+            results = run_sync(self._cancel_markets(betfair_ids), timeout=60)
+            for market_id, result in zip(betfair_ids, results):
+                if isinstance(result, Exception):
+                    self.logger.error(f"Error sweeping market {market_id}, will retry: {result}")
+                    failed.append(market_id)
+                    continue
+                final_states.update(result)
+                swept_markets.append(market_id)
+
+        swept = self._close_open_bets(get_db(), swept_markets, final_states) if swept_markets else 0
+        self.sweeps += 1
+        self.bets_swept += swept
+        self.last_sweep_at = time.time()
+        if swept:
+            self.logger.info(f"Swept {swept} unmatched bets on {len(swept_markets)} markets")
+        return swept, failed
+
+    async def _cancel_markets(self, market_ids):
+        """Cancel every market concurrently, reading back the final order states."""
+        return await asyncio.gather(
+            *(self._cancel_market(market_id) for market_id in market_ids),
+            return_exceptions=True
+        )
+
+    async def _cancel_market(self, market_id):
+        """
+        Cancel all of the account's unmatched orders on a market.
+
+        Returns:
+            Dict of bet_id -> (size_matched, average_price_matched) from
+            listCurrentOrders
+
+        Raises:
+            Any error of cancelOrders or of the read-back; without the final
+            matched sizes the market's bets are left open and the sweep is
+            retried, as closed bets are never corrected by order reconciliation
+        """
+        result = await self.betfair_async.cancel_orders(market_id)
+        if (result or {}).get('status') == 'FAILURE':
+            raise RuntimeError(result.get('errorCode') or 'cancelOrders failed')
+
+        final_states = {}
+        from_record = 0
+        while True:
+            page = await self.betfair_async.list_current_orders(
+                market_ids=[market_id], from_record=from_record, record_count=CURRENT_ORDERS_PAGE
+            )
+            for order in (page or {}).get('currentOrders') or []:
+                final_states[str(order['betId'])] = (
+                    order.get('sizeMatched') or 0, order.get('averagePriceMatched')
+                )
+            if not (page or {}).get('moreAvailable'):
+                break
+            from_record += CURRENT_ORDERS_PAGE
+        return final_states
+
+    def _close_open_bets(self, db, market_ids, final_states):
+        """
+        Close the open bets of swept markets.
+
+        Every update carries a sweep token, so one read tells which bets this
+        sweep closed rather than a concurrent cancel or reconciliation, and
+        only those have their liability released.
+
+        Returns:
+            Number of bets closed
+        """
+        open_bets = {
+            bet['_id']: bet for bet in db.bets.find(
+                {'market_id': {'$in': market_ids}, 'status': {'$in': OPEN_STATUSES}},
+                {'bet_id': 1, 'exchange': 1, 'size_matched': 1, 'average_price_matched': 1, 'status': 1}
+            )
+        }
+        if not open_bets:
+            return 0
+
+        now = datetime.utcnow()
+        sweep_id = ObjectId()
+        bet_updates = []
+        for bet in open_bets.values():
+            state = final_states.get(bet['bet_id'])
+            if state is None:
+                if bet.get('exchange'):
+                    # Fully matched on the book; the fill writer has it queued
+                    continue
+                state = (bet.get('size_matched') or 0, bet.get('average_price_matched'))
+            size_matched, average_price_matched = state
+            bet_updates.append(UpdateOne(
+                {'_id': bet['_id'], 'status': {'$in': OPEN_STATUSES}},
+                {'$set': {
+                    'size_matched': size_matched,
+                    'size_remaining': 0,
+                    'average_price_matched': average_price_matched,
+                    'status': 'MATCHED' if size_matched > 0 else 'CANCELLED',
+                    'cancelled_date': now,
+                    'updated_at': now,
+                    'sweep_id': sweep_id
+                }}
+            ))
+        if not bet_updates:
+            return 0
+
+        db.bets.bulk_write(bet_updates, ordered=False)
+        swept_bets = list(db.bets.find({'_id': {'$in': list(open_bets)}, 'sweep_id': sweep_id}))
+        if not swept_bets:
+            return 0
+
+        releases = {}
+        for bet in swept_bets:
+            release = remaining_liability(bet)
+            if release > 0:
+                releases[bet['user_id']] = releases.get(bet['user_id'], 0) + release
+        if releases:
+            db.users.bulk_write([
+                UpdateOne({'_id': user_id}, {'$inc': {'balance': amount}})
+                for user_id, amount in releases.items()
+            ], ordered=False)
+            if self.downline_stats is not None:
+                self.downline_stats.record_released(releases)
+
+        bet_events.publish(bet_events.BET_CANCELLED, swept_bets)
+        if self.bet_stats is not None:
+            self.bet_stats.record_transitions([
+                (bet, open_bets[bet['_id']]['status'], bet['status']) for bet in swept_bets
+            ])
+        return len(swept_bets)
+
+    def get_metrics(self):
+        """Get sweep counters."""
+        return {
+            'markets_watched': len(self._market_states),
+            'sweeps': self.sweeps,
+            'bets_swept': self.bets_swept,
+            'last_sweep_at': self.last_sweep_at
+        }
@@ -0,0 +1,613 @@
+"""Order reconciliation service for the BetPro Backend application.
+
+This module provides the OrderReconciliationService class, which keeps the
+status, size_matched and average_price_matched of open bets in line with
+Betfair. Order change messages from the order stream are applied as they
+arrive; when the stream is down, open bets are polled in batches through
+listCurrentOrders instead. Both paths write through one bulk_write.
+
+Bets written as PENDING by batch placement whose placeOrders outcome was
+never learned (a timeout or transport error) are resolved here too: they are
+looked up at Betfair by customer_order_ref once the placement request can no
+longer be in flight, then either confirmed with their bet ID or removed and
+their reserved liability released.
+
+An order leaves listCurrentOrders once its market settles or its bet lapses,
+is cancelled or voided, possibly before the poll or the PENDING lookup sees
+it. Such orders are looked up in listClearedOrders: a settled one leaves its
+bet MATCHED for settlement, any other closes it as CANCELLED. Only a PENDING
+bet found in neither list counts as never placed.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from pymongo import UpdateOne, ReturnDocument
+from database.db import get_db
+from utils.async_bridge import run_sync
+from utils import bet_events
+from utils.betting import bet_status, remaining_liability
+from utils.scheduler import PeriodicTask
+
+# Local statuses whose bets can still change on Betfair
+OPEN_STATUSES = ['UNMATCHED', 'PARTIALLY_MATCHED']
+
+# Local statuses that reconciliation must never overwrite
+FINAL_STATUSES = ['CANCELLED', 'SETTLED']
+
+# listCurrentOrders accepts at most 250 bet IDs per call
+MAX_BET_IDS_PER_CALL = 250
+
+# PENDING bets younger than this may still have their placeOrders call in flight
+PENDING_GRACE = timedelta(minutes=2)
+
+# listClearedOrders bet statuses an order can end up in
+CLEARED_STATUSES = ['SETTLED', 'VOIDED', 'LAPSED', 'CANCELLED']
+
+# Stream order status codes
+STREAM_STATUSES = {'E': 'EXECUTABLE', 'EC': 'EXECUTION_COMPLETE'}
+
+class OrderReconciliationService:
+    """Apply Betfair order state to the bets collection in bulk."""
+
+    def __init__(self, betfair_async, order_stream=None, poll_interval=15, stream_stale_after=60,
+                 bet_stats=None, downline_stats=None):
+        """
+        Initialize the reconciliation service.
+
+        Args:
+            betfair_async: AsyncBetfairAPI used for listCurrentOrders polling
+            order_stream: Optional BetfairOrderStream; its callback is wired here
+            poll_interval: Seconds between fallback polls
+            stream_stale_after: Poll even while connected if the stream has been
+                silent for this many seconds (heartbeats keep a healthy stream busy)
+            bet_stats: Optional BetStatsService told about status transitions
+            downline_stats: Optional DownlineStatsService told about released liability
+        """
+        self.betfair_async = betfair_async
+        self.order_stream = order_stream
+        self.bet_stats = bet_stats
+        self.downline_stats = downline_stats
+        self.stream_stale_after = stream_stale_after
+        self.logger = logging.getLogger('service.order_reconciliation')
+
+        self.updates_applied = 0
+        self.pending_resolved = 0
+        self.orders_cleared = 0
+        self.polls = 0
+        self.last_poll_at = None
+
+        if order_stream is not None:
+            order_stream.on_change = self.apply_order_changes
+        self._poll_task = PeriodicTask('order-reconciliation', poll_interval, self.poll_if_needed)
+
+    def start(self):
+        """Start the order stream and the polling fallback."""
+        if self.order_stream is not None:
+            self.order_stream.start()
+        self._poll_task.start()
+
+    def stop(self):
+        """Stop the order stream and the polling fallback."""
+        self._poll_task.stop()
+        if self.order_stream is not None:
+            self.order_stream.stop()
+
+    @property
+    def stream_healthy(self):
+        """Check if the order stream is connected and delivering messages."""
+        stream = self.order_stream
+        if stream is None or not stream.connected or stream.last_message_at is None:
+            return False
+        return time.time() - stream.last_message_at < self.stream_stale_after
+
+    def apply_order_changes(self, message):
+        """
+        Apply an order change message (op=ocm) from the order stream.
+
+        Args:
+            message: Decoded order change message
+
+        Returns:
+            Number of bets updated
+        """
+        orders = []
+        for market_change in message.get('oc') or []:
+            for runner_change in market_change.get('orc') or []:
+                for order in runner_change.get('uo') or []:
+                    orders.append({
+                        'bet_id': str(order['id']),
+                        'status': STREAM_STATUSES.get(order.get('status'), order.get('status')),
+                        'size_matched': order.get('sm', 0),
+                        'average_price_matched': order.get('avp'),
+                        'size_remaining': order.get('sr', 0),
+                        'size_cancelled': order.get('sc', 0),
+                        'size_lapsed': order.get('sl', 0),
+                        'size_voided': order.get('sv', 0)
+                    })
+        return self.apply_orders(orders)
+
+    def apply_current_orders(self, current_orders):
+        """
+        Apply listCurrentOrders results.
+
+        Args:
+            current_orders: List of currentOrders entries (camelCase dicts)
+
+        Returns:
+            Number of bets updated
+        """
+        orders = [
+            {
+                'bet_id': str(order['betId']),
+                'status': order.get('status'),
+                'size_matched': order.get('sizeMatched', 0),
+                'average_price_matched': order.get('averagePriceMatched'),
+                'size_remaining': order.get('sizeRemaining', 0),
+                'size_cancelled': order.get('sizeCancelled', 0),
+                'size_lapsed': order.get('sizeLapsed', 0),
+                'size_voided': order.get('sizeVoided', 0)
+            }
+            for order in current_orders
+        ]
+        return self.apply_orders(orders)
+
+    def apply_orders(self, orders):
+        """
+        Write normalised order states to the bets collection.
+
+        Open orders and fully matched orders are applied with a single unordered
+        bulk_write. Orders that completed with an unmatched remainder (cancelled
+        or lapsed on Betfair) also release the reserved liability, so each of
+        those is claimed atomically first and the balance increments are then
+        applied to users in one bulk_write.
+
+        Args:
+            orders: List of normalised order dicts
+
+        Returns:
+            Number of bets updated
+        """
+        if not orders:
+            return 0
+
+        db = get_db()
+        now = datetime.utcnow()
+        bet_updates = []
+        changed_bets = []
+        transitions = []
+        voided_orders = []
+
+        # Current local state, to skip finished bets and to count status transitions
+        current = {
+            bet['bet_id']: bet for bet in db.bets.find(
+                {'bet_id': {'$in': [order['bet_id'] for order in orders]}},
+                {'bet_id': 1, 'status': 1, 'size': 1, 'stake': 1}
+            )
+        }
+
+        for order in orders:
+            previous = current.get(order['bet_id'])
+            if previous is None or previous.get('status') in FINAL_STATUSES:
+                continue
+
+            complete = order['status'] == 'EXECUTION_COMPLETE'
+            unmatched_closed = order['size_cancelled'] + order['size_lapsed'] + order['size_voided']
+            if complete and unmatched_closed > 0:
+                voided_orders.append(order)
+                continue
+
+            fields = {
+                'size_matched': order['size_matched'],
+                'average_price_matched': order['average_price_matched'],
+                'updated_at': now
+            }
+            if complete:
+                fields['status'] = 'MATCHED'
+            elif order['size_matched'] > 0:
+                fields['status'] = 'PARTIALLY_MATCHED'
+            else:
+                fields['status'] = 'UNMATCHED'
+
+            bet_updates.append(UpdateOne(
+                {'bet_id': order['bet_id'], 'status': {'$nin': FINAL_STATUSES}},
+                {'$set': fields}
+            ))
+            changed_bets.append({'bet_id': order['bet_id'], **fields})
+            if previous.get('status') != fields['status']:
+                transitions.append((previous, previous.get('status'), fields['status']))
+
+        updated = 0
+        if bet_updates:
+            result = db.bets.bulk_write(bet_updates, ordered=False)
+            updated += result.modified_count
+            bet_events.publish(bet_events.BET_UPDATED, changed_bets)
+
+        if voided_orders:
+            updated += self._close_voided_orders(db, voided_orders, now, current, transitions)
+
+        if transitions and self.bet_stats is not None:
+            self.bet_stats.record_transitions(transitions)
+
+        self.updates_applied += updated
+        return updated
+
+    def _close_voided_orders(self, db, orders, now, current, transitions):
+        """Finish orders whose remainder was cancelled or lapsed, releasing its liability."""
+        releases = {}
+        closed_bets = []
+
+        for order in orders:
+            # Claim the transition so a concurrent cancel cannot release twice
+            bet = db.bets.find_one_and_update(
+                {'bet_id': order['bet_id'], 'status': {'$in': OPEN_STATUSES}},
+                {'$set': {
+                    'size_matched': order['size_matched'],
+                    'average_price_matched': order['average_price_matched'],
+                    'size_cancelled': order['size_cancelled'],
+                    'size_lapsed': order['size_lapsed'],
+                    'status': 'MATCHED' if order['size_matched'] > 0 else 'CANCELLED',
+                    'cancelled_date': now,
+                    'updated_at': now
+                }},
+                return_document=ReturnDocument.AFTER
+            )
+            if not bet:
+                continue
+
+            closed_bets.append(bet)
+            previous_status = current[order['bet_id']].get('status')
+            if previous_status != bet['status']:
+                transitions.append((bet, previous_status, bet['status']))
+            release = remaining_liability(bet)
+            if release > 0:
+                releases[bet['user_id']] = releases.get(bet['user_id'], 0) + release
+
+        if releases:
+            db.users.bulk_write([
+                UpdateOne({'_id': user_id}, {'$inc': {'balance': amount}})
+                for user_id, amount in releases.items()
+            ], ordered=False)
+            if self.downline_stats is not None:
+                self.downline_stats.record_released(releases)
+
+        bet_events.publish(bet_events.BET_UPDATED, closed_bets)
+        return len(closed_bets)
+
+    def poll_if_needed(self):
+        """Resolve stale PENDING bets, then poll listCurrentOrders unless the order stream is healthy."""
+        try:
+            self.resolve_pending_bets()
+        except Exception as e:
+            self.logger.error(f"Error resolving pending bets: {e}")
+        if self.stream_healthy:
+            return 0
+        return self.poll_open_orders()
+
+    def resolve_pending_bets(self, now=None):
+        """
+        Settle the outcome of PENDING bets whose placeOrders result was never seen.
+
+        Their orders are looked up by customer_order_ref with one
+        listCurrentOrders call per market. A bet whose order is found gets its
+        bet ID and is then updated like any open bet. The others are looked up
+        in listClearedOrders, as the order may have matched and settled, or
+        lapsed, in the meantime; a bet found in neither was never placed, so
+        it is removed and its liability released. Bets of a market whose
+        lookup failed stay PENDING for the next run.
+
+        Returns:
+            Number of bets resolved
+        """
+        db = get_db()
+        now = now or datetime.utcnow()
+        pending = list(db.bets.find({'status': 'PENDING', 'created_at': {'$lt': now - PENDING_GRACE}}))
+        if not pending:
+            return 0
+
+        by_market = {}
+        for bet in pending:
+            by_market.setdefault(bet['market_id'], []).append(bet)
+        lookups = [
+            (market_id, bets[i:i + MAX_BET_IDS_PER_CALL])
+            for market_id, bets in by_market.items()
+            for i in range(0, len(bets), MAX_BET_IDS_PER_CALL)
+        ]
+        results = run_sync(self._fetch_orders_by_ref(lookups), timeout=60)
+
+        placed_bets = []
+        found_orders = []
+        unseen = []
+        for (market_id, bets), result in zip(lookups, results):
+            if isinstance(result, Exception):
+                self.logger.error(f"Error looking up {len(bets)} pending bets on {market_id}: {result}")
+                continue
+            orders = {
+                order.get('customerOrderRef'): order
+                for order in (result or {}).get('currentOrders') or []
+            }
+            missing = []
+            for bet in bets:
+                order = orders.get(bet.get('customer_order_ref'))
+                if order is None:
+                    missing.append(bet)
+                    continue
+                confirmed = db.bets.find_one_and_update(
+                    {'_id': bet['_id'], 'status': 'PENDING'},
+                    {'$set': {
+                        'bet_id': str(order['betId']),
+                        'placed_date': order.get('placedDate') or now,
+                        'status': 'UNMATCHED',
+                        'updated_at': now
+                    }},
+                    return_document=ReturnDocument.AFTER
+                )
+                if confirmed:
+                    placed_bets.append(confirmed)
+                    found_orders.append(order)
+            if missing:
+                unseen.append((market_id, missing))
+
+        cleared_results = []
+        if unseen:
+            cleared_results = run_sync(self._fetch_cleared_orders([
+                {'market_ids': [market_id], 'customer_order_refs': [bet['customer_order_ref'] for bet in bets]}
+                for market_id, bets in unseen
+            ]), timeout=60)
+
+        cleared = []
+        releases = {}
+        removed = 0
+        for (market_id, bets), result in zip(unseen, cleared_results):
+            if isinstance(result, Exception):
+                self.logger.error(f"Error looking up {len(bets)} cleared pending bets on {market_id}: {result}")
+                continue
+            orders = self._by_status(result, 'customerOrderRef')
+            for bet in bets:
+                if bet['customer_order_ref'] in orders:
+                    cleared.append((bet, orders[bet['customer_order_ref']]))
+                    continue
+                # In neither list, so never placed: the claim keeps a second
+                # resolver from releasing twice
+                if db.bets.find_one_and_delete({'_id': bet['_id'], 'status': 'PENDING'}):
+                    releases[bet['user_id']] = releases.get(bet['user_id'], 0) + bet['liability']
+                    removed += 1
+
+        if releases:
+            db.users.bulk_write([
+                UpdateOne({'_id': user_id}, {'$inc': {'balance': amount}})
+                for user_id, amount in releases.items()
+            ], ordered=False)
+            if self.downline_stats is not None:
+                self.downline_stats.record_released(releases)
+
+        if placed_bets:
+            bet_events.publish(bet_events.BET_PLACED, placed_bets)
+            if self.bet_stats is not None:
+                self.bet_stats.record_placed(placed_bets)
+            # Matched size, cancellations and lapses go through the usual path
+            self.apply_current_orders(found_orders)
+
+        closed = self._close_cleared_bets(db, cleared, now) if cleared else 0
+
+        resolved = len(placed_bets) + closed + removed
+        self.pending_resolved += resolved
+        if resolved:
+            self.logger.info(f"Resolved {resolved} pending bets: {len(placed_bets)} placed, "
+                             f"{closed} already cleared, {removed} never placed")
+        return resolved
+
+    async def _fetch_orders_by_ref(self, lookups):
+        """Run one listCurrentOrders call per market's batch of customer order refs concurrently."""
+        return await asyncio.gather(
+            *(self.betfair_async.list_current_orders(
+                market_ids=[market_id],
+                customer_order_refs=[bet['customer_order_ref'] for bet in bets],
+                record_count=len(bets)
+            ) for market_id, bets in lookups),
+            return_exceptions=True
+        )
+
+    def poll_open_orders(self):
+        """
+        Fetch the Betfair state of every open bet in batches and apply it.
+
+        Bets whose orders are no longer current are closed from
+        listClearedOrders.
+
+        Returns:
+            Number of bets updated
+        """
+        db = get_db()
+        bet_ids = [
+            bet['bet_id'] for bet in db.bets.find(
+                {'status': {'$in': OPEN_STATUSES}, 'bet_id': {'$ne': None}},
+                {'bet_id': 1, '_id': 0}
+            )
+        ]
+        self.polls += 1
+        self.last_poll_at = time.time()
+        if not bet_ids:
+            return 0
+
+        batches = [bet_ids[i:i + MAX_BET_IDS_PER_CALL] for i in range(0, len(bet_ids), MAX_BET_IDS_PER_CALL)]
+        results = run_sync(self._fetch_current_orders(batches), timeout=60)
+
+        current_orders = []
+        gone = []
+        for batch, result in zip(batches, results):
+            if isinstance(result, Exception):
+                self.logger.error(f"Error polling {len(batch)} current orders: {result}")
+                continue
+            orders = (result or {}).get('currentOrders') or []
+            current_orders.extend(orders)
+            returned = {str(order['betId']) for order in orders}
+            gone.extend(bet_id for bet_id in batch if bet_id not in returned)
+
+        updated = self.apply_current_orders(current_orders)
+        if gone:
+            updated += self._close_gone_orders(gone)
+        return updated
+
+    def _close_gone_orders(self, bet_ids):
+        """
+        Close open bets whose orders have left listCurrentOrders.
+
+        Bets whose orders are not in listClearedOrders yet stay open for the
+        next poll.
+
+        Returns:
+            Number of bets closed
+        """
+        db = get_db()
+        batches = [bet_ids[i:i + MAX_BET_IDS_PER_CALL] for i in range(0, len(bet_ids), MAX_BET_IDS_PER_CALL)]
+        results = run_sync(self._fetch_cleared_orders([{'bet_ids': batch} for batch in batches]), timeout=60)
+
+        orders = {}
+        for batch, result in zip(batches, results):
+            if isinstance(result, Exception):
+                self.logger.error(f"Error looking up {len(batch)} cleared orders: {result}")
+                continue
+            orders.update(self._by_status(result, 'betId'))
+        if not orders:
+            return 0
+
+        bets = db.bets.find({'bet_id': {'$in': list(orders)}, 'status': {'$in': OPEN_STATUSES}})
+        return self._close_cleared_bets(db, [(bet, orders[bet['bet_id']]) for bet in bets], datetime.utcnow())
+
+    def _close_cleared_bets(self, db, cleared, now):
+        """
+        Close PENDING or open bets from their cleared orders.
+
+        A bet with a SETTLED order (its matched part) is left MATCHED on the
+        settled size, for settlement to credit; any other is CANCELLED, as
+        nothing of it stands. The liability that is no longer at risk is
+        released either way.
+
+        Args:
+            db: Database
+            cleared: List of (bet, dict of betStatus -> cleared order)
+            now: Update time
+
+        Returns:
+            Number of bets closed
+        """
+        placed_bets = []
+        updated_bets = []
+        transitions = []
+        releases = {}
+        for bet, orders in cleared:
+            settled = orders.get('SETTLED')
+            order = settled or next(iter(orders.values()))
+            fields = {'bet_id': str(order['betId']), 'updated_at': now}
+            if settled:
+                fields.update({
+                    'status': 'MATCHED',
+                    'size_matched': settled.get('sizeSettled') or 0,
+                    'average_price_matched': settled.get('priceMatched')
+                })
+            else:
+                fields.update({'status': 'CANCELLED', 'size_matched': 0, 'cancelled_date': now})
+            if bet['status'] == 'PENDING':
+                fields['placed_date'] = order.get('placedDate') or now
+
+            # Claim the transition so a concurrent cancel cannot release twice
+            previous = db.bets.find_one_and_update(
+                {'_id': bet['_id'], 'status': {'$in': ['PENDING'] + OPEN_STATUSES}},
+                {'$set': fields},
+                return_document=ReturnDocument.BEFORE
+            )
+            if not previous:
+                continue
+
+            closed = {**previous, **fields}
+            release = remaining_liability(closed)
+            if release > 0:
+                releases[closed['user_id']] = releases.get(closed['user_id'], 0) + release
+            if previous['status'] == 'PENDING':
+                placed_bets.append(closed)
+            else:
+                updated_bets.append(closed)
+                transitions.append((closed, previous['status'], closed['status']))
+            if settled:
+                self.logger.info(f"Bet {closed['bet_id']} was settled at Betfair on market {closed['market_id']} "
+                                 f"before it was seen matched; it is credited when the market is settled")
+
+        if releases:
+            db.users.bulk_write([
+                UpdateOne({'_id': user_id}, {'$inc': {'balance': amount}})
+                for user_id, amount in releases.items()
+            ], ordered=False)
+            if self.downline_stats is not None:
+                self.downline_stats.record_released(releases)
+
+        if placed_bets:
+            # A cancelled bet never had a position
+            bet_events.publish(bet_events.BET_PLACED, [bet for bet in placed_bets if bet['status'] != 'CANCELLED'])
+            if self.bet_stats is not None:
+                self.bet_stats.record_placed(placed_bets)
+        if updated_bets:
+            bet_events.publish(bet_events.BET_UPDATED, updated_bets)
+            if self.bet_stats is not None:
+                self.bet_stats.record_transitions(transitions)
+
+        closed_count = len(placed_bets) + len(updated_bets)
+        self.orders_cleared += closed_count
+        return closed_count
+
+    async def _fetch_cleared_orders(self, lookups):
+        """
+        Run one listClearedOrders call per lookup and cleared status concurrently.
+
+        Args:
+            lookups: List of list_cleared_orders filter keyword dicts
+
+        Returns:
+            For each lookup, a dict of betStatus -> clearedOrders, or the
+            first error of its calls
+        """
+        calls = [(index, status) for index in range(len(lookups)) for status in CLEARED_STATUSES]
+        results = await asyncio.gather(
+            *(self.betfair_async.list_cleared_orders(status, **lookups[index]) for index, status in calls),
+            return_exceptions=True
+        )
+        found = [{} for _ in lookups]
+        for (index, status), result in zip(calls, results):
+            if isinstance(found[index], Exception):
+                continue
+            if isinstance(result, Exception):
+                found[index] = result
+                continue
+            found[index][status] = (result or {}).get('clearedOrders') or []
+        return found
+
+    @staticmethod
+    def _by_status(cleared_orders, key):
+        """Index a lookup's cleared orders by `key` (as a string), then by betStatus."""
+        orders = {}
+        for status, entries in cleared_orders.items():
+            for order in entries:
+                orders.setdefault(str(order.get(key)), {})[status] = order
+        return orders
+
+    async def _fetch_current_orders(self, batches):
+        """Run one listCurrentOrders call per batch of bet IDs concurrently."""
+        return await asyncio.gather(
+            *(self.betfair_async.list_current_orders(bet_ids=batch, record_count=len(batch))
+              for batch in batches),
+            return_exceptions=True
+        )
+
+    def get_metrics(self):
+        """Get reconciliation counters and stream health."""
+        stream = self.order_stream
+        return {
+            'stream_connected': bool(stream and stream.connected),
+            'stream_healthy': self.stream_healthy,
+            'stream_messages': stream.messages_received if stream else 0,
+            'stream_error': stream.last_error if stream else None,
+            'polls': self.polls,
+            'updates_applied': self.updates_applied,
+            'pending_resolved': self.pending_resolved,
+            'orders_cleared': self.orders_cleared
+        }
@@ -0,0 +1,327 @@
+"""Position engine for the BetPro Backend application.
+
+This module provides the PositionEngine class, which keeps the net position
+of every user on every market in memory. For each (user, market) it holds the
+profit or loss the user makes if each runner wins, so a back and a lay on the
+same market offset each other instead of both locking full liability.
+
+A bet of stake m at price p on runner s moves every runner's P&L by the same
+amount except s (BACK: -m everywhere, +m*p on s; LAY: the opposite), so a
+position is stored as one shared base value plus a per-runner delta. Bet
+updates are O(1) and exposure queries are O(runners on the position).
+Unmatched stakes are kept apart and only their losing side counts towards
+the worst case, as if they were matched. A runner without a bet (paying the
+base value) only counts as an outcome if the market has one, which is known
+from its runner set (services.market_runners).
+
+The engine is rebuilt from the bets collection on startup and kept current
+through bet lifecycle events (utils.bet_events). Listeners such as the risk
+book receive every change to matched P&L from it.
+"""
+import logging
+import threading
+from datetime import datetime
+from database.db import get_db
+from utils.bet_events import BET_SETTLED
+
+# Local statuses whose unmatched remainder can still be matched
+OPEN_STATUSES = ['UNMATCHED', 'PARTIALLY_MATCHED']
+
+# Bet fields the engine keeps per bet
+BET_FIELDS = ('user_id', 'market_id', 'selection_id', 'side', 'price', 'size',
+              'size_matched', 'average_price_matched', 'status')
+
+# Values this close to zero are dropped from runner deltas
+EPSILON = 1e-9
+
+def _add(values, key, amount):
+    value = values.get(key, 0.0) + amount
+    if abs(value) < EPSILON:
+        values.pop(key, None)
+    else:
+        values[key] = value
+
+def matched_contribution(bet):
+    """
+    Matched P&L contribution of a bet.
+
+    Returns:
+        Tuple of (base, delta): the bet's P&L is base if any other runner
+        wins and base + delta if its own runner wins
+    """
+    matched = bet.get('size_matched') or 0.0
+    matched_price = bet.get('average_price_matched') or bet['price']
+    if bet['side'] == 'BACK':
+        return -matched, matched * matched_price
+    return matched, -matched * matched_price
+
+def has_other_runner(runners, runners_with_bets):
+    """
+    Check if a runner without a position can win the market.
+
+    Args:
+        runners: Selection IDs (strings) of every runner of the market, or
+            None if unknown
+        runners_with_bets: Selection IDs that have a position
+
+    Returns:
+        False only if the market's runners are known and all have a position
+    """
+    if runners is None:
+        return True
+    return not runners <= {str(selection_id) for selection_id in runners_with_bets}
+
+class Position:
+    """Runner P&L vector of one user on one market."""
+
+    __slots__ = ('base', 'deltas', 'pending_base', 'pending_deltas', 'bets')
+
+    def __init__(self):
+        self.base = 0.0
+        self.deltas = {}
+        self.pending_base = 0.0
+        self.pending_deltas = {}
+        self.bets = 0
+
+    def apply(self, bet, sign=1):
+        """Add (sign=1) or remove (sign=-1) a bet's contribution."""
+        selection_id = bet['selection_id']
+        base, delta = matched_contribution(bet)
+        self.base += sign * base
+        _add(self.deltas, selection_id, sign * delta)
+
+        unmatched = 0.0
+        if bet.get('status') in OPEN_STATUSES:
+            unmatched = max(bet['size'] - (bet.get('size_matched') or 0.0), 0.0)
+
+        if bet['side'] == 'BACK':
+            # An unmatched back stake is lost if any other runner wins
+            self.pending_base -= sign * unmatched
+            _add(self.pending_deltas, selection_id, sign * unmatched)
+        else:
+            # An unmatched lay stake loses (price - 1) x stake if its runner wins
+            _add(self.pending_deltas, selection_id, -sign * unmatched * (bet['price'] - 1))
+
+        self.bets += sign
+
+    def runner_pnl(self):
+        """Matched P&L if each runner with a bet wins."""
+        return {
+            selection_id: round(self.base + delta, 2)
+            for selection_id, delta in self.deltas.items()
+        }
+
+    def worst_case(self, runners=None):
+        """
+        Lowest P&L over all outcomes, counting unmatched stakes as matched.
+
+        Args:
+            runners: Selection IDs of every runner of the market, if known
+        """
+        runners_with_bets = set(self.deltas) | set(self.pending_deltas)
+        outcomes = [
+            self.base + self.deltas.get(selection_id, 0.0)
+            + self.pending_base + self.pending_deltas.get(selection_id, 0.0)
+            for selection_id in runners_with_bets
+        ]
+        if has_other_runner(runners, runners_with_bets):
+            # Any runner without a bet pays out the base values only
+            outcomes.append(self.base + self.pending_base)
+        return min(outcomes) if outcomes else 0.0
+
+    def to_dict(self, runners=None):
+        worst = self.worst_case(runners)
+        other = has_other_runner(runners, set(self.deltas) | set(self.pending_deltas))
+        return {
+            'runners': {str(selection_id): pnl for selection_id, pnl in self.runner_pnl().items()},
+            'other_runners': round(self.base, 2) if other else None,
+            'worst_case': round(worst, 2),
+            'exposure': round(max(0.0, -worst), 2),
+            'bets': self.bets
+        }
+
+class PositionEngine:
+    """In-memory per-(user, market) positions fed by bet events."""
+
+    def __init__(self, market_runners=None):
+        """
+        Initialize the position engine.
+
+        Args:
+            market_runners: Optional MarketRunners; without it every market
+                is assumed to have runners nobody bet on
+        """
+        self.market_runners = market_runners
+        self.logger = logging.getLogger('service.position_engine')
+        self._lock = threading.Lock()
+        self._bets = {}
+        # user ID -> market ID -> Position
+        self._positions = {}
+        self._listeners = []
+        self.events_applied = 0
+        self.rebuilt_at = None
+
+    def add_listener(self, listener):
+        """
+        Forward matched P&L changes to a listener.
+
+        The listener needs reset(), called before a rebuild replays every bet,
+        and apply(user_id, market_id, selection_id, base, delta, sign), called
+        with the signed matched contribution of each bet added (sign=1) or
+        removed (sign=-1).
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def rebuild(self):
+        """
+        Rebuild every position from the unsettled bets in the database.
+
+        Returns:
+            Number of bets loaded
+        """
+        db = get_db()
+        cursor = db.bets.find(
+            {'status': {'$ne': 'SETTLED'},
+             '$or': [{'status': {'$in': OPEN_STATUSES}}, {'size_matched': {'$gt': 0}}]},
+            {field: 1 for field in BET_FIELDS + ('bet_id',)}
+        )
+
+        bets = {}
+        positions = {}
+        for bet in cursor:
+            key = self._bet_key(bet)
+            state = {field: bet.get(field) for field in BET_FIELDS}
+            bets[key] = state
+            markets = positions.setdefault(str(state['user_id']), {})
+            position = markets.get(state['market_id'])
+            if position is None:
+                position = markets[state['market_id']] = Position()
+            position.apply(state)
+
+        with self._lock:
+            self._bets = bets
+            self._positions = positions
+            for listener in self._listeners:
+                listener.reset()
+            for state in bets.values():
+                self._notify(state)
+        self.rebuilt_at = datetime.utcnow()
+        self.logger.info(f"Position engine rebuilt from {len(bets)} bets for {len(positions)} users")
+        return len(bets)
+
+    def handle_event(self, event, bets):
+        """Bet event subscriber (see utils.bet_events)."""
+        with self._lock:
+            for bet in bets:
+                if event == BET_SETTLED:
+                    self._remove(self._bet_key(bet))
+                else:
+                    self._update(bet)
+            self.events_applied += len(bets)
+
+    def get_positions(self, user_id, market_id=None):
+        """
+        Get a user's positions.
+
+        Args:
+            user_id: User ID
+            market_id: Optional market ID to restrict the result to
+
+        Returns:
+            Dict of market ID to position dict
+        """
+        with self._lock:
+            markets = self._positions.get(str(user_id)) or {}
+            market_ids = [market_id] if market_id is not None else list(markets)
+        # Looked up outside the lock, it may call Betfair
+        runners = self.market_runners.get_runners(market_ids) if self.market_runners and market_ids else {}
+
+        with self._lock:
+            markets = self._positions.get(str(user_id)) or {}
+            if market_id is not None:
+                position = markets.get(market_id)
+                return {market_id: position.to_dict(runners.get(market_id))} if position else {}
+            return {
+                position_market_id: position.to_dict(runners.get(position_market_id))
+                for position_market_id, position in markets.items()
+            }
+
+    def get_exposure(self, user_id):
+        """Total worst-case exposure of a user across all markets."""
+        return round(sum(position['exposure'] for position in self.get_positions(user_id).values()), 2)
+
+    def get_metrics(self):
+        """Get engine size and activity counters."""
+        with self._lock:
+            return {
+                'bets': len(self._bets),
+                'users': len(self._positions),
+                'positions': sum(len(markets) for markets in self._positions.values()),
+                'events_applied': self.events_applied,
+                'rebuilt_at': self.rebuilt_at.isoformat() if self.rebuilt_at else None
+            }
+
+    @staticmethod
+    def _bet_key(bet):
+        """Betfair bet ID when known (order updates only carry that), else the document ID."""
+        return str(bet.get('bet_id') or bet.get('_id'))
+
+    def _update(self, bet):
+        key = self._bet_key(bet)
+        previous = self._bets.get(key)
+        if previous is None:
+            if any(bet.get(field) is None for field in ('user_id', 'market_id', 'selection_id', 'side', 'price', 'size')):
+                # A partial update for a bet the engine does not hold (e.g. already settled)
+                return
+            state = {field: bet.get(field) for field in BET_FIELDS}
+        elif previous['status'] == 'CANCELLED' and bet.get('status') != 'CANCELLED':
+            # Cancelled locally; a late order update must not reopen it
+            return
+        else:
+            state = dict(previous)
+            state.update({field: bet[field] for field in BET_FIELDS if field in bet})
+
+        position = self._position(state)
+        if previous is not None:
+            position.apply(previous, sign=-1)
+            self._notify(previous, sign=-1)
+        position.apply(state)
+        self._notify(state)
+        self._bets[key] = state
+
+    def _remove(self, key):
+        state = self._bets.pop(key, None)
+        if state is None:
+            return
+        self._notify(state, sign=-1)
+        user_id = str(state['user_id'])
+        markets = self._positions.get(user_id) or {}
+        position = markets.get(state['market_id'])
+        if position is None:
+            return
+        position.apply(state, sign=-1)
+        if position.bets <= 0:
+            del markets[state['market_id']]
+            if not markets:
+                del self._positions[user_id]
+
+    def _notify(self, state, sign=1):
+        if not self._listeners:
+            return
+        base, delta = matched_contribution(state)
+        if not base and not delta:
+            return
+        for listener in self._listeners:
+            try:
+                listener.apply(str(state['user_id']), state['market_id'], state['selection_id'],
+                               sign * base, sign * delta, sign)
+            except Exception as e:
+                self.logger.error(f"Error notifying position listener: {e}")
+
+    def _position(self, state):
+        markets = self._positions.setdefault(str(state['user_id']), {})
+        position = markets.get(state['market_id'])
+        if position is None:
+            position = markets[state['market_id']] = Position()
+        return position
@@ -0,0 +1,257 @@
+"""Risk book service for the BetPro Backend application.
+
+This module provides the RiskBook class, the market-wide liability view
+("Liables") for admins. For every open market it keeps a runner x user NumPy
+matrix of user P&L if each runner wins, stored like positions as a per-user
+base vector plus a runner x user delta matrix. Matched P&L changes arrive
+from the position engine, so each bet update touches one cell and one base
+entry; house liability per runner and top exposed users are vector
+reductions over the market's arrays. Runners nobody bet on only count as an
+outcome when the market's runner set says there are any.
+"""
+import logging
+import threading
+import numpy as np
+from bson import ObjectId
+from database.db import get_db
+from services.position_engine import has_other_runner
+
+# Initial runner and user capacity of a market book; arrays double when full
+INITIAL_RUNNERS = 8
+INITIAL_USERS = 64
+
+def _money(value):
+    """Round to pence, without negative zero."""
+    return round(float(value), 2) + 0.0
+
+class MarketBook:
+    """Runner x user P&L arrays of one market."""
+
+    def __init__(self):
+        self.runner_index = {}
+        self.user_index = {}
+        self.runners = []
+        self.users = []
+        self.base = np.zeros(INITIAL_USERS)
+        self.deltas = np.zeros((INITIAL_RUNNERS, INITIAL_USERS))
+        self.contributions = 0
+
+    def apply(self, user_id, selection_id, base, delta):
+        column = self._column(user_id)
+        row = self._row(selection_id)
+        self.base[column] += base
+        self.deltas[row, column] += delta
+
+    def pnl_matrix(self):
+        """User P&L if each runner wins, shape (runners, users)."""
+        runners, users = len(self.runners), len(self.users)
+        return self.base[:users] + self.deltas[:runners, :users]
+
+    def _row(self, selection_id):
+        row = self.runner_index.get(selection_id)
+        if row is None:
+            row = self.runner_index[selection_id] = len(self.runners)
+            self.runners.append(selection_id)
+            if row >= self.deltas.shape[0]:
+                grown = np.zeros((self.deltas.shape[0] * 2, self.deltas.shape[1]))
+                grown[:row] = self.deltas[:row]
+                self.deltas = grown
+        return row
+
+    def _column(self, user_id):
+        column = self.user_index.get(user_id)
+        if column is None:
+            column = self.user_index[user_id] = len(self.users)
+            self.users.append(user_id)
+            if column >= self.base.shape[0]:
+                capacity = self.base.shape[0] * 2
+                base = np.zeros(capacity)
+                base[:column] = self.base[:column]
+                deltas = np.zeros((self.deltas.shape[0], capacity))
+                deltas[:, :column] = self.deltas[:, :column]
+                self.base, self.deltas = base, deltas
+        return column
+
+class RiskBook:
+    """Market-wide house liability per runner, fed by the position engine."""
+
+    def __init__(self, market_runners=None):
+        """
+        Initialize the risk book.
+
+        Args:
+            market_runners: Optional MarketRunners; without it every market
+                is assumed to have runners nobody bet on
+        """
+        self.market_runners = market_runners
+        self.logger = logging.getLogger('service.risk_book')
+        self._lock = threading.Lock()
+        self._markets = {}
+
+    def reset(self):
+        """Drop every market book (position engine listener)."""
+        with self._lock:
+            self._markets = {}
+
+    def apply(self, user_id, market_id, selection_id, base, delta, sign):
+        """Apply one bet's matched P&L change (position engine listener)."""
+        with self._lock:
+            book = self._markets.get(market_id)
+            if book is None:
+                book = self._markets[market_id] = MarketBook()
+            book.apply(user_id, selection_id, base, delta)
+            book.contributions += sign
+            # Every bet on the market has been removed (settled)
+            if book.contributions <= 0:
+                del self._markets[market_id]
+
+    def list_markets(self):
+        """
+        Summarise every market with matched bets.
+
+        Returns:
+            List of dicts with the worst house result per market, worst first
+        """
+        with self._lock:
+            market_ids = list(self._markets)
+        market_runners = self._get_runners(market_ids)
+
+        with self._lock:
+            summaries = []
+            for market_id, book in self._markets.items():
+                pnl = book.pnl_matrix()
+                house = -pnl.sum(axis=1)
+                if has_other_runner(market_runners.get(market_id), book.runners):
+                    # A runner nobody bet on pays out the base values only
+                    other = -book.base[:len(book.users)].sum()
+                    worst = float(np.min(house, initial=other))
+                else:
+                    worst = float(np.min(house))
+                summaries.append({
+                    'market_id': market_id,
+                    'runners': len(book.runners),
+                    'users': len(book.users),
+                    'worst_house_result': _money(worst),
+                    'house_liability': _money(max(0.0, -worst))
+                })
+        summaries.sort(key=lambda summary: summary['worst_house_result'])
+        return summaries
+
+    def get_market(self, market_id, top=10, include_masters=True):
+        """
+        Get the liability book of a market.
+
+        Args:
+            market_id: Betfair market ID
+            top: Number of most exposed users to return
+            include_masters: Also total user P&L per parent (master) account
+
+        Returns:
+            Dict with house result if each runner wins, top users and
+            masters, or None if the market has no matched bets
+        """
+        market_runners = self._get_runners([market_id]).get(market_id)
+        with self._lock:
+            book = self._markets.get(market_id)
+            if book is None:
+                return None
+            runners = list(book.runners)
+            users = list(book.users)
+            pnl = book.pnl_matrix().copy()
+            base = book.base[:len(users)].copy()
+
+        # House result is the opposite of what users win
+        house = -pnl.sum(axis=1)
+        other = -float(base.sum())
+        other_runner = has_other_runner(market_runners, runners)
+
+        # A user's worst outcome, including runners they have no bet on (a
+        # runner row without their bet holds their base value already)
+        if not other_runner:
+            worst = pnl.min(axis=0)
+        else:
+            worst = np.minimum(pnl.min(axis=0), base) if runners else base
+        count = min(top, len(users))
+        order = np.argsort(worst)[:count]
+
+        result = {
+            'market_id': market_id,
+            'runners': [
+                {
+                    'selection_id': selection_id,
+                    'house_result': _money(house[row]),
+                    'house_liability': _money(max(0.0, -house[row]))
+                }
+                for row, selection_id in enumerate(runners)
+            ],
+            'other_runners': {
+                'house_result': _money(other),
+                'house_liability': _money(max(0.0, -other))
+            } if other_runner else None,
+            'top_users': [
+                {
+                    'user_id': users[column],
+                    'exposure': _money(max(0.0, -worst[column])),
+                    'runners': {
+                        str(selection_id): _money(pnl[row, column])
+                        for row, selection_id in enumerate(runners)
+                    }
+                }
+                for column in order
+            ]
+        }
+
+        if include_masters:
+            result['masters'] = self._master_totals(users, runners, pnl, base, other_runner)
+        return result
+
+    def _get_runners(self, market_ids):
+        """Runner sets of some markets, looked up outside the lock as it may call Betfair."""
+        if self.market_runners is None or not market_ids:
+            return {}
+        return self.market_runners.get_runners(market_ids)
+
+    def _master_totals(self, users, runners, pnl, base, other_runner=True):
+        """Sum user columns by parent account with one users query."""
+        db = get_db()
+        parents = {
+            str(user['_id']): str(user['parent_id']) if user.get('parent_id') else None
+            for user in db.users.find(
+                {'_id': {'$in': [ObjectId(user_id) for user_id in users if ObjectId.is_valid(user_id)]}},
+                {'parent_id': 1}
+            )
+        }
+
+        masters = []
+        master_index = {}
+        groups = np.empty(len(users), dtype=np.int64)
+        for column, user_id in enumerate(users):
+            master_id = parents.get(user_id)
+            if master_id not in master_index:
+                master_index[master_id] = len(masters)
+                masters.append(master_id)
+            groups[column] = master_index[master_id]
+
+        totals = np.zeros((len(runners), len(masters)))
+        np.add.at(totals.T, groups, pnl.T)
+        base_totals = np.zeros(len(masters))
+        np.add.at(base_totals, groups, base)
+
+        if not other_runner:
+            worst = totals.min(axis=0)
+        else:
+            worst = np.minimum(totals.min(axis=0), base_totals) if runners else base_totals
+        return sorted(
+            (
+                {
+                    'master_id': master_id,
+                    'exposure': _money(max(0.0, -worst[index])),
+                    'runners': {
+                        str(selection_id): _money(totals[row, index])
+                        for row, selection_id in enumerate(runners)
+                    }
+                }
+                for index, master_id in enumerate(masters)
+            ),
+            key=lambda master: -master['exposure']
+        )
@@ -0,0 +1,231 @@
+"""Betfair session manager for the BetPro Backend application.
+
+This module provides the BetfairSessionManager class, which keeps the Betfair
+session token alive in the background and renews it before it expires, so
+request handlers never have to re-initialize the client inline.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from models.api_connection import APIConnection
+from utils.scheduler import PeriodicTask
+
+class BetfairSessionManager:
+    """Background keep-alive and token lifecycle manager for the Betfair clients."""
+
+    def __init__(self, betfair_api, betfair_async=None, username=None, password=None,
+                 certs=None, keep_alive_interval=1200, session_ttl=8 * 3600,
+                 renew_before=1800, check_interval=60, api_service=None):
+        """
+        Initialize the session manager.
+
+        Args:
+            betfair_api: The shared BetfairAPI instance whose client is managed
+            betfair_async: Optional AsyncBetfairAPI that must follow token changes
+            username: Betfair username, required for renewal by login
+            password: Betfair password, required for renewal by login
+            certs: Directory with the Betfair client certificates (non-interactive login)
+            keep_alive_interval: Seconds between keepAlive calls
+            session_ttl: Seconds a session stays valid after login or keepAlive
+            renew_before: Renew this many seconds before the session expires
+            check_interval: Seconds between lifecycle checks
+            api_service: Optional APIService used to persist the session state
+        """
+        self.betfair_api = betfair_api
+        self.betfair_async = betfair_async
+        self.username = username
+        self.password = password
+        self.certs = certs
+        self.keep_alive_interval = keep_alive_interval
+        self.session_ttl = session_ttl
+        self.renew_before = renew_before
+        self.api_service = api_service
+        self.logger = logging.getLogger('service.betfair_session')
+
+        # Token lifecycle state (epoch seconds)
+        now = time.time()
+        self.token_issued_at = now
+        self.session_extended_at = now
+        self.last_keep_alive_at = None
+        self.keep_alive_count = 0
+        self.keep_alive_failures = 0
+        self.renewal_count = 0
+        self.renewal_failures = 0
+        self.last_error = None
+
+        self._renewal_requested = False
+        self._lock = threading.Lock()
+        self._task = PeriodicTask('betfair-session', check_interval, self.check_session)
+
+        # Let the API wrapper ask for renewal when it sees session errors
+        betfair_api.session_manager = self
+
+    @property
+    def can_renew(self):
+        """Check if credentials are configured for renewal by login."""
+        return bool(self.username and self.password)
+
+    @property
+    def session_expires_at(self):
+        """Epoch seconds at which the current session is expected to expire."""
+        return self.session_extended_at + self.session_ttl
+
+    def start(self):
+        """Start the background session task."""
+        self._task.start()
+
+    def stop(self):
+        """Stop the background session task."""
+        self._task.stop()
+
+    def request_renewal(self):
+        """Schedule a renewal on the background thread and return immediately."""
+        self._renewal_requested = True
+        self._task.trigger()
+
+    def check_session(self):
+        """Run one lifecycle check: renew if due or requested, otherwise keep alive."""
+        now = time.time()
+
+        if self._renewal_requested or now >= self.session_expires_at - self.renew_before:
+            self._renewal_requested = False
+            if self.renew():
+                return
+
+        if self.last_keep_alive_at is None or now - self.last_keep_alive_at >= self.keep_alive_interval:
+            if not self.keep_alive():
+                # A failed keepAlive usually means the token is dead, so replace it
+                self.renew()
+
+    def keep_alive(self):
+        """
+        Extend the current session with a keepAlive call.
+
+        Returns:
+            True if Betfair accepted the keepAlive, otherwise False
+        """
+        client = self.betfair_api.client
+        if client is None:
+            return False
+
+        try:
+            response = client.keep_alive()
+            status = response.get('status') if isinstance(response, dict) else getattr(response, 'status', None)
+            if status != 'SUCCESS':
+                error = response.get('error') if isinstance(response, dict) else getattr(response, 'error', None)
+                raise RuntimeError(f"keepAlive returned {status}: {error}")
+
+            with self._lock:
+                self.last_keep_alive_at = time.time()
+                self.session_extended_at = self.last_keep_alive_at
+                self.keep_alive_count += 1
+                self.keep_alive_failures = 0
+                self.last_error = None
+
+            self._persist_session(self.betfair_api.session_token)
+            self.logger.debug("Betfair session kept alive")
+            return True
+        except Exception as e:
+            with self._lock:
+                self.last_keep_alive_at = time.time()
+                self.keep_alive_failures += 1
+                self.last_error = str(e)
+            self.logger.warning(f"Betfair keepAlive failed: {e}")
+            return False
+
+    def renew(self):
+        """
+        Log in on a fresh client and swap it in once it holds a valid token.
+
+        The live client keeps serving requests until the replacement is ready,
+        so no request ever waits on a login round trip.
+
+        Returns:
+            True if a new session was obtained and swapped in, otherwise False
+        """
+        if not self.can_renew:
+            self.logger.warning("Betfair session renewal skipped: no username/password configured")
+            return False
+
+        try:
+            client = self.betfair_api.create_client(
+                username=self.username,
+                password=self.password,
+                certs=self.certs
+            )
+            if self.certs:
+                client.login()
+            else:
+                client.login_interactive()
+
+            session_token = client.session_token
+            if not session_token:
+                raise RuntimeError("login did not return a session token")
+
+            # Swap both clients over to the new token
+            self.betfair_api.swap_client(client, session_token)
+            if self.betfair_async is not None:
+                self.betfair_async.session_token = session_token
+
+            with self._lock:
+                now = time.time()
+                self.token_issued_at = now
+                self.session_extended_at = now
+                self.last_keep_alive_at = now
+                self.renewal_count += 1
+                self.keep_alive_failures = 0
+                self.last_error = None
+
+            self._persist_session(session_token)
+            self.logger.info("Betfair session renewed")
+            return True
+        except Exception as e:
+            with self._lock:
+                self.renewal_failures += 1
+                self.last_error = str(e)
+            self.logger.error(f"Betfair session renewal failed: {e}")
+            return False
+
+    def _persist_session(self, session_token):
+        """Record the session state in the api_connections collection."""
+        if self.api_service is None:
+            return
+
+        try:
+            connection_id, error = self.api_service.create_or_update_connection(
+                api_type=APIConnection.TYPE_BETFAIR,
+                app_key=self.betfair_api.app_key,
+                session_token=session_token,
+                username=self.username,
+                status=APIConnection.STATUS_CONNECTED
+            )
+            if connection_id:
+                self.api_service.update_by_id(connection_id, {
+                    "last_connected": datetime.utcfromtimestamp(self.token_issued_at),
+                    "session_expiry": datetime.utcfromtimestamp(self.session_expires_at),
+                    "error_message": None
+                })
+            elif error:
+                self.logger.warning(f"Could not persist Betfair session state: {error}")
+        except Exception as e:
+            self.logger.warning(f"Could not persist Betfair session state: {e}")
+
+    def get_metrics(self):
+        """Get token age and lifecycle metrics."""
+        now = time.time()
+        with self._lock:
+            return {
+                'running': self._task.is_running,
+                'can_renew': self.can_renew,
+                'token_age_seconds': int(now - self.token_issued_at),
+                'session_age_seconds': int(now - self.session_extended_at),
+                'seconds_to_expiry': max(0, int(self.session_expires_at - now)),
+                'session_expiry': (datetime.utcnow() + timedelta(seconds=max(0, self.session_expires_at - now))).strftime('%Y-%m-%d %H:%M:%S'),
+                'last_keep_alive_seconds_ago': int(now - self.last_keep_alive_at) if self.last_keep_alive_at else None,
+                'keep_alive_count': self.keep_alive_count,
+                'keep_alive_failures': self.keep_alive_failures,
+                'renewal_count': self.renewal_count,
+                'renewal_failures': self.renewal_failures,
+                'last_error': self.last_error
+            }
@@ -0,0 +1,474 @@
+"""Settlement service for the BetPro Backend application.
+
+This module provides the SettlementService class for settling a whole market
+at once. Cleared orders are pulled from Betfair in pages, P&L is computed for
+every bet in memory, and bet updates, ledger rows and balance increments are
+written with bulk_write in chunks. A checkpoint document records progress
+after every chunk so a crashed run resumes where it stopped, and doubles as
+a per-market lock so only one run settles a market at a time.
+
+Markets matched in-house (EXCHANGE_MARKETS) have no orders at Betfair. Their
+cleared orders are built from the bets instead: the result comes from the
+market's runner statuses at Betfair once it is CLOSED, and each bet's P&L
+from its matched size and average price. Bets on REMOVED runners are voided;
+dead-heat and reduction factors are not applied.
+"""
+import uuid
+from datetime import datetime, timedelta
+from pymongo import UpdateOne, ReturnDocument
+from database.db_config import COLLECTIONS
+from services.base_service import BaseService
+from utils.async_bridge import run_sync
+from utils.betting import calculate_liability
+from utils import bet_events
+
+# Cleared order statuses processed, in order
+SETTLEMENT_PHASES = ['SETTLED', 'VOIDED']
+
+# Local statuses whose unmatched part still holds reserved liability
+OPEN_STATUSES = ['UNMATCHED', 'PARTIALLY_MATCHED']
+
+# A run holds the market's lock this long past its last checkpoint write, so
+# the lock of a crashed run expires and the next run can resume
+LOCK_LEASE = timedelta(minutes=10)
+
+class SettlementService(BaseService):
+    """Market-level bulk settlement with checkpoint/resume."""
+
+    STATUS_RUNNING = 'RUNNING'
+    STATUS_COMPLETE = 'COMPLETE'
+
+    def __init__(self, betfair_async, page_size=1000, chunk_size=500, bet_stats=None, daily_stats=None,
+                 downline_stats=None, exchange_markets=None):
+        """
+        Initialize the settlement service.
+
+        Args:
+            betfair_async: AsyncBetfairAPI used for listClearedOrders
+            page_size: Cleared orders requested per Betfair call (max 1000)
+            chunk_size: Bets written per bulk_write chunk
+            bet_stats: Optional BetStatsService told about settled bets
+            daily_stats: Optional DailyUserStatsService told about settled bets
+            downline_stats: Optional DownlineStatsService told about settled bets
+            exchange_markets: IDs of the markets matched in-house
+        """
+        super().__init__(COLLECTIONS['SETTLEMENT_CHECKPOINTS'])
+        self.betfair_async = betfair_async
+        self.page_size = page_size
+        self.chunk_size = chunk_size
+        self.bet_stats = bet_stats
+        self.daily_stats = daily_stats
+        self.downline_stats = downline_stats
+        self.exchange_markets = set(exchange_markets or [])
+
+    def settle_market(self, market_id):
+        """
+        Settle every bet on a market, resuming from the last checkpoint.
+
+        Args:
+            market_id: Betfair market ID
+
+        Returns:
+            Tuple of (summary dict, error message); the summary is also set
+            with an error when another run holds the market
+        """
+        lock_id = None
+        try:
+            checkpoint = self._load_checkpoint(market_id)
+            if checkpoint['status'] == self.STATUS_COMPLETE:
+                if not checkpoint.get('marks_cleared'):
+                    self._clear_marks(checkpoint)
+                return self._summary(checkpoint), None
+
+            lock_id = uuid.uuid4().hex
+            claimed = self._claim(checkpoint, lock_id)
+            if claimed is None:
+                self.logger.info(f"Settlement of market {market_id} is already running")
+                return self._summary(checkpoint), 'Settlement of this market is already in progress'
+            checkpoint = claimed
+
+            while checkpoint['phase'] is not None:
+                page = self._fetch_page(market_id, checkpoint['phase'], checkpoint['from_record'])
+                cleared_orders = page.get('clearedOrders') or []
+
+                chunks = [cleared_orders[i:i + self.chunk_size]
+                          for i in range(0, len(cleared_orders), self.chunk_size)]
+                for chunk_index in range(checkpoint['chunk_index'], len(chunks)):
+                    chunk_key = f"{checkpoint['_id']}:{checkpoint['phase']}:{checkpoint['from_record']}:{chunk_index}"
+                    mark = (f"settlement_marks.{checkpoint['_id']}."
+                            f"{checkpoint['phase']}_{checkpoint['from_record']}_{chunk_index}")
+                    settled, credited = self._settle_chunk(market_id, chunks[chunk_index], chunk_key, mark,
+                                                            voided=checkpoint['phase'] == 'VOIDED')
+                    checkpoint = self._advance(checkpoint, chunk_index=chunk_index + 1,
+                                               settled=settled, credited=credited)
+
+                # Page done: move to the next page, or the next phase
+                if page.get('moreAvailable') and cleared_orders:
+                    checkpoint = self._advance(checkpoint, from_record=checkpoint['from_record'] + len(cleared_orders),
+                                               chunk_index=0)
+                else:
+                    phase_index = SETTLEMENT_PHASES.index(checkpoint['phase']) + 1
+                    next_phase = SETTLEMENT_PHASES[phase_index] if phase_index < len(SETTLEMENT_PHASES) else None
+                    checkpoint = self._advance(checkpoint, phase=next_phase, from_record=0, chunk_index=0)
+
+            checkpoint = self._advance(checkpoint, status=self.STATUS_COMPLETE, completed_at=datetime.utcnow())
+            self._clear_marks(checkpoint)
+            self.logger.info(f"Settled market {market_id}: {checkpoint['bets_settled']} bets, "
+                             f"{checkpoint['amount_credited']:.2f} credited")
+            return self._summary(checkpoint), None
+        except Exception as e:
+            self.logger.error(f"Error settling market {market_id}: {e}")
+            return None, str(e)
+        finally:
+            if lock_id is not None:
+                self._release(market_id, lock_id)
+
+    def get_checkpoint(self, market_id):
+        """Get the settlement checkpoint for a market."""
+        return self.find_one({'market_id': market_id})
+
+    def _load_checkpoint(self, market_id):
+        """Get the existing checkpoint or start a new run."""
+        checkpoint = self.find_one({'market_id': market_id})
+        if checkpoint:
+            if checkpoint['status'] == self.STATUS_RUNNING:
+                self.logger.info(f"Resuming settlement of market {market_id} at "
+                                 f"{checkpoint['phase']} record {checkpoint['from_record']} "
+                                 f"chunk {checkpoint['chunk_index']}")
+            return checkpoint
+
+        # Upserted, so two runs starting together share one checkpoint
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {'market_id': market_id},
+            {'$setOnInsert': {
+                'market_id': market_id,
+                'status': self.STATUS_RUNNING,
+                'phase': SETTLEMENT_PHASES[0],
+                'from_record': 0,
+                'chunk_index': 0,
+                'bets_settled': 0,
+                'amount_credited': 0.0,
+                'locked_by': None,
+                'locked_until': None,
+                'started_at': now,
+                'completed_at': None,
+                'updated_at': now
+            }},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _claim(self, checkpoint, lock_id):
+        """
+        Take the market's lock unless another live run holds it.
+
+        Returns:
+            The checkpoint as of the claim, or None if the lock is held
+        """
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {
+                '_id': checkpoint['_id'],
+                'status': self.STATUS_RUNNING,
+                '$or': [{'locked_until': None}, {'locked_until': {'$lt': now}}]
+            },
+            {'$set': {'locked_by': lock_id, 'locked_until': now + LOCK_LEASE}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _release(self, market_id, lock_id):
+        """Give up the market's lock if this run still holds it."""
+        try:
+            self.collection.update_one(
+                {'market_id': market_id, 'locked_by': lock_id},
+                {'$set': {'locked_by': None, 'locked_until': None}}
+            )
+        except Exception as e:
+            # The lease expires on its own
+            self.logger.error(f"Error releasing settlement lock of market {market_id}: {e}")
+
+    def _clear_marks(self, checkpoint):
+        """
+        Remove the run's balance marks from users once the run is complete.
+
+        Marks must outlive every checkpoint write of their chunk: a chunk
+        replayed after a crash relies on them to skip users already credited.
+        """
+        run_marks = f"settlement_marks.{checkpoint['_id']}"
+        self.db[COLLECTIONS['USERS']].update_many(
+            {run_marks: {'$exists': True}},
+            {'$unset': {run_marks: ''}}
+        )
+        self.collection.update_one({'_id': checkpoint['_id']}, {'$set': {'marks_cleared': True}})
+
+    def _advance(self, checkpoint, settled=0, credited=0.0, **fields):
+        """Persist checkpoint progress, renewing the run's lock, and return the updated copy."""
+        fields['updated_at'] = datetime.utcnow()
+        if checkpoint.get('locked_by'):
+            fields['locked_until'] = fields['updated_at'] + LOCK_LEASE
+        update = {'$set': fields}
+        if settled or credited:
+            update['$inc'] = {'bets_settled': settled, 'amount_credited': credited}
+        result = self.collection.update_one({'_id': checkpoint['_id'], 'locked_by': checkpoint.get('locked_by')},
+                                            update)
+        if result.matched_count == 0:
+            raise RuntimeError('Settlement lock lost to another run')
+
+        checkpoint = dict(checkpoint, **fields)
+        checkpoint['bets_settled'] += settled
+        checkpoint['amount_credited'] += credited
+        return checkpoint
+
+    def _fetch_page(self, market_id, bet_status, from_record):
+        """Fetch one page of cleared orders from Betfair, or build it for an in-house market."""
+        if market_id in self.exchange_markets:
+            return self._exchange_page(market_id, bet_status, from_record)
+        return run_sync(
+            self.betfair_async.list_cleared_orders(
+                bet_status, market_ids=[market_id], from_record=from_record, record_count=self.page_size
+            ),
+            timeout=60
+        ) or {}
+
+    def _settle_chunk(self, market_id, cleared_orders, chunk_key, mark, voided=False):
+        """
+        Settle one chunk of cleared orders.
+
+        Every write is idempotent so the chunk can be replayed after a crash:
+        ledger rows are upserted on (reference_id, type), balance increments
+        are guarded by the chunk's mark on each user (kept until the run is
+        complete), and bets only move to SETTLED once (or are re-selected by
+        the same chunk key).
+
+        Returns:
+            Tuple of (bets settled, amount credited)
+        """
+        cleared_by_bet_id = {str(order['betId']): order for order in cleared_orders}
+        bets = list(self.db[COLLECTIONS['BETS']].find(
+            {
+                'bet_id': {'$in': list(cleared_by_bet_id)},
+                '$or': [{'status': {'$ne': 'SETTLED'}}, {'settlement_chunk': chunk_key}]
+            },
+            {'user_id': 1, 'bet_id': 1, 'side': 1, 'price': 1, 'liability': 1, 'size': 1, 'stake': 1,
+             'size_matched': 1, 'status': 1, 'selection_id': 1}
+        ))
+        if not bets:
+            return 0, 0.0
+
+        # Compute P&L and the amount returned to each user in memory
+        now = datetime.utcnow()
+        settlements = []
+        credits = {}
+        for bet in bets:
+            order = cleared_by_bet_id[bet['bet_id']]
+            profit_loss, credit = self._calculate_settlement(bet, order, voided)
+            settlements.append((bet, order, profit_loss, credit))
+            if credit:
+                credits[bet['user_id']] = credits.get(bet['user_id'], 0.0) + credit
+
+        # Balance snapshot for the ledger rows of this chunk
+        balances = {
+            user['_id']: user.get('balance', 0.0)
+            for user in self.db[COLLECTIONS['USERS']].find(
+                {'_id': {'$in': list(credits)}}, {'balance': 1}
+            )
+        }
+
+        # Every settlement with a credit or a P&L gets a ledger row; a lost
+        # back bet credits nothing but its loss is in the ledger
+        ledger_ops = []
+        for bet, order, profit_loss, credit in settlements:
+            if not credit and not profit_loss:
+                continue
+            balance_before = balances.get(bet['user_id'], 0.0)
+            balances[bet['user_id']] = balance_before + credit
+            ledger_ops.append(UpdateOne(
+                {'reference_id': bet['bet_id'], 'type': 'BET_SETTLEMENT'},
+                {'$setOnInsert': {
+                    'user_id': bet['user_id'],
+                    'type': 'BET_SETTLEMENT',
+                    'amount': credit,
+                    'profit_loss': profit_loss,
+                    'balance_before': balance_before,
+                    'balance_after': balance_before + credit,
+                    'reference_id': bet['bet_id'],
+                    'market_id': market_id,
+                    'description': self._describe(order, voided),
+                    'status': 'COMPLETED',
+                    'created_at': now,
+                    'updated_at': now
+                }},
+                upsert=True
+            ))
+        if ledger_ops:
+            self.db[COLLECTIONS['TRANSACTIONS']].bulk_write(ledger_ops, ordered=False)
+
+        if credits:
+            self.db[COLLECTIONS['USERS']].bulk_write([
+                UpdateOne(
+                    {'_id': user_id, mark: {'$exists': False}},
+                    {'$inc': {'balance': amount}, '$set': {mark: True}}
+                )
+                for user_id, amount in credits.items()
+            ], ordered=False)
+
+        self.db[COLLECTIONS['BETS']].bulk_write([
+            UpdateOne(
+                {'_id': bet['_id']},
+                {'$set': {
+                    'status': 'SETTLED',
+                    'profit_loss': profit_loss,
+                    'bet_outcome': 'VOIDED' if voided else order.get('betOutcome'),
+                    'size_settled': order.get('sizeSettled', 0),
+                    'settled_date': self._settled_date(order, now),
+                    'commission': float(order.get('commission') or 0.0),
+                    'settlement_chunk': chunk_key,
+                    'updated_at': now
+                }}
+            )
+            for bet, order, profit_loss, credit in settlements
+        ], ordered=False)
+        bet_events.publish(bet_events.BET_SETTLED, bets)
+        if self.bet_stats is not None:
+            # Bets already SETTLED were re-selected by a replayed chunk and are counted
+            self.bet_stats.record_settled([
+                (bet, bet['status'], 'VOIDED' if voided else order.get('betOutcome'), profit_loss)
+                for bet, order, profit_loss, credit in settlements
+                if bet['status'] != 'SETTLED'
+            ])
+        if self.daily_stats is not None:
+            self.daily_stats.record_settled([
+                {
+                    'user_id': bet['user_id'],
+                    'settled_date': self._settled_date(order, now),
+                    'result': 'VOIDED' if voided else order.get('betOutcome'),
+                    'turnover': 0.0 if voided else float(order.get('sizeSettled') or bet.get('size_matched') or 0),
+                    'profit_loss': profit_loss,
+                    'commission': float(order.get('commission') or 0.0)
+                }
+                for bet, order, profit_loss, credit in settlements
+                if bet['status'] != 'SETTLED'
+            ])
+        if self.downline_stats is not None:
+            # The credit is the held liability plus the P&L
+            self.downline_stats.record_settled([
+                (bet['user_id'], credit - profit_loss, credit, profit_loss)
+                for bet, order, profit_loss, credit in settlements
+                if bet['status'] != 'SETTLED'
+            ])
+
+        return len(settlements), sum(credits.values())
+
+    def _exchange_page(self, market_id, bet_status, from_record):
+        """
+        Build one page of cleared orders for an in-house market from its bets.
+
+        Raises:
+            ValueError: If the market is not closed at Betfair or still has
+                open exchange bets (the sweeper cancels them at close)
+        """
+        books = run_sync(self.betfair_async.get_market_book([market_id]), timeout=60) or []
+        book = next((book for book in books if book.get('market_id') == market_id), None)
+        if book is None or book.get('status') != 'CLOSED':
+            raise ValueError(f"Market {market_id} is not closed yet")
+        bets = self.db[COLLECTIONS['BETS']]
+        if bets.find_one({'market_id': market_id, 'exchange': True, 'status': {'$in': OPEN_STATUSES}}, {'_id': 1}):
+            raise ValueError(f"Market {market_id} still has open exchange bets")
+
+        runner_status = {str(runner['selection_id']): runner.get('status') for runner in book.get('runners') or []}
+        removed = [selection_id for selection_id, status in runner_status.items() if status == 'REMOVED']
+        # Exchange bets store integer selection IDs
+        removed += [int(selection_id) for selection_id in removed if selection_id.isdigit()]
+        selection_filter = {'$in': removed} if bet_status == 'VOIDED' else {'$nin': removed}
+
+        page = list(
+            bets.find(
+                {'market_id': market_id, 'exchange': True, 'size_matched': {'$gt': 0},
+                 'selection_id': selection_filter},
+                {'bet_id': 1, 'selection_id': 1, 'side': 1, 'price': 1, 'size_matched': 1,
+                 'average_price_matched': 1}
+            )
+            .sort('_id', 1)
+            .skip(from_record)
+            .limit(self.page_size + 1)
+        )
+
+        cleared_orders = []
+        for bet in page[:self.page_size]:
+            matched = bet['size_matched']
+            price = bet.get('average_price_matched') or bet['price']
+            runner_won = runner_status.get(str(bet['selection_id'])) == 'WINNER'
+            if bet['side'] == 'BACK':
+                won = runner_won
+                profit = matched * (price - 1) if won else -matched
+            else:
+                won = not runner_won
+                profit = matched if won else -matched * (price - 1)
+            cleared_orders.append({
+                'betId': bet['bet_id'],
+                'betOutcome': 'WON' if won else 'LOST',
+                'profit': round(profit, 2),
+                'sizeSettled': matched,
+                'priceMatched': price
+            })
+        return {'clearedOrders': cleared_orders, 'moreAvailable': len(page) > self.page_size}
+
+    @staticmethod
+    def _calculate_settlement(bet, order, voided=False):
+        """
+        Work out the P&L of a bet and the amount returned to the user.
+
+        The liability reserved at placement is still held for the matched
+        part, and for the unmatched part too if the bet never left an open
+        status. Settlement returns the held liability plus Betfair's profit.
+
+        Returns:
+            Tuple of (profit_loss, credit)
+        """
+        size_settled = order.get('sizeSettled')
+        if size_settled is None:
+            size_settled = bet.get('size_matched') or 0
+
+        if bet.get('status') in OPEN_STATUSES:
+            held = bet['liability']
+        else:
+            held = calculate_liability(bet['side'], bet['price'], bet.get('size_matched') or size_settled)
+
+        profit_loss = 0.0 if voided else float(order.get('profit') or 0.0)
+        credit = round(max(held + profit_loss, 0.0), 2)
+        return round(profit_loss, 2), credit
+
+    @staticmethod
+    def _settled_date(order, default):
+        """Settled time of a cleared order; Betfair sends an ISO string."""
+        settled_date = order.get('settledDate')
+        if isinstance(settled_date, str):
+            try:
+                return datetime.fromisoformat(settled_date.replace('Z', '+00:00')).replace(tzinfo=None)
+            except ValueError:
+                return default
+        return settled_date or default
+
+    @staticmethod
+    def _describe(order, voided=False):
+        """Ledger description for a cleared order."""
+        if voided:
+            return 'Refund from voided bet'
+        if order.get('betOutcome') == 'WON':
+            return f"Win from bet at odds {order.get('priceMatched')}"
+        if order.get('betOutcome') == 'LOST':
+            return 'Loss from settled bet'
+        return 'Returned liability from settled bet'
+
+    @staticmethod
+    def _summary(checkpoint):
+        """Public view of a checkpoint."""
+        return {
+            'market_id': checkpoint['market_id'],
+            'status': checkpoint['status'],
+            'bets_settled': checkpoint['bets_settled'],
+            'amount_credited': round(checkpoint['amount_credited'], 2),
+            'started_at': checkpoint['started_at'],
+            'completed_at': checkpoint.get('completed_at')
+        }
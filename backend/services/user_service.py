@@ -6,11 +6,19 @@ operations and business logic.
 import logging
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 from werkzeug.security import generate_password_hash, check_password_hash
 from models.user import User
 from models.transaction import Transaction
 from services.base_service import BaseService
 from utils.cache import session_cached, request_cached
+from utils.pagination import KEYSET_SORT, keyset_query
+from utils import user_events
+from utils.hierarchy import ancestors_for_parent, downline_query, get_ancestors, is_in_downline, reparent
+
+# Distribution reference_ids kept on a wallet to tell which updates applied
+DISTRIBUTION_REFS = 20
 
 # Singleton instance
 _user_service_instance = None
@@ -18,6 +26,22 @@ _user_service_instance = None
 class UserService(BaseService):
     """User service for handling user-related operations."""
     
+    # Write wallet changes and their ledger rows in one multi-document
+    # transaction; needs a replica set (set from WALLET_TRANSACTIONS_ENABLED)
+    WALLET_TRANSACTIONS = False
+    
+    # Group-commit LedgerWriter for ledger rows written outside a transaction
+    # (set from LEDGER_GROUP_COMMIT_ENABLED); None inserts each row on its own
+    LEDGER_WRITER = None
+    
+    # DownlineStatsService told about new users and wallet changes (set by
+    # the app); None leaves the downline totals to its reconciliation
+    DOWNLINE_STATS = None
+    
+    # UserStatsService told about new users, role changes and wallet changes
+    # (set by the app); None leaves the counters to its reconciliation
+    USER_STATS = None
+    
     def __init__(self):
         """Initialize the user service."""
         # Use singleton pattern to prevent repeated initialization
@@ -258,6 +282,11 @@ class UserService(BaseService):
             if self.find_one({"email": email}):
                 return None, "Email already exists"
             
+            # The parent's chain plus the parent, for one-query hierarchy lookups
+            ancestors = ancestors_for_parent(self.collection, parent_id)
+            if ancestors is None:
+                return None, "Parent user not found"
+            
             # Hash the password
             password_hash = generate_password_hash(password)
             
@@ -270,19 +299,20 @@ class UserService(BaseService):
                 full_name=full_name,
                 phone=phone,
                 parent_id=parent_id,
+                ancestors=ancestors,
                 wallet_balance=initial_balance
             )
             
             # Insert the user into the database
-            user_dict = user.to_dict()
-            user_id = self.insert_one(user_dict)
+            user_id = self.insert_one(user.to_document())
             
             if user_id:
                 # Update parent's children list if parent_id is provided
                 if parent_id:
-                    self.update_by_id(parent_id, {
-                        "$push": {"children": str(user_id)}
-                    })
+                    self.collection.update_one(
+                        {"_id": ObjectId(parent_id) if isinstance(parent_id, str) else parent_id},
+                        {"$push": {"children": str(user_id)}}
+                    )
                 
                 # Create initial balance transaction if needed
                 if initial_balance > 0:
@@ -298,8 +328,13 @@ class UserService(BaseService):
                     )
                     
                     # Insert transaction
-                    transaction_dict = transaction.to_dict()
-                    self.transactions.insert_one(transaction_dict)
+                    self._insert_ledger_row(transaction.to_document())
+                
+                if self.DOWNLINE_STATS is not None:
+                    self.DOWNLINE_STATS.record_user_created(user_id, wallet_balance=initial_balance)
+                if self.USER_STATS is not None:
+                    self.USER_STATS.record_created(role, wallet_balance=initial_balance)
+                user_events.publish(user_events.USER_CREATED, user_id)
                 
                 return user_id, None
             else:
@@ -385,9 +420,29 @@ class UserService(BaseService):
                 update_data['password_hash'] = generate_password_hash(update_data['password'])
                 del update_data['password']
             
+            # Moving to another parent rewrites the ancestors of the whole subtree
+            update_data.pop('ancestors', None)
+            if 'parent_id' in update_data:
+                _, error = reparent(self.collection, user_id, update_data.pop('parent_id'))
+                if error:
+                    return False, error
+                if self.DOWNLINE_STATS is not None:
+                    # Both the old and the new ancestors' totals change
+                    self.DOWNLINE_STATS.request_reconcile()
+            
+            # The role counters move from the role the user had
+            previous_role = None
+            if 'role' in update_data:
+                previous = self.collection.find_one({"_id": ObjectId(user_id)}, {"role": 1}) or {}
+                previous_role = previous.get('role')
+            
             # Update the user
             update_data['updated_at'] = datetime.utcnow()
             success = self.update_by_id(user_id, update_data)
+            if success:
+                user_events.publish(user_events.USER_UPDATED, user_id)
+                if previous_role and self.USER_STATS is not None:
+                    self.USER_STATS.record_role_changed(previous_role, update_data['role'])
             
             return success, None if success else "Failed to update user"
         except Exception as e:
@@ -412,83 +467,383 @@ class UserService(BaseService):
                 "password_hash": password_hash,
                 "updated_at": datetime.utcnow()
             })
+            if success:
+                user_events.publish(user_events.USER_UPDATED, user_id)
             
             return success, None if success else "Failed to change password"
         except Exception as e:
             self.logger.error(f"Error changing password: {e}")
             return False, str(e)
     
-    def update_wallet_balance(self, user_id, amount, transaction_type, description=None, reference_id=None, created_by=None):
-        """Update a user's wallet balance and create a transaction record."""
-        try:
-            # Get the user
-            user_data = self.find_by_id(user_id)
-            if not user_data:
-                return False, None, "User not found"
-            
-            # Get current balance
-            current_balance = user_data.get('wallet_balance', 0)
-            
-            # Calculate new balance
-            new_balance = current_balance + amount
-            
-            # Create transaction record
-            transaction = Transaction(
-                user_id=user_id,
-                username=user_data.get('username'),
-                amount=amount,
-                transaction_type=transaction_type,
-                description=description,
-                previous_balance=current_balance,
-                new_balance=new_balance,
-                reference_id=reference_id,
-                created_by=created_by
-            )
-            
-            # Insert transaction
-            transaction_dict = transaction.to_dict()
-            transaction_id = self.transactions.insert_one(transaction_dict).inserted_id
-            
-            if not transaction_id:
-                return False, None, "Failed to create transaction record"
-            
-            # Update user's wallet balance
-            success = self.update_by_id(user_id, {
-                "wallet_balance": new_balance,
-                "updated_at": datetime.utcnow(),
-                "$push": {"transactions": str(transaction_id)}
-            })
+    def update_wallet_balance(self, user_id, amount, transaction_type, description=None, reference_id=None,
+                              created_by=None, use_transaction=None):
+        """Change a user's wallet balance and write the ledger row.
+        
+        The balance moves with a single $inc through find_one_and_update, so
+        concurrent updates cannot overwrite each other, and the returned
+        document gives the new balance; the previous one is derived from it.
+        Debits only apply when the balance covers them.
+        
+        With a multi-document transaction (replica sets only) the balance
+        change and the ledger row commit together. Without one, the balance
+        change is reversed if the ledger row cannot be written.
+        
+        Args:
+            user_id: User ID
+            amount: Signed amount; negative amounts debit the wallet
+            transaction_type: Transaction type
+            description: Ledger description
+            reference_id: ID of the bet, deposit, etc. the change belongs to
+            created_by: ID of the user making the change
+            use_transaction: Override WALLET_TRANSACTIONS for this call
             
-            if not success:
-                # Rollback transaction if user update fails
-                self.transactions.delete_one({"_id": transaction_id})
-                return False, None, "Failed to update wallet balance"
+        Returns:
+            Tuple of (success, transaction ID, error message)
+        """
+        try:
+            user_id = ObjectId(user_id) if isinstance(user_id, str) else user_id
+            amount = float(amount)
+            ledger = (transaction_type, description, reference_id, created_by)
+            
+            if self.WALLET_TRANSACTIONS if use_transaction is None else use_transaction:
+                with self.db.client.start_session() as session:
+                    result = session.with_transaction(
+                        lambda s: self._apply_wallet_change(user_id, amount, *ledger, session=s)
+                    )
+            else:
+                result = self._apply_wallet_change(user_id, amount, *ledger)
             
-            return True, transaction_id, None
+            if result[0]:
+                self._record_wallet_changes({user_id: amount})
+            return result
         except Exception as e:
             self.logger.error(f"Error updating wallet balance: {e}")
             return False, None, str(e)
     
-    def get_user_transactions(self, user_id, limit=20, skip=0, sort=None):
-        """Get a user's transactions."""
+    def _apply_wallet_change(self, user_id, amount, transaction_type, description, reference_id, created_by,
+                             session=None):
+        """Apply one balance change and its ledger row, optionally inside a session's transaction."""
+        query = {"_id": user_id}
+        if amount < 0:
+            query["wallet_balance"] = {"$gte": -amount}
+        
+        user_data = self.collection.find_one_and_update(
+            query,
+            {"$inc": {"wallet_balance": amount}, "$set": {"updated_at": datetime.utcnow()}},
+            projection={"wallet_balance": 1, "username": 1},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if not user_data:
+            if self.collection.find_one({"_id": user_id}, {"_id": 1}, session=session) is None:
+                return False, None, "User not found"
+            return False, None, "Insufficient balance"
+        
+        new_balance = user_data["wallet_balance"]
+        transaction = Transaction(
+            user_id=user_id,
+            username=user_data.get("username"),
+            amount=amount,
+            transaction_type=transaction_type,
+            description=description,
+            previous_balance=new_balance - amount,
+            new_balance=new_balance,
+            reference_id=reference_id,
+            created_by=created_by
+        )
+        
+        try:
+            transaction_id = self._insert_ledger_row(transaction.to_document(), session=session)
+        except Exception:
+            if session is None:
+                # Reverse the balance change; the ledger must account for every change
+                self.collection.update_one({"_id": user_id}, {"$inc": {"wallet_balance": -amount}})
+            raise
+        
+        return True, transaction_id, None
+
+    def _record_wallet_changes(self, changes):
+        """Pass committed wallet changes on to the downline totals and the user caches."""
+        if self.DOWNLINE_STATS is not None:
+            self.DOWNLINE_STATS.record_balance(changes, field='wallet_balance')
+        if self.USER_STATS is not None:
+            self.USER_STATS.record_wallet_change(sum(changes.values()))
+        user_events.publish(user_events.USER_WALLET_CHANGED, list(changes))
+
+    def _insert_ledger_row(self, document, session=None):
+        """Insert one ledger row, through the group-commit writer unless inside a transaction."""
+        if session is None and self.LEDGER_WRITER is not None:
+            return self.LEDGER_WRITER.write(document)
+        return self.transactions.insert_one(document, session=session).inserted_id
+
+    def distribute_wallet_balance(self, parent, entries, description=None, use_transaction=None):
+        """Credit or debit many downline wallets against the parent's wallet.
+
+        The target users are checked with one query: they must exist, have a
+        lower role than the parent and, unless the parent is an admin, be in
+        the parent's downline. The parent's wallet then moves once by
+        the net amount, the children's wallets through one ordered
+        bulk_write, and every ledger row goes in with one insert_many, all
+        sharing a reference_id. Only the parent's row records its balances;
+        the children's rows record the amount.
+
+        Child debits only match while the balance covers them. Every child
+        update also tags the wallet with the reference_id, so when fewer
+        updates match than were sent the applied ones can be told apart: the
+        transaction is aborted, or without one they are reversed, and the
+        users who fell short are named with their current balance. Without a
+        transaction, the whole distribution is reversed if any step fails.
+
+        Args:
+            parent: User object making the distribution
+            entries: List of (user_id, amount, type) with type credit or debit
+            description: Ledger description
+            use_transaction: Override WALLET_TRANSACTIONS for this call
+
+        Returns:
+            Tuple of (result dict, error message)
+        """
         try:
+            parent_id = parent._id
+            if not entries:
+                return None, "No users to distribute to"
+            amounts = {}
+            for user_id, amount, transaction_type in entries:
+                user_id = ObjectId(user_id) if isinstance(user_id, str) else user_id
+                if user_id in amounts:
+                    return None, f"User {user_id} is listed more than once"
+                amounts[user_id] = float(amount) if transaction_type == Transaction.TYPE_CREDIT else -float(amount)
+            if parent_id in amounts:
+                return None, "Cannot distribute to your own wallet"
+
+            query = {"_id": {"$in": list(amounts)}}
+            if parent.role != 'admin':
+                query.update(downline_query(parent_id))
+            children = {
+                user["_id"]: user
+                for user in self.collection.find(query, {"username": 1, "role": 1})
+            }
+            missing = [str(user_id) for user_id in amounts if user_id not in children]
+            if missing:
+                return None, f"Users not found in your downline: {', '.join(missing)}"
+            denied = [str(user_id) for user_id, user in children.items()
+                      if User.ROLES.get(user.get("role"), 0) >= User.ROLES.get(parent.role, 0)]
+            if denied:
+                return None, f"Access denied to users: {', '.join(denied)}"
+
+            args = (parent, amounts, children, description, ObjectId())
+            if self.WALLET_TRANSACTIONS if use_transaction is None else use_transaction:
+                with self.db.client.start_session() as session:
+                    result, error = session.with_transaction(lambda s: self._apply_distribution(*args, session=s))
+            else:
+                result, error = self._apply_distribution(*args)
+
+            if result:
+                self._record_wallet_changes({parent_id: -sum(amounts.values()), **amounts})
+            return result, error
+        except Exception as e:
+            self.logger.error(f"Error distributing wallet balance: {e}")
+            return None, str(e)
+
+    def _apply_distribution(self, parent, amounts, children, description, reference_id, session=None):
+        """Apply a validated distribution, optionally inside a session's transaction."""
+        now = datetime.utcnow()
+        net = sum(amounts.values())
+
+        # The parent pays the net amount of the credits and debits
+        parent_query = {"_id": parent._id}
+        if net > 0:
+            parent_query["wallet_balance"] = {"$gte": net}
+        parent_data = self.collection.find_one_and_update(
+            parent_query,
+            {"$inc": {"wallet_balance": -net}, "$set": {"updated_at": now}},
+            projection={"wallet_balance": 1, "username": 1},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if not parent_data:
+            return None, "Insufficient balance"
+
+        user_ids = list(amounts)
+        operations = []
+        for user_id in user_ids:
+            amount = amounts[user_id]
+            query = {"_id": user_id}
+            if amount < 0:
+                query["wallet_balance"] = {"$gte": -amount}
+            operations.append(UpdateOne(query, {
+                "$inc": {"wallet_balance": amount},
+                "$set": {"updated_at": now},
+                # Marks the wallets this distribution changed; kept short
+                "$push": {"distribution_refs": {"$each": [reference_id], "$slice": -DISTRIBUTION_REFS}}
+            }))
+
+        applied, short = user_ids, None
+        try:
+            result = self.collection.bulk_write(operations, ordered=True, session=session)
+            if result.matched_count < len(operations):
+                wallets = {
+                    user["_id"]: user
+                    for user in self.collection.find(
+                        {"_id": {"$in": user_ids}}, {"wallet_balance": 1, "distribution_refs": 1}, session=session
+                    )
+                }
+                applied = [user_id for user_id in user_ids
+                           if reference_id in wallets.get(user_id, {}).get("distribution_refs", [])]
+                short = [
+                    f"{user_id} (balance {wallets[user_id].get('wallet_balance', 0)})" if user_id in wallets
+                    else f"{user_id} (not found)"
+                    for user_id in user_ids if user_id not in applied
+                ]
+                if session is not None:
+                    session.abort_transaction()
+                else:
+                    self._reverse_distribution(parent, amounts, applied, net, reference_id)
+                return None, f"Insufficient balance or user not found: {', '.join(short)}"
+
+            parent_balance = parent_data["wallet_balance"]
+            transactions = [Transaction(
+                user_id=parent._id,
+                username=parent_data.get("username"),
+                amount=-net,
+                transaction_type=Transaction.TYPE_DEBIT if net > 0 else Transaction.TYPE_CREDIT,
+                description=description or f"Distribution to {len(user_ids)} users",
+                previous_balance=parent_balance + net,
+                new_balance=parent_balance,
+                reference_id=reference_id,
+                created_by=parent._id,
+                created_at=now
+            )]
+            # The bulk_write does not return the child balances, and the
+            # validation read may be stale by now, so child rows carry the
+            # amount only
+            for user_id in user_ids:
+                amount = amounts[user_id]
+                transactions.append(Transaction(
+                    user_id=user_id,
+                    username=children[user_id].get("username"),
+                    amount=amount,
+                    transaction_type=Transaction.TYPE_CREDIT if amount > 0 else Transaction.TYPE_DEBIT,
+                    description=description,
+                    reference_id=reference_id,
+                    created_by=parent._id,
+                    created_at=now
+                ))
+            self.transactions.insert_many(
+                [transaction.to_document() for transaction in transactions], ordered=False, session=session
+            )
+        except Exception as e:
+            if isinstance(e, BulkWriteError) and e.details.get("writeErrors"):
+                # Ordered: everything before the failed update was applied
+                applied = user_ids[:e.details["writeErrors"][0]["index"]]
+            if session is None and short is None:
+                self._reverse_distribution(parent, amounts, applied, net, reference_id)
+            raise
+
+        return {
+            "reference_id": reference_id,
+            "users": len(user_ids),
+            "total_credited": sum(amount for amount in amounts.values() if amount > 0),
+            "total_debited": -sum(amount for amount in amounts.values() if amount < 0),
+            "previous_balance": parent_data["wallet_balance"] + net,
+            "new_balance": parent_data["wallet_balance"]
+        }, None
+
+    def _reverse_distribution(self, parent, amounts, applied, net, reference_id):
+        """Undo the wallet changes of a failed distribution made without a transaction.
+
+        The ledger must account for every change, so nothing may be left applied.
+        """
+        reversals = [
+            UpdateOne(
+                {"_id": user_id, "distribution_refs": reference_id},
+                {"$inc": {"wallet_balance": -amounts[user_id]}, "$pull": {"distribution_refs": reference_id}}
+            )
+            for user_id in applied
+        ]
+        reversals.append(UpdateOne({"_id": parent._id}, {"$inc": {"wallet_balance": net}}))
+        self.collection.bulk_write(reversals, ordered=False)
+
+    def get_user_transactions(self, user_id, limit=20, skip=0, sort=None, after=None, transaction_type=None):
+        """Get a user's transactions.
+        
+        Without a custom sort, transactions come newest first and `after`
+        (a token from utils.pagination.encode_cursor) continues from the last
+        transaction of the previous page using the (user_id, created_at, _id)
+        index instead of skipping.
+        """
+        try:
+            query = {"user_id": ObjectId(user_id) if isinstance(user_id, str) else user_id}
+            if transaction_type:
+                query["transaction_type"] = transaction_type
+            
             if sort is None:
-                sort = [("created_at", -1)]  # Default sort by created_at desc
-                
-            transactions = self.transactions.find(
-                {"user_id": ObjectId(user_id) if isinstance(user_id, str) else user_id}
-            ).sort(sort).skip(skip).limit(limit)
+                transactions = self.transactions.find(keyset_query(query, after)).sort(KEYSET_SORT)
+            else:
+                transactions = self.transactions.find(query).sort(sort)
+            
+            if skip and not after:
+                transactions = transactions.skip(skip)
             
-            return list(transactions)
+            return list(transactions.limit(limit))
+        except ValueError:
+            # Malformed `after` token
+            raise
         except Exception as e:
             self.logger.error(f"Error getting user transactions: {e}")
             return []
     
+    def get_users_by_parent(self, parent_id, skip=0, limit=20):
+        """Get the direct children of a user with pagination."""
+        try:
+            parent_id = ObjectId(parent_id) if isinstance(parent_id, str) else parent_id
+            user_data = self.find_many(
+                {"parent_id": {"$in": [parent_id, str(parent_id)]}},
+                limit=limit, skip=skip, sort=[('created_at', -1)]
+            )
+            return [User.from_dict(data) for data in user_data]
+        except Exception as e:
+            self.logger.error(f"Error getting users by parent: {e}")
+            return []
+    
+    def get_user_hierarchy(self, user_id):
+        """Get a user with its ancestor chain (direct parent first) and direct children."""
+        try:
+            user = self.get_user_by_id(user_id)
+            if not user:
+                return None
+            
+            ancestors = [User.from_dict(data) for data in get_ancestors(self.collection, user)]
+            children = self.get_users_by_parent(user._id)
+            return {
+                "user": user.to_safe_dict(),
+                "ancestors": [ancestor.to_safe_dict() for ancestor in ancestors],
+                "children": [child.to_safe_dict() for child in children]
+            }
+        except Exception as e:
+            self.logger.error(f"Error getting user hierarchy: {e}")
+            return None
+    
+    def is_in_downline(self, ancestor_id, user_id):
+        """Check whether a user is anywhere below another, with one indexed lookup."""
+        try:
+            return is_in_downline(self.collection, ancestor_id, user_id)
+        except Exception as e:
+            self.logger.error(f"Error checking downline: {e}")
+            return False
+    
+    def get_downline_ids(self, user_id):
+        """IDs of every user below a user."""
+        return [user["_id"] for user in self.collection.find(downline_query(user_id), {"_id": 1})]
+    
     @session_cached(ttl=300, key_prefix='user_count')
     @request_cached
     def count_users_by_role(self):
-        """Count users by role."""
+        """Count users by role, from the user stats counters when available."""
         try:
+            if self.USER_STATS is not None:
+                return self.USER_STATS.get_stats()['by_role']
+            
             pipeline = [
                 {"$group": {"_id": "$role", "count": {"$sum": 1}}}
             ]
@@ -0,0 +1,125 @@
+"""User statistics service for the BetPro Backend application.
+
+This module provides the UserStatsService class, which keeps user counts by
+role and the wallet balance total in one small user_stats document. User
+creation, role changes and wallet changes apply their changes as a single
+atomic $inc, so the dashboard reads one document instead of counting the
+users collection. A background task recomputes the document with one $facet
+aggregation to correct any drift, e.g. users written by paths that do not
+report to the service.
+"""
+from datetime import datetime
+from database.db_config import COLLECTIONS
+from services.base_service import BaseService, VersionedCountersMixin
+from utils.scheduler import PeriodicTask
+
+class UserStatsService(VersionedCountersMixin, BaseService):
+    """Incrementally maintained user statistics."""
+
+    STATS_ID = 'global'
+
+    def __init__(self, reconcile_interval=3600):
+        """
+        Initialize the user stats service.
+
+        Args:
+            reconcile_interval: Seconds between full recomputes
+        """
+        super().__init__(COLLECTIONS['USER_STATS'])
+        self._reconcile_task = PeriodicTask(
+            'user-stats-reconcile', reconcile_interval, self.reconcile, run_immediately=True
+        )
+
+    def start(self):
+        """Start the background reconciliation."""
+        self._reconcile_task.start()
+
+    def stop(self):
+        """Stop the background reconciliation."""
+        self._reconcile_task.stop()
+
+    def record_created(self, role, wallet_balance=0):
+        """Count a new user and its opening wallet balance."""
+        self._apply({
+            'total_users': 1,
+            f"by_role.{role}": 1,
+            'total_wallet_balance': float(wallet_balance or 0)
+        })
+
+    def record_role_changed(self, from_role, to_role):
+        """Move a user between role counters."""
+        if from_role == to_role:
+            return
+        self._apply({f"by_role.{from_role}": -1, f"by_role.{to_role}": 1})
+
+    def record_wallet_change(self, amount):
+        """Add a committed wallet change (or the net of several) to the balance total."""
+        self._apply({'total_wallet_balance': float(amount)})
+
+    def get_stats(self):
+        """
+        Get user statistics.
+
+        Returns:
+            Dict with the total user count, counts by role and the wallet
+            balance total
+        """
+        stats = self.collection.find_one({'_id': self.STATS_ID})
+        if stats is None or not stats.get('reconciled_at'):
+            # Counters recorded before the first full recompute have no baseline
+            stats = self.reconcile()
+        return {
+            'total_users': stats.get('total_users', 0),
+            'by_role': {role: count for role, count in (stats.get('by_role') or {}).items() if count},
+            'total_wallet_balance': stats.get('total_wallet_balance', 0),
+            'updated_at': stats.get('updated_at'),
+            'reconciled_at': stats.get('reconciled_at')
+        }
+
+    def reconcile(self):
+        """
+        Recompute the statistics document from the users collection.
+
+        Returns:
+            The new statistics document
+        """
+        results, conflicts = self._reconcile_versioned(
+            lambda: {self.STATS_ID: self._recompute()}, fields=('total_users',)
+        )
+        previous, stats = results[self.STATS_ID]
+        if conflicts:
+            self.logger.warning("User stats kept changing during the recompute; left to the next run")
+        elif previous and previous.get('total_users') != stats['total_users']:
+            self.logger.warning(
+                f"User stats drifted: {previous.get('total_users')} counted, {stats['total_users']} in users"
+            )
+        return stats
+
+    def _recompute(self):
+        """Compute the statistics document with one $facet aggregation."""
+        facets = list(self.db[COLLECTIONS['USERS']].aggregate([
+            {'$facet': {
+                'totals': [
+                    {'$group': {'_id': None, 'count': {'$sum': 1},
+                                'wallet_balance': {'$sum': {'$ifNull': ['$wallet_balance', 0]}}}}
+                ],
+                'by_role': [
+                    {'$group': {'_id': '$role', 'count': {'$sum': 1}}}
+                ]
+            }}
+        ]))[0]
+
+        totals = facets['totals'][0] if facets['totals'] else {'count': 0, 'wallet_balance': 0}
+        now = datetime.utcnow()
+        return {
+            '_id': self.STATS_ID,
+            'total_users': totals['count'],
+            'by_role': {str(row['_id']): row['count'] for row in facets['by_role']},
+            'total_wallet_balance': totals['wallet_balance'],
+            'updated_at': now,
+            'reconciled_at': now
+        }
+
+    def _apply(self, inc):
+        """Apply all counter changes of one write in a single atomic update."""
+        self._increment({self.STATS_ID: inc})
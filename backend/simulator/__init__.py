@@ -0,0 +1 @@
+"""Local Betfair stand-ins for development and testing of the BetPro Backend."""
@@ -0,0 +1,599 @@
+"""
+In-memory Betfair betting API simulator.
+
+Generates a synthetic catalogue (event types, events, markets, runners) and
+evolves runner prices with a random walk on implied probabilities, snapped to
+the Betfair tick ladder. Orders placed through placeOrders match against the
+synthetic book immediately and keep matching as prices move. Responses use
+the same camelCase shapes as the real JSON-RPC API.
+"""
+import math
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from utils.betting import PRICE_LADDER, nearest_tick, price_to_tick, tick_to_price
+from utils.request_weight import (
+    REQUEST_WEIGHT_LIMIT, market_catalogue_weight, price_projection_weight
+)
+
+# Synthetic sports: (id, name, runner names for MATCH_ODDS)
+EVENT_TYPES = [
+    ('1', 'Soccer', ['Home', 'Away', 'The Draw']),
+    ('2', 'Tennis', ['Player A', 'Player B']),
+    ('4', 'Cricket', ['Team A', 'Team B']),
+    ('7', 'Horse Racing', [f'Runner {i}' for i in range(1, 9)])
+]
+
+# Correct score runners for soccer
+CORRECT_SCORES = [f'{home} - {away}' for home in range(4) for away in range(4)] + [
+    'Any Other Home Win', 'Any Other Away Win', 'Any Other Draw'
+]
+
+class SimulatorError(Exception):
+    """APING error returned to the caller as a JSON-RPC error."""
+
+    def __init__(self, error_code, message=None):
+        super().__init__(message or error_code)
+        self.error_code = error_code
+
+class _Runner:
+    def __init__(self, selection_id, name, sort_priority, probability):
+        self.selection_id = selection_id
+        self.name = name
+        self.sort_priority = sort_priority
+        self.probability = probability
+        self.total_matched = 0.0
+        self.last_price_traded = None
+        self.back_tick = 0
+        self.lay_tick = 1
+
+class _Market:
+    def __init__(self, market_id, name, market_type, event, event_type, competition, start_time, runners):
+        self.market_id = market_id
+        self.name = name
+        self.market_type = market_type
+        self.event = event
+        self.event_type = event_type
+        self.competition = competition
+        self.start_time = start_time
+        self.runners = runners
+        self.status = 'OPEN'
+        self.version = 1
+        self.total_matched = 0.0
+        self.last_step = time.time()
+        self.orders = {}
+
+class BettingSimulator:
+    """Synthetic exchange answering the subset of betting operations the app uses."""
+
+    def __init__(self, seed=None, events_per_type=10, volatility=0.03, step_interval=1.0,
+                 overround=0.02, base_liquidity=500.0, order_listener=None):
+        """
+        Initialize the simulator.
+
+        Args:
+            seed: Random seed for a reproducible catalogue and price path
+            events_per_type: Events generated for each sport
+            volatility: Standard deviation of the per-step log-probability move
+            step_interval: Seconds of wall time per price step
+            overround: Spread added around the fair price
+            base_liquidity: Typical size available at each price level
+            order_listener: Optional callable(market_id, selection_id, order) receiving
+                stream-format order updates (see simulator.order_stream)
+        """
+        self.random = random.Random(seed)
+        self.volatility = volatility
+        self.step_interval = step_interval
+        self.overround = overround
+        self.base_liquidity = base_liquidity
+        self.order_listener = order_listener
+        self.lock = threading.RLock()
+
+        self.event_types = {}
+        self.events = {}
+        self.markets = {}
+        self.orders = {}
+        self._next_bet_id = 300000000000
+        self._generate(events_per_type)
+
+        self.handlers = {
+            'listEventTypes': self.list_event_types,
+            'listEvents': self.list_events,
+            'listMarketCatalogue': self.list_market_catalogue,
+            'listMarketBook': self.list_market_book,
+            'placeOrders': self.place_orders,
+            'cancelOrders': self.cancel_orders,
+            'listCurrentOrders': self.list_current_orders,
+            'listClearedOrders': self.list_cleared_orders
+        }
+
+    def handle(self, method, params):
+        """
+        Dispatch a betting operation.
+
+        Args:
+            method: Operation name without the SportsAPING/v1.0/ prefix
+            params: Operation parameters
+
+        Raises:
+            SimulatorError: For unsupported operations or invalid input
+        """
+        handler = self.handlers.get(method)
+        if handler is None:
+            raise SimulatorError('INVALID_INPUT_DATA', f'Unsupported operation {method}')
+        with self.lock:
+            return handler(params or {})
+
+    # Catalogue generation
+
+    def _generate(self, events_per_type):
+        """Build the synthetic event and market catalogue."""
+        market_number = 1
+        selection_id = 10000
+        now = datetime.utcnow()
+
+        for event_type_id, event_type_name, runner_names in EVENT_TYPES:
+            event_type = {'id': event_type_id, 'name': event_type_name}
+            self.event_types[event_type_id] = event_type
+            competition = {'id': f'{event_type_id}000', 'name': f'{event_type_name} Simulated League'}
+
+            for i in range(events_per_type):
+                event_id = f'{31000000 + int(event_type_id) * 1000 + i}'
+                start_time = now + timedelta(hours=self.random.randint(1, 144))
+                event = {
+                    'id': event_id,
+                    'name': f'{event_type_name} Event {i + 1}',
+                    'countryCode': 'GB',
+                    'timezone': 'GMT',
+                    'openDate': start_time.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+                }
+                self.events[event_id] = (event, event_type_id, competition)
+
+                market_specs = [('MATCH_ODDS', 'Match Odds', runner_names)]
+                if event_type_id == '1':
+                    market_specs.append(('OVER_UNDER_25', 'Over/Under 2.5 Goals', ['Under 2.5 Goals', 'Over 2.5 Goals']))
+                    market_specs.append(('CORRECT_SCORE', 'Correct Score', CORRECT_SCORES))
+
+                for market_type, market_name, names in market_specs:
+                    market_id = f'1.{200000000 + market_number}'
+                    market_number += 1
+                    weights = [self.random.uniform(0.5, 2.0) for _ in names]
+                    total = sum(weights)
+                    runners = []
+                    for priority, (name, weight) in enumerate(zip(names, weights), start=1):
+                        selection_id += 1
+                        runners.append(_Runner(selection_id, name, priority, weight / total))
+                    market = _Market(market_id, market_name, market_type, event, event_type,
+                                     competition, start_time, runners)
+                    self._quote(market)
+                    self.markets[market_id] = market
+
+    # Price evolution
+
+    def _step(self, market):
+        """Advance a market's prices by the number of steps since it was last touched."""
+        now = time.time()
+        steps = int((now - market.last_step) / self.step_interval)
+        if steps <= 0 or market.status != 'OPEN':
+            return
+        market.last_step += steps * self.step_interval
+
+        # Random walk in log-probability space, scaled for the elapsed steps
+        scale = self.volatility * math.sqrt(min(steps, 100))
+        for runner in market.runners:
+            runner.probability *= math.exp(self.random.gauss(0, scale))
+        total = sum(runner.probability for runner in market.runners)
+        for runner in market.runners:
+            runner.probability = min(max(runner.probability / total, 0.001), 0.99)
+
+        self._quote(market)
+        market.version += 1
+        for order in list(market.orders.values()):
+            if order['status'] == 'EXECUTABLE':
+                self._match(market, order)
+
+    def _quote(self, market):
+        """Set each runner's best back/lay ticks around its fair price."""
+        for runner in market.runners:
+            fair_price = 1.0 / runner.probability
+            back_tick = nearest_tick(fair_price / (1 + self.overround))
+            lay_tick = max(nearest_tick(fair_price * (1 + self.overround)), back_tick + 1)
+            runner.back_tick = back_tick
+            runner.lay_tick = min(lay_tick, len(PRICE_LADDER) - 1)
+
+    def _level_size(self, market, selection_id, tick):
+        """Deterministic pseudo-random size available at a price level for the current version."""
+        level_random = random.Random(hash((market.market_id, selection_id, tick, market.version)))
+        return round(self.base_liquidity * level_random.uniform(0.2, 2.0), 2)
+
+    def _ladder(self, market, runner, depth):
+        """Best back and lay offers for a runner."""
+        available_to_back = [
+            {'price': tick_to_price(runner.back_tick - i),
+             'size': self._level_size(market, runner.selection_id, runner.back_tick - i)}
+            for i in range(depth) if runner.back_tick - i >= 0
+        ]
+        available_to_lay = [
+            {'price': tick_to_price(runner.lay_tick + i),
+             'size': self._level_size(market, runner.selection_id, runner.lay_tick + i)}
+            for i in range(depth) if runner.lay_tick + i < len(PRICE_LADDER)
+        ]
+        return available_to_back, available_to_lay
+
+    # Read operations
+
+    @staticmethod
+    def _filter_values(market_filter, key):
+        values = (market_filter or {}).get(key)
+        return set(str(value) for value in values) if values else None
+
+    def _filtered_markets(self, market_filter):
+        """Markets matching the subset of MarketFilter fields the app sends."""
+        event_type_ids = self._filter_values(market_filter, 'eventTypeIds')
+        event_ids = self._filter_values(market_filter, 'eventIds')
+        market_ids = self._filter_values(market_filter, 'marketIds')
+        competition_ids = self._filter_values(market_filter, 'competitionIds')
+        market_types = self._filter_values(market_filter, 'marketTypeCodes')
+
+        for market in self.markets.values():
+            if event_type_ids and market.event_type['id'] not in event_type_ids:
+                continue
+            if event_ids and market.event['id'] not in event_ids:
+                continue
+            if market_ids and market.market_id not in market_ids:
+                continue
+            if competition_ids and market.competition['id'] not in competition_ids:
+                continue
+            if market_types and market.market_type not in market_types:
+                continue
+            yield market
+
+    def list_event_types(self, params):
+        counts = {}
+        for market in self._filtered_markets(params.get('filter')):
+            counts[market.event_type['id']] = counts.get(market.event_type['id'], 0) + 1
+        return [
+            {'eventType': dict(self.event_types[event_type_id]), 'marketCount': count}
+            for event_type_id, count in counts.items()
+        ]
+
+    def list_events(self, params):
+        counts = {}
+        for market in self._filtered_markets(params.get('filter')):
+            counts[market.event['id']] = counts.get(market.event['id'], 0) + 1
+        return [
+            {'event': dict(self.events[event_id][0]), 'marketCount': count}
+            for event_id, count in counts.items()
+        ]
+
+    def list_market_catalogue(self, params):
+        max_results = int(params.get('maxResults', 100))
+        projection = set(params.get('marketProjection') or [])
+        if max_results > 1000 or market_catalogue_weight(projection) * max_results > REQUEST_WEIGHT_LIMIT:
+            raise SimulatorError('TOO_MUCH_DATA')
+
+        catalogues = []
+        for market in self._filtered_markets(params.get('filter')):
+            if len(catalogues) >= max_results:
+                break
+            catalogue = {
+                'marketId': market.market_id,
+                'marketName': market.name,
+                'totalMatched': round(market.total_matched, 2)
+            }
+            if 'MARKET_START_TIME' in projection:
+                catalogue['marketStartTime'] = market.start_time.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+            if 'RUNNER_DESCRIPTION' in projection or 'RUNNER_METADATA' in projection:
+                catalogue['runners'] = [
+                    {'selectionId': runner.selection_id, 'runnerName': runner.name,
+                     'handicap': 0.0, 'sortPriority': runner.sort_priority}
+                    for runner in market.runners
+                ]
+            if 'EVENT_TYPE' in projection:
+                catalogue['eventType'] = dict(market.event_type)
+            if 'COMPETITION' in projection:
+                catalogue['competition'] = dict(market.competition)
+            if 'EVENT' in projection:
+                catalogue['event'] = dict(market.event)
+            if 'MARKET_DESCRIPTION' in projection:
+                catalogue['description'] = {
+                    'persistenceEnabled': True, 'bspMarket': False, 'marketType': market.market_type,
+                    'marketTime': market.start_time.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                    'turnInPlayEnabled': True, 'bettingType': 'ODDS'
+                }
+            catalogues.append(catalogue)
+        return catalogues
+
+    def list_market_book(self, params):
+        market_ids = params.get('marketIds') or []
+        price_projection = params.get('priceProjection') or {}
+        if price_projection_weight(price_projection) * len(market_ids) > REQUEST_WEIGHT_LIMIT:
+            raise SimulatorError('TOO_MUCH_DATA')
+
+        price_data = set(price_projection.get('priceData') or [])
+        overrides = price_projection.get('exBestOffersOverrides') or {}
+        if 'EX_ALL_OFFERS' in price_data:
+            depth = len(PRICE_LADDER)
+        elif 'EX_BEST_OFFERS' in price_data:
+            depth = overrides.get('bestPricesDepth') or 3
+        else:
+            depth = 0
+
+        books = []
+        for market_id in market_ids:
+            market = self.markets.get(str(market_id))
+            if market is None:
+                continue
+            self._step(market)
+            runners = []
+            for runner in market.runners:
+                runner_book = {
+                    'selectionId': runner.selection_id,
+                    'handicap': 0.0,
+                    'status': 'ACTIVE',
+                    'lastPriceTraded': runner.last_price_traded,
+                    'totalMatched': round(runner.total_matched, 2)
+                }
+                if depth or 'EX_TRADED' in price_data:
+                    available_to_back, available_to_lay = self._ladder(market, runner, depth)
+                    runner_book['ex'] = {
+                        'availableToBack': available_to_back,
+                        'availableToLay': available_to_lay,
+                        'tradedVolume': []
+                    }
+                runners.append(runner_book)
+            books.append({
+                'marketId': market.market_id,
+                'isMarketDataDelayed': False,
+                'status': market.status,
+                'betDelay': 0,
+                'bspReconciled': False,
+                'complete': True,
+                'inplay': False,
+                'numberOfWinners': 1,
+                'numberOfRunners': len(market.runners),
+                'numberOfActiveRunners': len(market.runners),
+                'totalMatched': round(market.total_matched, 2),
+                'totalAvailable': 0.0,
+                'crossMatching': True,
+                'runnersVoidable': False,
+                'version': market.version,
+                'runners': runners
+            })
+        return books
+
+    # Order operations
+
+    def place_orders(self, params):
+        market = self.markets.get(str(params.get('marketId')))
+        instructions = params.get('instructions') or []
+        if market is None:
+            return self._execution_failure(params, 'MARKET_NOT_OPEN_FOR_BETTING', 'INVALID_MARKET_ID', instructions)
+        if market.status != 'OPEN':
+            return self._execution_failure(params, 'MARKET_NOT_OPEN_FOR_BETTING', 'MARKET_NOT_OPEN_FOR_BETTING', instructions)
+        if not instructions or len(instructions) > 200:
+            return self._execution_failure(params, 'INVALID_BET_SIZE' if instructions else 'INVALID_INPUT_DATA',
+                                           'INVALID_INPUT_DATA', instructions)
+
+        self._step(market)
+        runner_ids = {runner.selection_id for runner in market.runners}
+
+        # Validation is all-or-nothing: one bad instruction fails the whole request
+        errors = [self._validate_instruction(instruction, runner_ids) for instruction in instructions]
+        if any(errors):
+            result = {
+                'status': 'FAILURE',
+                'errorCode': 'BET_ACTION_ERROR',
+                'marketId': market.market_id,
+                'instructionReports': [
+                    {'status': 'FAILURE', 'errorCode': error or 'ERROR_IN_ORDER', 'instruction': instruction}
+                    for instruction, error in zip(instructions, errors)
+                ]
+            }
+            if params.get('customerRef'):
+                result['customerRef'] = params['customerRef']
+            return result
+
+        reports = []
+        for instruction in instructions:
+            limit_order = instruction['limitOrder']
+            self._next_bet_id += 1
+            order = {
+                'betId': str(self._next_bet_id),
+                'marketId': market.market_id,
+                'selectionId': int(instruction['selectionId']),
+                'handicap': 0.0,
+                'side': instruction['side'],
+                'priceSize': {'price': float(limit_order['price']), 'size': float(limit_order['size'])},
+                'orderType': 'LIMIT',
+                'persistenceType': limit_order.get('persistenceType', 'LAPSE'),
+                'status': 'EXECUTABLE',
+                'placedDate': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                'averagePriceMatched': 0.0,
+                'sizeMatched': 0.0,
+                'sizeRemaining': float(limit_order['size']),
+                'sizeLapsed': 0.0,
+                'sizeCancelled': 0.0,
+                'sizeVoided': 0.0,
+                'customerOrderRef': instruction.get('customerOrderRef')
+            }
+            market.orders[order['betId']] = order
+            self.orders[order['betId']] = order
+            self._match(market, order, notify=False)
+            self._notify(order)
+
+            reports.append({
+                'status': 'SUCCESS',
+                'instruction': instruction,
+                'betId': order['betId'],
+                'placedDate': order['placedDate'],
+                'averagePriceMatched': order['averagePriceMatched'],
+                'sizeMatched': order['sizeMatched'],
+                'orderStatus': order['status']
+            })
+
+        result = {
+            'status': 'SUCCESS',
+            'marketId': market.market_id,
+            'instructionReports': reports
+        }
+        if params.get('customerRef'):
+            result['customerRef'] = params['customerRef']
+        return result
+
+    @staticmethod
+    def _validate_instruction(instruction, runner_ids):
+        """Return the instruction error code, or None if the instruction is valid."""
+        limit_order = instruction.get('limitOrder') or {}
+        try:
+            selection_id = int(instruction.get('selectionId', 0))
+            price = float(limit_order['price'])
+            size = float(limit_order['size'])
+        except (KeyError, TypeError, ValueError):
+            return 'INVALID_INPUT_DATA'
+
+        if selection_id not in runner_ids:
+            return 'RUNNER_REMOVED'
+        if instruction.get('side') not in ('BACK', 'LAY'):
+            return 'INVALID_INPUT_DATA'
+        if price_to_tick(price) is None:
+            return 'INVALID_ODDS'
+        if size <= 0:
+            return 'INVALID_BET_SIZE'
+        return None
+
+    @staticmethod
+    def _execution_failure(params, instruction_error, error_code, instructions):
+        return {
+            'status': 'FAILURE',
+            'errorCode': error_code,
+            'marketId': params.get('marketId'),
+            'instructionReports': [
+                {'status': 'FAILURE', 'errorCode': instruction_error, 'instruction': instruction}
+                for instruction in instructions
+            ]
+        }
+
+    def _match(self, market, order, notify=True):
+        """Match the remaining size of an order against the synthetic book."""
+        runner = next(r for r in market.runners if r.selection_id == order['selectionId'])
+        available_to_back, available_to_lay = self._ladder(market, runner, 3)
+        limit_price = order['priceSize']['price']
+
+        if order['side'] == 'BACK':
+            levels = [level for level in available_to_back if level['price'] >= limit_price]
+        else:
+            levels = [level for level in available_to_lay if level['price'] <= limit_price]
+
+        matched_value = order['averagePriceMatched'] * order['sizeMatched']
+        filled = 0.0
+        for level in levels:
+            if order['sizeRemaining'] <= 0:
+                break
+            take = round(min(order['sizeRemaining'], level['size']), 2)
+            order['sizeRemaining'] = round(order['sizeRemaining'] - take, 2)
+            order['sizeMatched'] = round(order['sizeMatched'] + take, 2)
+            matched_value += take * level['price']
+            filled += take
+            runner.last_price_traded = level['price']
+
+        if filled:
+            order['averagePriceMatched'] = round(matched_value / order['sizeMatched'], 2)
+            order['matchedDate'] = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.000Z')
+            runner.total_matched += filled
+            market.total_matched += filled
+            if order['sizeRemaining'] <= 0:
+                order['status'] = 'EXECUTION_COMPLETE'
+            if notify:
+                self._notify(order)
+
+    def cancel_orders(self, params):
+        market = self.markets.get(str(params.get('marketId')))
+        if market is None:
+            return {'status': 'FAILURE', 'errorCode': 'INVALID_MARKET_ID', 'marketId': params.get('marketId'),
+                    'instructionReports': []}
+
+        instructions = params.get('instructions')
+        if not instructions:
+            instructions = [{'betId': bet_id} for bet_id, order in market.orders.items()
+                            if order['status'] == 'EXECUTABLE']
+
+        now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        reports = []
+        for instruction in instructions:
+            order = market.orders.get(str(instruction.get('betId')))
+            if order is None or order['status'] != 'EXECUTABLE':
+                reports.append({'status': 'FAILURE', 'errorCode': 'BET_TAKEN_OR_LAPSED', 'instruction': instruction})
+                continue
+
+            reduction = instruction.get('sizeReduction')
+            size_cancelled = order['sizeRemaining'] if reduction is None else min(float(reduction), order['sizeRemaining'])
+            order['sizeRemaining'] = round(order['sizeRemaining'] - size_cancelled, 2)
+            order['sizeCancelled'] = round(order['sizeCancelled'] + size_cancelled, 2)
+            if order['sizeRemaining'] <= 0:
+                order['status'] = 'EXECUTION_COMPLETE'
+            self._notify(order)
+            reports.append({
+                'status': 'SUCCESS',
+                'instruction': instruction,
+                'sizeCancelled': size_cancelled,
+                'cancelledDate': now
+            })
+
+        failed = any(report['status'] == 'FAILURE' for report in reports)
+        result = {
+            'status': 'FAILURE' if failed else 'SUCCESS',
+            'marketId': market.market_id,
+            'instructionReports': reports
+        }
+        if failed:
+            result['errorCode'] = 'BET_ACTION_ERROR'
+        return result
+
+    def list_current_orders(self, params):
+        bet_ids = set(str(bet_id) for bet_id in params.get('betIds') or [])
+        market_ids = set(str(market_id) for market_id in params.get('marketIds') or [])
+        order_refs = set(params.get('customerOrderRefs') or [])
+        from_record = int(params.get('fromRecord', 0))
+        record_count = int(params.get('recordCount', 1000)) or 1000
+
+        orders = []
+        for order in self.orders.values():
+            if bet_ids and order['betId'] not in bet_ids:
+                continue
+            if market_ids and order['marketId'] not in market_ids:
+                continue
+            if order_refs and order.get('customerOrderRef') not in order_refs:
+                continue
+            self._step(self.markets[order['marketId']])
+            orders.append(dict(order))
+
+        page = orders[from_record:from_record + record_count]
+        return {'currentOrders': page, 'moreAvailable': from_record + record_count < len(orders)}
+
+    def list_cleared_orders(self, params):
+        # Markets never close here, so no order is ever cleared
+        return {'clearedOrders': [], 'moreAvailable': False}
+
+    def _notify(self, order):
+        """Send a stream-format order update to the order listener."""
+        if self.order_listener is None:
+            return
+        self.order_listener(order['marketId'], order['selectionId'], {
+            'id': order['betId'],
+            'p': order['priceSize']['price'],
+            's': order['priceSize']['size'],
+            'side': 'B' if order['side'] == 'BACK' else 'L',
+            'status': 'E' if order['status'] == 'EXECUTABLE' else 'EC',
+            'pt': 'L',
+            'ot': 'L',
+            'pd': int(time.time() * 1000),
+            'sm': order['sizeMatched'],
+            'avp': order['averagePriceMatched'] or None,
+            'sr': order['sizeRemaining'],
+            'sc': order['sizeCancelled'],
+            'sl': order['sizeLapsed'],
+            'sv': order['sizeVoided'],
+            'rfo': order.get('customerOrderRef')
+        })
@@ -0,0 +1,229 @@
+"""
+Local stand-in for the Betfair order stream.
+
+Accepts plain TCP connections, answers authentication and order subscription
+requests like the Exchange Stream API, then emits order change messages
+(op=ocm) pushed through `emit_order` / `emit` plus periodic heartbeats.
+Point the backend at it with BETFAIR_STREAM_HOST/PORT and BETFAIR_STREAM_SSL=false.
+
+Run standalone and type order change messages (one JSON object per line):
+
+    python -m simulator.order_stream --port 9443
+"""
+import argparse
+import json
+import logging
+import socketserver
+import sys
+import threading
+import time
+
+class _StreamHandler(socketserver.StreamRequestHandler):
+    """One subscribed client connection."""
+
+    def handle(self):
+        stand_in = self.server.stand_in
+        self._lock = threading.Lock()
+        self._send({'op': 'connection', 'connectionId': f"standin-{stand_in.next_id()}"})
+
+        subscribed = False
+        while not stand_in.stopped:
+            line = self.rfile.readline()
+            if not line:
+                return
+            request = json.loads(line.decode('utf-8'))
+            op = request.get('op')
+
+            if op == 'authentication':
+                if stand_in.reject_session:
+                    self._send({'op': 'status', 'id': request.get('id'), 'statusCode': 'FAILURE',
+                                'errorCode': 'INVALID_SESSION_INFORMATION', 'connectionClosed': True})
+                    return
+                self._send({'op': 'status', 'id': request.get('id'), 'statusCode': 'SUCCESS'})
+            elif op == 'orderSubscription':
+                self._send({'op': 'status', 'id': request.get('id'), 'statusCode': 'SUCCESS'})
+                heartbeat_ms = request.get('heartbeatMs', 5000)
+                subscribed = True
+                break
+            elif op == 'heartbeat':
+                self._send({'op': 'status', 'id': request.get('id'), 'statusCode': 'SUCCESS'})
+
+        if not subscribed:
+            return
+
+        # Initial image, then changes as they are emitted
+        self._send({'op': 'ocm', 'id': 1, 'initialClk': stand_in.clock(), 'clk': stand_in.clock(),
+                    'ct': 'SUB_IMAGE', 'pt': stand_in.publish_time(), 'oc': []})
+        queue = stand_in.subscribe()
+        try:
+            while not stand_in.stopped:
+                message = queue.get(heartbeat_ms / 1000.0)
+                if message is None:
+                    message = {'op': 'ocm', 'id': 1, 'ct': 'HEARTBEAT', 'clk': stand_in.clock(),
+                               'pt': stand_in.publish_time()}
+                self._send(message)
+        except (BrokenPipeError, ConnectionResetError, OSError):
+            return
+        finally:
+            stand_in.unsubscribe(queue)
+
+    def _send(self, message):
+        with self._lock:
+            self.wfile.write((json.dumps(message) + '\r\n').encode('utf-8'))
+            self.wfile.flush()
+
+class _MessageQueue:
+    """Minimal blocking queue with a timeout, one per subscriber."""
+
+    def __init__(self):
+        self._items = []
+        self._condition = threading.Condition()
+
+    def put(self, item):
+        with self._condition:
+            self._items.append(item)
+            self._condition.notify()
+
+    def get(self, timeout):
+        with self._condition:
+            if not self._items:
+                self._condition.wait(timeout)
+            return self._items.pop(0) if self._items else None
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class OrderStreamStandIn:
+    """Threaded TCP server emitting Betfair order change messages."""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        """
+        Initialize the stand-in.
+
+        Args:
+            host: Interface to bind
+            port: Port to bind (0 picks a free port, see `address`)
+        """
+        self.reject_session = False
+        self.stopped = False
+        self._clk = 0
+        self._id = 0
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _StreamHandler)
+        self._server.stand_in = self
+        self._thread = None
+
+    @property
+    def address(self):
+        """(host, port) the stand-in is listening on."""
+        return self._server.server_address
+
+    def start(self):
+        """Serve connections in a daemon thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name='order-stream-standin', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and disconnect subscribers."""
+        self.stopped = True
+        self._server.shutdown()
+        self._server.server_close()
+
+    def next_id(self):
+        with self._lock:
+            self._id += 1
+            return self._id
+
+    def clock(self):
+        return str(self._clk)
+
+    @staticmethod
+    def publish_time():
+        return int(time.time() * 1000)
+
+    def subscribe(self):
+        queue = _MessageQueue()
+        with self._lock:
+            self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            if queue in self._subscribers:
+                self._subscribers.remove(queue)
+
+    def emit(self, market_changes):
+        """
+        Push an order change message to every subscriber.
+
+        Args:
+            market_changes: List of market order changes in stream format
+                ({'id': marketId, 'orc': [{'id': selectionId, 'uo': [...]}]})
+        """
+        with self._lock:
+            self._clk += 1
+            message = {'op': 'ocm', 'id': 1, 'clk': self.clock(), 'pt': self.publish_time(),
+                       'oc': market_changes}
+            for queue in self._subscribers:
+                queue.put(message)
+
+    def emit_order(self, market_id, selection_id, bet_id, price, size, side='B',
+                   size_matched=0, average_price_matched=None, size_cancelled=0,
+                   size_lapsed=0, complete=False):
+        """Push a change for a single order."""
+        size_remaining = 0 if complete else max(size - size_matched - size_cancelled - size_lapsed, 0)
+        self.emit([{
+            'id': market_id,
+            'orc': [{
+                'id': selection_id,
+                'uo': [{
+                    'id': str(bet_id),
+                    'p': price,
+                    's': size,
+                    'side': side,
+                    'status': 'EC' if complete else 'E',
+                    'pt': 'L',
+                    'ot': 'L',
+                    'pd': self.publish_time(),
+                    'sm': size_matched,
+                    'avp': average_price_matched,
+                    'sr': size_remaining,
+                    'sc': size_cancelled,
+                    'sl': size_lapsed,
+                    'sv': 0
+                }]
+            }]
+        }])
+
+def main(argv=None):
+    """Run the stand-in and emit market changes read from stdin."""
+    parser = argparse.ArgumentParser(description='Local Betfair order stream stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9443)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    stand_in = OrderStreamStandIn(args.host, args.port).start()
+    logging.info(f"Order stream stand-in listening on {stand_in.address[0]}:{stand_in.address[1]}")
+
+    try:
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                payload = json.loads(line)
+            except ValueError as e:
+                logging.error(f"Invalid JSON: {e}")
+                continue
+            stand_in.emit(payload if isinstance(payload, list) else payload.get('oc', [payload]))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stand_in.stop()
+
+if __name__ == '__main__':
+    main()
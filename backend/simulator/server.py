@@ -0,0 +1,376 @@
+"""
+HTTP front end for the Betfair betting API simulator.
+
+Serves the JSON-RPC betting endpoint and the identity endpoints the app uses
+over HTTP/1.1 keep-alive, with configurable latency distributions and
+injectable errors. Point the app at it with:
+
+    BETFAIR_API_URI=http://127.0.0.1:8090/exchange/
+    BETFAIR_IDENTITY_URI=http://127.0.0.1:8090/api/
+
+Run it with:
+
+    python -m simulator.server --port 8090 --latency lognormal:3.0,0.5 \\
+        --error-rate listMarketBook:TOO_MUCH_DATA=0.01 --error-rate INVALID_SESSION=0.001
+
+Runtime control (JSON body, all keys optional):
+
+    POST /simulator/control {"latency": "normal:40,10", "error_rates": {"INVALID_SESSION": 0.5},
+                             "invalidate_sessions": true}
+"""
+import argparse
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from simulator.betting import BettingSimulator, SimulatorError
+
+# JSON-RPC method prefix used by the betting API
+METHOD_PREFIX = 'SportsAPING/v1.0/'
+
+# Error codes that can be injected, mapped to what Betfair actually returns
+INJECTABLE_ERRORS = {
+    'TOO_MUCH_DATA': 'TOO_MUCH_DATA',
+    'INVALID_SESSION': 'INVALID_SESSION_INFORMATION',
+    'TOO_MANY_REQUESTS': 'TOO_MANY_REQUESTS',
+    'UNEXPECTED_ERROR': 'UNEXPECTED_ERROR'
+}
+
+class LatencyDistribution:
+    """
+    Samples simulated server latency in milliseconds.
+
+    Specs: 'none', 'fixed:MS', 'uniform:LOW,HIGH', 'normal:MEAN,STD',
+    'lognormal:MU,SIGMA' (parameters of the underlying normal, in log-ms).
+    """
+
+    def __init__(self, spec='none', seed=None):
+        self.spec = spec or 'none'
+        self.random = random.Random(seed)
+        kind, _, args = self.spec.partition(':')
+        self.kind = kind
+        self.args = [float(value) for value in args.split(',')] if args else []
+        if kind not in ('none', 'fixed', 'uniform', 'normal', 'lognormal'):
+            raise ValueError(f"Unknown latency distribution: {self.spec}")
+
+    def sample(self):
+        """Draw one latency in milliseconds."""
+        if self.kind == 'fixed':
+            return self.args[0]
+        if self.kind == 'uniform':
+            return self.random.uniform(self.args[0], self.args[1])
+        if self.kind == 'normal':
+            return max(0.0, self.random.gauss(self.args[0], self.args[1]))
+        if self.kind == 'lognormal':
+            return math.exp(self.random.gauss(self.args[0], self.args[1]))
+        return 0.0
+
+class SimulatorState:
+    """Shared server state: the exchange, latency, error injection and sessions."""
+
+    def __init__(self, simulator, latency='none', method_latency=None, error_rates=None,
+                 strict_sessions=False, seed=None):
+        """
+        Initialize the server state.
+
+        Args:
+            simulator: BettingSimulator instance
+            latency: Default latency distribution spec
+            method_latency: Dict of operation name -> latency spec overrides
+            error_rates: Dict of '[operation:]ERROR' -> probability of injecting it
+            strict_sessions: Only accept session tokens issued by the identity endpoints
+            seed: Random seed for latency and error injection
+        """
+        self.simulator = simulator
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.latency = LatencyDistribution(latency, seed)
+        self.method_latency = {
+            method: LatencyDistribution(spec, seed) for method, spec in (method_latency or {}).items()
+        }
+        self.error_rates = dict(error_rates or {})
+        self.strict_sessions = strict_sessions
+        self.sessions = set()
+        self.requests = 0
+        self.errors_injected = 0
+
+    def issue_session(self):
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.sessions.add(token)
+        return token
+
+    def session_valid(self, token):
+        if not token:
+            return False
+        if not self.strict_sessions:
+            return True
+        with self.lock:
+            return token in self.sessions
+
+    def delay(self, method):
+        """Sleep for a latency drawn from the method's distribution."""
+        distribution = self.method_latency.get(method, self.latency)
+        with self.lock:
+            latency_ms = distribution.sample()
+        if latency_ms > 0:
+            time.sleep(latency_ms / 1000.0)
+
+    def injected_error(self, method):
+        """Return the error code to inject for this call, if any."""
+        with self.lock:
+            self.requests += 1
+            for key, rate in self.error_rates.items():
+                target, _, error = key.rpartition(':')
+                if target and target != method:
+                    continue
+                if self.random.random() < rate:
+                    self.errors_injected += 1
+                    return INJECTABLE_ERRORS.get(error, error)
+        return None
+
+class SimulatorRequestHandler(BaseHTTPRequestHandler):
+    """Routes betting JSON-RPC, identity and control requests."""
+
+    protocol_version = 'HTTP/1.1'  # Keep connections alive like the real endpoint
+    server_version = 'BetfairSimulator/1.0'
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        logging.getLogger('simulator.http').debug(format % args)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        path = self.path.split('?')[0].rstrip('/')
+
+        if path.endswith('/betting/json-rpc/v1'):
+            self._handle_json_rpc(body)
+        elif path.endswith('/keepAlive'):
+            self._handle_keep_alive()
+        elif path.endswith('/certlogin') or path.endswith('/login'):
+            self._handle_login(path, body)
+        elif path == '/simulator/control':
+            self._handle_control(body)
+        else:
+            self._send_json(404, {'error': f'Unknown path {self.path}'})
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/simulator/status':
+            self._send_json(200, {
+                'requests': self.state.requests,
+                'errors_injected': self.state.errors_injected,
+                'markets': len(self.state.simulator.markets),
+                'orders': len(self.state.simulator.orders),
+                'sessions': len(self.state.sessions)
+            })
+        else:
+            self._send_json(404, {'error': f'Unknown path {self.path}'})
+
+    def _handle_json_rpc(self, body):
+        try:
+            payload = json.loads(body or b'null')
+        except ValueError:
+            self._send_json(200, self._rpc_error(None, -32700, 'DSC-0008'))
+            return
+
+        # The API accepts a single call or a batch (list) of calls
+        if isinstance(payload, list):
+            self._send_json(200, [self._rpc_call(call) for call in payload])
+        else:
+            self._send_json(200, self._rpc_call(payload or {}))
+
+    def _rpc_call(self, call):
+        request_id = call.get('id')
+        method = (call.get('method') or '')
+        if method.startswith(METHOD_PREFIX):
+            method = method[len(METHOD_PREFIX):]
+
+        self.state.delay(method)
+
+        if not self.state.session_valid(self.headers.get('X-Authentication')):
+            return self._aping_error(request_id, 'INVALID_SESSION_INFORMATION')
+
+        injected = self.state.injected_error(method)
+        if injected:
+            return self._aping_error(request_id, injected)
+
+        try:
+            result = self.state.simulator.handle(method, call.get('params') or {})
+        except SimulatorError as e:
+            return self._aping_error(request_id, e.error_code)
+        except Exception as e:
+            logging.getLogger('simulator').exception(f"Simulator failure in {method}")
+            return self._aping_error(request_id, 'UNEXPECTED_ERROR', str(e))
+        return {'jsonrpc': '2.0', 'result': result, 'id': request_id}
+
+    @staticmethod
+    def _rpc_error(request_id, code, message):
+        return {'jsonrpc': '2.0', 'error': {'code': code, 'message': message}, 'id': request_id}
+
+    @staticmethod
+    def _aping_error(request_id, error_code, details=''):
+        return {
+            'jsonrpc': '2.0',
+            'error': {
+                'code': -32099,
+                'message': 'ANGX-0003',
+                'data': {
+                    'APINGException': {
+                        'requestUUID': str(uuid.uuid4()),
+                        'errorCode': error_code,
+                        'errorDetails': details
+                    },
+                    'exceptionname': 'APINGException'
+                }
+            },
+            'id': request_id
+        }
+
+    def _handle_keep_alive(self):
+        self.state.delay('keepAlive')
+        token = self.headers.get('X-Authentication')
+        if self.state.session_valid(token):
+            self._send_json(200, {'token': token, 'product': self.headers.get('X-Application'),
+                                  'status': 'SUCCESS', 'error': ''})
+        else:
+            self._send_json(200, {'token': '', 'product': self.headers.get('X-Application'),
+                                  'status': 'FAIL', 'error': 'NO_SESSION'})
+
+    def _handle_login(self, path, body):
+        self.state.delay('login')
+        form = parse_qs(body.decode('utf-8'))
+        if not form.get('username') or not form.get('password'):
+            response = {'loginStatus': 'INVALID_USERNAME_OR_PASSWORD'} if path.endswith('certlogin') \
+                else {'token': '', 'status': 'FAIL', 'error': 'INVALID_USERNAME_OR_PASSWORD'}
+            self._send_json(200, response)
+            return
+
+        token = self.state.issue_session()
+        if path.endswith('certlogin'):
+            self._send_json(200, {'sessionToken': token, 'loginStatus': 'SUCCESS'})
+        else:
+            self._send_json(200, {'token': token, 'product': self.headers.get('X-Application'),
+                                  'status': 'SUCCESS', 'error': ''})
+
+    def _handle_control(self, body):
+        try:
+            control = json.loads(body or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': 'Invalid JSON'})
+            return
+
+        state = self.state
+        with state.lock:
+            if 'latency' in control:
+                state.latency = LatencyDistribution(control['latency'])
+            if 'method_latency' in control:
+                state.method_latency = {
+                    method: LatencyDistribution(spec) for method, spec in control['method_latency'].items()
+                }
+            if 'error_rates' in control:
+                state.error_rates = {key: float(rate) for key, rate in control['error_rates'].items()}
+            if 'strict_sessions' in control:
+                state.strict_sessions = bool(control['strict_sessions'])
+            if control.get('invalidate_sessions'):
+                state.sessions.clear()
+                state.strict_sessions = True
+        self._send_json(200, {'status': 'SUCCESS'})
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class SimulatorServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the simulator state."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, state):
+        super().__init__(address, SimulatorRequestHandler)
+        self.state = state
+
+def _parse_error_rates(values):
+    """Parse repeated '[operation:]ERROR=RATE' options."""
+    rates = {}
+    for value in values or []:
+        key, _, rate = value.partition('=')
+        rates[key] = float(rate)
+    return rates
+
+def _parse_method_latency(values):
+    """Parse repeated 'operation=SPEC' options."""
+    return dict(value.split('=', 1) for value in values or [])
+
+def main(argv=None):
+    """Run the simulator server."""
+    parser = argparse.ArgumentParser(description='Local Betfair betting API simulator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--events-per-type', type=int, default=10)
+    parser.add_argument('--volatility', type=float, default=0.03)
+    parser.add_argument('--step-interval', type=float, default=1.0)
+    parser.add_argument('--latency', default='none', help="e.g. fixed:20, normal:40,10, lognormal:3.0,0.5")
+    parser.add_argument('--method-latency', action='append', help="e.g. placeOrders=normal:120,30")
+    parser.add_argument('--error-rate', action='append', help="e.g. TOO_MUCH_DATA=0.01 or listMarketBook:INVALID_SESSION=0.05")
+    parser.add_argument('--strict-sessions', action='store_true', help="Only accept tokens issued by login")
+    parser.add_argument('--stream-port', type=int, default=None,
+                        help="Also run the order stream stand-in and feed it simulated order changes")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    stand_in = None
+    order_listener = None
+    if args.stream_port:
+        from simulator.order_stream import OrderStreamStandIn
+        stand_in = OrderStreamStandIn(args.host, args.stream_port).start()
+        order_listener = lambda market_id, selection_id, order: stand_in.emit(
+            [{'id': market_id, 'orc': [{'id': selection_id, 'uo': [order]}]}]
+        )
+        logging.info(f"Order stream stand-in listening on {args.host}:{args.stream_port}")
+
+    simulator = BettingSimulator(
+        seed=args.seed,
+        events_per_type=args.events_per_type,
+        volatility=args.volatility,
+        step_interval=args.step_interval,
+        order_listener=order_listener
+    )
+    state = SimulatorState(
+        simulator,
+        latency=args.latency,
+        method_latency=_parse_method_latency(args.method_latency),
+        error_rates=_parse_error_rates(args.error_rate),
+        strict_sessions=args.strict_sessions,
+        seed=args.seed
+    )
+    server = SimulatorServer((args.host, args.port), state)
+    logging.info(f"Betfair simulator listening on http://{args.host}:{args.port} "
+                 f"({len(simulator.markets)} markets)")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if stand_in is not None:
+            stand_in.stop()
+
+if __name__ == '__main__':
+    main()
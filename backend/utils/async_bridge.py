@@ -0,0 +1,91 @@
+"""
+Sync bridge for running asyncio coroutines from Flask views.
+
+Flask request handlers are synchronous, but the async Betfair client keeps a
+pooled HTTP session that is bound to one event loop. This module owns a single
+long-lived event loop running in a daemon thread, so every request submits its
+coroutines to the same loop and reuses the same keep-alive connections.
+"""
+import asyncio
+import logging
+import threading
+from utils.metrics import get_call_origin, set_call_origin, reset_call_origin
+
+# Background event loop shared by the whole process
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+def _run_loop(loop):
+    """Run the background event loop until it is stopped."""
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+def get_event_loop():
+    """
+    Get the background event loop, starting it on first use.
+
+    Returns:
+        The asyncio event loop running in the bridge thread
+    """
+    global _loop, _loop_thread
+
+    if _loop is not None and _loop_thread is not None and _loop_thread.is_alive():
+        return _loop
+
+    with _loop_lock:
+        if _loop is None or _loop_thread is None or not _loop_thread.is_alive():
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(
+                target=_run_loop,
+                args=(_loop,),
+                name='async-bridge',
+                daemon=True
+            )
+            _loop_thread.start()
+            logging.debug("Async bridge event loop started")
+
+    return _loop
+
+async def _with_origin(coro, origin):
+    """Run a coroutine with the caller's endpoint as its call origin."""
+    token = set_call_origin(origin)
+    try:
+        return await coro
+    finally:
+        reset_call_origin(token)
+
+def run_sync(coro, timeout=None):
+    """
+    Run a coroutine on the background loop and block until it completes.
+
+    Args:
+        coro: The coroutine to run
+        timeout: Maximum number of seconds to wait for the result
+
+    Returns:
+        The coroutine's return value
+
+    Raises:
+        Whatever the coroutine raises, or concurrent.futures.TimeoutError
+    """
+    # Tag calls with the originating endpoint, which is not visible from the loop thread
+    future = asyncio.run_coroutine_threadsafe(_with_origin(coro, get_call_origin()), get_event_loop())
+    try:
+        return future.result(timeout)
+    except Exception:
+        future.cancel()
+        raise
+
+def shutdown(timeout=5):
+    """Stop the background event loop during application shutdown."""
+    global _loop, _loop_thread
+
+    with _loop_lock:
+        if _loop is None:
+            return
+        _loop.call_soon_threadsafe(_loop.stop)
+        if _loop_thread is not None:
+            _loop_thread.join(timeout)
+        _loop = None
+        _loop_thread = None
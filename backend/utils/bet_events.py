@@ -0,0 +1,62 @@
+"""
+Bet lifecycle events for the BetPro Backend application.
+
+The bet write paths (placement, cancellation, order reconciliation and
+settlement) publish what they changed here so in-memory views of open bets,
+such as the position engine, can update incrementally instead of re-reading
+the bets collection.
+"""
+import logging
+import threading
+
+# Event types
+BET_PLACED = 'placed'
+BET_UPDATED = 'updated'
+BET_CANCELLED = 'cancelled'
+BET_SETTLED = 'settled'
+
+logger = logging.getLogger('bet_events')
+
+_subscribers = []
+_lock = threading.Lock()
+
+def subscribe(handler):
+    """
+    Register a handler called as handler(event, bets) for every published event.
+
+    Args:
+        handler: Callable taking an event type and a list of bet dicts
+    """
+    with _lock:
+        if handler not in _subscribers:
+            _subscribers.append(handler)
+
+def unsubscribe(handler):
+    """Remove a previously registered handler."""
+    with _lock:
+        if handler in _subscribers:
+            _subscribers.remove(handler)
+
+def publish(event, bets):
+    """
+    Deliver a bet event to every subscriber.
+
+    Bets are bet documents, or partial dicts carrying 'bet_id' and the fields
+    that changed. A failing subscriber is logged and never fails the write
+    path that published the event.
+
+    Args:
+        event: One of the BET_* event types
+        bets: Bet dict or list of bet dicts
+    """
+    if isinstance(bets, dict):
+        bets = [bets]
+    if not bets:
+        return
+    with _lock:
+        handlers = list(_subscribers)
+    for handler in handlers:
+        try:
+            handler(event, bets)
+        except Exception as e:
+            logger.error(f"Error handling bet event {event}: {e}")
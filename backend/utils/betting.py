@@ -0,0 +1,138 @@
+"""
+Betting helpers for the BetPro Backend application.
+
+Liability and status calculations shared by the bet placement, cancellation
+and settlement code paths, plus the Betfair price ladder.
+"""
+from bisect import bisect_left
+
+# Betfair accepts at most 200 place instructions per placeOrders call
+MAX_PLACE_INSTRUCTIONS = 200
+
+# Betfair price ladder: (band start, band end, tick increment)
+TICK_BANDS = [
+    (1.01, 2.0, 0.01),
+    (2.0, 3.0, 0.02),
+    (3.0, 4.0, 0.05),
+    (4.0, 6.0, 0.1),
+    (6.0, 10.0, 0.2),
+    (10.0, 20.0, 0.5),
+    (20.0, 30.0, 1.0),
+    (30.0, 50.0, 2.0),
+    (50.0, 100.0, 5.0),
+    (100.0, 1000.0, 10.0)
+]
+
+def _build_ladder():
+    """Expand the tick bands into the full list of valid prices (1.01 .. 1000)."""
+    prices = []
+    for start, end, increment in TICK_BANDS:
+        steps = int(round((end - start) / increment))
+        prices.extend(round(start + i * increment, 2) for i in range(steps))
+    prices.append(TICK_BANDS[-1][1])
+    return prices
+
+# Every valid Betfair price in ascending order; a price's index is its tick
+PRICE_LADDER = _build_ladder()
+
+def price_to_tick(price):
+    """
+    Get the ladder index of a price.
+
+    Returns:
+        The tick index, or None if the price is not on the ladder
+    """
+    index = bisect_left(PRICE_LADDER, round(price, 2))
+    if index < len(PRICE_LADDER) and PRICE_LADDER[index] == round(price, 2):
+        return index
+    return None
+
+def tick_to_price(tick):
+    """Get the price at a ladder index, clamped to the ladder bounds."""
+    return PRICE_LADDER[max(0, min(tick, len(PRICE_LADDER) - 1))]
+
+def nearest_tick(price):
+    """Get the ladder index of the valid price closest to `price`."""
+    index = bisect_left(PRICE_LADDER, price)
+    if index <= 0:
+        return 0
+    if index >= len(PRICE_LADDER):
+        return len(PRICE_LADDER) - 1
+    below, above = PRICE_LADDER[index - 1], PRICE_LADDER[index]
+    return index - 1 if price - below <= above - price else index
+
+def calculate_liability(side, price, size):
+    """
+    Calculate the amount a bet puts at risk.
+
+    Args:
+        side: 'BACK' or 'LAY'
+        price: Decimal odds
+        size: Stake
+
+    Returns:
+        The stake for a back bet, or the payout owed if a lay bet loses
+    """
+    if side.upper() == 'LAY':
+        return size * (price - 1)
+    return size
+
+def remaining_liability(bet):
+    """
+    Calculate the liability still held for the unmatched part of a bet.
+
+    Args:
+        bet: Bet document with side, price, liability and size_matched
+
+    Returns:
+        The liability that is released if the unmatched part is cancelled
+    """
+    matched_liability = calculate_liability(bet['side'], bet['price'], bet.get('size_matched') or 0)
+    return max(bet['liability'] - matched_liability, 0)
+
+def bet_status(size, size_matched):
+    """
+    Derive the bet status from the matched size.
+
+    Args:
+        size: Requested stake
+        size_matched: Stake matched so far
+
+    Returns:
+        'MATCHED', 'PARTIALLY_MATCHED' or 'UNMATCHED'
+    """
+    size_matched = size_matched or 0
+    if size_matched <= 0:
+        return 'UNMATCHED'
+    if size_matched >= size:
+        return 'MATCHED'
+    return 'PARTIALLY_MATCHED'
+
+def limit_order_instruction(selection_id, side, price, size, customer_order_ref=None):
+    """
+    Build a Betfair LIMIT place instruction.
+
+    Args:
+        selection_id: Runner selection ID
+        side: 'BACK' or 'LAY'
+        price: Decimal odds
+        size: Stake
+        customer_order_ref: Optional per-order reference echoed back by Betfair
+
+    Returns:
+        The place instruction (camelCase keys)
+    """
+    instruction = {
+        'selectionId': selection_id,
+        'handicap': 0,
+        'side': side.upper(),
+        'orderType': 'LIMIT',
+        'limitOrder': {
+            'size': size,
+            'price': price,
+            'persistenceType': 'LAPSE'
+        }
+    }
+    if customer_order_ref:
+        instruction['customerOrderRef'] = customer_order_ref
+    return instruction
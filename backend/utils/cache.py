@@ -4,10 +4,14 @@ Caching utilities for the BetPro Backend application.
 This module provides caching mechanisms to improve application performance
 by storing frequently accessed data in memory.
 """
+import copy
 import time
 import functools
+import threading
+from collections import OrderedDict
 from flask import g, current_app, session
 import logging
+from utils import user_events
 
 class SimpleCache:
     """Simple in-memory cache implementation"""
@@ -44,13 +48,135 @@ class SimpleCache:
         """Clear all items from cache"""
         self._cache.clear()
 
+class LRUCache:
+    """Thread-safe in-memory cache bounded in size, evicting the least recently used item"""
+    
+    def __init__(self, maxsize=10000, ttl=60):
+        """
+        Initialize the cache.
+        
+        Args:
+            maxsize: Items kept before the least recently used one is evicted
+            ttl: Default time to live in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def configure(self, maxsize=None, ttl=None):
+        """Change the size bound and default TTL, evicting down to the new bound"""
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            self._evict()
+    
+    def get(self, key):
+        """Get value from cache if it exists and is not expired"""
+        with self._lock:
+            item = self._cache.get(key)
+            if item is None or item[1] < time.monotonic():
+                if item is not None:
+                    del self._cache[key]
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return item[0]
+    
+    def set(self, key, value, ttl=None):
+        """Set value in cache with expiration time"""
+        with self._lock:
+            self._cache[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._cache.move_to_end(key)
+            self._evict()
+    
+    def delete(self, key):
+        """Delete item from cache"""
+        with self._lock:
+            self._cache.pop(key, None)
+    
+    def clear(self):
+        """Clear all items from cache"""
+        with self._lock:
+            self._cache.clear()
+    
+    def get_stats(self):
+        """Get size and hit counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._cache),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0
+            }
+    
+    def _evict(self):
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+
 # Global cache instance
 _cache = SimpleCache()
 
+# User documents looked up by the authentication decorators, by user ID
+_user_cache = LRUCache()
+
+# Betting balance moved by bets and settlement outside the user services;
+# never cached, read from the database where it is shown
+UNCACHED_USER_FIELDS = ('balance',)
+
 def get_cache():
     """Get the cache instance"""
     return _cache
 
+def get_user_cache():
+    """Get the user cache instance"""
+    return _user_cache
+
+def get_cached_user(user_id, loader):
+    """
+    Get a user document through the user cache.
+    
+    Callers get their own copy, so changing it never changes the cached one.
+    The cached copy has no UNCACHED_USER_FIELDS.
+    
+    Args:
+        user_id: User ID (string or ObjectId)
+        loader: Callable returning the user document, or None, on a miss
+        
+    Returns:
+        User document or None
+    """
+    key = str(user_id)
+    user = _user_cache.get(key)
+    if user is None:
+        user = loader()
+        if user is None:
+            return None
+        user = {field: value for field, value in user.items() if field not in UNCACHED_USER_FIELDS}
+        _user_cache.set(key, user)
+    return copy.deepcopy(user)
+
+def invalidate_user(user_id):
+    """Drop a user from the user cache"""
+    _user_cache.delete(str(user_id))
+
+def _invalidate_users(event, user_ids):
+    for user_id in user_ids:
+        invalidate_user(user_id)
+
+user_events.subscribe(_invalidate_users)
+
 def cached(ttl=300, key_prefix=''):
     """
     Decorator to cache function results.
@@ -0,0 +1,149 @@
+"""
+Streaming export helpers for the BetPro Backend application.
+
+Exports iterate a MongoDB cursor in batches with a projection and yield CSV
+or NDJSON text in chunks, optionally gzip-compressed on the fly, so memory
+use stays constant however many rows are exported.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from bson import ObjectId
+from flask import Response, stream_with_context
+
+# Documents fetched from MongoDB per cursor batch
+EXPORT_BATCH_SIZE = 1000
+
+# Rows buffered into one chunk of the response body
+ROWS_PER_CHUNK = 500
+
+# Chronological order; walks the (user_id, created_at, _id) index forwards
+EXPORT_SORT = [('created_at', 1), ('_id', 1)]
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+def iter_documents(collection, query, fields, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Iterate matching documents in batches, reading only the exported fields.
+
+    Args:
+        collection: MongoDB collection
+        query: Filter
+        fields: List of (column, document field) pairs
+        batch_size: Documents per cursor batch
+
+    Returns:
+        Cursor over the documents, in EXPORT_SORT order
+    """
+    projection = {field: 1 for _, field in fields}
+    return collection.find(query, projection).sort(EXPORT_SORT).batch_size(batch_size)
+
+def _format_value(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def _row(doc, fields):
+    return [_format_value(doc.get(field)) for _, field in fields]
+
+def csv_chunks(docs, fields):
+    """Yield CSV text: a header line, then ROWS_PER_CHUNK rows per chunk."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column for column, _ in fields])
+
+    rows = 0
+    for doc in docs:
+        writer.writerow(_row(doc, fields))
+        rows += 1
+        if rows % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def ndjson_chunks(docs, fields):
+    """Yield one JSON object per line, ROWS_PER_CHUNK lines per chunk."""
+    lines = []
+    for doc in docs:
+        lines.append(json.dumps(dict(zip((column for column, _ in fields), _row(doc, fields)))))
+        if len(lines) == ROWS_PER_CHUNK:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def gzip_chunks(chunks):
+    """Gzip a stream of text chunks on the fly."""
+    compressor = zlib.compressobj(wbits=31)  # 31 selects the gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_response(docs, fields, export_format, filename, compress=False):
+    """
+    Build a streaming download response.
+
+    Args:
+        docs: Iterable of documents (usually from iter_documents)
+        fields: List of (column, document field) pairs
+        export_format: 'csv' or 'ndjson'
+        filename: Download file name without extension
+        compress: Gzip the body on the fly
+
+    Returns:
+        Flask Response streaming the export
+    """
+    chunks = csv_chunks(docs, fields) if export_format == 'csv' else ndjson_chunks(docs, fields)
+    mimetype = EXPORT_FORMATS[export_format]
+    filename = f"{filename}.{export_format}"
+    if compress:
+        chunks = gzip_chunks(chunks)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+def parse_export_args(args):
+    """
+    Read format, gzip and the created_at range from request arguments.
+
+    Returns:
+        Dict with format, compress and created_at (a range filter or None)
+
+    Raises:
+        ValueError: If an argument is invalid
+    """
+    export_format = (args.get('format') or 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+
+    created_at = {}
+    for arg, operator in (('from', '$gte'), ('to', '$lt')):
+        if args.get(arg):
+            try:
+                created_at[operator] = datetime.fromisoformat(args[arg])
+            except ValueError:
+                raise ValueError(f'{arg} must be an ISO date or datetime')
+
+    return {
+        'format': export_format,
+        'compress': (args.get('gzip') or 'false').lower() == 'true',
+        'created_at': created_at or None
+    }
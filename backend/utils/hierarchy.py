@@ -0,0 +1,108 @@
+"""
+User hierarchy helpers for the BetPro Backend application.
+
+Every user document carries `ancestors`: the IDs of its parent chain, root
+first and direct parent last. The array is indexed, so a user's ancestor
+chain is one query, "is X in Y's downline" is an indexed lookup on
+{'_id': X, 'ancestors': Y}, and a whole subtree is one {'ancestors': Y}
+find. The array is set when a user is created and rewritten for the whole
+subtree, with one update_many, when a user moves to another parent.
+"""
+from bson import ObjectId
+
+def _oid(value):
+    return ObjectId(value) if isinstance(value, str) else value
+
+def ancestors_for_parent(users, parent_id):
+    """
+    Ancestors of a new child of `parent_id`.
+
+    Returns:
+        The parent's ancestors followed by the parent, [] without a parent,
+        or None if the parent does not exist
+    """
+    if not parent_id:
+        return []
+    parent_id = _oid(parent_id)
+    parent = users.find_one({'_id': parent_id}, {'ancestors': 1})
+    if parent is None:
+        return None
+    return list(parent.get('ancestors') or []) + [parent_id]
+
+def is_in_downline(users, ancestor_id, user_id):
+    """Check whether `user_id` is anywhere below `ancestor_id`."""
+    return users.count_documents({'_id': _oid(user_id), 'ancestors': _oid(ancestor_id)}, limit=1) > 0
+
+def downline_query(ancestor_id):
+    """Query matching every user below `ancestor_id`."""
+    return {'ancestors': _oid(ancestor_id)}
+
+def get_ancestors(users, user, projection=None):
+    """
+    Fetch a user's ancestor documents with one query.
+
+    Args:
+        users: Users collection
+        user: User document (or User object) with `ancestors`
+        projection: Optional projection for the ancestor documents
+
+    Returns:
+        List of ancestor documents, direct parent first
+    """
+    ancestor_ids = user.get('ancestors') if isinstance(user, dict) else getattr(user, 'ancestors', None)
+    if not ancestor_ids:
+        return []
+    found = {doc['_id']: doc for doc in users.find({'_id': {'$in': ancestor_ids}}, projection)}
+    return [found[ancestor_id] for ancestor_id in reversed(ancestor_ids) if ancestor_id in found]
+
+def reparent(users, user_id, new_parent_id):
+    """
+    Move a user, with its whole subtree, under another parent.
+
+    The user's ancestors become the new parent's chain; every descendant
+    keeps the part of its chain from the user down and gets the new chain
+    in front of it, all in one pipeline update_many.
+
+    Args:
+        users: Users collection
+        user_id: User to move
+        new_parent_id: New parent, or None to make the user a root
+
+    Returns:
+        Tuple of (number of descendants moved along, error message)
+    """
+    user_id = _oid(user_id)
+    new_parent_id = _oid(new_parent_id) if new_parent_id else None
+    user = users.find_one({'_id': user_id}, {'parent_id': 1})
+    if user is None:
+        return 0, "User not found"
+
+    new_chain = ancestors_for_parent(users, new_parent_id)
+    if new_chain is None:
+        return 0, "Parent user not found"
+    if user_id in new_chain:
+        return 0, "A user cannot be moved below itself or its own downline"
+
+    users.update_one(
+        {'_id': user_id},
+        {'$set': {'parent_id': new_parent_id, 'ancestors': new_chain}}
+    )
+    moved = users.update_many(
+        {'ancestors': user_id},
+        [{'$set': {'ancestors': {'$concatArrays': [
+            new_chain,
+            {'$slice': [
+                '$ancestors',
+                {'$indexOfArray': ['$ancestors', user_id]},
+                {'$size': '$ancestors'}
+            ]}
+        ]}}}]
+    ).modified_count
+
+    # children lists hold the IDs as strings or ObjectIds depending on the writer
+    old_parent_id = user.get('parent_id')
+    if old_parent_id:
+        users.update_one({'_id': _oid(old_parent_id)}, {'$pull': {'children': {'$in': [user_id, str(user_id)]}}})
+    if new_parent_id:
+        users.update_one({'_id': new_parent_id}, {'$addToSet': {'children': str(user_id)}})
+    return moved, None
@@ -0,0 +1,157 @@
+"""
+In-process call metrics for the BetPro Backend application.
+
+Records latency histograms, error codes, ids per call and request weight for
+outbound API calls, keyed by operation and by the endpoint (or background
+task) that originated the call.
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from flask import has_request_context, request
+
+# Latency histogram bucket upper bounds in milliseconds (last bucket is +Inf)
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# Origin override for code running outside the request thread (async bridge, tasks)
+_call_origin = contextvars.ContextVar('call_origin', default=None)
+
+def get_call_origin():
+    """
+    Get the endpoint or task a call originates from.
+
+    Returns:
+        The explicitly set origin, else the Flask endpoint of the current
+        request, else the current thread name
+    """
+    origin = _call_origin.get()
+    if origin:
+        return origin
+    if has_request_context():
+        return request.endpoint or request.path
+    return threading.current_thread().name
+
+def set_call_origin(origin):
+    """Set the origin for the current context; returns a token for reset_call_origin."""
+    return _call_origin.set(origin)
+
+def reset_call_origin(token):
+    """Restore the origin set before set_call_origin."""
+    _call_origin.reset(token)
+
+class Histogram:
+    """Fixed-bucket latency histogram."""
+
+    def __init__(self, buckets=None):
+        self.buckets = list(buckets or LATENCY_BUCKETS_MS)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Approximate quantile: upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets + [self.max], self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count, 2) if self.count else None,
+            'p50_ms': self.quantile(0.5),
+            'p95_ms': self.quantile(0.95),
+            'p99_ms': self.quantile(0.99),
+            'max_ms': round(self.max, 2),
+            'buckets': {
+                **{f'le_{bound}': count for bound, count in zip(self.buckets, self.counts)},
+                'le_inf': self.counts[-1]
+            }
+        }
+
+class _OperationStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = {}
+        self.ids = 0
+        self.max_ids = 0
+        self.weight = 0
+        self.max_weight = 0
+
+class CallMetrics:
+    """Thread-safe registry of per-(operation, origin) call statistics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.started_at = time.time()
+
+    def record(self, operation, origin, latency_ms, error_code=None, ids=0, weight=0):
+        """
+        Record one call.
+
+        Args:
+            operation: API operation name, e.g. 'listMarketBook'
+            origin: Endpoint or task that made the call
+            latency_ms: Wall-clock duration of the call
+            error_code: Error code if the call failed
+            ids: Number of ids (markets, bets or instructions) in the call
+            weight: Request weight charged by the API
+        """
+        with self._lock:
+            stats = self._stats.get((operation, origin))
+            if stats is None:
+                stats = self._stats[(operation, origin)] = _OperationStats()
+            stats.latency.observe(latency_ms)
+            if error_code:
+                stats.errors[error_code] = stats.errors.get(error_code, 0) + 1
+            stats.ids += ids
+            stats.max_ids = max(stats.max_ids, ids)
+            stats.weight += weight
+            stats.max_weight = max(stats.max_weight, weight)
+
+    def snapshot(self):
+        """Get all statistics grouped by operation, then origin."""
+        with self._lock:
+            operations = {}
+            for (operation, origin), stats in sorted(self._stats.items()):
+                calls = stats.latency.count
+                operations.setdefault(operation, {})[origin] = {
+                    'calls': calls,
+                    'errors': sum(stats.errors.values()),
+                    'error_codes': dict(stats.errors),
+                    'latency': stats.latency.to_dict(),
+                    'ids_total': stats.ids,
+                    'ids_per_call': round(stats.ids / calls, 2) if calls else 0,
+                    'max_ids': stats.max_ids,
+                    'weight_total': stats.weight,
+                    'weight_per_call': round(stats.weight / calls, 2) if calls else 0,
+                    'max_weight': stats.max_weight
+                }
+            return {
+                'since': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.started_at)),
+                'operations': operations
+            }
+
+    def reset(self):
+        """Clear all statistics."""
+        with self._lock:
+            self._stats = {}
+            self.started_at = time.time()
+
+# Process-wide registry for Betfair calls
+betfair_metrics = CallMetrics()
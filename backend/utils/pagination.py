@@ -0,0 +1,266 @@
+"""
+Keyset pagination helpers for the BetPro Backend application.
+
+Listings sorted newest first page with an opaque `after` token holding the
+created_at and _id of the last document returned, instead of skip/offset.
+With a (user_id, created_at, _id) index every page is an index range scan,
+however deep the client pages. Listings sorted by another field use the
+same scheme with tokens holding that field's value and the _id.
+"""
+import base64
+import json
+from datetime import datetime
+from bson import ObjectId
+
+# Newest-first sort used by keyset listings; _id breaks created_at ties
+KEYSET_SORT = [('created_at', -1), ('_id', -1)]
+
+# Total counts stop counting at this many documents
+MAX_COUNT = 10000
+
+# Largest page a listing returns
+MAX_PAGE_SIZE = 200
+
+# Accepted values of the `total` query parameter
+TOTAL_MODES = ('none', 'estimate', 'exact')
+
+def encode_cursor(doc):
+    """
+    Build the `after` token for the page that follows a document.
+
+    Args:
+        doc: Last document of the page (needs created_at and _id)
+
+    Returns:
+        URL-safe token string
+    """
+    created_at = doc.get('created_at')
+    payload = {
+        't': created_at.isoformat() if isinstance(created_at, datetime) else created_at,
+        'i': str(doc['_id'])
+    }
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token):
+    """
+    Decode an `after` token.
+
+    Returns:
+        Tuple of (created_at, _id)
+
+    Raises:
+        ValueError: If the token is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        created_at = datetime.fromisoformat(payload['t']) if payload.get('t') else None
+        return created_at, ObjectId(payload['i'])
+    except Exception:
+        raise ValueError('Invalid pagination token')
+
+def keyset_query(query, after):
+    """
+    Restrict a query to documents after a token in KEYSET_SORT order.
+
+    Args:
+        query: Base filter
+        after: `after` token, or None for the first page
+
+    Returns:
+        New filter dict
+    """
+    if not after:
+        return dict(query)
+    created_at, last_id = decode_cursor(after)
+    if created_at is None:
+        position = {'created_at': None, '_id': {'$lt': last_id}}
+    else:
+        position = {'$or': [
+            {'created_at': {'$lt': created_at}},
+            {'created_at': created_at, '_id': {'$lt': last_id}}
+        ]}
+    return {'$and': [query, position]} if query else position
+
+def keyset_page(collection, query, limit, after=None, projection=None):
+    """
+    Fetch one newest-first page.
+
+    One extra document is read to know whether another page exists, so no
+    count is needed to build the next token. An inclusion projection must
+    keep created_at.
+
+    Returns:
+        Tuple of (documents, next `after` token or None)
+    """
+    docs = list(
+        collection.find(keyset_query(query, after), projection)
+        .sort(KEYSET_SORT)
+        .limit(limit + 1)
+    )
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    return docs, encode_cursor(docs[-1])
+
+def encode_sort_cursor(field, value, doc_id):
+    """
+    Build the `after` token of a listing sorted by `field`, then _id.
+
+    Args:
+        field: Sort field, checked again when the token comes back
+        value: The last document's value of the sort field
+        doc_id: The last document's _id
+
+    Returns:
+        URL-safe token string
+    """
+    payload = {'f': field, 'v': value, 'i': str(doc_id)}
+    if isinstance(value, datetime):
+        payload['v'] = value.isoformat()
+        payload['d'] = 1
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_sort_cursor(token, field):
+    """
+    Decode an `after` token built by encode_sort_cursor.
+
+    Returns:
+        Tuple of (sort value, _id)
+
+    Raises:
+        ValueError: If the token is malformed or was built for another sort
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        value = payload.get('v')
+        if payload.get('d') and value is not None:
+            value = datetime.fromisoformat(value)
+        last_id = ObjectId(payload['i'])
+    except Exception:
+        raise ValueError('Invalid pagination token')
+    if payload.get('f') != field:
+        raise ValueError('Pagination token belongs to another sort order')
+    return value, last_id
+
+def sort_keyset_query(query, field, direction, after):
+    """
+    Restrict a query to documents after a token in (field, _id) order.
+
+    Missing and null values sort first ascending and last descending, as in
+    MongoDB, and get their own branch since range operators skip them.
+
+    Args:
+        query: Base filter
+        field: Sort field
+        direction: 1 or -1, used for both the field and _id
+        after: `after` token, or None for the first page
+
+    Returns:
+        New filter dict
+    """
+    if not after:
+        return dict(query)
+    value, last_id = decode_sort_cursor(after, field)
+    past = '$gt' if direction == 1 else '$lt'
+    if value is None:
+        branches = [{field: None, '_id': {past: last_id}}]
+        if direction == 1:
+            branches.append({field: {'$ne': None}})
+    else:
+        branches = [{field: {past: value}}, {field: value, '_id': {past: last_id}}]
+        if direction == -1:
+            branches.append({field: None})
+    position = {'$or': branches}
+    return {'$and': [query, position]} if query else position
+
+def count_total(collection, query, mode=None):
+    """
+    Count the documents of a listing on request.
+
+    Args:
+        mode: None or 'none' to skip counting, 'exact' for a full count,
+            'estimate' for a count capped at MAX_COUNT
+
+    Returns:
+        Tuple of (total or None, whether the total was capped)
+    """
+    if not mode or mode == 'none':
+        return None, False
+    if mode == 'exact':
+        return collection.count_documents(query), False
+    total = collection.count_documents(query, limit=MAX_COUNT)
+    return total, total >= MAX_COUNT
+
+def parse_page_args(args, default_limit=50):
+    """
+    Read limit, after, offset and total from request arguments.
+
+    Offset is still honoured for clients that have not moved to `after`
+    tokens; it is ignored when a token is given. The total is estimated on
+    the first page and skipped on later pages unless asked for.
+
+    Returns:
+        Dict with limit, after, offset and total_mode
+
+    Raises:
+        ValueError: If an argument is invalid
+    """
+    try:
+        limit = int(args.get('limit', default_limit))
+        offset = int(args.get('offset', 0))
+    except (TypeError, ValueError):
+        raise ValueError('limit and offset must be integers')
+    if limit < 1 or offset < 0:
+        raise ValueError('limit must be positive and offset not negative')
+
+    after = args.get('after') or None
+    if after:
+        decode_cursor(after)
+        offset = 0
+
+    total_mode = (args.get('total') or ('none' if after else 'estimate')).lower()
+    if total_mode not in TOTAL_MODES:
+        raise ValueError(f"total must be one of: {', '.join(TOTAL_MODES)}")
+
+    return {
+        'limit': min(limit, MAX_PAGE_SIZE),
+        'after': after,
+        'offset': offset,
+        'total_mode': total_mode
+    }
+
+def fetch_page(collection, query, page, projection=None):
+    """
+    Fetch a page described by parse_page_args.
+
+    Returns:
+        Tuple of (documents, pagination dict for the response)
+    """
+    if page['offset']:
+        # Legacy offset paging: skip to the offset, then continue by keyset
+        docs = list(
+            collection.find(query, projection)
+            .sort(KEYSET_SORT)
+            .skip(page['offset'])
+            .limit(page['limit'] + 1)
+        )
+        next_after = encode_cursor(docs[page['limit'] - 1]) if len(docs) > page['limit'] else None
+        docs = docs[:page['limit']]
+    else:
+        docs, next_after = keyset_page(collection, query, page['limit'], page['after'], projection)
+
+    total, capped = count_total(collection, query, page['total_mode'])
+    pagination = {
+        'limit': page['limit'],
+        'offset': page['offset'],
+        'next_after': next_after,
+        'has_more': next_after is not None,
+        'total': total
+    }
+    if capped:
+        pagination['total_capped'] = True
+    return docs, pagination
@@ -0,0 +1,97 @@
+"""
+Betfair request weight accounting for the BetPro Backend application.
+
+Betfair rejects listMarketBook and listMarketCatalogue requests whose
+weight (per-market projection weight x number of markets) exceeds 200 with
+TOO_MUCH_DATA. These helpers compute the weight of a request the same way.
+"""
+
+# Maximum weight Betfair accepts in a single request
+REQUEST_WEIGHT_LIMIT = 200
+
+# listMarketBook weight per market for each priceData value
+PRICE_DATA_WEIGHTS = {
+    'SP_AVAILABLE': 3,
+    'SP_TRADED': 7,
+    'EX_BEST_OFFERS': 5,
+    'EX_ALL_OFFERS': 17,
+    'EX_TRADED': 17
+}
+
+# Combinations Betfair weighs less than the sum of their parts
+PRICE_DATA_COMBINATIONS = {
+    frozenset(['EX_BEST_OFFERS', 'EX_TRADED']): 20,
+    frozenset(['EX_ALL_OFFERS', 'EX_TRADED']): 32
+}
+
+# listMarketBook weight per market with no priceData
+EMPTY_PRICE_DATA_WEIGHT = 2
+
+# listMarketCatalogue weight per market for each marketProjection value
+MARKET_PROJECTION_WEIGHTS = {
+    'COMPETITION': 0,
+    'EVENT': 0,
+    'EVENT_TYPE': 0,
+    'MARKET_START_TIME': 0,
+    'MARKET_DESCRIPTION': 1,
+    'RUNNER_DESCRIPTION': 0,
+    'RUNNER_METADATA': 1
+}
+
+def market_book_weight(price_data=None, best_prices_depth=None):
+    """
+    Weight of one market in a listMarketBook request.
+
+    Args:
+        price_data: List of priceData values from the price projection
+        best_prices_depth: exBestOffersOverrides.bestPricesDepth, if set
+
+    Returns:
+        The per-market weight
+    """
+    price_data = set(price_data or [])
+    if not price_data:
+        return EMPTY_PRICE_DATA_WEIGHT
+
+    weight = 0
+    remaining = set(price_data)
+    for combination, combination_weight in PRICE_DATA_COMBINATIONS.items():
+        if combination <= remaining:
+            weight += combination_weight
+            remaining -= combination
+    weight += sum(PRICE_DATA_WEIGHTS.get(value, 0) for value in remaining)
+
+    # EX_BEST_OFFERS is priced for the default depth of 3 and scales beyond it
+    if 'EX_BEST_OFFERS' in price_data and best_prices_depth and best_prices_depth > 3:
+        weight += PRICE_DATA_WEIGHTS['EX_BEST_OFFERS'] * (best_prices_depth - 3) // 3
+    return weight
+
+def market_catalogue_weight(market_projection=None):
+    """Weight of one market in a listMarketCatalogue request."""
+    return sum(MARKET_PROJECTION_WEIGHTS.get(value, 0) for value in market_projection or [])
+
+def price_projection_weight(price_projection):
+    """Per-market weight of a camelCase priceProjection dict."""
+    price_projection = price_projection or {}
+    overrides = price_projection.get('exBestOffersOverrides') or {}
+    return market_book_weight(price_projection.get('priceData'), overrides.get('bestPricesDepth'))
+
+def request_weight(operation, market_ids=None, price_projection=None, max_results=None, market_projection=None):
+    """
+    Total weight of a betting request.
+
+    Args:
+        operation: Betting operation name, e.g. 'listMarketBook'
+        market_ids: Market IDs of a listMarketBook request
+        price_projection: camelCase priceProjection of a listMarketBook request
+        max_results: maxResults of a listMarketCatalogue request
+        market_projection: marketProjection of a listMarketCatalogue request
+
+    Returns:
+        The request weight, or 0 for operations Betfair does not weigh
+    """
+    if operation == 'listMarketBook':
+        return price_projection_weight(price_projection) * len(market_ids or [])
+    if operation == 'listMarketCatalogue':
+        return market_catalogue_weight(market_projection) * (max_results or 0)
+    return 0
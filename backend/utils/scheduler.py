@@ -0,0 +1,76 @@
+"""
+Background task utilities for the BetPro Backend application.
+
+This module provides a small periodic task runner used by services that need
+to do work on a schedule (session keep-alive, reconciliation jobs, etc.)
+without blocking request handling.
+"""
+import logging
+import threading
+
+class PeriodicTask:
+    """Run a function every `interval` seconds in a daemon thread."""
+
+    def __init__(self, name, interval, func, run_immediately=False):
+        """
+        Initialize a periodic task.
+
+        Args:
+            name: Thread name, also used in log messages
+            interval: Seconds between runs
+            func: Callable invoked with no arguments on every run
+            run_immediately: Run once as soon as the task starts
+        """
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.run_immediately = run_immediately
+        self.logger = logging.getLogger(f"task.{name}")
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        """Check if the task thread is alive."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the task thread if it is not already running."""
+        if self.is_running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        self.logger.debug(f"Started periodic task every {self.interval}s")
+
+    def stop(self, timeout=5):
+        """Stop the task thread and wait for it to exit."""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def trigger(self):
+        """Wake the task up so it runs now instead of at the next interval."""
+        self._wake_event.set()
+
+    def _run(self):
+        """Task loop: wait for the interval (or a trigger) then run the function."""
+        if self.run_immediately:
+            self._run_once()
+
+        while not self._stop_event.is_set():
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+            if self._stop_event.is_set():
+                break
+            self._run_once()
+
+    def _run_once(self):
+        """Run the function, logging and swallowing errors so the loop survives."""
+        try:
+            self.func()
+        except Exception as e:
+            self.logger.error(f"Error in periodic task {self.name}: {e}")
@@ -0,0 +1,65 @@
+"""
+User write events for the BetPro Backend application.
+
+The user write paths (creation, profile, role, status and password updates,
+moves in the hierarchy, deactivation and wallet changes) publish the IDs of
+the users they changed here, so in-process caches of user data, such as the
+authentication user cache and the dashboard's listing counts, are
+invalidated when the data changes instead of only expiring.
+Events are process-local; caches keep a TTL for writes made by other
+processes.
+"""
+import logging
+import threading
+
+# Event types
+USER_CREATED = 'created'
+USER_UPDATED = 'updated'
+USER_DEACTIVATED = 'deactivated'
+USER_WALLET_CHANGED = 'wallet_changed'
+
+logger = logging.getLogger('user_events')
+
+_subscribers = []
+_lock = threading.Lock()
+
+def subscribe(handler):
+    """
+    Register a handler called as handler(event, user_ids) for every published event.
+
+    Args:
+        handler: Callable taking an event type and a list of user IDs
+    """
+    with _lock:
+        if handler not in _subscribers:
+            _subscribers.append(handler)
+
+def unsubscribe(handler):
+    """Remove a previously registered handler."""
+    with _lock:
+        if handler in _subscribers:
+            _subscribers.remove(handler)
+
+def publish(event, user_ids):
+    """
+    Deliver a user event to every subscriber.
+
+    A failing subscriber is logged and never fails the write path that
+    published the event.
+
+    Args:
+        event: One of the USER_* event types
+        user_ids: User ID or list of user IDs (strings or ObjectIds)
+    """
+    if not isinstance(user_ids, (list, tuple, set)):
+        user_ids = [user_ids]
+    user_ids = [str(user_id) for user_id in user_ids if user_id is not None]
+    if not user_ids:
+        return
+    with _lock:
+        handlers = list(_subscribers)
+    for handler in handlers:
+        try:
+            handler(event, user_ids)
+        except Exception as e:
+            logger.error(f"Error handling user event {event}: {e}")